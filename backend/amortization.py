@@ -0,0 +1,135 @@
+"""
+Bulk amortization recompute
+amortization = days_used x daily rate of the item's tariff (day_1, legacy days_1),
+the same formula process_return applies to one item at a time. After a tariff
+edit the stored value of the whole fleet is stale, so this recomputes it
+server-side: one aggregation per item type joins items to the store tariff and
+$merges the new amortization back into `items` (no documents travel to the app).
+
+Runs are background tasks tracked in `amortization_runs` (status, progress per
+type, counts) for /api/items/amortization/runs/{run_id}. Items without a priced
+tariff and generic items keep their stored value, as in process_return.
+"""
+import asyncio
+import contextvars
+import uuid
+from datetime import datetime, timezone
+from typing import List, Optional, Set
+
+import logging
+
+from item_type_registry import item_type_registry
+
+logger = logging.getLogger(__name__)
+
+RUNS_COLLECTION = "amortization_runs"
+
+
+def amortization_pipeline(store_id, item_type: str) -> List[dict]:
+    return [
+        {"$match": {"store_id": store_id, "item_type": item_type, "is_generic": {"$ne": True}}},
+        {"$lookup": {
+            "from": "tariffs",
+            "let": {"store": "$store_id", "type": "$item_type"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$store_id", "$$store"]},
+                    {"$eq": ["$item_type", "$$type"]},
+                ]}}},
+                {"$project": {"_id": 0, "day_1": 1, "days_1": 1}},
+                {"$limit": 1},
+            ],
+            "as": "tariff",
+        }},
+        {"$set": {"tariff": {"$first": "$tariff"}}},
+        {"$set": {"daily_rate": {"$cond": [
+            {"$gt": [{"$ifNull": ["$tariff.day_1", 0]}, 0]},
+            "$tariff.day_1",
+            {"$ifNull": ["$tariff.days_1", 0]},
+        ]}}},
+        {"$match": {"daily_rate": {"$gt": 0}}},
+        {"$project": {
+            "_id": 1,
+            "amortization": {"$multiply": [{"$ifNull": ["$days_used", 0]}, "$daily_rate"]},
+            "amortization_updated_at": {"$literal": datetime.now(timezone.utc).isoformat()},
+        }},
+        {"$merge": {"into": "items", "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}},
+    ]
+
+
+class AmortizationRecompute:
+    def __init__(self):
+        self.db = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def attach(self, db):
+        self.db = db
+
+    @property
+    def runs(self):
+        return self.db[RUNS_COLLECTION]
+
+    async def schedule(self, store_id, item_types: Optional[List[str]] = None, triggered_by: str = "") -> str:
+        """Queue a recompute for the given types (all types of the store if None); returns run id"""
+        run = {
+            "id": str(uuid.uuid4()),
+            "store_id": store_id,
+            "item_types": item_types,
+            "status": "queued",
+            "triggered_by": triggered_by,
+            "types_total": None,
+            "types_done": 0,
+            "items_checked": 0,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        await self.runs.insert_one(dict(run))
+        # Fresh context: the run's queries must not count against the triggering request
+        task = asyncio.create_task(self._run(run), context=contextvars.Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return run["id"]
+
+    async def _run(self, run: dict):
+        run_filter = {"id": run["id"]}
+        store_id = run["store_id"]
+        try:
+            types = run["item_types"]
+            if types is None:
+                types = [t["value"] for t in await item_type_registry.types(store_id) if t.get("value")]
+            await self.runs.update_one(run_filter, {"$set": {
+                "status": "running",
+                "types_total": len(types),
+                "started_at": datetime.now(timezone.utc).isoformat(),
+            }})
+            checked = 0
+            for done, item_type in enumerate(types, start=1):
+                pipeline = amortization_pipeline(store_id, item_type)
+                # Same filter as the pipeline up to the rate check: cheap progress figure
+                checked += await self.db.items.count_documents(pipeline[0]["$match"])
+                await self.db.items.aggregate(pipeline).to_list(None)
+                await self.runs.update_one(run_filter, {"$set": {
+                    "types_done": done,
+                    "items_checked": checked,
+                    "current_type": item_type,
+                }})
+            await self.runs.update_one(run_filter, {"$set": {
+                "status": "done",
+                "finished_at": datetime.now(timezone.utc).isoformat(),
+            }, "$unset": {"current_type": ""}})
+            logger.info(f"✅ Amortization recomputed for store {store_id}: {len(types)} types, {checked} items checked")
+        except Exception as e:
+            logger.error(f"❌ Amortization recompute failed for store {store_id}: {e}")
+            await self.runs.update_one(run_filter, {"$set": {
+                "status": "failed",
+                "error": str(e)[:500],
+                "finished_at": datetime.now(timezone.utc).isoformat(),
+            }})
+
+    async def get_run(self, store_id, run_id: str) -> Optional[dict]:
+        return await self.runs.find_one({"store_id": store_id, "id": run_id}, {"_id": 0})
+
+    async def recent_runs(self, store_id, limit: int = 10) -> List[dict]:
+        return await self.runs.find({"store_id": store_id}, {"_id": 0}).sort("created_at", -1).to_list(limit)
+
+
+amortization_recompute = AmortizationRecompute()
@@ -0,0 +1,471 @@
+"""
+Season analytics cube
+Compact pre-aggregation of rentals in `analytics_cube`, one document per
+(store, level, local_date, item_type, category, source, payment_method) with
+rentals, lines, rental_days, revenue and returns, plus the week / month /
+season of the day for group-bys. Two levels:
+- "rental": one cell per rental dimensions (item_type / category = "*"),
+  every measure additive
+- "line": rental lines unwound; revenue is the rental's paid_amount split by
+  line value (unit_price x quantity), rentals counts the rentals with lines in
+  the cell (exact when grouping by both item_type and category)
+Days are the store-local creation day of the rental (local_dates.py); source is
+the provider of the customer (customers.source) at build time.
+
+Built by aggregations that $merge into the cube:
+- incremental: rental write endpoints decorated with @updates_analytics_cube
+  mark the rental's day dirty; dirty days are rebuilt by the background worker
+  every CUBE_REFRESH_SECONDS and before a query of the store
+- nightly: full rebuild of each store once a day after CUBE_NIGHTLY_HOUR
+  (store-local), which also picks up provider changes of customers
+Rebuilds of a store are serialized by a lease on its analytics_cube_builds
+doc (every worker runs the refresh loop; dirty markers are claimed in one
+pass: stamped with a claim id, read back and dropped). A rebuild only drops cells stamped before it
+started, so one that outlives its lease never deletes a newer rebuild's cells.
+Days already moved to the archive tier are built from the store's archived
+rentals as well (archive_tier.py).
+"""
+import asyncio
+import calendar
+import contextvars
+import functools
+import logging
+import os
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from archive_tier import archive_tier
+from local_dates import local_dates, zone
+from response_cache import store_id_from_call
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "analytics_cube"
+DIRTY_COLLECTION = "analytics_cube_dirty"
+BUILDS_COLLECTION = "analytics_cube_builds"
+ALL = "*"
+CELL_KEYS = ["store_id", "level", "local_date", "item_type", "category", "source", "payment_method"]
+DATE_DIMENSIONS = ["local_date", "week", "month", "season"]  # finest first
+DIMENSIONS = DATE_DIMENSIONS + ["item_type", "category", "source", "payment_method"]
+MEASURES = ["rentals", "lines", "rental_days", "revenue", "returns"]
+SEASON_START_MONTH = 9  # ski season 2025-26 = Sept 2025 .. Aug 2026
+REFRESH_SECONDS = int(os.environ.get("CUBE_REFRESH_SECONDS", "300"))
+NIGHTLY_HOUR = int(os.environ.get("CUBE_NIGHTLY_HOUR", "3"))
+LEASE_SECONDS = 600
+LEASE_WAIT_SECONDS = 60
+
+
+class CubeQueryError(ValueError):
+    """Invalid group-by or filter (mapped to 400 by the endpoint)"""
+
+
+# ---------- Build ----------
+
+def _source_lookup(store_id) -> List[dict]:
+    return [
+        {"$lookup": {
+            "from": "customers",
+            "let": {"customer_id": "$customer_id"},
+            "pipeline": [
+                {"$match": {"store_id": store_id, "$expr": {"$eq": ["$id", "$$customer_id"]}}},
+                {"$project": {"_id": 0, "source": 1}},
+            ],
+            "as": "customer",
+        }},
+        {"$set": {
+            "source": {"$ifNull": [{"$first": "$customer.source"}, ""]},
+            "payment_method": {"$ifNull": ["$payment_method", ""]},
+            "days": {"$ifNull": ["$days", 1]},
+            "paid_amount": {"$ifNull": ["$paid_amount", 0]},
+            "items": {"$ifNull": ["$items", []]},
+        }},
+    ]
+
+
+def _qty(line: str) -> dict:
+    return {"$ifNull": [f"{line}.quantity", 1]}
+
+
+def _line_stages() -> List[dict]:
+    line_value = {"$multiply": [{"$ifNull": ["$items.unit_price", 0]}, _qty("$items")]}
+    return [
+        {"$set": {
+            "_value": {"$sum": {"$map": {
+                "input": "$items", "as": "l",
+                "in": {"$multiply": [{"$ifNull": ["$$l.unit_price", 0]}, _qty("$$l")]},
+            }}},
+            "_lines": {"$size": "$items"},
+        }},
+        {"$unwind": "$items"},
+        {"$group": {
+            "_id": {
+                "local_date": "$local_date",
+                "item_type": {"$ifNull": ["$items.item_type", "unknown"]},
+                "category": {"$ifNull": ["$items.category", ""]},
+                "source": "$source",
+                "payment_method": "$payment_method",
+            },
+            "rentals": {"$addToSet": "$id"},
+            "lines": {"$sum": _qty("$items")},
+            "rental_days": {"$sum": {"$multiply": ["$days", _qty("$items")]}},
+            "revenue": {"$sum": {"$cond": [
+                {"$gt": ["$_value", 0]},
+                {"$multiply": ["$paid_amount", {"$divide": [line_value, "$_value"]}]},
+                {"$divide": ["$paid_amount", "$_lines"]},
+            ]}},
+            "returns": {"$sum": {"$cond": [{"$eq": ["$items.returned", True]}, _qty("$items"), 0]}},
+        }},
+        {"$set": {"level": "line", "rentals": {"$size": "$rentals"}}},
+    ]
+
+
+def _rental_stages() -> List[dict]:
+    quantities = {"$map": {"input": "$items", "as": "l", "in": _qty("$$l")}}
+    returned = {"$map": {
+        "input": "$items", "as": "l",
+        "in": {"$cond": [{"$eq": ["$$l.returned", True]}, _qty("$$l"), 0]},
+    }}
+    return [
+        {"$group": {
+            "_id": {
+                "local_date": "$local_date",
+                "item_type": ALL,
+                "category": ALL,
+                "source": "$source",
+                "payment_method": "$payment_method",
+            },
+            "rentals": {"$sum": 1},
+            "lines": {"$sum": {"$sum": quantities}},
+            "rental_days": {"$sum": {"$multiply": ["$days", {"$sum": quantities}]}},
+            "revenue": {"$sum": "$paid_amount"},
+            "returns": {"$sum": {"$sum": returned}},
+        }},
+        {"$set": {"level": "rental"}},
+    ]
+
+
+def _calendar_stage() -> dict:
+    day = {"$dateFromString": {"dateString": "$local_date", "format": "%Y-%m-%d"}}
+    year = {"$toInt": {"$substrBytes": ["$local_date", 0, 4]}}
+    month = {"$toInt": {"$substrBytes": ["$local_date", 5, 2]}}
+    return {"$set": {
+        "week": {"$dateToString": {"format": "%G-W%V", "date": day}},
+        "month": {"$substrBytes": ["$local_date", 0, 7]},
+        "season": {"$let": {
+            "vars": {"start": {"$cond": [{"$gte": [month, SEASON_START_MONTH]}, year, {"$subtract": [year, 1]}]}},
+            "in": {"$concat": [
+                {"$toString": "$$start"}, "-",
+                {"$substrBytes": [{"$toString": {"$add": ["$$start", 1]}}, 2, 2]},
+            ]},
+        }},
+    }}
+
+
+def build_pipeline(store_id, days: Optional[List[str]], build: str, built_at: datetime,
+                   archive: Optional[str] = None) -> List[dict]:
+    match = {"$match": {"store_id": store_id, "local_date": {"$in": days} if days is not None else {"$type": "string"}}}
+    archived = [{"$unionWith": {"coll": archive, "pipeline": [match]}}] if archive else []
+    facts = [match, *archived, *_source_lookup(store_id)]
+    return [
+        *facts,
+        *_line_stages(),
+        {"$unionWith": {"coll": "rentals", "pipeline": [*facts, *_rental_stages()]}},
+        {"$replaceWith": {"$mergeObjects": [
+            "$_id",
+            {"store_id": store_id, "level": "$level", "build": build, "built_at": built_at},
+            {m: f"${m}" for m in MEASURES},
+        ]}},
+        _calendar_stage(),
+        {"$merge": {"into": COLLECTION, "on": CELL_KEYS, "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+
+
+# ---------- Query helpers ----------
+
+def _bucket_bounds(dimension: str, key: str):
+    if dimension == "local_date":
+        day = date.fromisoformat(key)
+        return day, day
+    if dimension == "week":
+        year, week = key.split("-W")
+        start = date.fromisocalendar(int(year), int(week), 1)
+        return start, start + timedelta(days=6)
+    if dimension == "month":
+        year, month = (int(p) for p in key.split("-"))
+        return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+    start_year = int(key[:4])
+    return date(start_year, SEASON_START_MONTH, 1), date(start_year + 1, SEASON_START_MONTH, 1) - timedelta(days=1)
+
+
+def covered_days(row: dict, group_by: List[str], first: date, last: date) -> int:
+    """Calendar days of the row's date bucket inside [first, last] (whole range without a date group-by)"""
+    dimension = next((d for d in DATE_DIMENSIONS if d in group_by), None)
+    if dimension:
+        start, end = _bucket_bounds(dimension, row[dimension])
+        first, last = max(first, start), min(last, end)
+    return max((last - first).days + 1, 0)
+
+
+def parse_group_by(group_by: Optional[str]) -> List[str]:
+    dims = [d.strip() for d in (group_by or "").split(",") if d.strip()]
+    unknown = [d for d in dims if d not in DIMENSIONS]
+    if unknown:
+        raise CubeQueryError(f"Dimensiones no válidas: {', '.join(unknown)}. Disponibles: {', '.join(DIMENSIONS)}")
+    return list(dict.fromkeys(dims))
+
+
+class AnalyticsCube:
+    def __init__(self):
+        self.db = None
+        self.worker_id = uuid.uuid4().hex
+        self._worker: Optional[asyncio.Task] = None
+
+    def attach(self, db):
+        self.db = db
+
+    @property
+    def collection(self):
+        return self.db[COLLECTION]
+
+    async def create_indexes(self):
+        await self.collection.create_index(CELL_KEYS, unique=True)
+        await self.db[DIRTY_COLLECTION].create_index([("store_id", 1), ("day", 1)], unique=True)
+        await self.db[BUILDS_COLLECTION].create_index("store_id", unique=True)
+
+    # ----- Build -----
+
+    async def _lock(self, store_id, wait: float = 0) -> bool:
+        """Take the store's rebuild lease, waiting up to `wait` seconds for another rebuild"""
+        deadline = time.monotonic() + wait
+        while True:
+            now = datetime.now(timezone.utc)
+            try:
+                await self.db[BUILDS_COLLECTION].find_one_and_update(
+                    {"store_id": store_id, "$or": [{"lease_until": None}, {"lease_until": {"$lte": now.isoformat()}}]},
+                    {"$set": {"lease_until": (now + timedelta(seconds=LEASE_SECONDS)).isoformat(),
+                              "worker": self.worker_id}},
+                    upsert=True
+                )
+                return True
+            except DuplicateKeyError:
+                pass  # held by another rebuild
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.5)
+
+    async def _unlock(self, store_id):
+        await self.db[BUILDS_COLLECTION].update_one(
+            {"store_id": store_id, "worker": self.worker_id}, {"$set": {"lease_until": None}}
+        )
+
+    async def _build(self, store_id, days: Optional[List[str]] = None) -> int:
+        build = str(uuid.uuid4())
+        # Stamped by us, not $$NOW: only cells older than this rebuild are stale
+        started = datetime.now(timezone.utc)
+        archive = await archive_tier.archive_for("rentals", {"store_id": store_id}, min(days) if days else None)
+        pipeline = build_pipeline(store_id, days, build, started, archive.name if archive is not None else None)
+        await self.db.rentals.aggregate(pipeline, allowDiskUse=True).to_list(None)
+        stale = {"store_id": store_id, "built_at": {"$lt": started}}
+        if days is not None:
+            stale["local_date"] = {"$in": days}
+        await self.collection.delete_many(stale)
+        return await self.collection.count_documents({"store_id": store_id, "build": build})
+
+    async def rebuild(self, store_id, days: Optional[List[str]] = None) -> int:
+        """Rebuild the given days of a store (all of them if None); returns the cells written"""
+        locked = await self._lock(store_id, LEASE_WAIT_SECONDS)
+        if not locked:
+            logger.warning(f"⚠️ Analytics cube: store {store_id} still locked after {LEASE_WAIT_SECONDS}s, rebuilding anyway")
+        try:
+            return await self._build(store_id, days)
+        finally:
+            if locked:
+                await self._unlock(store_id)
+
+    async def mark_rental(self, store_id, rental_id: str):
+        rental = await self.db.rentals.find_one({"store_id": store_id, "id": rental_id}, {"_id": 0, "local_date": 1})
+        if rental and rental.get("local_date"):
+            await self._mark(store_id, rental["local_date"])
+
+    async def _mark(self, store_id, day: str):
+        await self.db[DIRTY_COLLECTION].update_one(
+            {"store_id": store_id, "day": day},
+            {"$setOnInsert": {"marked_at": datetime.now(timezone.utc).isoformat()}},
+            upsert=True
+        )
+
+    async def _claim(self, query: dict) -> Dict:
+        """
+        Claim the dirty markers matching `query` in three round trips, whatever
+        their number: stamp them with a claim id, read them back, drop them.
+        A claim left behind by a crashed worker is taken over after LEASE_SECONDS.
+        """
+        claim = str(uuid.uuid4())
+        now = datetime.now(timezone.utc)
+        await self.db[DIRTY_COLLECTION].update_many(
+            {**query, "$or": [{"claim": None},
+                              {"claimed_at": {"$lte": (now - timedelta(seconds=LEASE_SECONDS)).isoformat()}}]},
+            {"$set": {"claim": claim, "claimed_at": now.isoformat()}}
+        )
+        markers = await self.db[DIRTY_COLLECTION].find(
+            {"claim": claim}, {"_id": 0, "store_id": 1, "day": 1}
+        ).to_list(None)
+        if markers:
+            await self.db[DIRTY_COLLECTION].delete_many({"claim": claim})
+        by_store: Dict = {}
+        for marker in markers:
+            by_store.setdefault(marker["store_id"], []).append(marker["day"])
+        return by_store
+
+    async def flush(self, store_id=None) -> int:
+        """
+        Rebuild dirty days (of one store or all). Markers are claimed and
+        dropped before the rebuild reads, so concurrent flushes never rebuild
+        the same marker twice; days whose rebuild fails are marked again.
+        """
+        by_store = await self._claim({} if store_id is None else {"store_id": store_id})
+        claimed = sum(len(days) for days in by_store.values())
+        if not claimed and store_id is not None:
+            # Another flush may hold this store's markers: wait for its rebuild
+            if await self._lock(store_id, LEASE_WAIT_SECONDS):
+                await self._unlock(store_id)
+        for store, days in by_store.items():
+            try:
+                await self.rebuild(store, days)
+            except Exception:
+                for day in days:
+                    await self._mark(store, day)
+                raise
+        return claimed
+
+    async def nightly(self):
+        """Full rebuild of each store once per local day, after NIGHTLY_HOUR (one worker per store)"""
+        for store_id in await self.db.rentals.distinct("store_id"):
+            now = datetime.now(zone(await local_dates.timezone(store_id)))
+            today = now.strftime("%Y-%m-%d")
+            if now.hour < NIGHTLY_HOUR:
+                continue
+            state = await self.db[BUILDS_COLLECTION].find_one({"store_id": store_id}) or {}
+            if state.get("last_full_build", "") >= today:
+                continue
+            if not await self._lock(store_id):
+                continue  # another worker is rebuilding it
+            try:
+                # Re-read under the lease: another worker may have just finished it
+                state = await self.db[BUILDS_COLLECTION].find_one({"store_id": store_id}) or {}
+                if state.get("last_full_build", "") >= today:
+                    continue
+                cells = await self._build(store_id)
+                await self.db[BUILDS_COLLECTION].update_one(
+                    {"store_id": store_id},
+                    {"$set": {"last_full_build": today, "cells": cells,
+                              "built_at": datetime.now(timezone.utc).isoformat()}}
+                )
+            finally:
+                await self._unlock(store_id)
+            logger.info(f"✅ Analytics cube rebuilt for store {store_id}: {cells} cells")
+
+    async def _run(self):
+        while True:
+            try:
+                await self.flush()
+                await self.nightly()
+            except Exception as e:
+                logger.error(f"❌ Analytics cube refresh failed (retried next cycle): {e}")
+            await asyncio.sleep(REFRESH_SECONDS)
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run(), context=contextvars.Context())
+
+    def stop(self):
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+
+    # ----- Query -----
+
+    async def query(self, store_id, group_by: List[str], filters: Dict[str, List[str]],
+                    date_from: Optional[str] = None, date_to: Optional[str] = None) -> dict:
+        """Slice (filters) and dice (group_by) over the cube; utilization when grouping by item_type"""
+        unknown = [d for d in filters if d not in DIMENSIONS]
+        if unknown:
+            raise CubeQueryError(f"Filtros no válidos: {', '.join(unknown)}")
+        await self.flush(store_id)
+        by_line = any(d in ("item_type", "category") for d in [*group_by, *filters])
+        match = {"store_id": store_id, "level": "line" if by_line else "rental"}
+        if date_from or date_to:
+            match["local_date"] = {**({"$gte": date_from} if date_from else {}), **({"$lte": date_to} if date_to else {})}
+        for dimension, values in filters.items():
+            match[dimension] = values[0] if len(values) == 1 else {"$in": values}
+        pipeline = [
+            {"$match": match},
+            {"$group": {
+                "_id": {d: f"${d}" for d in group_by},
+                **{m: {"$sum": f"${m}"} for m in MEASURES},
+                "first_day": {"$min": "$local_date"},
+                "last_day": {"$max": "$local_date"},
+            }},
+            {"$sort": {f"_id.{d}": 1 for d in group_by} or {"_id": 1}},
+        ]
+        groups = await self.collection.aggregate(pipeline).to_list(None)
+        rows = [{**g["_id"], **{m: g[m] for m in MEASURES}} for g in groups]
+        for row in rows:
+            row["revenue"] = round(row["revenue"], 2)
+
+        if "item_type" in group_by and groups:
+            first = date.fromisoformat(date_from or min(g["first_day"] for g in groups))
+            last = date.fromisoformat(date_to or max(g["last_day"] for g in groups))
+            fleet = await self.fleet_by_type(store_id)
+            for row in rows:
+                capacity = fleet.get(row["item_type"], 0) * covered_days(row, group_by, first, last)
+                row["utilization"] = round(100 * row["rental_days"] / capacity, 1) if capacity else None
+
+        return {
+            "level": match["level"],
+            "group_by": group_by,
+            "filters": filters,
+            "date_from": date_from,
+            "date_to": date_to,
+            "rows": rows,
+        }
+
+    async def fleet_by_type(self, store_id) -> Dict[str, int]:
+        """Units in service per item type (generic items count their stock)"""
+        rows = await self.db.items.aggregate([
+            {"$match": {"store_id": store_id, "status": {"$nin": ["deleted", "retired"]}}},
+            {"$group": {
+                "_id": "$item_type",
+                "units": {"$sum": {"$cond": [{"$eq": ["$is_generic", True]}, {"$ifNull": ["$stock_total", 0]}, 1]}},
+            }},
+        ]).to_list(None)
+        return {r["_id"]: r["units"] for r in rows}
+
+
+analytics_cube = AnalyticsCube()
+
+
+def updates_analytics_cube(func: Callable) -> Callable:
+    """
+    Mark a rental write endpoint: the rental's day is marked dirty in the cube
+    after the call (`rental_id` kwarg or the returned rental).
+    Goes below @api_router.<method>(...).
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        result = None
+        try:
+            result = await func(*args, **kwargs)
+            return result
+        finally:
+            rental_id = kwargs.get("rental_id") or getattr(result, "id", None)
+            if rental_id:
+                try:
+                    await analytics_cube.mark_rental(store_id_from_call(args, kwargs), rental_id)
+                except Exception as e:
+                    logger.error(f"❌ Analytics cube mark failed for rental {rental_id}: {e}")
+    return wrapper
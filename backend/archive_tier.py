@@ -0,0 +1,205 @@
+"""
+Cold-season archive tier
+Old closed data moves out of the hot collections into per-store archive
+collections (`<collection>_archive_<store_id>`, same documents, compact indexes
+without the store_id prefix):
+- rentals: fully returned, created and due before the cutoff
+- cash_movements: of closed sessions (or without session), before the cutoff
+- cash_closings: closing day before the cutoff
+Days are store-local days (local_date, local_dates.py).
+
+The store's boundary (archive_state.archived_before, cached per store in
+config_cache) is raised before anything moves, so every archived document is
+older than the boundary. Reads that can reach older data (customer history,
+item profitability, reports, exports, the analytics cube) go through
+archive_tier: aggregations get a $unionWith of the archive collection, finds
+read both tiers, and only when the requested range starts before the boundary
+(or is unbounded). Moves are batched insert_many (duplicates ignored, so a
+crashed run can be resumed) followed by delete_many of the same ids.
+"""
+import heapq
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from pymongo.errors import BulkWriteError
+
+from jobs import report_progress
+
+logger = logging.getLogger(__name__)
+
+STATE_COLLECTION = "archive_state"
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", "400"))
+ARCHIVE_INDEXES = {
+    "rentals": [
+        ([("id", 1)], {"unique": True}),
+        ([("customer_id", 1), ("created_at", -1)], {}),
+        ([("local_date", 1)], {}),
+        ([("items.item_id", 1)], {}),
+    ],
+    "cash_movements": [
+        ([("id", 1)], {"unique": True}),
+        ([("local_date", 1)], {}),
+        ([("reference_id", 1)], {}),
+    ],
+    "cash_closings": [
+        ([("id", 1)], {"unique": True}),
+        ([("date", 1)], {}),
+    ],
+}
+ARCHIVED_COLLECTIONS = tuple(ARCHIVE_INDEXES)
+
+
+def archive_name(collection: str, store_id) -> str:
+    return f"{collection}_archive_{store_id}"
+
+
+def default_cutoff(today: str) -> str:
+    return (datetime.strptime(today, "%Y-%m-%d") - timedelta(days=ARCHIVE_AFTER_DAYS)).strftime("%Y-%m-%d")
+
+
+class ArchiveTier:
+    def __init__(self):
+        self.db = None
+        self.store_config = None
+
+    def attach(self, db, store_config):
+        self.db = db
+        self.store_config = store_config
+
+    # ---------- Reads ----------
+
+    async def archive_for(self, collection: str, store_filter: Optional[dict], start_date: Optional[str] = None):
+        """Archive collection to read as well, or None (range starts after the boundary / no archive)"""
+        store_id = (store_filter or {}).get("store_id")
+        if store_id is None or collection not in ARCHIVE_INDEXES:
+            return None
+        boundary = await self.store_config.archive_boundary(store_id)
+        if not boundary or (start_date and start_date >= boundary):
+            return None
+        return self.db[archive_name(collection, store_id)]
+
+    async def pipeline(self, collection: str, store_filter: Optional[dict], start_date: Optional[str],
+                       pipeline: List[dict]) -> List[dict]:
+        """Add the archive's documents right after the leading $match when the range reaches it"""
+        archive = await self.archive_for(collection, store_filter, start_date)
+        if archive is None:
+            return pipeline
+        return [pipeline[0], {"$unionWith": {"coll": archive.name, "pipeline": [pipeline[0]]}}, *pipeline[1:]]
+
+    async def collections(self, collection: str, store_filter: Optional[dict], start_date: Optional[str] = None) -> list:
+        archive = await self.archive_for(collection, store_filter, start_date)
+        return [self.db[collection]] + ([archive] if archive is not None else [])
+
+    async def find(self, collection: str, store_filter: Optional[dict], query: dict, projection: Optional[dict] = None,
+                   start_date: Optional[str] = None, sort: Optional[tuple] = None, limit: Optional[int] = None) -> List[dict]:
+        """find() over both tiers; sort = (field, direction) merges them, limit applies to the result"""
+        results = []
+        for coll in await self.collections(collection, store_filter, start_date):
+            cursor = coll.find(query, projection)
+            if sort:
+                cursor = cursor.sort(*sort)
+            results.append(await cursor.to_list(limit))
+        if len(results) == 1:
+            return results[0]
+        if sort:
+            field, direction = sort
+            merged = list(heapq.merge(*results, key=lambda d: d.get(field) or "", reverse=direction < 0))
+        else:
+            merged = [doc for docs in results for doc in docs]
+        return merged[:limit] if limit else merged
+
+    async def find_one(self, collection: str, store_filter: dict, query: dict, projection: Optional[dict] = None):
+        """Archive lookup after a hot miss (e.g. an old rental opened from a customer's history)"""
+        archive = await self.archive_for(collection, store_filter)
+        if archive is None:
+            return None
+        return await archive.find_one(query, projection)
+
+    async def count(self, collection: str, store_filter: Optional[dict], query: dict, start_date: Optional[str] = None) -> int:
+        total = 0
+        for coll in await self.collections(collection, store_filter, start_date):
+            total += await coll.count_documents(query)
+        return total
+
+    # ---------- Archival job ----------
+
+    async def state(self, store_id) -> dict:
+        return await self.db[STATE_COLLECTION].find_one({"store_id": store_id}, {"_id": 0}) or {"store_id": store_id}
+
+    async def _ensure_indexes(self, store_id):
+        for collection, indexes in ARCHIVE_INDEXES.items():
+            for keys, options in indexes:
+                await self.db[archive_name(collection, store_id)].create_index(keys, **options)
+
+    async def _selectors(self, store_id, before: str) -> Dict[str, dict]:
+        closed_sessions = await self.db.cash_sessions.distinct(
+            "id", {"store_id": store_id, "status": "closed", "date": {"$lt": before}}
+        )
+        return {
+            "rentals": {
+                "store_id": store_id,
+                "status": "returned",
+                "local_date": {"$lt": before},
+                "end_date": {"$lt": before},
+            },
+            "cash_movements": {
+                "store_id": store_id,
+                "local_date": {"$lt": before},
+                "$or": [{"session_id": {"$in": closed_sessions}}, {"session_id": {"$in": [None, ""]}}],
+            },
+            "cash_closings": {"store_id": store_id, "date": {"$lt": before}},
+        }
+
+    async def _move(self, collection: str, store_id, selector: dict, batch_size: int) -> int:
+        hot, archive = self.db[collection], self.db[archive_name(collection, store_id)]
+        moved = 0
+        while True:
+            docs = await hot.find(selector).limit(batch_size).to_list(batch_size)
+            if not docs:
+                return moved
+            try:
+                await archive.insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                # Already archived by an interrupted run: only duplicate keys are acceptable
+                if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                    raise
+            result = await hot.delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+            moved += result.deleted_count
+
+    async def archive_store(self, store_id, before: str, batch_size: int = 500) -> dict:
+        """Move the store's closed data older than `before` (YYYY-MM-DD) to its archive collections"""
+        await self._ensure_indexes(store_id)
+        state = await self.state(store_id)
+        boundary = max(before, state.get("archived_before") or "")
+        # Boundary first: from now on reads of older ranges also look in the archive
+        await self.db[STATE_COLLECTION].update_one(
+            {"store_id": store_id},
+            {"$set": {"archived_before": boundary, "status": "running",
+                      "started_at": datetime.now(timezone.utc).isoformat()}},
+            upsert=True
+        )
+        await self.store_config.invalidate(store_id, "archive")
+        moved = {}
+        try:
+            selectors = await self._selectors(store_id, before)
+            for n, (collection, selector) in enumerate(selectors.items()):
+                await report_progress(n, len(selectors), collection)
+                moved[collection] = await self._move(collection, store_id, selector, batch_size)
+        except Exception as e:
+            await self.db[STATE_COLLECTION].update_one(
+                {"store_id": store_id}, {"$set": {"status": "failed", "error": str(e), "moved": moved}}
+            )
+            raise
+        await self.db[STATE_COLLECTION].update_one(
+            {"store_id": store_id},
+            {"$set": {"status": "done", "moved": moved, "error": None,
+                      "finished_at": datetime.now(timezone.utc).isoformat()}}
+        )
+        await report_progress(len(moved), len(moved))
+        logger.info(f"✅ Archived store {store_id} before {before}: {moved}")
+        return moved
+
+
+archive_tier = ArchiveTier()
@@ -0,0 +1,104 @@
+"""
+Cash audit-sync
+Paid rentals and delivered workshop repairs of the store since the cash session
+opened that have no movement in the session (cash_movements.reference_id).
+One aggregation over rentals ($unionWith external_repairs), each source
+anti-joined against the session movements with a $lookup on reference_id
+(index session_id + reference_id), so only the missing rows leave MongoDB.
+The endpoint reserves their operation numbers in one counter update and
+writes them with one insert_many (or only reports them, dry_run).
+"""
+import uuid
+from typing import List
+
+LOOKUP_INDEX_KEYS = [("session_id", 1), ("reference_id", 1)]
+
+
+def _without_movement(session_id: str) -> List[dict]:
+    """Anti-join: keep documents with no movement of the session referencing them"""
+    return [
+        {"$lookup": {
+            "from": "cash_movements",
+            "let": {"ref": "$id"},
+            "pipeline": [
+                {"$match": {"session_id": session_id, "$expr": {"$eq": ["$reference_id", "$$ref"]}}},
+                {"$limit": 1},
+                {"$project": {"_id": 1}},
+            ],
+            "as": "movement",
+        }},
+        {"$match": {"movement": {"$size": 0}}},
+    ]
+
+
+def missing_movements_pipeline(store_filter: dict, session_id: str, since: str) -> List[dict]:
+    rentals = [
+        {"$match": {**store_filter, "paid_amount": {"$gt": 0}, "created_at": {"$gte": since}}},
+        *_without_movement(session_id),
+        {"$project": {
+            "_id": 0,
+            "kind": {"$literal": "rental"},
+            "id": 1,
+            "amount": "$paid_amount",
+            "payment_method": {"$ifNull": ["$payment_method", "cash"]},
+            "customer_name": {"$ifNull": ["$customer_name", ""]},
+            "start_date": 1,
+        }},
+    ]
+    repairs = [
+        {"$match": {**store_filter, "status": "delivered", "price": {"$gt": 0}, "delivery_date": {"$gte": since}}},
+        *_without_movement(session_id),
+        {"$project": {
+            "_id": 0,
+            "kind": {"$literal": "workshop"},
+            "id": 1,
+            "amount": "$price",
+            "payment_method": {"$ifNull": ["$payment_method", "cash"]},
+            "customer_name": {"$ifNull": ["$customer_name", ""]},
+            "description": {"$ifNull": ["$description", ""]},
+        }},
+    ]
+    return [*rentals, {"$unionWith": {"coll": "external_repairs", "pipeline": repairs}}]
+
+
+async def missing_movements(db, store_filter: dict, session_id: str, since: str) -> List[dict]:
+    """Rentals first, then repairs (same order as the movements are numbered)"""
+    return await db.rentals.aggregate(missing_movements_pipeline(store_filter, session_id, since)).to_list(None)
+
+
+def sync_movement(row: dict, session_id: str, operation_number: str, created_by: str, created_at: str, date: str) -> dict:
+    """Cash movement document for a missing row"""
+    if row["kind"] == "rental":
+        concept = f"[SYNC] Alquiler #{row['id'][:8]} - {row['customer_name'] or 'Cliente'}"
+        notes = f"Movimiento sincronizado automáticamente. Alquiler del {row.get('start_date') or date}"
+        category = "rental"
+    else:
+        concept = f"[SYNC] Taller: {row['customer_name'] or 'Cliente'}"
+        notes = f"Movimiento sincronizado automáticamente. Reparación: {row.get('description', '')[:50]}"
+        category = "workshop"
+    return {
+        "id": str(uuid.uuid4()),
+        "operation_number": operation_number,
+        "session_id": session_id,
+        "movement_type": "income",
+        "amount": row["amount"],
+        "payment_method": row["payment_method"],
+        "category": category,
+        "concept": concept,
+        "reference_id": row["id"],
+        "customer_name": row["customer_name"],
+        "notes": notes,
+        "created_at": created_at,
+        "created_by": created_by,
+    }
+
+
+def sync_detail(row: dict, operation_number=None) -> dict:
+    """Entry of the endpoint's details list"""
+    return {
+        "type": row["kind"],
+        "operation_number": operation_number,
+        ("rental_id" if row["kind"] == "rental" else "repair_id"): row["id"][:8],
+        "amount": row["amount"],
+        "payment_method": row["payment_method"],
+    }
@@ -0,0 +1,208 @@
+"""
+Columnar exports (Parquet / Arrow IPC) for offline BI
+Datasets of one store and date range (store-local days):
+- rental_lines: one row per rental line, with the rental's fields repeated
+  (rentals without lines give one row with empty line columns)
+- cash_movements
+- cash_closings
+Rows are read from Motor cursors in batches of BATCH_ROWS, converted to typed
+Arrow record batches (timestamps, dates, float64 amounts, dictionary-encoded
+categoricals) and written to a sink that hands the bytes to the response as
+they are produced, so memory stays at one batch whatever the range.
+Parquet is zstd-compressed, one row group per batch. Ranges reaching into the
+archive tier read the store's archive collection after the hot one.
+"""
+import asyncio
+import io
+from datetime import date
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from archive_tier import archive_tier
+from local_dates import day_range_filter, parse_instant
+
+BATCH_ROWS = 5000
+FORMATS = {
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+TEXT = pa.string()
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+MONEY = pa.float64()
+COUNT = pa.int32()
+INSTANT = pa.timestamp("ms", tz="UTC")
+DAY = pa.date32()
+FLAG = pa.bool_()
+
+
+def _schema(fields: Iterable[Tuple[str, pa.DataType]]) -> pa.Schema:
+    return pa.schema([pa.field(name, kind) for name, kind in fields])
+
+
+RENTAL_LINES_SCHEMA = _schema([
+    ("rental_id", TEXT), ("created_at", INSTANT), ("local_date", DAY),
+    ("start_date", DAY), ("end_date", DAY), ("days", COUNT),
+    ("status", CATEGORY), ("payment_method", CATEGORY),
+    ("customer_id", TEXT), ("customer_name", TEXT), ("customer_dni", TEXT),
+    ("total_amount", MONEY), ("paid_amount", MONEY), ("pending_amount", MONEY), ("deposit", MONEY),
+    ("line_no", COUNT), ("item_id", TEXT), ("barcode", TEXT), ("internal_code", TEXT),
+    ("item_type", CATEGORY), ("category", CATEGORY), ("brand", CATEGORY), ("model", CATEGORY),
+    ("size", CATEGORY), ("is_generic", FLAG), ("quantity", COUNT), ("unit_price", MONEY),
+    ("returned", FLAG), ("return_date", INSTANT),
+])
+
+CASH_MOVEMENTS_SCHEMA = _schema([
+    ("id", TEXT), ("operation_number", TEXT), ("session_id", TEXT),
+    ("created_at", INSTANT), ("local_date", DAY),
+    ("movement_type", CATEGORY), ("category", CATEGORY), ("payment_method", CATEGORY),
+    ("amount", MONEY), ("concept", TEXT), ("reference_id", TEXT),
+    ("customer_name", TEXT), ("created_by", CATEGORY), ("notes", TEXT),
+])
+
+CASH_CLOSINGS_SCHEMA = _schema([
+    ("id", TEXT), ("date", DAY), ("session_id", TEXT), ("closure_number", COUNT),
+    ("opening_balance", MONEY), ("ingresos_brutos", MONEY), ("total_salidas", MONEY),
+    ("balance_neto_dia", MONEY), ("expected_cash", MONEY), ("expected_card", MONEY),
+    ("physical_cash", MONEY), ("card_total", MONEY),
+    ("discrepancy_cash", MONEY), ("discrepancy_card", MONEY), ("discrepancy_total", MONEY),
+    ("total_income", MONEY), ("total_expense", MONEY), ("total_refunds", MONEY),
+    ("movements_count", COUNT), ("closed_by", CATEGORY), ("closed_at", INSTANT), ("notes", TEXT),
+])
+
+
+def _coerce(kind: pa.DataType, value):
+    """Stored value -> Python value of the column type (None when missing or malformed)"""
+    if value is None or value == "":
+        return None
+    try:
+        if kind == INSTANT:
+            return parse_instant(value)
+        if kind == DAY:
+            return value.date() if hasattr(value, "date") else date.fromisoformat(str(value)[:10])
+        if kind == MONEY:
+            return float(value)
+        if kind == COUNT:
+            return int(value)
+        if kind == FLAG:
+            return bool(value)
+        return str(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _rental_rows(rental: dict) -> List[dict]:
+    head = {
+        "rental_id": rental.get("id"),
+        "created_at": rental.get("created_at"),
+        "local_date": rental.get("local_date"),
+        "start_date": rental.get("start_local_date") or rental.get("start_date"),
+        "end_date": rental.get("end_local_date") or rental.get("end_date"),
+        **{k: rental.get(k) for k in ("days", "status", "payment_method", "customer_id", "customer_name",
+                                      "customer_dni", "total_amount", "paid_amount", "pending_amount", "deposit")},
+    }
+    lines = rental.get("items") or []
+    if not lines:
+        return [head]
+    return [
+        {
+            **head,
+            "line_no": n,
+            **{k: line.get(k) for k in ("item_id", "barcode", "internal_code", "item_type", "category",
+                                        "brand", "model", "size", "is_generic", "returned", "return_date")},
+            "quantity": line.get("quantity", 1),
+            "unit_price": line.get("unit_price"),
+        }
+        for n, line in enumerate(lines, start=1)
+    ]
+
+
+class Dataset:
+    def __init__(self, collection: str, schema: pa.Schema, query: Callable, rows: Callable = None):
+        self.collection = collection
+        self.schema = schema
+        self.query = query
+        self.rows = rows or (lambda doc: [doc])
+
+
+DATASETS: Dict[str, Dataset] = {
+    "rental_lines": Dataset("rentals", RENTAL_LINES_SCHEMA, lambda f, t: day_range_filter(f, t), _rental_rows),
+    "cash_movements": Dataset("cash_movements", CASH_MOVEMENTS_SCHEMA, lambda f, t: day_range_filter(f, t)),
+    "cash_closings": Dataset("cash_closings", CASH_CLOSINGS_SCHEMA, lambda f, t: {"date": {
+        **({"$gte": f} if f else {}), **({"$lte": t} if t else {})
+    }} if f or t else {}),
+}
+
+
+def record_batch(schema: pa.Schema, rows: List[dict]) -> pa.RecordBatch:
+    columns = [
+        pa.array([_coerce(field.type.value_type if pa.types.is_dictionary(field.type) else field.type,
+                          row.get(field.name)) for row in rows], type=field.type)
+        for field in schema
+    ]
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+class _Drain(io.RawIOBase):
+    """Write-only sink that keeps the bytes until drained (tell() counts everything written)"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+class _Writer:
+    def __init__(self, schema: pa.Schema, fmt: str):
+        self.sink = _Drain()
+        if fmt == "parquet":
+            self.writer = pq.ParquetWriter(self.sink, schema, compression="zstd", use_dictionary=True)
+        else:
+            self.writer = pa.ipc.new_stream(self.sink, schema)
+
+    def write(self, batch: pa.RecordBatch) -> bytes:
+        self.writer.write_batch(batch)
+        return self.sink.drain()
+
+    def close(self) -> bytes:
+        self.writer.close()
+        return self.sink.drain()
+
+
+async def export_stream(db, store_filter: dict, dataset: str, fmt: str,
+                        date_from: Optional[str] = None, date_to: Optional[str] = None) -> AsyncIterator[bytes]:
+    """Bytes of the export file, one chunk per batch (encoding runs in a worker thread)"""
+    spec = DATASETS[dataset]
+    writer = _Writer(spec.schema, fmt)
+    rows: List[dict] = []
+    archive = await archive_tier.archive_for(spec.collection, store_filter, date_from)
+    for collection in [db[spec.collection]] + ([archive] if archive is not None else []):
+        cursor = collection.find({**spec.query(date_from, date_to), **store_filter}, {"_id": 0})
+        try:
+            async for doc in cursor.batch_size(BATCH_ROWS):
+                rows.extend(spec.rows(doc))
+                if len(rows) >= BATCH_ROWS:
+                    batch, rows = rows, []
+                    yield await asyncio.to_thread(lambda b=batch: writer.write(record_batch(spec.schema, b)))
+        finally:
+            await cursor.close()
+    if rows:
+        yield await asyncio.to_thread(lambda: writer.write(record_batch(spec.schema, rows)))
+    yield await asyncio.to_thread(writer.close)
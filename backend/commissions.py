@@ -0,0 +1,104 @@
+"""
+Provider (source) commissions
+Customers belong to a provider by name (customers.source). Both report paths
+are single aggregations whose cost does not depend on the number of providers:
+- commissions_by_source: rentals of the period summed per customer, joined to
+  the customer (store_id + id index) for its source, grouped by source; the
+  customer count per source comes in through $unionWith customers
+- source_rentals: customers of one source with their rentals joined by
+  customer_id and by DNI (rentals (store_id, customer_id) / (store_id,
+  customer_dni) indexes), deduplicated by rental id
+Ranges reaching into the archive tier also read the store's archived rentals
+(archive_tier.py).
+"""
+from typing import Dict, List, Optional, Tuple
+
+from archive_tier import archive_tier
+from local_dates import day_range_filter
+
+CUSTOMER_INDEXES = [
+    [("store_id", 1), ("id", 1)],
+    [("store_id", 1), ("source", 1)],
+]
+RENTAL_INDEXES = [
+    [("store_id", 1), ("customer_id", 1)],
+    [("store_id", 1), ("customer_dni", 1)],
+]
+RENTAL_DETAIL_FIELDS = {"_id": 0, "id": 1, "created_at": 1, "customer_id": 1, "customer_name": 1,
+                        "customer_dni": 1, "total_amount": 1}
+
+
+async def commissions_by_source(db, store_filter: dict, source_names: List[str],
+                                start_date: str, end_date: str) -> Dict[str, dict]:
+    """{source name: {"revenue": paid_amount of the period, "customers": customers of the source}}"""
+    if not source_names:
+        return {}
+    pipeline = [
+        {"$match": {**store_filter, **day_range_filter(start_date, end_date), "customer_id": {"$type": "string"}}},
+        {"$group": {"_id": "$customer_id", "revenue": {"$sum": {"$ifNull": ["$paid_amount", 0]}}}},
+        {"$lookup": {
+            "from": "customers",
+            "let": {"customer_id": "$_id"},
+            "pipeline": [
+                {"$match": {**store_filter, "source": {"$in": source_names}, "$expr": {"$eq": ["$id", "$$customer_id"]}}},
+                {"$project": {"_id": 0, "source": 1}},
+            ],
+            "as": "customer",
+        }},
+        {"$unwind": "$customer"},
+        {"$group": {"_id": "$customer.source", "revenue": {"$sum": "$revenue"}, "customers": {"$sum": 0}}},
+        {"$unionWith": {"coll": "customers", "pipeline": [
+            {"$match": {**store_filter, "source": {"$in": source_names}}},
+            {"$group": {"_id": "$source", "revenue": {"$sum": 0}, "customers": {"$sum": 1}}},
+        ]}},
+        {"$group": {"_id": "$_id", "revenue": {"$sum": "$revenue"}, "customers": {"$sum": "$customers"}}},
+    ]
+    pipeline = await archive_tier.pipeline("rentals", store_filter, start_date, pipeline)
+    rows = await db.rentals.aggregate(pipeline).to_list(None)
+    return {row["_id"]: {"revenue": row["revenue"], "customers": row["customers"]} for row in rows}
+
+
+def _rentals_lookup(collection: str, store_filter: dict, date_filter: Optional[dict], local: str, foreign: str,
+                    alias: str) -> dict:
+    return {"$lookup": {
+        "from": collection,
+        "let": {"key": local},
+        "pipeline": [
+            {"$match": {
+                **store_filter,
+                **(date_filter or {}),
+                "$expr": {"$and": [{"$ne": ["$$key", ""]}, {"$eq": [f"${foreign}", "$$key"]}]},
+            }},
+            {"$project": RENTAL_DETAIL_FIELDS},
+        ],
+        "as": alias,
+    }}
+
+
+async def source_rentals(db, store_filter: dict, source_name: str,
+                         date_from: Optional[str] = None, date_to: Optional[str] = None) -> Tuple[int, List[dict]]:
+    """(customers of the source, their rentals newest first) matched by customer id or DNI"""
+    date_filter = day_range_filter(date_from, date_to) if date_from or date_to else None
+    tiers = ["rentals"]
+    archive = await archive_tier.archive_for("rentals", store_filter, date_from)
+    if archive is not None:
+        tiers.append(archive.name)
+    lookups, aliases = [], []
+    for n, collection in enumerate(tiers):
+        for local, foreign in (("$id", "customer_id"), ("$dni", "customer_dni")):
+            aliases.append(f"$by_{foreign}_{n}")
+            lookups.append(_rentals_lookup(collection, store_filter, date_filter, local, foreign, aliases[-1][1:]))
+    pipeline = [
+        {"$match": {**store_filter, "source": source_name}},
+        {"$project": {"_id": 0, "id": 1, "dni": {"$toUpper": {"$ifNull": ["$dni", ""]}}}},
+        *lookups,
+        {"$project": {"rentals": {"$concatArrays": aliases}}},
+    ]
+    customers = 0
+    rentals: Dict[str, dict] = {}
+    async for row in db.customers.aggregate(pipeline, allowDiskUse=True):
+        customers += 1
+        for rental in row["rentals"]:
+            rentals.setdefault(rental.get("id"), rental)
+    ordered = sorted(rentals.values(), key=lambda r: r.get("created_at") or "", reverse=True)
+    return customers, ordered
@@ -0,0 +1,139 @@
+"""
+Store configuration cache: tariffs, packs, item_types, sources, business settings, timezone,
+archive boundary
+These change rarely but are read on almost every screen and inside hot paths
+(returns, imports, reports). Each (store, kind) is loaded once and kept until its
+version changes.
+
+Invalidation:
+- Every create/update/delete of these collections calls `store_config.invalidate(...)`
+- Versions live in the `config_versions` collection (one doc per store) so other
+  workers notice: each process re-reads the version doc at most every
+  CONFIG_VERSION_CHECK_SECONDS per store (one tiny find_one for all kinds)
+
+Hit / miss / stale counters are exported on /api/metrics.
+"""
+import copy
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import logging
+
+from observability import registry
+
+logger = logging.getLogger(__name__)
+
+CONFIG_KINDS = ("tariffs", "packs", "item_types", "sources", "settings", "timezone", "archive")
+CONFIG_VERSION_CHECK_SECONDS = float(os.environ.get("CONFIG_VERSION_CHECK_SECONDS", "1"))
+
+config_cache_requests = registry.counter(
+    "alpineflow_config_cache_requests_total",
+    "Store configuration cache lookups by kind and result (hit, miss)",
+    ("kind", "result"),
+)
+
+
+class StoreConfigCache:
+    def __init__(self):
+        self.db = None
+        # (store_id, kind) -> (version, value)
+        self._entries: Dict[Tuple[Any, str], Tuple[int, Any]] = {}
+        # store_id -> (checked_at, {kind: version})
+        self._versions: Dict[Any, Tuple[float, Dict[str, int]]] = {}
+
+    def attach(self, db):
+        self.db = db
+
+    # ---------- versions ----------
+
+    async def _store_versions(self, store_id) -> Dict[str, int]:
+        now = time.monotonic()
+        cached = self._versions.get(store_id)
+        if cached and now - cached[0] < CONFIG_VERSION_CHECK_SECONDS:
+            return cached[1]
+        doc = await self.db.config_versions.find_one({"store_id": store_id}, {"_id": 0, "versions": 1})
+        versions = (doc or {}).get("versions", {})
+        self._versions[store_id] = (now, versions)
+        return versions
+
+    async def versions(self, store_id, *kinds: str) -> Tuple[int, ...]:
+        """Current versions of the given kinds, for caches derived from them"""
+        versions = await self._store_versions(store_id)
+        return tuple(versions.get(kind, 0) for kind in kinds)
+
+    async def invalidate(self, store_id, *kinds: str):
+        """Bump the version of the given kinds (all if none) for the store, locally and in Mongo"""
+        if store_id is None:
+            return
+        kinds = kinds or CONFIG_KINDS
+        doc = await self.db.config_versions.find_one_and_update(
+            {"store_id": store_id},
+            {"$inc": {f"versions.{kind}": 1 for kind in kinds}},
+            upsert=True,
+            projection={"_id": 0, "versions": 1},
+            return_document=True,
+        )
+        self._versions[store_id] = (time.monotonic(), (doc or {}).get("versions", {}))
+        for kind in kinds:
+            self._entries.pop((store_id, kind), None)
+
+    # ---------- generic access ----------
+
+    async def get(self, store_id, kind: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Cached value of `kind` for the store. Returns a copy: callers may mutate it."""
+        version = (await self._store_versions(store_id)).get(kind, 0)
+        entry = self._entries.get((store_id, kind))
+        if entry and entry[0] == version:
+            config_cache_requests.inc((kind, "hit"))
+            return copy.deepcopy(entry[1])
+
+        config_cache_requests.inc((kind, "miss"))
+        value = await loader()
+        self._entries[(store_id, kind)] = (version, value)
+        return copy.deepcopy(value)
+
+    def hit_rates(self) -> Dict[str, Optional[float]]:
+        rates = {}
+        for kind in CONFIG_KINDS:
+            hits = config_cache_requests.value((kind, "hit"))
+            misses = config_cache_requests.value((kind, "miss"))
+            rates[kind] = round(hits / (hits + misses), 4) if hits + misses else None
+        return rates
+
+    # ---------- typed loaders ----------
+
+    async def tariffs(self, store_id) -> List[dict]:
+        return await self.get(store_id, "tariffs", lambda: self.db.tariffs.find(
+            {"store_id": store_id}, {"_id": 0}).to_list(5000))
+
+    async def tariffs_by_type(self, store_id) -> Dict[str, dict]:
+        return {t.get("item_type"): t for t in await self.tariffs(store_id)}
+
+    async def packs(self, store_id) -> List[dict]:
+        return await self.get(store_id, "packs", lambda: self.db.packs.find(
+            {"store_id": store_id}, {"_id": 0}).to_list(5000))
+
+    async def item_types(self, store_id) -> List[dict]:
+        return await self.get(store_id, "item_types", lambda: self.db.item_types.find(
+            {"store_id": store_id}, {"_id": 0}).to_list(5000))
+
+    async def sources(self, store_id) -> List[dict]:
+        return await self.get(store_id, "sources", lambda: self.db.sources.find(
+            {"store_id": store_id}, {"_id": 0}).sort([("is_favorite", -1), ("name", 1)]).to_list(5000))
+
+    async def timezone(self, store_id) -> Optional[str]:
+        async def load():
+            store = await self.db.stores.find_one({"store_id": store_id}, {"_id": 0, "settings.timezone": 1})
+            return ((store or {}).get("settings") or {}).get("timezone")
+        return await self.get(store_id, "timezone", load)
+
+    async def archive_boundary(self, store_id) -> Optional[str]:
+        """First store-local day still entirely in the hot collections (archive_tier.py)"""
+        async def load():
+            state = await self.db.archive_state.find_one({"store_id": store_id}, {"_id": 0, "archived_before": 1})
+            return (state or {}).get("archived_before")
+        return await self.get(store_id, "archive", load)
+
+
+store_config = StoreConfigCache()
@@ -0,0 +1,2 @@
+# N+1 query detector for the HTTP test suite (see tests/query_budget_plugin.py)
+pytest_plugins = ["tests.query_budget_plugin"]
@@ -0,0 +1,204 @@
+"""
+Materialized item type registry with live item counts
+One document per (store_id, item_type) in `item_type_registry`:
+
+    {store_id, value, total, active, ghost, status_deleted, soft_deleted, updated_at}
+
+- active:         status in available / rented / maintenance
+- ghost:          status in retired / deleted / archived
+- status_deleted: status == deleted (subset of ghost)
+- soft_deleted:   deleted_at set
+
+Maintained incrementally by the item write paths (insert, update, soft/hard delete,
+reassign, bulk deletes) so /item-types, auto-cleanup and delete_item_type read
+counts instead of running distinct()/count_documents over the inventory.
+Rental flows only move items between available/rented/maintenance, which never
+changes these counters, so they need no hook.
+
+A store's registry is rebuilt from the inventory (one aggregation) the first time
+it is used, and on demand via /item-types/sync.
+"""
+import re
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+import logging
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ["available", "rented", "maintenance"]
+GHOST_STATUSES = ["retired", "deleted", "archived"]
+COUNTER_FIELDS = ("total", "active", "ghost", "status_deleted", "soft_deleted")
+
+
+def normalize_type_name(type_name: str) -> str:
+    """
+    Preserve original type name exactly as provided.
+    Only trim whitespace from start/end and collapse multiple spaces.
+    NO lowercase conversion, NO accent removal, NO underscore conversion.
+    """
+    if not type_name:
+        return ""
+    return re.sub(r'\s+', ' ', type_name.strip())
+
+
+def format_type_label(normalized_value: str) -> str:
+    """Create human-readable label from normalized value"""
+    return normalized_value.replace('_', ' ').title()
+
+
+def item_contribution(item: Optional[dict]) -> Dict[str, int]:
+    """Counters a single item document adds to its type"""
+    if not item:
+        return {}
+    status = item.get("status")
+    return {
+        "total": 1,
+        "active": 1 if status in ACTIVE_STATUSES else 0,
+        "ghost": 1 if status in GHOST_STATUSES else 0,
+        "status_deleted": 1 if status == "deleted" else 0,
+        "soft_deleted": 1 if item.get("deleted_at") is not None else 0,
+    }
+
+
+def _counts_pipeline(query: dict) -> List[dict]:
+    def count_if(condition):
+        return {"$sum": {"$cond": [condition, 1, 0]}}
+
+    return [
+        {"$match": query},
+        {"$group": {
+            "_id": "$item_type",
+            "total": {"$sum": 1},
+            "active": count_if({"$in": ["$status", ACTIVE_STATUSES]}),
+            "ghost": count_if({"$in": ["$status", GHOST_STATUSES]}),
+            "status_deleted": count_if({"$eq": ["$status", "deleted"]}),
+            "soft_deleted": count_if({"$ne": [{"$ifNull": ["$deleted_at", None]}, None]}),
+        }},
+    ]
+
+
+class ItemTypeRegistry:
+    def __init__(self):
+        self.db = None
+        self._built = set()
+
+    def attach(self, db):
+        self.db = db
+
+    @property
+    def collection(self):
+        return self.db.item_type_registry
+
+    # ---------- incremental maintenance ----------
+
+    async def _apply(self, store_id, deltas: Dict[str, Dict[str, int]]):
+        now = datetime.now(timezone.utc).isoformat()
+        ops = []
+        for type_value, counters in deltas.items():
+            inc = {k: v for k, v in counters.items() if v}
+            if type_value is None or not inc:
+                continue
+            ops.append(UpdateOne(
+                {"store_id": store_id, "value": type_value},
+                {"$inc": inc, "$set": {"updated_at": now}},
+                upsert=True
+            ))
+        if ops:
+            await self.collection.bulk_write(ops, ordered=False)
+
+    async def items_added(self, store_id, items: Iterable[dict]):
+        deltas = defaultdict(lambda: defaultdict(int))
+        for item in items:
+            for field, value in item_contribution(item).items():
+                deltas[item.get("item_type")][field] += value
+        await self._apply(store_id, deltas)
+
+    async def items_removed(self, store_id, items: Iterable[dict]):
+        deltas = defaultdict(lambda: defaultdict(int))
+        for item in items:
+            for field, value in item_contribution(item).items():
+                deltas[item.get("item_type")][field] -= value
+        await self._apply(store_id, deltas)
+
+    async def item_changed(self, store_id, before: dict, updates: dict):
+        """`updates` is the $set applied to `before`"""
+        after = {**before, **updates}
+        deltas = defaultdict(lambda: defaultdict(int))
+        for field, value in item_contribution(before).items():
+            deltas[before.get("item_type")][field] -= value
+        for field, value in item_contribution(after).items():
+            deltas[after.get("item_type")][field] += value
+        await self._apply(store_id, deltas)
+
+    async def _matching_counts(self, query: dict) -> List[dict]:
+        return await self.db.items.aggregate(_counts_pipeline(query)).to_list(5000)
+
+    async def remove_matching(self, store_id, query: dict):
+        """Call BEFORE items.delete_many(query)"""
+        deltas = {g["_id"]: {f: -g[f] for f in COUNTER_FIELDS} for g in await self._matching_counts(query)}
+        await self._apply(store_id, deltas)
+
+    async def retype_matching(self, store_id, query: dict, new_type: str):
+        """Call BEFORE items.update_many(query, {"$set": {"item_type": new_type}})"""
+        deltas = defaultdict(lambda: defaultdict(int))
+        for g in await self._matching_counts(query):
+            for f in COUNTER_FIELDS:
+                deltas[g["_id"]][f] -= g[f]
+                deltas[new_type][f] += g[f]
+        await self._apply(store_id, deltas)
+
+    # ---------- build / read ----------
+
+    async def rebuild(self, store_id) -> int:
+        """Recount the store's inventory into the registry (authoritative, self-healing)"""
+        groups = await self._matching_counts({"store_id": store_id})
+        now = datetime.now(timezone.utc).isoformat()
+        ops = [
+            UpdateOne(
+                {"store_id": store_id, "value": g["_id"]},
+                {"$set": {**{f: g[f] for f in COUNTER_FIELDS}, "updated_at": now}},
+                upsert=True
+            )
+            for g in groups if g["_id"] is not None
+        ]
+        if ops:
+            await self.collection.bulk_write(ops, ordered=False)
+        present = [g["_id"] for g in groups if g["_id"] is not None]
+        await self.collection.delete_many({"store_id": store_id, "value": {"$nin": present}})
+        await self.db.config_versions.update_one(
+            {"store_id": store_id},
+            {"$set": {"item_type_registry_built_at": now}},
+            upsert=True
+        )
+        self._built.add(store_id)
+        logger.info(f"🔄 Item type registry rebuilt for store {store_id}: {len(present)} types")
+        return len(present)
+
+    async def ensure_built(self, store_id):
+        if store_id in self._built:
+            return
+        meta = await self.db.config_versions.find_one(
+            {"store_id": store_id, "item_type_registry_built_at": {"$exists": True}}, {"_id": 1}
+        )
+        if meta:
+            self._built.add(store_id)
+        else:
+            await self.rebuild(store_id)
+
+    async def types(self, store_id) -> List[dict]:
+        """Types with at least one item (any status), like distinct(item_type) over the inventory"""
+        await self.ensure_built(store_id)
+        return await self.collection.find(
+            {"store_id": store_id, "total": {"$gt": 0}}, {"_id": 0}
+        ).to_list(5000)
+
+    async def counts(self, store_id, type_value: str) -> Dict[str, int]:
+        await self.ensure_built(store_id)
+        doc = await self.collection.find_one({"store_id": store_id, "value": type_value}, {"_id": 0}) or {}
+        return {f: max(doc.get(f, 0), 0) for f in COUNTER_FIELDS}
+
+
+item_type_registry = ItemTypeRegistry()
@@ -0,0 +1,468 @@
+"""
+Background jobs
+Long operations (imports, item type sync / migration, cash audit-sync, store
+cleanup, big exports, archival) run outside the HTTP request. Jobs are
+documents of the `jobs` collection, claimed by the in-process runner of any
+backend worker:
+- endpoints decorated with @background_job(kind) accept ?async=true and answer
+  202 with the job; the job later calls the same endpoint with the stored
+  arguments (body models, uploaded files, query params) as the stored user
+- other kinds register a handler (job_queue.register) and are submitted directly
+- at most JOBS_PER_STORE running jobs per store and JOBS_MAX_RUNNING per process
+- running jobs hold a lease renewed every HEARTBEAT_SECONDS; a job whose lease
+  expired (worker restarted or died) is claimed again and re-run: the wrapped
+  operations skip what is already done (anti-join in audit-sync, resumable
+  archival)
+- errors other than HTTPException are retried with backoff up to
+  JOBS_MAX_ATTEMPTS; an HTTPException fails the job with its detail. Kinds
+  registered with max_attempts=1 (destructive or non-idempotent: cleanups,
+  imports) are never re-run on their own, only by an explicit /retry
+- cancellation: queued jobs are cancelled at once, running ones by the worker
+  holding them at its next heartbeat
+- report_progress(done, total) in the job's code updates job.progress (no-op
+  inside a request)
+Results are stored in the job. Responses (CSV, Parquet, streaming) and results
+over RESULT_INLINE_BYTES go to GridFS (`job_files`), served by /jobs/{id}/download.
+A job keeps the role its endpoint requires (required_role). Users see and
+download their own jobs and those requiring at most their role; cancel and
+retry of others' jobs also need an admin (a retried job runs as its submitter).
+"""
+import asyncio
+import contextvars
+import functools
+import inspect
+import io
+import json
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+import bson
+from bson import ObjectId
+from fastapi import HTTPException, Query, UploadFile
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pydantic import BaseModel
+from pymongo import ReturnDocument
+from starlette.datastructures import UploadFile as StarletteUploadFile
+
+from multitenant import CurrentUser
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "jobs"
+FILES_BUCKET = "job_files"
+MAX_RUNNING = int(os.environ.get("JOBS_MAX_RUNNING", "4"))
+PER_STORE = int(os.environ.get("JOBS_PER_STORE", "1"))
+MAX_ATTEMPTS = int(os.environ.get("JOBS_MAX_ATTEMPTS", "3"))
+POLL_SECONDS = 2
+HEARTBEAT_SECONDS = 10
+LEASE_SECONDS = 60
+RETRY_BACKOFF_SECONDS = 30
+PROGRESS_EVERY_SECONDS = 1.0
+RESULT_INLINE_BYTES = 1024 * 1024
+MAX_UPLOAD_BYTES = 12 * 1024 * 1024  # job document stays under the 16MB BSON limit
+ACTIVE = ["queued", "running"]
+INDEXES = [
+    ([("id", 1)], {"unique": True}),
+    ([("status", 1), ("not_before", 1)], {}),
+    ([("store_id", 1), ("created_at", -1)], {}),
+]
+PUBLIC_PROJECTION = {"_id": 0, "uploads": 0, "file.id": 0, "worker": 0, "lease_until": 0}
+ROLE_LEVELS = {"employee": 0, "admin": 1, "super_admin": 2}
+ROLE_DEPENDENCIES = {"require_admin": "admin", "require_super_admin": "super_admin"}
+
+_current_job: contextvars.ContextVar = contextvars.ContextVar("current_job", default=None)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class JobContext:
+    """What a handler gets: the job document and progress reporting"""
+
+    def __init__(self, queue: "JobQueue", job: dict):
+        self.queue = queue
+        self.job = job
+        self.id = job["id"]
+        self.store_id = job["store_id"]
+        self.params = job.get("params") or {}
+        self._reported_at = 0.0
+
+    async def progress(self, done: int, total: Optional[int] = None, message: Optional[str] = None):
+        """Throttled to one write per PROGRESS_EVERY_SECONDS (the last step is always written)"""
+        now = asyncio.get_running_loop().time()
+        if now - self._reported_at < PROGRESS_EVERY_SECONDS and (total is None or done < total):
+            return
+        self._reported_at = now
+        await self.queue.collection.update_one(
+            {"id": self.id}, {"$set": {"progress": {"done": done, "total": total, "message": message}}}
+        )
+
+
+async def report_progress(done: int, total: Optional[int] = None, message: Optional[str] = None):
+    """Progress of the running job (no-op when called from a request)"""
+    job = _current_job.get()
+    if job is not None:
+        await job.progress(done, total, message)
+
+
+def _access(user: CurrentUser, manage: bool = False) -> dict:
+    """Jobs of the user's store the user may see (manage: cancel / retry)"""
+    level = ROLE_LEVELS.get(user.role, 0)
+    if manage and level < ROLE_LEVELS["admin"]:
+        return {"store_id": user.store_id, "user.user_id": user.user_id}
+    roles = [role for role, required in ROLE_LEVELS.items() if required <= level]
+    return {"store_id": user.store_id,
+            "$or": [{"user.user_id": user.user_id}, {"required_role": {"$in": roles}}]}
+
+
+def _filename(response: Response, default: str) -> str:
+    disposition = response.headers.get("content-disposition", "")
+    if "filename=" in disposition:
+        return disposition.split("filename=", 1)[1].strip('"; ')
+    return default
+
+
+async def _response_chunks(response: Response) -> AsyncIterator[bytes]:
+    if isinstance(response, StreamingResponse):
+        async for chunk in response.body_iterator:
+            yield chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+    else:
+        yield response.body
+
+
+class JobQueue:
+    def __init__(self):
+        self.db = None
+        self.handlers: Dict[str, Callable[[JobContext], Awaitable]] = {}
+        self.max_attempts: Dict[str, int] = {}
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._running: Dict[str, asyncio.Task] = {}
+        self._worker: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._stopping = False
+
+    def attach(self, db):
+        self.db = db
+
+    @property
+    def collection(self):
+        return self.db[COLLECTION]
+
+    @property
+    def files(self) -> AsyncIOMotorGridFSBucket:
+        return AsyncIOMotorGridFSBucket(self.db, bucket_name=FILES_BUCKET)
+
+    async def create_indexes(self):
+        for keys, options in INDEXES:
+            await self.collection.create_index(keys, **options)
+
+    def register(self, kind: str, handler: Callable[[JobContext], Awaitable], max_attempts: int = MAX_ATTEMPTS):
+        """max_attempts=1: the kind is not idempotent and must not be re-run automatically"""
+        self.handlers[kind] = handler
+        self.max_attempts[kind] = max_attempts
+
+    # ---------- API ----------
+
+    async def submit(self, kind: str, user: CurrentUser, params: Optional[dict] = None,
+                     uploads: Optional[dict] = None, max_attempts: Optional[int] = None,
+                     required_role: Optional[str] = None) -> dict:
+        """
+        max_attempts: default the kind's (register); required_role: role the
+        endpoint requires (default: the submitter's)
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        now = _now().isoformat()
+        doc = {
+            "id": str(uuid.uuid4()),
+            "kind": kind,
+            "store_id": user.store_id,
+            "user": {"user_id": user.user_id, "username": user.username, "role": user.role, "store_id": user.store_id},
+            "required_role": required_role or user.role,
+            "params": params or {},
+            "uploads": uploads or {},
+            "status": "queued",
+            "progress": None,
+            "attempts": 0,
+            "max_attempts": max_attempts or self.max_attempts[kind],
+            "cancel_requested": False,
+            "error": None,
+            "created_at": now,
+            "not_before": now,
+        }
+        await self.collection.insert_one(doc)
+        if self._wake:
+            self._wake.set()
+        logger.info(f"📥 Job {kind} {doc['id']} queued for store {user.store_id}")
+        return await self.get(user, doc["id"])
+
+    async def get(self, user: CurrentUser, job_id: str) -> Optional[dict]:
+        return await self.collection.find_one({**_access(user), "id": job_id}, PUBLIC_PROJECTION)
+
+    async def list(self, user: CurrentUser, status: Optional[str] = None, limit: int = 50) -> List[dict]:
+        query = {**_access(user), **({"status": status} if status else {})}
+        return await self.collection.find(query, PUBLIC_PROJECTION).sort("created_at", -1).to_list(limit)
+
+    async def active(self, store_id, kind: str) -> Optional[dict]:
+        return await self.collection.find_one({"store_id": store_id, "kind": kind, "status": {"$in": ACTIVE}},
+                                              PUBLIC_PROJECTION)
+
+    async def cancel(self, user: CurrentUser, job_id: str) -> Optional[dict]:
+        """None if the job doesn't exist or the user may not manage it"""
+        query = {**_access(user, manage=True), "id": job_id}
+        if not await self.collection.find_one(query, {"_id": 1}):
+            return None
+        now = _now().isoformat()
+        queued = await self.collection.update_one(
+            {**query, "status": "queued"},
+            {"$set": {"status": "cancelled", "cancel_requested": True, "finished_at": now}}
+        )
+        if not queued.modified_count:
+            await self.collection.update_one({**query, "status": "running"}, {"$set": {"cancel_requested": True}})
+            if job_id in self._running:
+                self._running[job_id].cancel()
+        return await self.get(user, job_id)
+
+    async def retry(self, user: CurrentUser, job_id: str) -> Optional[dict]:
+        """Queue a failed / cancelled job again with a fresh attempt budget (None if not allowed)"""
+        query = {**_access(user, manage=True), "id": job_id}
+        if not await self.collection.find_one(query, {"_id": 1}):
+            return None
+        await self.collection.update_one(
+            {**query, "status": {"$in": ["failed", "cancelled"]}},
+            {"$set": {"status": "queued", "attempts": 0, "cancel_requested": False, "error": None,
+                      "not_before": _now().isoformat(), "finished_at": None}}
+        )
+        if self._wake:
+            self._wake.set()
+        return await self.get(user, job_id)
+
+    async def download(self, user: CurrentUser, job_id: str):
+        """(file info, chunks) of the job's stored file, or None"""
+        job = await self.collection.find_one({**_access(user), "id": job_id, "status": "done"}, {"file": 1})
+        if not job or not job.get("file"):
+            return None
+        stream = await self.files.open_download_stream(job["file"]["id"])
+
+        async def chunks():
+            while True:
+                chunk = await stream.readchunk()
+                if not chunk:
+                    return
+                yield chunk
+        return job["file"], chunks()
+
+    # ---------- Runner ----------
+
+    async def _claim(self) -> Optional[dict]:
+        now = _now()
+        busy = [row["_id"] async for row in self.collection.aggregate([
+            {"$match": {"status": "running", "lease_until": {"$gt": now.isoformat()}}},
+            {"$group": {"_id": "$store_id", "running": {"$sum": 1}}},
+            {"$match": {"running": {"$gte": PER_STORE}}},
+        ])]
+        return await self.collection.find_one_and_update(
+            {
+                "kind": {"$in": list(self.handlers)},
+                "store_id": {"$nin": busy},
+                "$or": [
+                    {"status": "queued", "not_before": {"$lte": now.isoformat()}},
+                    # Lease expired: the worker that ran it is gone, resume it here
+                    {"status": "running", "lease_until": {"$lte": now.isoformat()}, "cancel_requested": False},
+                ],
+            },
+            {
+                "$set": {"status": "running", "worker": self.worker_id, "started_at": now.isoformat(),
+                         "lease_until": (now + timedelta(seconds=LEASE_SECONDS)).isoformat()},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("created_at", 1)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _heartbeat(self):
+        now = _now()
+        # Abandoned jobs that were asked to stop
+        await self.collection.update_many(
+            {"status": "running", "lease_until": {"$lte": now.isoformat()}, "cancel_requested": True},
+            {"$set": {"status": "cancelled", "finished_at": now.isoformat()}}
+        )
+        if not self._running:
+            return
+        ids = list(self._running)
+        await self.collection.update_many(
+            {"id": {"$in": ids}, "worker": self.worker_id, "status": "running"},
+            {"$set": {"lease_until": (now + timedelta(seconds=LEASE_SECONDS)).isoformat()}}
+        )
+        for job_id in await self.collection.distinct("id", {"id": {"$in": ids}, "cancel_requested": True}):
+            if job_id in self._running:
+                self._running[job_id].cancel()
+
+    async def _store_file(self, job: dict, filename: str, media_type: str, chunks: AsyncIterator[bytes]) -> dict:
+        file_id = ObjectId()
+        stream = self.files.open_upload_stream_with_id(
+            file_id, filename, metadata={"job_id": job["id"], "store_id": job["store_id"], "media_type": media_type}
+        )
+        size = 0
+        async for chunk in chunks:
+            await stream.write(chunk)
+            size += len(chunk)
+        await stream.close()
+        return {"id": file_id, "filename": filename, "media_type": media_type, "size": size}
+
+    async def _store_result(self, job: dict, result) -> dict:
+        """Fields of the job document holding the result"""
+        if isinstance(result, Response):
+            filename = _filename(result, f"{job['kind']}_{job['id']}")
+            media_type = result.media_type or "application/octet-stream"
+            return {"result": None, "file": await self._store_file(job, filename, media_type, _response_chunks(result))}
+        result = jsonable_encoder(result)
+        if len(bson.encode({"result": result})) <= RESULT_INLINE_BYTES:
+            return {"result": result}
+
+        async def body():
+            yield json.dumps(result, ensure_ascii=False).encode("utf-8")
+        return {"result": None, "file": await self._store_file(job, f"{job['kind']}_{job['id']}.json", "application/json", body())}
+
+    async def _execute(self, job: dict):
+        _current_job.set(JobContext(self, job))
+        fields: dict = {"lease_until": None}
+        try:
+            if job["attempts"] > job["max_attempts"]:
+                raise HTTPException(status_code=500, detail="Trabajo interrumpido demasiadas veces")
+            result = await self.handlers[job["kind"]](_current_job.get())
+            fields.update(status="done", error=None, **await self._store_result(job, result))
+        except asyncio.CancelledError:
+            if self._stopping:
+                raise  # shutdown: lease expires and another worker resumes it
+            fields["status"] = "cancelled"
+        except HTTPException as e:
+            fields.update(status="failed", error=str(e.detail))
+        except Exception as e:
+            logger.error(f"❌ Job {job['kind']} {job['id']} failed (attempt {job['attempts']}): {e}")
+            fields["error"] = str(e)
+            if job["attempts"] < job["max_attempts"]:
+                delay = RETRY_BACKOFF_SECONDS * job["attempts"]
+                fields.update(status="queued", not_before=(_now() + timedelta(seconds=delay)).isoformat())
+            else:
+                fields["status"] = "failed"
+        if fields["status"] != "queued":
+            fields["finished_at"] = _now().isoformat()
+        update = {"$set": fields}
+        if fields["status"] == "done":
+            update["$unset"] = {"uploads": ""}
+        await self.collection.update_one({"id": job["id"], "worker": self.worker_id}, update)
+        logger.info(f"🏁 Job {job['kind']} {job['id']}: {fields['status']}")
+
+    def _launch(self, job: dict):
+        task = asyncio.create_task(self._execute(job), context=contextvars.Context())
+        self._running[job["id"]] = task
+
+        def done(_):
+            self._running.pop(job["id"], None)
+            self._wake.set()
+        task.add_done_callback(done)
+
+    async def _run(self):
+        self._wake = asyncio.Event()
+        beat_at = 0.0
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                while len(self._running) < MAX_RUNNING:
+                    job = await self._claim()
+                    if job is None:
+                        break
+                    self._launch(job)
+                if loop.time() - beat_at >= HEARTBEAT_SECONDS:
+                    beat_at = loop.time()
+                    await self._heartbeat()
+            except Exception as e:
+                logger.error(f"❌ Job runner cycle failed (retried next cycle): {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def start(self):
+        if self._worker is None:
+            self._stopping = False
+            self._worker = asyncio.create_task(self._run(), context=contextvars.Context())
+
+    def stop(self):
+        self._stopping = True
+        for task in list(self._running.values()):
+            task.cancel()
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+
+
+job_queue = JobQueue()
+
+
+def background_job(kind: str, max_attempts: int = MAX_ATTEMPTS) -> Callable:
+    """
+    Let an endpoint run as a job with ?async=true (202 + job). Goes below
+    @api_router.<method>(...) / @query_budget and above the endpoint's other
+    decorators, which then run inside the job (once per attempt: endpoints that
+    delete or insert without skipping duplicates pass max_attempts=1).
+    """
+    def decorator(func: Callable) -> Callable:
+        signature = inspect.signature(func)
+        user_param = next(name for name, p in signature.parameters.items() if p.annotation is CurrentUser)
+        # Role the endpoint's auth dependency requires (Depends(require_admin) ...)
+        dependency = getattr(signature.parameters[user_param].default, "dependency", None)
+        required_role = ROLE_DEPENDENCIES.get(getattr(dependency, "__name__", ""), "employee")
+
+        async def handler(job: JobContext):
+            kwargs = {}
+            uploads = job.job.get("uploads") or {}
+            for name, param in signature.parameters.items():
+                if name == user_param:
+                    kwargs[name] = CurrentUser(**job.job["user"])
+                elif name in uploads:
+                    kwargs[name] = UploadFile(io.BytesIO(uploads[name]["content"]), filename=uploads[name]["filename"])
+                elif inspect.isclass(param.annotation) and issubclass(param.annotation, BaseModel):
+                    kwargs[name] = param.annotation.model_validate(job.params[name])
+                else:
+                    kwargs[name] = job.params.get(name)
+            return await func(**kwargs)
+        job_queue.register(kind, handler, max_attempts)
+
+        @functools.wraps(func)
+        async def wrapper(*args, run_async: bool = False, **kwargs):
+            if not run_async:
+                return await func(*args, **kwargs)
+            params, uploads = {}, {}
+            for name, value in kwargs.items():
+                if name == user_param:
+                    continue
+                if isinstance(value, StarletteUploadFile):
+                    uploads[name] = {"filename": value.filename, "content": await value.read()}
+                elif isinstance(value, BaseModel):
+                    params[name] = value.model_dump(mode="json")
+                else:
+                    params[name] = value
+            if sum(len(u["content"]) for u in uploads.values()) > MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail="Archivo demasiado grande para un trabajo en segundo plano")
+            job = await job_queue.submit(kind, kwargs[user_param], params, uploads, required_role=required_role)
+            return JSONResponse(status_code=202, content=job)
+
+        wrapper.__signature__ = signature.replace(parameters=[
+            *signature.parameters.values(),
+            inspect.Parameter("run_async", inspect.Parameter.KEYWORD_ONLY, annotation=bool, default=Query(
+                False, alias="async", description="Ejecutar en segundo plano (devuelve el trabajo, ver /jobs/{id})"
+            )),
+        ])
+        return wrapper
+    return decorator
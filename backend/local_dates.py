@@ -0,0 +1,189 @@
+"""
+Store-local date keys
+created_at is stored as a UTC ISO string, while reports, cash views and stats
+ask for store-local days ("YYYY-MM-DD"). Rentals and cash movements therefore
+carry precomputed keys, stamped at write time with the store timezone
+(stores.settings.timezone, default Europe/Madrid):
+- local_date: local day of created_at (rentals and cash movements)
+- created_at_dt: created_at as a native BSON datetime
+- start_local_date / end_local_date: day part of the rental period (rentals)
+
+Day and range queries use day_range_filter(), an equality/range on local_date
+(indexed with store_id). Documents written before the keys existed are matched
+by the legacy created_at string range until the backfill (startup, resumable,
+per store in batches) has stamped them; a timezone change re-stamps the store,
+its archive collections included (archive_tier.py), then runs the caller's
+`after` hook (server.py rebuilds the analytics cube and the returns tower).
+"""
+import asyncio
+import contextvars
+import logging
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional, Set
+from zoneinfo import ZoneInfo
+
+from pymongo import UpdateOne
+
+from archive_tier import archive_name
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEZONE = "Europe/Madrid"
+STAMPED_COLLECTIONS = ("rentals", "cash_movements")
+
+_tasks: Set[asyncio.Task] = set()
+
+
+def zone(tz_name: Optional[str]) -> ZoneInfo:
+    try:
+        return ZoneInfo(tz_name or DEFAULT_TIMEZONE)
+    except Exception:
+        return ZoneInfo(DEFAULT_TIMEZONE)
+
+
+def valid_timezone(tz_name: str) -> bool:
+    try:
+        ZoneInfo(tz_name)
+        return True
+    except Exception:
+        return False
+
+
+def local_today(tz_name: Optional[str] = None) -> str:
+    return datetime.now(zone(tz_name)).strftime("%Y-%m-%d")
+
+
+def parse_instant(value) -> Optional[datetime]:
+    """Aware datetime for a stored timestamp (naive strings are taken as UTC, like created_at)"""
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def local_date_of(value, tz_name: Optional[str]) -> Optional[str]:
+    instant = parse_instant(value)
+    return instant.astimezone(zone(tz_name)).strftime("%Y-%m-%d") if instant else None
+
+
+def calendar_day(value, tz_name: Optional[str]) -> Optional[str]:
+    """Local day of a rental period bound (start_date / end_date, entered in local time)"""
+    if not value or not isinstance(value, str):
+        return None
+    if value.endswith("Z"):
+        # Serialized from a browser Date: back to the store's wall clock
+        return local_date_of(value, tz_name)
+    return value[:10]
+
+
+def local_keys(doc: dict, tz_name: Optional[str], rental: bool = False) -> dict:
+    keys = {
+        "local_date": local_date_of(doc.get("created_at"), tz_name),
+        "created_at_dt": parse_instant(doc.get("created_at")),
+    }
+    if rental:
+        keys["start_local_date"] = calendar_day(doc.get("start_date"), tz_name)
+        keys["end_local_date"] = calendar_day(doc.get("end_date"), tz_name)
+    return keys
+
+
+def day_range_filter(start_date: Optional[str], end_date: Optional[str], legacy_field: str = "created_at") -> dict:
+    """Local days [start_date, end_date] (either bound optional); unstamped documents fall back to the string range"""
+    local, legacy = {}, {}
+    if start_date:
+        local["$gte"] = start_date
+        legacy["$gte"] = f"{start_date}T00:00:00"
+    if end_date:
+        local["$lte"] = end_date
+        legacy["$lte"] = f"{end_date}T23:59:59"
+    return {"$or": [
+        {"local_date": local},
+        {"local_date": {"$exists": False}, legacy_field: legacy},
+    ]}
+
+
+class LocalDates:
+    def __init__(self):
+        self.db = None
+        self.store_config = None
+
+    def attach(self, db, store_config):
+        self.db = db
+        self.store_config = store_config
+
+    async def timezone(self, store_id) -> str:
+        if store_id is None:
+            return DEFAULT_TIMEZONE
+        return await self.store_config.timezone(store_id) or DEFAULT_TIMEZONE
+
+    async def today(self, store_id) -> str:
+        return local_today(await self.timezone(store_id))
+
+    async def stamp(self, doc: dict, rental: bool = False) -> dict:
+        """Add the local keys to a document about to be inserted (in place, returned)"""
+        doc.update(local_keys(doc, await self.timezone(doc.get("store_id")), rental))
+        return doc
+
+    async def backfill(self, store_id=None, restamp: bool = False, batch_size: int = 1000) -> dict:
+        """
+        Stamp documents without keys, store by store. restamp: all of the store's
+        documents, in the hot and the archive collections.
+        """
+        stores = [store_id] if store_id is not None else await self.db.rentals.distinct("store_id")
+        if store_id is None:
+            stores = sorted(set(stores) | set(await self.db.cash_movements.distinct("store_id")), key=str)
+        updated = {name: 0 for name in STAMPED_COLLECTIONS}
+        for store in stores:
+            tz_name = await self.timezone(store)
+            for name in STAMPED_COLLECTIONS:
+                updated[name] += await self._backfill_collection(name, store, tz_name, restamp, batch_size)
+                if restamp and archive_name(name, store) in await self.db.list_collection_names():
+                    updated[name] += await self._backfill_collection(name, store, tz_name, restamp, batch_size,
+                                                                     archive_name(name, store))
+        if any(updated.values()):
+            logger.info(f"✅ Local date keys stamped: {updated}")
+        return updated
+
+    async def _backfill_collection(self, name: str, store_id, tz_name: str, restamp: bool, batch_size: int,
+                                   collection_name: Optional[str] = None) -> int:
+        collection = self.db[collection_name or name]
+        rental = name == "rentals"
+        query = {"store_id": store_id}
+        if not restamp:
+            query["local_date"] = {"$exists": False}
+        fields = {"_id": 1, "created_at": 1, **({"start_date": 1, "end_date": 1} if rental else {})}
+        updated = 0
+        last_id = None
+        while True:
+            page = dict(query)
+            if last_id is not None:
+                page["_id"] = {"$gt": last_id}
+            docs = await collection.find(page, fields).sort("_id", 1).limit(batch_size).to_list(batch_size)
+            if not docs:
+                return updated
+            last_id = docs[-1]["_id"]
+            ops = [UpdateOne({"_id": d["_id"]}, {"$set": local_keys(d, tz_name, rental)}) for d in docs]
+            result = await collection.bulk_write(ops, ordered=False)
+            updated += result.modified_count
+
+    def start_backfill(self, store_id=None, restamp: bool = False,
+                       after: Optional[Callable[[], Awaitable]] = None):
+        """Run the backfill in the background (startup, timezone change), then `after`"""
+        async def run():
+            try:
+                await self.backfill(store_id, restamp)
+                if after:
+                    await after()
+            except Exception as e:
+                logger.error(f"❌ Local date backfill failed (resumes on next start): {e}")
+        task = asyncio.create_task(run(), context=contextvars.Context())
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+
+
+local_dates = LocalDates()
@@ -0,0 +1,363 @@
+"""
+Data migrations
+Versioned replacements of the old one-off repair scripts. Each migration is
+registered with @migration(version, description) and runs once per store (or
+once for the whole database when per_store=False); its state lives in the
+`migrations` collection, one document per (version, store_id):
+
+    {version, store_id, status: running | done | failed, checkpoint, counts, ...}
+
+- documents are read with cursors in _id order, BATCH_SIZE at a time, and
+  written with one bulk_write per batch; the checkpoint (last _id per
+  collection) is saved after each batch, so a failed or interrupted run resumes
+  where it stopped
+- stores run in parallel (MIGRATION_CONCURRENCY); migrations run in version
+  order and a store that fails one skips the following ones
+- dry_run counts what would change without writing (and without state)
+- afterwards the store's item type registry is recounted and its configuration
+  cache invalidated for the kinds the migration touched
+
+Type names follow the application's rule (item_type_registry.normalize_type_name).
+
+Run with `python migrations.py [--dry-run] [--store N] [--only VERSION]` or
+POST /api/admin/migrations (background job).
+"""
+import argparse
+import asyncio
+import logging
+import os
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from pymongo import DeleteOne, InsertOne, UpdateMany, UpdateOne
+
+from config_cache import store_config
+from item_type_registry import format_type_label, item_type_registry, normalize_type_name
+from jobs import report_progress
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "migrations"
+BATCH_SIZE = int(os.environ.get("MIGRATION_BATCH_SIZE", "1000"))
+CONCURRENCY = int(os.environ.get("MIGRATION_CONCURRENCY", "4"))
+LEGACY_STORE_ID = 1
+LIVE_ITEM_STATUSES = {"$nin": ["deleted", "retired"]}
+
+
+class Migration:
+    def __init__(self, version: str, description: str, func: Callable, per_store: bool):
+        self.version = version
+        self.description = description
+        self.func = func
+        self.per_store = per_store
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: str, description: str, per_store: bool = True) -> Callable:
+    def decorator(func: Callable) -> Callable:
+        MIGRATIONS.append(Migration(version, description, func, per_store))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return func
+    return decorator
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class MigrationContext:
+    def __init__(self, db, migration: Migration, store_id, state: dict, dry_run: bool):
+        self.db = db
+        self.migration = migration
+        self.store_id = store_id
+        self.dry_run = dry_run
+        self.checkpoint: Dict[str, object] = {} if dry_run else dict(state.get("checkpoint") or {})
+        self.counts: Dict[str, int] = defaultdict(int, {} if dry_run else state.get("counts") or {})
+        self.touched: set = set()  # config kinds to invalidate
+
+    @property
+    def store_filter(self) -> dict:
+        return {} if self.store_id is None else {"store_id": self.store_id}
+
+    def count(self, key: str, n: int = 1):
+        self.counts[key] += n
+
+    async def save(self, **fields):
+        if self.dry_run:
+            return
+        await self.db[COLLECTION].update_one(
+            {"version": self.migration.version, "store_id": self.store_id},
+            {"$set": {"checkpoint": self.checkpoint, "counts": dict(self.counts), **fields}},
+            upsert=True
+        )
+
+    async def batches(self, collection: str, query: dict, projection: Optional[dict] = None) -> AsyncIterator[List[dict]]:
+        """The store's matching documents in _id order from the checkpoint, BATCH_SIZE at a time"""
+        key = collection
+        query = {**query, **self.store_filter}
+        if self.checkpoint.get(key) is not None:
+            query["_id"] = {"$gt": self.checkpoint[key]}
+        cursor = self.db[collection].find(query, projection).sort("_id", 1).batch_size(BATCH_SIZE)
+        batch: List[dict] = []
+        try:
+            async for doc in cursor:
+                batch.append(doc)
+                if len(batch) >= BATCH_SIZE:
+                    yield batch
+                    self.checkpoint[key] = batch[-1]["_id"]
+                    await self.save()
+                    batch = []
+            if batch:
+                yield batch
+                self.checkpoint[key] = batch[-1]["_id"]
+                await self.save()
+        finally:
+            await cursor.close()
+
+    async def bulk_write(self, collection: str, ops: list, counter: str, documents: Optional[int] = None) -> int:
+        """Apply ops (unordered) and count them (or `documents`) under `counter`; dry runs only count"""
+        if not ops:
+            return 0
+        self.count(counter, len(ops) if documents is None else documents)
+        if not self.dry_run:
+            await self.db[collection].bulk_write(ops, ordered=False)
+        return len(ops)
+
+
+# ---------- Migrations ----------
+
+@migration("0001_legacy_store_id", "Documentos sin store_id -> tienda 1 (phase3_migrate_data, migrate_to_multitenant, "
+           "migrate_config_collections)", per_store=False)
+async def legacy_store_id(ctx: MigrationContext):
+    # users excluded: a super_admin may legitimately have no store
+    for collection in ("customers", "items", "rentals", "cash_sessions", "cash_movements", "cash_closures",
+                       "cash_closings", "packs", "tariffs", "item_types", "sources"):
+        async for batch in ctx.batches(collection, {"store_id": {"$exists": False}}, {"_id": 1}):
+            await ctx.bulk_write(collection, [
+                UpdateMany({"_id": {"$in": [d["_id"] for d in batch]}},
+                           {"$set": {"store_id": LEGACY_STORE_ID, "migrated_at": _now()}})
+            ], collection, documents=len(batch))
+
+
+@migration("0002_normalize_type_names", "Normaliza item_type en artículos y packs "
+           "(normalize_item_types, normalize_packs)")
+async def normalize_type_names(ctx: MigrationContext):
+    async for batch in ctx.batches("items", {"item_type": {"$type": "string"}}, {"_id": 1, "item_type": 1}):
+        await ctx.bulk_write("items", [
+            UpdateOne({"_id": d["_id"]}, {"$set": {"item_type": normalize_type_name(d["item_type"]), "updated_at": _now()}})
+            for d in batch if d["item_type"] != normalize_type_name(d["item_type"])
+        ], "items")
+    async for batch in ctx.batches("packs", {"items.0": {"$exists": True}}, {"_id": 1, "items": 1}):
+        ops = []
+        for pack in batch:
+            normalized = [normalize_type_name(t) if isinstance(t, str) else t for t in pack["items"]]
+            if normalized != pack["items"]:
+                ops.append(UpdateOne({"_id": pack["_id"]}, {"$set": {"items": normalized, "updated_at": _now()}}))
+        await ctx.bulk_write("packs", ops, "packs")
+    ctx.touched.add("packs")
+
+
+async def _merge_by_type(ctx: MigrationContext, collection: str, field: str, rank: Callable[[dict], tuple],
+                         before_delete: Optional[Callable[[dict, dict], Awaitable]] = None):
+    """
+    One document per normalized type: the best ranked is kept (renamed), the rest deleted.
+    before_delete(groups, kept) runs before the deletes (references to the duplicates are
+    moved while they can still be found: an interrupted run is redone from the same groups).
+    """
+    docs = await ctx.db[collection].find(ctx.store_filter, {"_id": 1, "id": 1, field: 1, "created_at": 1}).to_list(None)
+    groups = defaultdict(list)
+    for doc in docs:
+        if isinstance(doc.get(field), str):
+            groups[normalize_type_name(doc[field])].append(doc)
+    kept, deletes, renames = {}, [], []
+    for value, group in groups.items():
+        group.sort(key=rank)
+        kept[value] = group[0]
+        deletes.extend(DeleteOne({"_id": d["_id"]}) for d in group[1:])
+        if group[0][field] != value:
+            renames.append(UpdateOne({"_id": group[0]["_id"]}, {"$set": {field: value}}))
+    if before_delete:
+        await before_delete(groups, kept)
+    # Deletes first: a rename must not collide with a duplicate still in place
+    await ctx.bulk_write(collection, deletes, f"{collection}_deleted")
+    await ctx.bulk_write(collection, renames, f"{collection}_renamed")
+    return groups, kept
+
+
+@migration("0003_merge_duplicate_types", "Un tipo y una tarifa por tipo normalizado; los artículos de tarifas "
+           "duplicadas pasan a la que se conserva (merge_duplicate_types, cleanup_item_types)")
+async def merge_duplicate_types(ctx: MigrationContext):
+    await _merge_by_type(ctx, "item_types", "value", lambda t: t.get("created_at") or "")
+    # Tariffs: keep the one most items point to
+    usage = {row["_id"]: row["n"] async for row in ctx.db.items.aggregate([
+        {"$match": {**ctx.store_filter, "tariff_id": {"$type": "string"}}},
+        {"$group": {"_id": "$tariff_id", "n": {"$sum": 1}}},
+    ])}
+
+    async def repoint_items(groups: dict, kept: dict):
+        # items of the duplicates -> the kept tariff
+        repoint = {value: [t["id"] for t in group[1:] if t.get("id")] for value, group in groups.items()}
+        await ctx.bulk_write("items", [
+            UpdateMany({**ctx.store_filter, "tariff_id": {"$in": ids}}, {"$set": {"tariff_id": kept[value].get("id")}})
+            for value, ids in repoint.items() if ids
+        ], "items_tariff_repointed")
+
+    await _merge_by_type(ctx, "tariffs", "item_type",
+                         lambda t: (-usage.get(t.get("id"), 0), t.get("created_at") or ""),
+                         before_delete=repoint_items)
+    ctx.touched.update(("item_types", "tariffs"))
+
+
+@migration("0004_type_catalog", "Tipo y tarifa para cada tipo del inventario; elimina tipos sin artículos "
+           "(cleanup_types)")
+async def type_catalog(ctx: MigrationContext):
+    in_use = {
+        row["_id"]: row["n"] async for row in ctx.db.items.aggregate([
+            {"$match": {**ctx.store_filter, "status": {"$nin": ["deleted"]}}},
+            {"$group": {"_id": "$item_type", "n": {"$sum": 1}}},
+        ]) if row["_id"]
+    }
+    types = set(await ctx.db.item_types.distinct("value", ctx.store_filter))
+    tariffs = set(await ctx.db.tariffs.distinct("item_type", ctx.store_filter))
+    now = _now()
+    await ctx.bulk_write("item_types", [
+        InsertOne({"id": str(uuid.uuid4()), "store_id": ctx.store_id, "value": value,
+                   "label": format_type_label(value), "is_default": False, "created_at": now})
+        for value in in_use if value not in types
+    ], "item_types_created")
+    await ctx.bulk_write("tariffs", [
+        InsertOne({"id": str(uuid.uuid4()), "store_id": ctx.store_id, "item_type": value, "daily_rate": 0.0,
+                   "deposit": 0.0, "name": format_type_label(value), "created_at": now})
+        for value in in_use if value not in tariffs
+    ], "tariffs_created")
+    empty = [value for value in types if value not in in_use]
+    await ctx.bulk_write("item_types", [DeleteOne({**ctx.store_filter, "value": v}) for v in empty], "item_types_deleted")
+    await ctx.bulk_write("tariffs", [DeleteOne({**ctx.store_filter, "item_type": v}) for v in empty], "tariffs_deleted")
+    ctx.touched.update(("item_types", "tariffs"))
+
+
+@migration("0005_item_tariffs", "Asigna tariff_id y rental_price a los artículos que no los tienen "
+           "(repair_item_tariffs, fix_missing_tariffs, fix_missing_tariffs_v2)")
+async def item_tariffs(ctx: MigrationContext):
+    tariffs = {
+        t["item_type"]: t for t in await ctx.db.tariffs.find(
+            ctx.store_filter, {"_id": 0, "id": 1, "item_type": 1, "daily_rate": 1}
+        ).to_list(None)
+    }
+    query = {
+        "status": LIVE_ITEM_STATUSES,
+        "$or": [
+            {"tariff_id": {"$in": [None, ""]}},
+            {"rental_price": None},
+        ],
+    }
+    async for batch in ctx.batches("items", query, {"_id": 1, "item_type": 1, "tariff_id": 1, "rental_price": 1}):
+        ops = []
+        for item in batch:
+            tariff = tariffs.get(item.get("item_type"))
+            if not tariff:
+                ctx.count("items_without_tariff")
+                continue
+            update = {}
+            if not item.get("tariff_id"):
+                update["tariff_id"] = tariff["id"]
+            if item.get("rental_price") is None or "tariff_id" in update:
+                update["rental_price"] = tariff.get("daily_rate") or 0.0
+            ops.append(UpdateOne({"_id": item["_id"]}, {"$set": update}))
+        await ctx.bulk_write("items", ops, "items")
+
+
+# ---------- Runner ----------
+
+async def _run_one(db, m: Migration, store_id, dry_run: bool) -> dict:
+    key = {"version": m.version, "store_id": store_id}
+    state = await db[COLLECTION].find_one(key, {"_id": 0}) or {}
+    if state.get("status") == "done" and not dry_run:
+        return {**key, "status": "done", "skipped": True}
+    ctx = MigrationContext(db, m, store_id, state, dry_run)
+    await ctx.save(status="running", description=m.description, started_at=_now(), error=None)
+    try:
+        await m.func(ctx)
+    except Exception as e:
+        logger.error(f"❌ Migration {m.version} failed for store {store_id} (re-run to resume): {e}")
+        await ctx.save(status="failed", error=str(e))
+        return {**key, "status": "failed", "error": str(e), "counts": dict(ctx.counts)}
+    await ctx.save(status="done", finished_at=_now())
+    if not dry_run and store_id is not None and ctx.counts:
+        if ctx.touched:
+            await store_config.invalidate(store_id, *ctx.touched)
+        await item_type_registry.rebuild(store_id)
+    logger.info(f"✅ Migration {m.version} store {store_id}{' (dry run)' if dry_run else ''}: {dict(ctx.counts)}")
+    return {**key, "status": "dry_run" if dry_run else "done", "counts": dict(ctx.counts)}
+
+
+async def run_migrations(db, store_ids: Optional[List] = None, only: Optional[str] = None,
+                         dry_run: bool = False, concurrency: int = CONCURRENCY) -> List[dict]:
+    """Pending migrations (or just `only`) for the given stores (default: all), in version order"""
+    selected = [m for m in MIGRATIONS if only is None or m.version == only]
+    if not selected:
+        raise ValueError(f"Migración desconocida: {only}")
+    stores = store_ids or await db.stores.distinct("store_id")
+    failed = set()
+    results = []
+    limit = asyncio.Semaphore(concurrency)
+
+    async def limited(m, store_id):
+        async with limit:
+            return await _run_one(db, m, store_id, dry_run)
+
+    for n, m in enumerate(selected):
+        await report_progress(n, len(selected), m.version)
+        if not m.per_store:
+            # Global migrations only run on full runs
+            results.append(await _run_one(db, m, None, dry_run) if not store_ids else
+                           {"version": m.version, "store_id": None, "status": "skipped"})
+            continue
+        batch = await asyncio.gather(*(limited(m, s) for s in stores if s not in failed))
+        failed.update(r["store_id"] for r in batch if r["status"] == "failed")
+        results.extend(batch)
+    await report_progress(len(selected), len(selected))
+    return results
+
+
+async def migration_status(db) -> List[dict]:
+    """Registered migrations with their per-store state"""
+    states = defaultdict(list)
+    async for state in db[COLLECTION].find({}, {"_id": 0, "checkpoint": 0}):
+        states[state["version"]].append(state)
+    return [
+        {"version": m.version, "description": m.description, "per_store": m.per_store, "stores": states[m.version]}
+        for m in MIGRATIONS
+    ]
+
+
+async def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(os.path.join(os.path.dirname(__file__), ".env"))
+    parser = argparse.ArgumentParser(description="Run AlpineFlow data migrations")
+    parser.add_argument("--dry-run", action="store_true", help="count changes without writing")
+    parser.add_argument("--store", type=int, action="append", help="only this store (repeatable)")
+    parser.add_argument("--only", help="only this migration version")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = client[os.environ["DB_NAME"]]
+    store_config.attach(db)
+    item_type_registry.attach(db)
+    try:
+        for result in await run_migrations(db, args.store, args.only, args.dry_run, args.concurrency):
+            print(result)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,345 @@
+"""
+Observability: per-request MongoDB instrumentation + in-process metrics
+Counts Mongo commands, documents returned and DB time for every HTTP request,
+attaches a Server-Timing header and exposes Prometheus text on /api/metrics.
+Everything stays in-process (no external collector).
+"""
+import contextvars
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+import json
+import logging
+
+from query_budget import query_budget_enabled, budget_for_endpoint, check_queries, HEADER_COUNT, HEADER_VIOLATIONS
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== REQUEST SCOPE ====================
+
+class RequestStats:
+    """
+    Mongo activity collected while serving a single HTTP request.
+    Raw commands are only kept with collect_queries (query budget check): other
+    requests keep the counters and timings only.
+    """
+    __slots__ = ("commands", "documents", "db_time", "queries", "scope", "_lock")
+
+    def __init__(self, scope: Optional[dict] = None, collect_queries: bool = False):
+        self.scope = scope          # ASGI scope, the router fills scope["route"]
+        self.commands = 0
+        self.documents = 0
+        self.db_time = 0.0          # seconds
+        # (command, collection, raw command doc); None when not collected
+        self.queries: Optional[List[Tuple[str, str, dict]]] = [] if collect_queries else None
+        self._lock = threading.Lock()
+
+    def record(self, command_name: str, collection: str, command: Optional[dict], duration: float, documents: int):
+        # Motor runs PyMongo on a thread pool, so increments must be locked
+        with self._lock:
+            self.commands += 1
+            self.documents += documents
+            self.db_time += duration
+            if self.queries is not None:
+                self.queries.append((command_name, collection, command))
+
+    @property
+    def route(self) -> str:
+        return _route_template(self.scope) if self.scope is not None else "background"
+
+
+_current_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "alpineflow_request_stats", default=None
+)
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    """Stats of the request being served (None outside a request)"""
+    return _current_stats.get()
+
+
+# ==================== MONGO COMMAND LISTENER ====================
+
+# Commands that are driver housekeeping, not application queries
+_IGNORED_COMMANDS = {
+    "isMaster", "ismaster", "hello", "ping", "saslStart", "saslContinue",
+    "buildInfo", "endSessions", "killCursors", "getnonce", "authenticate",
+}
+
+
+def _count_returned_documents(reply: dict) -> int:
+    """Number of documents a command reply carries back to the app"""
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        batch = cursor.get("firstBatch", cursor.get("nextBatch"))
+        if isinstance(batch, list):
+            return len(batch)
+    values = reply.get("values")  # distinct
+    if isinstance(values, list):
+        return len(values)
+    if "value" in reply and isinstance(reply.get("value"), dict):  # findAndModify
+        return 1
+    return 0
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    PyMongo command listener bound to the request-scoped RequestStats.
+    Motor copies the contextvars context into its executor, so started/succeeded
+    events see the stats object of the request that issued the command.
+    """
+
+    def __init__(self):
+        self._pending: Dict[Tuple[int, int], Tuple[Optional[RequestStats], str, str, Optional[dict]]] = {}
+        self._lock = threading.Lock()
+        # Optional observer of every finished command (slow-query profiler), also outside requests
+        self.observer = None
+
+    def started(self, event):
+        if event.command_name in _IGNORED_COMMANDS:
+            return
+        stats = _current_stats.get()
+        if stats is None and self.observer is None:
+            return
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = event.command.get("collection", "")  # getMore
+        # Keep the command shape but not bulk payloads (insert documents can be large),
+        # and only for a consumer (query budget check, profiler)
+        command = None
+        if self.observer is not None or (stats is not None and stats.queries is not None):
+            command = {k: v for k, v in event.command.items() if k != "documents"}
+        with self._lock:
+            self._pending[(event.request_id, event.operation_id)] = (
+                stats, event.command_name, collection or "", command
+            )
+
+    def _finish(self, event, reply: Optional[dict]):
+        with self._lock:
+            pending = self._pending.pop((event.request_id, event.operation_id), None)
+        if pending is None:
+            return
+        stats, command_name, collection, command = pending
+        documents = _count_returned_documents(reply) if reply else 0
+        duration = event.duration_micros / 1_000_000
+        if stats is not None:
+            stats.record(command_name, collection, command, duration, documents)
+        if self.observer is not None:
+            try:
+                self.observer(command_name, collection, command, duration, documents,
+                              stats.route if stats is not None else "background")
+            except Exception as e:
+                logger.debug(f"Command observer failed: {e}")
+
+    def succeeded(self, event):
+        self._finish(event, event.reply)
+
+    def failed(self, event):
+        self._finish(event, None)
+
+
+mongo_listener = MongoCommandListener()
+
+
+# ==================== METRICS REGISTRY ====================
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+RESPONSE_BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    """Minimal Prometheus histogram keyed by label tuples"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets: Tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # bucket counters..., +Inf count, sum
+                series = [0] * (len(self.buckets) + 1) + [0.0]
+                self._series[labels] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {k: list(v) for k, v in self._series.items()}
+        for labels, series in sorted(snapshot.items()):
+            base = ",".join(f'{n}="{_escape_label(v)}"' for n, v in zip(self.label_names, labels))
+            sep = "," if base else ""
+            for i, bound in enumerate(self.buckets):
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{_format_bound(bound)}"}} {series[i]}')
+            count = series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{base}}} {series[-1]}")
+            lines.append(f"{self.name}_count{{{base}}} {count}")
+        return lines
+
+
+class Counter:
+    """Minimal Prometheus counter keyed by label tuples"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: Tuple[str, ...], amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels: Tuple[str, ...]) -> float:
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = dict(self._values)
+        for labels, value in sorted(snapshot.items()):
+            base = ",".join(f'{n}="{_escape_label(v)}"' for n, v in zip(self.label_names, labels))
+            lines.append(f"{self.name}{{{base}}} {value}")
+        return lines
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_bound(bound: float) -> str:
+    return str(int(bound)) if float(bound).is_integer() else repr(bound)
+
+
+class MetricsRegistry:
+    """All in-process metrics, rendered together by /api/metrics"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets) -> Histogram:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Histogram(name, help_text, label_names, buckets)
+            return self._metrics[name]
+
+    def counter(self, name: str, help_text: str, label_names: Tuple[str, ...]) -> Counter:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Counter(name, help_text, label_names)
+            return self._metrics[name]
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+_ROUTE_LABELS = ("method", "route", "status")
+http_latency = registry.histogram(
+    "alpineflow_http_request_duration_seconds", "HTTP request latency", _ROUTE_LABELS, LATENCY_BUCKETS)
+http_db_time = registry.histogram(
+    "alpineflow_http_request_db_seconds", "Time spent in MongoDB per request", _ROUTE_LABELS, DB_TIME_BUCKETS)
+http_round_trips = registry.histogram(
+    "alpineflow_http_request_db_round_trips", "MongoDB commands issued per request", _ROUTE_LABELS, ROUND_TRIP_BUCKETS)
+http_response_bytes = registry.histogram(
+    "alpineflow_http_response_size_bytes", "Response body size", _ROUTE_LABELS, RESPONSE_BYTES_BUCKETS)
+http_db_documents = registry.counter(
+    "alpineflow_http_db_documents_returned_total", "Documents returned by MongoDB", _ROUTE_LABELS)
+
+
+# ==================== ASGI MIDDLEWARE ====================
+
+def _route_template(scope) -> str:
+    """Route template (/api/rentals/{rental_id}) instead of the raw path, to keep label cardinality bounded"""
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    return path or "unmatched"
+
+
+def server_timing_value(stats: RequestStats, total_seconds: float) -> str:
+    return (
+        f'db;dur={stats.db_time * 1000:.1f};desc="mongo {stats.commands} cmds/{stats.documents} docs", '
+        f"app;dur={total_seconds * 1000:.1f}"
+    )
+
+
+def _query_budget_headers(scope, stats: RequestStats) -> List[Tuple[bytes, bytes]]:
+    """X-Query-Count / X-Query-Budget-Violations for the test-time N+1 detector"""
+    route = scope.get("route")
+    budget = budget_for_endpoint(getattr(route, "endpoint", None))
+    count, violations = check_queries(list(stats.queries), budget)
+    headers = [(HEADER_COUNT.lower().encode(), str(count).encode())]
+    if violations:
+        payload = json.dumps({"route": _route_template(scope), "violations": violations})
+        headers.append((HEADER_VIOLATIONS.lower().encode(), payload[:8000].encode()))
+    return headers
+
+
+class RequestMetricsMiddleware:
+    """
+    Pure ASGI middleware: opens a RequestStats scope per HTTP request, adds the
+    Server-Timing header and feeds the per-route histograms.
+    With QUERY_BUDGET_CHECK=1 it also reports query budget violations (see query_budget.py).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        check_budget = query_budget_enabled()
+        stats = RequestStats(scope, collect_queries=check_budget)
+        token = _current_stats.set(stats)
+        started = time.perf_counter()
+        state = {"status": 500, "bytes": 0}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing_value(stats, time.perf_counter() - started).encode()))
+                if check_budget:
+                    headers.extend(_query_budget_headers(scope, stats))
+                message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body":
+                state["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_stats.reset(token)
+            elapsed = time.perf_counter() - started
+            labels = (scope.get("method", ""), _route_template(scope), str(state["status"]))
+            http_latency.observe(labels, elapsed)
+            http_db_time.observe(labels, stats.db_time)
+            http_round_trips.observe(labels, stats.commands)
+            http_response_bytes.observe(labels, state["bytes"])
+            http_db_documents.inc(labels, stats.documents)
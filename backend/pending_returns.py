@@ -0,0 +1,148 @@
+"""
+Pending returns
+Rentals with items still out (status active/partial), grouped by due date
+(end_date, day part). Everything is computed in MongoDB:
+- pages are delimited by one aggregation over the (store_id, status, end_date)
+  partial index that groups the pending rentals from `after` on by due day and
+  returns only the page's day strings: the index scan still grows with the
+  pending rentals after the cursor, the response does not
+- pending lines and per-day groups and counts come from one aggregation over
+  the rentals of the page (per-type counts are tallied from the grouped lines)
+Report endpoints use pending_returns_summary (all rentals, light fields only).
+"""
+from collections import Counter
+from datetime import date
+from typing import List, Optional
+
+PENDING_STATUSES = ["active", "partial"]
+INDEX_NAME = "pending_returns_by_due_date"
+INDEX_KEYS = [("store_id", 1), ("status", 1), ("end_date", 1)]
+MAX_PAGE_DAYS = 31
+
+
+def pending_filter(store_filter: dict) -> dict:
+    return {**store_filter, "status": {"$in": PENDING_STATUSES}}
+
+
+def _pending_items_expr() -> dict:
+    return {"$filter": {
+        "input": {"$ifNull": ["$items", []]},
+        "as": "line",
+        "cond": {"$ne": ["$$line.returned", True]},
+    }}
+
+
+async def pending_returns_summary(db, store_filter: dict) -> List[dict]:
+    """One row per rental with items out (reports): ids, due date, counts, amount"""
+    pipeline = [
+        {"$match": pending_filter(store_filter)},
+        {"$project": {
+            "_id": 0,
+            "rental_id": "$id",
+            "customer_name": {"$ifNull": ["$customer_name", ""]},
+            "customer_dni": {"$ifNull": ["$customer_dni", ""]},
+            "end_date": {"$ifNull": ["$end_date", ""]},
+            "pending_items": {"$size": _pending_items_expr()},
+            "pending_amount": {"$ifNull": ["$pending_amount", 0]},
+        }},
+        {"$match": {"pending_items": {"$gt": 0}}},
+        {"$sort": {"end_date": 1}},
+    ]
+    return await db.rentals.aggregate(pipeline).to_list(None)
+
+
+async def _page_bounds(db, store_filter: dict, after: Optional[str], page_days: int):
+    """First due date of the page, last one, and the first due date of the next page"""
+    query = pending_filter(store_filter)
+    if after:
+        query["end_date"] = {"$gte": after}
+    # Distinct due days in MongoDB: only page_days + 1 day strings come back
+    days = [row["_id"] async for row in db.rentals.aggregate([
+        {"$match": query},
+        {"$group": {"_id": {"$substrCP": [{"$ifNull": ["$end_date", ""]}, 0, 10]}}},
+        {"$sort": {"_id": 1}},
+        {"$limit": page_days + 1},
+    ])]
+    if not days:
+        return None, None, None
+    next_cursor = days[page_days] if len(days) > page_days else None
+    return days[0], days[min(page_days, len(days)) - 1], next_cursor
+
+
+def _days_between(day: str, today: str) -> int:
+    try:
+        return (date.fromisoformat(today) - date.fromisoformat(day)).days
+    except ValueError:
+        return 0
+
+
+async def pending_returns_page(db, store_filter: dict, today: str,
+                               after: Optional[str] = None, page_days: Optional[int] = 7) -> dict:
+    """
+    Due dates [after, ...] with their rentals, `page_days` due dates per page
+    (None: all of them). `next_cursor` is the `after` of the next page.
+    """
+    match = pending_filter(store_filter)
+    next_cursor = None
+    if page_days is not None:
+        first_day, last_day, next_cursor = await _page_bounds(db, store_filter, after, page_days)
+        if first_day is None:
+            return {"today": today, "days": [], "next_cursor": None}
+        # end_date may be a plain date or a full ISO timestamp
+        match["end_date"] = {"$gte": first_day, "$lt": f"{last_day}~"}
+    elif after:
+        match["end_date"] = {"$gte": after}
+
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"end_date": 1}},
+        {"$project": {
+            "_id": 0,
+            "id": 1,
+            "customer_id": {"$ifNull": ["$customer_id", ""]},
+            "customer_name": 1,
+            "customer_dni": 1,
+            "customer_phone": {"$ifNull": ["$customer_phone", ""]},
+            "customer_email": {"$ifNull": ["$customer_email", ""]},
+            "customer_hotel": {"$ifNull": ["$customer_hotel", {"$ifNull": ["$hotel", ""]}]},
+            "start_date": {"$ifNull": ["$start_date", ""]},
+            "end_date": {"$substrCP": ["$end_date", 0, 10]},
+            "days": {"$ifNull": ["$days", 1]},
+            "total_amount": {"$ifNull": ["$total_amount", 0]},
+            "pending_amount": {"$ifNull": ["$pending_amount", 0]},
+            "pending_items": _pending_items_expr(),
+        }},
+        {"$match": {"pending_items.0": {"$exists": True}}},
+        {"$group": {
+            "_id": "$end_date",
+            "rentals": {"$push": "$$ROOT"},
+            "rentals_count": {"$sum": 1},
+            "items_count": {"$sum": {"$size": "$pending_items"}},
+        }},
+        {"$sort": {"_id": 1}},
+    ]
+
+    days = []
+    async for group in db.rentals.aggregate(pipeline):
+        day = group["_id"]
+        overdue = max(_days_between(day, today), 0)
+        type_counts = Counter()
+        rentals = group["rentals"]
+        for rental in rentals:
+            rental["days_overdue"] = overdue
+            for line in rental["pending_items"]:
+                line["item_type"] = line.get("item_type") or "unknown"
+                line.setdefault("internal_code", "")
+                type_counts[line["item_type"]] += line.get("quantity") or 1
+            rental["items"] = [{"item_type": t} for t in sorted({l["item_type"] for l in rental["pending_items"]})]
+        days.append({
+            "date": day,
+            "is_today": day == today,
+            "days_overdue": overdue,
+            "rentals_count": group["rentals_count"],
+            "items_count": group["items_count"],
+            "by_type": [{"item_type": t, "count": c} for t, c in type_counts.most_common()],
+            "rentals": rentals,
+        })
+
+    return {"today": today, "days": days, "next_cursor": next_cursor}
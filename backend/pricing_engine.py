@@ -0,0 +1,472 @@
+"""
+Server-side pricing engine
+Tariffs and packs of a store are compiled once into dense price tables
+(one row per item type / pack, one column per rental length 1..10 plus 11+),
+reused until the store's tariffs or packs change (config cache versions).
+
+Price semantics are the ones the counter (NewRental) applies:
+- day_N is the line price for an N-day rental, day_11_plus for 11 days or more
+- missing day_N falls back to the legacy buckets (days_1, days_2_3, days_4_7,
+  week for 8+) and finally to day_1
+- the unit price is the manual price, else the item's rental_price, else the
+  tariff (generic items without rental_price are free)
+- a pack replaces the price of the units it takes with its own day_N price;
+  a line of quantity N gives units one by one, and a pack is never applied
+  where it costs more than the units it takes
+
+A quote prices a whole cart for several durations in one vectorized pass.
+The pack optimizer finds the cheapest pack/tariff assignment per person and
+rental length (exact DP, memoized on the compiled tables of the store) and
+falls back to the counter's greedy detection for groups too large for it.
+"""
+import math
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config_cache import store_config
+
+PRICE_COLUMNS = 12  # 0 unused, 1..10 days, 11 = 11+ days
+DAY_FIELDS = [f"day_{d}" for d in range(1, 11)] + ["day_11_plus"]
+
+
+def _positive(value) -> Optional[float]:
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+def _legacy_price(tariff: dict, days: int) -> Optional[float]:
+    if days == 1:
+        return _positive(tariff.get("days_1"))
+    if days <= 3:
+        return _positive(tariff.get("days_2_3"))
+    if days <= 7:
+        return _positive(tariff.get("days_4_7"))
+    return _positive(tariff.get("week"))
+
+
+def compile_price_row(doc: dict, legacy: bool = False) -> np.ndarray:
+    """Dense price row for a tariff or pack document"""
+    row = np.zeros(PRICE_COLUMNS, dtype=np.float64)
+    base = _positive(doc.get("day_1")) or (legacy and _positive(doc.get("days_1"))) or 0.0
+    for days, field_name in enumerate(DAY_FIELDS, start=1):
+        price = _positive(doc.get(field_name))
+        if price is None and legacy:
+            price = _legacy_price(doc, days)
+        row[days] = price if price is not None else base
+    return row
+
+
+def duration_columns(durations: Sequence[int]) -> np.ndarray:
+    return np.clip(np.asarray(durations, dtype=np.int64), 1, PRICE_COLUMNS - 1)
+
+
+@dataclass
+class CompiledPricing:
+    versions: Tuple[int, ...]
+    type_index: Dict[str, int]
+    tariff_table: np.ndarray           # (types + 1, PRICE_COLUMNS); last row = no tariff (zeros)
+    packs: List[dict] = field(default_factory=list)
+    pack_table: np.ndarray = None      # (packs, PRICE_COLUMNS)
+    pack_types: List[str] = field(default_factory=list)
+    pack_requirements: np.ndarray = None  # (packs, pack_types) component counts
+    # (column, counts, unit prices) -> (cost, pack indices): optimizer memo, lives as long as these tables
+    pack_memo: Dict[tuple, Tuple[float, Tuple[int, ...]]] = field(default_factory=dict)
+
+    def type_row(self, item_type: Optional[str]) -> int:
+        return self.type_index.get(item_type, len(self.type_index))
+
+    def has_tariff(self, item_type: Optional[str]) -> bool:
+        return item_type in self.type_index
+
+    def daily_rate(self, item_type: Optional[str]) -> float:
+        """1-day price of a type (amortization base)"""
+        return float(self.tariff_table[self.type_row(item_type), 1])
+
+    def tariff_price(self, item_type: Optional[str], days: int) -> float:
+        return float(self.tariff_table[self.type_row(item_type), duration_columns([days])[0]])
+
+    def pack_price(self, pack_id: str, days: int) -> float:
+        for i, pack in enumerate(self.packs):
+            if pack.get("id") == pack_id:
+                return float(self.pack_table[i, duration_columns([days])[0]])
+        return 0.0
+
+
+def compile_pricing(tariffs: List[dict], packs: List[dict], versions: Tuple[int, ...] = ()) -> CompiledPricing:
+    tariffs = [t for t in tariffs if t.get("item_type")]
+    type_index = {t["item_type"]: i for i, t in enumerate(tariffs)}
+    tariff_table = np.zeros((len(tariffs) + 1, PRICE_COLUMNS), dtype=np.float64)
+    for t in tariffs:
+        tariff_table[type_index[t["item_type"]]] = compile_price_row(t, legacy=True)
+
+    packs = [p for p in packs if p.get("items")]
+    pack_table = np.zeros((len(packs), PRICE_COLUMNS), dtype=np.float64)
+    for i, p in enumerate(packs):
+        pack_table[i] = compile_price_row(p)
+
+    pack_types = sorted({t for p in packs for t in p["items"]})
+    pack_type_index = {t: i for i, t in enumerate(pack_types)}
+    pack_requirements = np.zeros((len(packs), len(pack_types)), dtype=np.int64)
+    for i, p in enumerate(packs):
+        for item_type in p["items"]:
+            pack_requirements[i, pack_type_index[item_type]] += 1
+
+    return CompiledPricing(versions=versions, type_index=type_index, tariff_table=tariff_table,
+                           packs=packs, pack_table=pack_table, pack_types=pack_types,
+                           pack_requirements=pack_requirements)
+
+
+def detect_packs(compiled: CompiledPricing, counts: Sequence[int], col: Optional[int] = None) -> np.ndarray:
+    """
+    Greedy pack detection (same order as the counter) on unit counts per pack
+    type: each round forms every pack definition, in order, whose components
+    are still available, until a round forms none. Rounds that repeat are
+    applied at once. With `col`, unpriced packs are left out.
+    Returns packs formed per pack definition.
+    """
+    state = np.array(counts, dtype=np.int64)
+    formed = np.zeros(len(compiled.packs), dtype=np.int64)
+    usable = [p for p in range(len(compiled.packs)) if col is None or compiled.pack_table[p, col] > 0]
+    while True:
+        round_packs = []
+        for p_idx in usable:
+            required = compiled.pack_requirements[p_idx]
+            if np.all(required <= state):
+                state -= required
+                round_packs.append(p_idx)
+        if not round_packs:
+            return formed
+        formed[round_packs] += 1
+        # Packs that didn't fit never will; the round repeats while its total fits
+        need = compiled.pack_requirements[round_packs].sum(axis=0)
+        repeat = int(np.min(state[need > 0] // need[need > 0]))
+        if repeat:
+            state -= need * repeat
+            formed[round_packs] += repeat
+
+
+def line_price_override(line: dict) -> Optional[float]:
+    """
+    Unit price that replaces the tariff, with the counter's precedence:
+    manual price, then the item's own rental_price, then 0 for generic stock
+    """
+    if line.get("unit_price") is not None:
+        return float(line["unit_price"])
+    rental_price = _positive(line.get("rental_price"))
+    if rental_price is not None:
+        return rental_price
+    if line.get("is_generic"):
+        return 0.0
+    return None
+
+
+def _pack_pools(compiled: CompiledPricing, lines: List[dict], members: Sequence[int],
+                quantities: Sequence[int], prices: Sequence[float]) -> Dict[int, List[list]]:
+    """
+    Packable units per pack type slot: [[line index, units, unit price], ...],
+    dearest first (a pack takes the units it saves most on). `prices` are the
+    lines' effective unit prices for the rental length being priced.
+    """
+    slots = {t: i for i, t in enumerate(compiled.pack_types)}
+    pools: Dict[int, List[list]] = {}
+    for i in members:
+        line = lines[i]
+        slot = slots.get(line.get("item_type"))
+        # Lines with a manual price or generic stock never join a pack
+        if slot is not None and line.get("unit_price") is None and not line.get("is_generic"):
+            pools.setdefault(slot, []).append([i, int(quantities[i]), float(prices[i])])
+    for pool in pools.values():
+        pool.sort(key=lambda entry: -entry[2])
+    return pools
+
+
+def _pool_counts(compiled: CompiledPricing, pools: Dict[int, List[list]]) -> Tuple[int, ...]:
+    return tuple(sum(entry[1] for entry in pools.get(slot, [])) for slot in range(len(compiled.pack_types)))
+
+
+def _pool_singles(compiled: CompiledPricing, pools: Dict[int, List[list]]) -> Tuple[Tuple[Tuple[float, int], ...], ...]:
+    """Per slot ((unit price, units), ...) cheapest first: what units left out of packs cost"""
+    return tuple(
+        tuple((entry[2], entry[1]) for entry in reversed(pools.get(slot, [])))
+        for slot in range(len(compiled.pack_types))
+    )
+
+
+def _cheapest(singles: Sequence[Tuple[float, int]], units: int) -> float:
+    """Cost of the `units` cheapest units of a slot"""
+    cost = 0.0
+    for price, available in singles:
+        take = min(units, available)
+        cost += price * take
+        units -= take
+        if not units:
+            break
+    return cost
+
+
+def _assign_packs(compiled: CompiledPricing, formed: np.ndarray, pools: Dict[int, List[list]],
+                  covered: np.ndarray) -> List[Tuple[int, int, List[int]]]:
+    """
+    Take the units of the formed packs from the pools, dearest first.
+    Adds the units each line gives to packs to `covered`.
+    Returns [(pack index, packs formed, [line index, ...]), ...]
+    """
+    instances = []
+    for p_idx in np.flatnonzero(formed):
+        count = int(formed[p_idx])
+        members = []
+        for slot in np.flatnonzero(compiled.pack_requirements[p_idx]):
+            need = int(compiled.pack_requirements[p_idx, slot]) * count
+            for entry in pools[int(slot)]:
+                take = min(need, entry[1])
+                if take:
+                    entry[1] -= take
+                    covered[entry[0]] += take
+                    members.append(entry[0])
+                    need -= take
+                if not need:
+                    break
+        instances.append((int(p_idx), count, sorted(set(members))))
+    return instances
+
+
+def price_cart(compiled: CompiledPricing, lines: List[dict], durations: Sequence[int], apply_packs: bool = True) -> dict:
+    """
+    Price a cart for every duration at once.
+    lines: [{item_type, quantity, is_generic, rental_price, unit_price (override)}]
+    A pack takes single units: a line of quantity 3 can give one unit to a pack
+    and pay the other two at its unit price. Packs are dropped for a duration
+    where they would cost more than the units they replace.
+    """
+    cols = duration_columns(durations)
+    n = len(lines)
+    quantities = np.array([max(int(l.get("quantity") or 1), 1) for l in lines], dtype=np.int64)
+
+    # (lines, durations) tariff prices in one gather
+    rows = np.array([compiled.type_row(l.get("item_type")) for l in lines], dtype=np.int64)
+    unit = compiled.tariff_table[rows[:, None], cols[None, :]] if n else np.zeros((0, len(cols)))
+
+    for i, line in enumerate(lines):
+        override = line_price_override(line)
+        if override is not None:
+            unit[i, :] = override
+
+    quotes = []
+    for j, days in enumerate(durations):
+        covered = np.zeros(n, dtype=np.int64)
+        instances = []
+        pack_total = 0.0
+        if apply_packs and compiled.packs:
+            pools = _pack_pools(compiled, lines, range(n), quantities, unit[:, j])
+            formed = detect_packs(compiled, _pool_counts(compiled, pools))
+            instances = _assign_packs(compiled, formed, pools, covered)
+            pack_total = sum(float(compiled.pack_table[p_idx, cols[j]]) * count for p_idx, count, _ in instances)
+            if pack_total > float(unit[:, j] @ covered):
+                covered[:], instances, pack_total = 0, [], 0.0
+        individual_total = float(unit[:, j] @ (quantities - covered)) if n else 0.0
+        quotes.append({
+            "days": int(days),
+            "total": round(individual_total + pack_total, 2),
+            "packs_total": round(pack_total, 2),
+            "individuals_total": round(individual_total, 2),
+            "lines": [
+                {
+                    "index": i,
+                    "item_type": lines[i].get("item_type"),
+                    "quantity": int(quantities[i]),
+                    "packed_quantity": int(covered[i]),
+                    "unit_price": round(float(unit[i, j]), 2),
+                    "in_pack": bool(covered[i] == quantities[i]),
+                }
+                for i in range(n)
+            ],
+            "packs": [
+                {
+                    "pack_id": compiled.packs[p_idx].get("id"),
+                    "name": compiled.packs[p_idx].get("name"),
+                    "count": count,
+                    "lines": members,
+                    "price": round(float(compiled.pack_table[p_idx, cols[j]]), 2),
+                }
+                for p_idx, count, members in instances
+            ],
+        })
+    return {"quotes": quotes, "missing_tariffs": sorted({
+        l.get("item_type") for l in lines
+        if l.get("item_type") and not l.get("is_generic") and not compiled.has_tariff(l.get("item_type"))
+    })}
+
+
+MAX_PACK_MEMO = 50000
+MAX_PACK_UNITS = 40      # exact optimizer: units of one (person, days) group
+MAX_PACK_STATES = 20000  # exact optimizer: count vectors it may visit
+MAX_LINE_QUANTITY = 1000
+
+
+def _tariff_singles(compiled: CompiledPricing, col: int, counts: Sequence[int]) -> Tuple[Tuple[Tuple[float, int], ...], ...]:
+    """Every unit at its type's tariff"""
+    return tuple(((float(compiled.tariff_table[compiled.type_row(t), col]), int(c)),)
+                 for t, c in zip(compiled.pack_types, counts))
+
+
+def best_pack_cover(compiled: CompiledPricing, col: int, counts: Tuple[int, ...],
+                    singles: Tuple[Tuple[Tuple[float, int], ...], ...]) -> Tuple[float, Tuple[int, ...]]:
+    """
+    Cheapest way to price `counts` (units per pack type) for one rental length:
+    every unit either sold alone or inside a pack, the units left alone being
+    the cheapest of `singles` (see _pool_singles). Exact DP over the count
+    vectors below `counts` (their number is the product of count + 1: callers
+    bound it, see pack_cover). Results are memoized per compiled table.
+    """
+    key = (col, counts, singles)
+    cached = compiled.pack_memo.get(key)
+    if cached is not None:
+        return cached
+
+    alone = [[_cheapest(slot, k) for k in range(count + 1)] for slot, count in zip(singles, counts)]
+    # Unpriced packs (0) are unconfigured, not free
+    packs = [
+        (p_idx, float(compiled.pack_table[p_idx, col]), tuple(int(v) for v in required))
+        for p_idx, required in enumerate(compiled.pack_requirements)
+        if compiled.pack_table[p_idx, col] > 0
+    ]
+    memo: Dict[Tuple[int, ...], Tuple[float, Tuple[int, ...]]] = {}
+
+    def solve(state: Tuple[int, ...]) -> Tuple[float, Tuple[int, ...]]:
+        hit = memo.get(state)
+        if hit is not None:
+            return hit
+        best = (sum(costs[c] for costs, c in zip(alone, state)), ())
+        for p_idx, price, required in packs:
+            if all(r <= c for r, c in zip(required, state)):
+                rest_cost, rest_packs = solve(tuple(c - r for c, r in zip(state, required)))
+                if price + rest_cost < best[0] - 1e-9:
+                    best = (price + rest_cost, (p_idx,) + rest_packs)
+        memo[state] = best
+        return best
+
+    best = solve(tuple(counts))
+    if len(compiled.pack_memo) >= MAX_PACK_MEMO:
+        compiled.pack_memo.clear()
+    compiled.pack_memo[key] = best
+    return best
+
+
+def pack_cover(compiled: CompiledPricing, col: int, counts: Sequence[int],
+               singles: Optional[Tuple[Tuple[Tuple[float, int], ...], ...]] = None) -> Tuple[float, np.ndarray]:
+    """
+    (cost, packs formed per pack definition) for `counts` and one rental length.
+    `singles`: unit prices of the counted units (default: the type's tariff).
+    Exact when the group has at most MAX_PACK_UNITS units and MAX_PACK_STATES
+    count vectors; larger groups fall back to the counter's greedy detection,
+    kept only when it beats pricing every unit alone. The cost never exceeds
+    pricing every unit alone.
+    """
+    counts = tuple(int(c) for c in counts)
+    if singles is None:
+        singles = _tariff_singles(compiled, col, counts)
+    if sum(counts) <= MAX_PACK_UNITS and math.prod(c + 1 for c in counts) <= MAX_PACK_STATES:
+        cost, chosen = best_pack_cover(compiled, col, counts, singles)
+        return cost, np.bincount(np.asarray(chosen, dtype=np.int64), minlength=len(compiled.packs))
+    alone = sum(_cheapest(slot, c) for slot, c in zip(singles, counts))
+    formed = detect_packs(compiled, counts, col)
+    rest = np.asarray(counts) - formed @ compiled.pack_requirements
+    cost = float(formed @ compiled.pack_table[:, col]) + sum(_cheapest(slot, int(c)) for slot, c in zip(singles, rest))
+    if cost < alone:
+        return cost, formed
+    return alone, np.zeros(len(compiled.packs), dtype=np.int64)
+
+
+def optimize_cart(compiled: CompiledPricing, lines: List[dict]) -> dict:
+    """
+    Cheapest assignment of cart units to packs and single prices (manual price,
+    rental_price or tariff, as in price_cart). Packs only combine units of the
+    same person and rental length, and never cost more than the units they take.
+    lines: [{item_type, days, person, quantity, is_generic, rental_price, unit_price}]
+    CPU-bound: run it in a worker thread.
+    """
+    groups: Dict[Tuple[str, int], List[int]] = {}
+    for i, line in enumerate(lines):
+        groups.setdefault((line.get("person") or "", int(line.get("days") or 1)), []).append(i)
+
+    quantities = [max(int(line.get("quantity") or 1), 1) for line in lines]
+    covered = np.zeros(len(lines), dtype=np.int64)
+    result_groups = []
+    total = 0.0
+    total_without_packs = 0.0
+
+    for (person, days), members in groups.items():
+        col = int(duration_columns([days])[0])
+        unit_prices = {}
+        for i in members:
+            override = line_price_override(lines[i])
+            unit_prices[i] = (override if override is not None
+                              else float(compiled.tariff_table[compiled.type_row(lines[i].get("item_type")), col]))
+        group_without_packs = sum(unit_prices[i] * quantities[i] for i in members)
+
+        pools = _pack_pools(compiled, lines, members, quantities, [unit_prices.get(i, 0.0) for i in range(len(lines))])
+        counts = _pool_counts(compiled, pools)
+        formed = (pack_cover(compiled, col, counts, _pool_singles(compiled, pools))[1] if any(counts)
+                  else np.zeros(len(compiled.packs), dtype=np.int64))
+        instances = _assign_packs(compiled, formed, pools, covered)
+
+        packs_out = [
+            {
+                "pack_id": compiled.packs[p_idx].get("id"),
+                "name": compiled.packs[p_idx].get("name"),
+                "count": count,
+                "lines": pack_lines,
+                "price": round(float(compiled.pack_table[p_idx, col]), 2),
+            }
+            for p_idx, count, pack_lines in instances
+        ]
+        singles = []
+        for i in members:
+            quantity = quantities[i] - int(covered[i])
+            if quantity:
+                singles.append({"index": i, "item_type": lines[i].get("item_type"), "quantity": quantity,
+                                "unit_price": round(unit_prices[i], 2),
+                                "subtotal": round(unit_prices[i] * quantity, 2)})
+        group_total = (sum(float(compiled.pack_table[p_idx, col]) * count for p_idx, count, _ in instances)
+                       + sum(unit_prices[s["index"]] * s["quantity"] for s in singles))
+        total += group_total
+        total_without_packs += group_without_packs
+        result_groups.append({
+            "person": person,
+            "days": days,
+            "total": round(group_total, 2),
+            "packs": packs_out,
+            "singles": singles,
+        })
+
+    return {
+        "total": round(total, 2),
+        "total_without_packs": round(total_without_packs, 2),
+        "savings": round(total_without_packs - total, 2),
+        "groups": result_groups,
+    }
+
+
+class PricingEngine:
+    def __init__(self):
+        self._compiled: Dict[object, CompiledPricing] = {}
+
+    async def compiled(self, store_id) -> CompiledPricing:
+        """Compiled tables of the store, rebuilt only when tariffs or packs change"""
+        versions = await store_config.versions(store_id, "tariffs", "packs")
+        entry = self._compiled.get(store_id)
+        if entry is not None and entry.versions == versions:
+            return entry
+        tariffs = await store_config.tariffs(store_id)
+        packs = await store_config.packs(store_id)
+        entry = compile_pricing(tariffs, packs, versions)
+        self._compiled[store_id] = entry
+        return entry
+
+
+pricing_engine = PricingEngine()
@@ -0,0 +1,101 @@
+"""
+Query budgets per endpoint (N+1 detection)
+Routes declare how many MongoDB round trips they may issue with @query_budget,
+right below the @api_router decorator in server.py. When QUERY_BUDGET_CHECK=1
+(test runs), RequestMetricsMiddleware checks every request against its budget
+and reports violations in response headers; tests/query_budget_plugin.py turns
+those headers into test failures.
+"""
+import json
+import os
+from collections import Counter as _Counter
+from typing import Any, Callable, List, Optional, Tuple
+
+# Same-shape queries tolerated inside one request before it is flagged as N+1
+DEFAULT_MAX_REPEATS = int(os.environ.get("QUERY_BUDGET_MAX_REPEATS", "3"))
+
+# Driver round trips that are not new queries (cursor batches)
+_NON_QUERY_COMMANDS = {"getMore", "killCursors"}
+
+# Keys of a command document that carry the query shape
+_SHAPE_KEYS = ("filter", "query", "pipeline", "q", "key", "sort", "projection")
+
+HEADER_COUNT = "X-Query-Count"
+HEADER_VIOLATIONS = "X-Query-Budget-Violations"
+
+
+def query_budget_enabled() -> bool:
+    return os.environ.get("QUERY_BUDGET_CHECK", "").lower() in ("1", "true", "yes")
+
+
+class QueryBudget:
+    __slots__ = ("max_queries", "max_repeats", "reason")
+
+    def __init__(self, max_queries: Optional[int], max_repeats: Optional[int], reason: str):
+        self.max_queries = max_queries
+        self.max_repeats = max_repeats
+        self.reason = reason
+
+
+def query_budget(max_queries: Optional[int] = None, max_repeats: Optional[int] = DEFAULT_MAX_REPEATS, reason: str = ""):
+    """
+    Declare the Mongo query budget of a route. Goes below @api_router.<method>(...):
+
+        @api_router.get("/rentals/{rental_id}")
+        @query_budget(3)
+        async def get_rental(...):
+
+    max_queries: max commands per request (None = unlimited)
+    max_repeats: max same-shape queries per request (None = don't check; document why in reason)
+    """
+    def decorator(func: Callable) -> Callable:
+        func.__query_budget__ = QueryBudget(max_queries, max_repeats, reason)
+        return func
+    return decorator
+
+
+def budget_for_endpoint(endpoint: Any) -> QueryBudget:
+    return getattr(endpoint, "__query_budget__", None) or QueryBudget(None, DEFAULT_MAX_REPEATS, "")
+
+
+def shape_of(value: Any) -> Any:
+    """Strip literals from a filter/pipeline, keeping field names and operators"""
+    if isinstance(value, dict):
+        return {k: shape_of(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for v in value:
+            s = shape_of(v)
+            if s not in shapes:
+                shapes.append(s)
+        return shapes
+    return "?"
+
+
+def command_shape(command_name: str, collection: str, command: dict) -> str:
+    parts = {}
+    for key in _SHAPE_KEYS:
+        if key in command:
+            parts[key] = shape_of(command[key])
+    for key in ("updates", "deletes"):
+        if key in command:
+            parts[key] = shape_of([{"q": op.get("q")} for op in command[key] if isinstance(op, dict)])
+    return f"{command_name} {collection} {json.dumps(parts, sort_keys=True, default=str)}"
+
+
+def check_queries(queries: List[Tuple[str, str, dict]], budget: QueryBudget) -> Tuple[int, List[str]]:
+    """Returns (query count, violation messages) for the queries of one request"""
+    real = [q for q in queries if q[0] not in _NON_QUERY_COMMANDS]
+    violations: List[str] = []
+
+    if budget.max_queries is not None and len(real) > budget.max_queries:
+        violations.append(f"{len(real)} queries > budget {budget.max_queries}")
+
+    if budget.max_repeats is not None:
+        shapes = _Counter(command_shape(*q) for q in real)
+        for shape, count in shapes.most_common():
+            if count <= budget.max_repeats:
+                break
+            violations.append(f"N+1: {count}x {shape}")
+
+    return len(real), violations
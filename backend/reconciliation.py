@@ -0,0 +1,222 @@
+"""
+Cash / rentals reconciliation
+Totals per payment method come from one $group per collection. Orphans come
+from a streaming merge-join of two cursors sorted by rental id:
+- paid rentals of the period (id)
+- rental movements of the period (reference_id up to the first "_": later
+  payments, extensions and adjustments use "<rental_id>_pay_..." etc.)
+Both sorts run in MongoDB (allowDiskUse), so a full season is walked with one
+row of each side in memory. Candidates are confirmed in batches against the
+other side outside the period (rental paid on another day, movement of a rental
+created before the period) before being reported.
+Pages are cut on a rental id (cursor = last rental id of the page); the CSV
+export walks all of them. Periods reaching into the archive tier read both
+tiers (archive_tier.py).
+"""
+from typing import AsyncIterator, List, Optional
+
+from archive_tier import archive_tier
+from local_dates import day_range_filter
+
+RENTAL_MOVEMENT_CATEGORIES = ["rental", "rental_payment", "rental_extension", "rental_adjustment"]
+CONFIRM_BATCH = 200
+MAX_PAGE_SIZE = 500
+CSV_FIELDS = ["type", "rental_id", "movement_id", "operation_number", "reference_id",
+              "amount", "payment_method", "customer", "date"]
+
+
+def period_filter(store_filter: Optional[dict], start_date: str, end_date: str) -> dict:
+    return {**day_range_filter(start_date, end_date), **(store_filter or {})}
+
+
+async def period_totals(db, store_filter: Optional[dict], start_date: str, end_date: str):
+    """(cash_movements income, rentals paid_amount) per payment method (cash / card)"""
+    base_filter = period_filter(store_filter, start_date, end_date)
+    movements_total = {"cash": 0, "card": 0}
+    rentals_total = {"cash": 0, "card": 0}
+    methods = {"$in": list(movements_total)}
+    cursor = db.cash_movements.aggregate(await archive_tier.pipeline("cash_movements", store_filter, start_date, [
+        {"$match": {**base_filter, "movement_type": "income", "payment_method": methods}},
+        {"$group": {"_id": "$payment_method", "total": {"$sum": "$amount"}}},
+    ]))
+    async for row in cursor:
+        movements_total[row["_id"]] = row["total"]
+    cursor = db.rentals.aggregate(await archive_tier.pipeline("rentals", store_filter, start_date, [
+        {"$match": {**base_filter, "payment_method": methods}},
+        {"$group": {"_id": "$payment_method", "total": {"$sum": {"$ifNull": ["$paid_amount", 0]}}}},
+    ]))
+    async for row in cursor:
+        rentals_total[row["_id"]] = row["total"]
+    return movements_total, rentals_total
+
+
+def _rentals_pipeline(base_filter: dict, after: Optional[str]) -> List[dict]:
+    match = {**base_filter, "paid_amount": {"$gt": 0}, "id": {"$type": "string"}}
+    if after:
+        match["id"]["$gt"] = after
+    return [
+        {"$match": match},
+        {"$project": {
+            "_id": 0,
+            "key": "$id",
+            "amount": "$paid_amount",
+            "payment_method": 1,
+            "customer": "$customer_name",
+            "created_at": 1,
+        }},
+        {"$sort": {"key": 1}},
+    ]
+
+
+def _movements_pipeline(base_filter: dict, after: Optional[str]) -> List[dict]:
+    pipeline = [
+        {"$match": {
+            **base_filter,
+            "category": {"$in": RENTAL_MOVEMENT_CATEGORIES},
+            "reference_id": {"$type": "string"},
+        }},
+        {"$project": {
+            "_id": 0,
+            "key": {"$arrayElemAt": [{"$split": ["$reference_id", "_"]}, 0]},
+            "id": 1,
+            "operation_number": 1,
+            "reference_id": 1,
+            "amount": 1,
+            "payment_method": 1,
+            "customer": "$customer_name",
+            "created_at": 1,
+        }},
+    ]
+    if after:
+        pipeline.append({"$match": {"key": {"$gt": after}}})
+    pipeline.append({"$sort": {"key": 1}})
+    return pipeline
+
+
+async def _next(cursor) -> Optional[dict]:
+    try:
+        return await cursor.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def _merge_join(rentals, movements) -> AsyncIterator[tuple]:
+    """Unmatched rentals and groups of movements of the same rental, in rental id order"""
+    r, m = await _next(rentals), await _next(movements)
+    while r or m:
+        if m is None or (r and r["key"] < m["key"]):
+            yield "rental", r["key"], [r]
+            r = await _next(rentals)
+            continue
+        key = m["key"]
+        group = []
+        while m and m["key"] == key:
+            group.append(m)
+            m = await _next(movements)
+        if r and r["key"] == key:
+            r = await _next(rentals)
+        else:
+            yield "movement", key, group
+
+
+async def _confirm(db, store_filter: Optional[dict], batch: List[tuple]) -> List[tuple]:
+    """Drop candidates matched outside the period (either tier)"""
+    rental_ids = [key for kind, key, _ in batch if kind == "rental"]
+    movement_keys = [key for kind, key, _ in batch if kind == "movement"]
+    paid_elsewhere, existing = set(), set()
+    if rental_ids:
+        for coll in await archive_tier.collections("cash_movements", store_filter):
+            paid_elsewhere.update(await coll.distinct("reference_id", {
+                **(store_filter or {}),
+                "reference_id": {"$in": rental_ids},
+                "category": {"$in": RENTAL_MOVEMENT_CATEGORIES},
+            }))
+    if movement_keys:
+        for coll in await archive_tier.collections("rentals", store_filter):
+            existing.update(await coll.distinct("id", {**(store_filter or {}), "id": {"$in": movement_keys}}))
+    return [
+        c for c in batch
+        if not (c[0] == "rental" and c[1] in paid_elsewhere) and not (c[0] == "movement" and c[1] in existing)
+    ]
+
+
+def _rows(kind: str, key: str, docs: List[dict]) -> List[dict]:
+    if kind == "rental":
+        r = docs[0]
+        return [{
+            "type": "rental",
+            "rental_id": key,
+            "amount": r.get("amount", 0),
+            "payment_method": r.get("payment_method"),
+            "customer": r.get("customer"),
+            "date": (r.get("created_at") or "")[:10],
+        }]
+    return [{
+        "type": "movement",
+        "rental_id": key,
+        "movement_id": m.get("id"),
+        "operation_number": m.get("operation_number"),
+        "reference_id": m.get("reference_id"),
+        "amount": m.get("amount", 0),
+        "payment_method": m.get("payment_method"),
+        "customer": m.get("customer"),
+        "date": (m.get("created_at") or "")[:10],
+    } for m in docs]
+
+
+async def iter_orphans(db, store_filter: Optional[dict], start_date: str, end_date: str,
+                       after: Optional[str] = None) -> AsyncIterator[dict]:
+    """Orphan rows in rental id order (all movements of a rental are consecutive)"""
+    base_filter = period_filter(store_filter, start_date, end_date)
+    rentals = db.rentals.aggregate(await archive_tier.pipeline(
+        "rentals", store_filter, start_date, _rentals_pipeline(base_filter, after)), allowDiskUse=True)
+    movements = db.cash_movements.aggregate(await archive_tier.pipeline(
+        "cash_movements", store_filter, start_date, _movements_pipeline(base_filter, after)), allowDiskUse=True)
+    try:
+        batch = []
+        async for candidate in _merge_join(rentals, movements):
+            batch.append(candidate)
+            if len(batch) >= CONFIRM_BATCH:
+                for kind, key, docs in await _confirm(db, store_filter, batch):
+                    for row in _rows(kind, key, docs):
+                        yield row
+                batch = []
+        for kind, key, docs in await _confirm(db, store_filter, batch):
+            for row in _rows(kind, key, docs):
+                yield row
+    finally:
+        await rentals.close()
+        await movements.close()
+
+
+async def orphans_page(db, store_filter: Optional[dict], start_date: str, end_date: str,
+                       after: Optional[str] = None, limit: int = 50) -> dict:
+    """One page of orphans (never splits a rental's movements) and the cursor of the next one"""
+    orphan_rentals, orphan_movements = [], []
+    last_key, next_cursor = None, None
+    rows = iter_orphans(db, store_filter, start_date, end_date, after)
+    try:
+        async for row in rows:
+            if len(orphan_rentals) + len(orphan_movements) >= limit and row["rental_id"] != last_key:
+                next_cursor = last_key
+                break
+            (orphan_rentals if row["type"] == "rental" else orphan_movements).append(row)
+            last_key = row["rental_id"]
+    finally:
+        await rows.aclose()
+    return {"orphan_rentals": orphan_rentals, "orphan_movements": orphan_movements, "next_cursor": next_cursor}
+
+
+async def orphan_totals(db, store_filter: Optional[dict], start_date: str, end_date: str) -> dict:
+    """Count and amount of every orphan of the period (full walk, constant memory)"""
+    totals = {
+        "rentals": {"count": 0, "amount": 0},
+        "movements": {"count": 0, "amount": 0},
+    }
+    async for row in iter_orphans(db, store_filter, start_date, end_date):
+        side = totals["rentals" if row["type"] == "rental" else "movements"]
+        side["count"] += 1
+        side["amount"] += row["amount"] or 0
+    for side in totals.values():
+        side["amount"] = round(side["amount"], 2)
+    return totals
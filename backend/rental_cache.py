@@ -0,0 +1,198 @@
+"""
+Rental view cache for the counter
+While a rental is handled at the counter the same rental is read again and again
+(detail, scan by item code, global lookup), each time with an extra items query
+to enrich internal codes. This keeps, per store:
+- an LRU of enriched rental views keyed by rental id
+- a map from item codes (barcode, internal_code, item_id; upper-cased) of active
+  rentals to the rental id, for scanner lookups
+
+Rental write endpoints are decorated with @invalidates_rental (drops that rental
+and its codes); bulk fixes and item code edits drop the whole store. Every
+invalidation also bumps the store's "rentals" version in `config_versions`
+(config_cache.py): other workers compare it on read (re-read at most every
+CONFIG_VERSION_CHECK_SECONDS) and drop their views of the store when it moved.
+Entries also expire after RENTAL_CACHE_TTL seconds. Hit / miss counters are
+exported on /api/metrics.
+"""
+import copy
+import functools
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from observability import registry
+from response_cache import store_id_from_call
+
+RENTAL_CACHE_TTL = float(os.environ.get("RENTAL_CACHE_TTL", "30"))
+VERSION_KIND = "rentals"  # version key in config_versions
+MAX_RENTALS_PER_STORE = 500
+ACTIVE_STATUSES = ("active", "partial")
+
+rental_cache_requests = registry.counter(
+    "alpineflow_rental_cache_requests_total",
+    "Rental view cache lookups by key kind (id, code) and result (hit, miss)",
+    ("lookup", "result"),
+)
+
+
+def rental_codes(rental: dict):
+    for item in rental.get("items", []):
+        for key in ("barcode", "internal_code", "item_id"):
+            value = item.get(key)
+            if value:
+                yield str(value).strip().upper()
+
+
+class RentalViewCache:
+    def __init__(self, ttl: float = RENTAL_CACHE_TTL, max_per_store: int = MAX_RENTALS_PER_STORE):
+        self.ttl = ttl
+        self.max_per_store = max_per_store
+        # store_id -> OrderedDict(rental_id -> (expires_at, view))
+        self._views: Dict[Any, "OrderedDict[str, tuple]"] = {}
+        # store_id -> {CODE: rental_id}
+        self._codes: Dict[Any, Dict[str, str]] = {}
+        # store_id -> bumped on every invalidation; a load that raced a write is not stored
+        self._generation: Dict[Any, int] = {}
+        # store_id -> shared "rentals" version the cached views were read under
+        self._versions: Dict[Any, int] = {}
+        self.store_config = None
+
+    def attach(self, store_config):
+        self.store_config = store_config
+
+    async def _sync(self, store_id):
+        """Drop the store's views if another worker invalidated it"""
+        if self.store_config is None or store_id is None:
+            return
+        version, = await self.store_config.versions(store_id, VERSION_KIND)
+        if self._versions.get(store_id) != version:
+            self._drop_store(store_id)
+            self._versions[store_id] = version
+
+    async def _publish(self, store_id):
+        """Tell the other workers (shared version bump)"""
+        if self.store_config is None or store_id is None:
+            return
+        await self.store_config.invalidate(store_id, VERSION_KIND)
+        self._versions[store_id], = await self.store_config.versions(store_id, VERSION_KIND)
+
+    def _lookup(self, store_id, rental_id: str) -> Optional[dict]:
+        views = self._views.get(store_id)
+        entry = views.get(rental_id) if views else None
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            self._drop(store_id, rental_id)
+            return None
+        views.move_to_end(rental_id)
+        return entry[1]
+
+    def _store(self, store_id, rental: dict):
+        views = self._views.setdefault(store_id, OrderedDict())
+        views[rental["id"]] = (time.monotonic() + self.ttl, rental)
+        views.move_to_end(rental["id"])
+        if rental.get("status") in ACTIVE_STATUSES:
+            codes = self._codes.setdefault(store_id, {})
+            for code in rental_codes(rental):
+                codes[code] = rental["id"]
+        while len(views) > self.max_per_store:
+            oldest_id, _ = views.popitem(last=False)
+            self._forget_codes_of(store_id, oldest_id)
+
+    def _forget_codes_of(self, store_id, rental_id: str):
+        codes = self._codes.get(store_id)
+        if codes:
+            for code in [c for c, rid in codes.items() if rid == rental_id]:
+                del codes[code]
+
+    async def get(self, store_id, rental_id: str, loader: Callable[[], Awaitable[Optional[dict]]]) -> Optional[dict]:
+        """Enriched rental view by id (copy: callers may mutate it)"""
+        await self._sync(store_id)
+        view = self._lookup(store_id, rental_id)
+        if view is not None:
+            rental_cache_requests.inc(("id", "hit"))
+            return copy.deepcopy(view)
+        rental_cache_requests.inc(("id", "miss"))
+        return await self._load(store_id, loader)
+
+    async def get_active_by_code(self, store_id, code: str,
+                                 loader: Callable[[], Awaitable[Optional[dict]]]) -> Optional[dict]:
+        """Active rental containing an item code (barcode / internal_code / item_id)"""
+        await self._sync(store_id)
+        rental_id = self._codes.get(store_id, {}).get(code.strip().upper())
+        view = self._lookup(store_id, rental_id) if rental_id else None
+        if view is not None and view.get("status") in ACTIVE_STATUSES:
+            rental_cache_requests.inc(("code", "hit"))
+            return copy.deepcopy(view)
+        rental_cache_requests.inc(("code", "miss"))
+        return await self._load(store_id, loader)
+
+    async def _load(self, store_id, loader: Callable[[], Awaitable[Optional[dict]]]) -> Optional[dict]:
+        generation = self._generation.get(store_id, 0)
+        view = await loader()
+        if view is not None and self._generation.get(store_id, 0) == generation:
+            self._store(store_id, view)
+        return copy.deepcopy(view)
+
+    def _bump(self, store_id):
+        self._generation[store_id] = self._generation.get(store_id, 0) + 1
+
+    def _drop(self, store_id, rental_id: str):
+        self._bump(store_id)
+        views = self._views.get(store_id)
+        if views:
+            views.pop(rental_id, None)
+        self._forget_codes_of(store_id, rental_id)
+
+    def _drop_store(self, store_id):
+        self._bump(store_id)
+        self._views.pop(store_id, None)
+        self._codes.pop(store_id, None)
+
+    async def invalidate(self, store_id, rental_id: str):
+        self._drop(store_id, rental_id)
+        await self._publish(store_id)
+
+    async def forget_codes(self, store_id):
+        """Item codes may now belong to another rental (new rental created)"""
+        self._bump(store_id)
+        self._codes.pop(store_id, None)
+        await self._publish(store_id)
+
+    async def invalidate_store(self, store_id):
+        self._drop_store(store_id)
+        await self._publish(store_id)
+
+    async def clear(self, store_ids: Iterable = ()):
+        """Cross-store maintenance wrote rentals directly (store_ids: the stores it touched)"""
+        for store_id in set(self._views) | set(self._codes):
+            self._bump(store_id)
+        self._views.clear()
+        self._codes.clear()
+        for store_id in set(store_ids):
+            await self._publish(store_id)
+
+
+rental_cache = RentalViewCache()
+
+
+def invalidates_rental(func: Callable) -> Callable:
+    """
+    Mark a rental write endpoint: after it runs, the cached view of `rental_id`
+    (or, without rental_id, the store's code map) is dropped.
+    Goes below @api_router.<method>(...).
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            store_id = store_id_from_call(args, kwargs)
+            rental_id = kwargs.get("rental_id")
+            if rental_id:
+                await rental_cache.invalidate(store_id, rental_id)
+            else:
+                await rental_cache.forget_codes(store_id)
+    return wrapper
@@ -0,0 +1,157 @@
+"""
+Rental line snapshot
+Rental lines carry the item fields the rental screens show (internal_code,
+item_type, category), copied from the item when the line is written, so rental
+reads are a single query with no join against `items`.
+
+Rentals written before this carry only barcode/item_id on some lines; the
+backfill copies the fields from the current items in batches, and the item_id
+of legacy lines resolved by barcode (update_item keeps snapshots in sync by
+item_id). Rentals that are done are marked with LINES_VERSION, so the backfill
+can be stopped and resumed at any point. A full run that leaves nothing behind
+records the version in `backfills`; later startups skip the scan.
+"""
+import asyncio
+import contextvars
+import logging
+from datetime import datetime, timezone
+from typing import Optional, Set
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+LINES_VERSION = 2  # 2: item_id resolved on legacy lines
+STATE_COLLECTION = "backfills"
+STATE_ID = "rental_lines"
+SNAPSHOT_FIELDS = ("internal_code", "item_type", "category")
+
+_tasks: Set[asyncio.Task] = set()
+
+
+def line_snapshot(item: dict) -> dict:
+    """Item fields denormalized into a rental line"""
+    return {
+        "internal_code": item.get("internal_code") or "",
+        "item_type": item.get("item_type") or "",
+        "category": item.get("category") or "",
+    }
+
+
+def backfill_query(store_id=None) -> dict:
+    query = {"lines_version": {"$ne": LINES_VERSION}}
+    if store_id is not None:
+        query["store_id"] = store_id
+    return query
+
+
+async def _items_by_key(db, rentals: list) -> dict:
+    """(store_id, item_id | barcode) -> item, for the lines of a batch of rentals"""
+    ids, barcodes, stores = set(), set(), set()
+    for rental in rentals:
+        stores.add(rental.get("store_id"))
+        for line in rental.get("items") or []:
+            if line.get("item_id"):
+                ids.add(line["item_id"])
+            if line.get("barcode"):
+                barcodes.add(line["barcode"])
+    if not ids and not barcodes:
+        return {}
+    cursor = db.items.find(
+        {
+            "store_id": {"$in": list(stores)},
+            "$or": [{"id": {"$in": list(ids)}}, {"barcode": {"$in": list(barcodes)}}],
+        },
+        {"_id": 0, "store_id": 1, "id": 1, "barcode": 1, **{f: 1 for f in SNAPSHOT_FIELDS}},
+    )
+    by_key = {}
+    async for item in cursor:
+        by_key[(item.get("store_id"), item.get("id"))] = item
+        if item.get("barcode"):
+            by_key.setdefault((item.get("store_id"), item["barcode"]), item)
+    return by_key
+
+
+def _snapshot_lines(rental: dict, items_by_key: dict) -> list:
+    lines = []
+    store_id = rental.get("store_id")
+    for line in rental.get("items") or []:
+        item = items_by_key.get((store_id, line.get("item_id"))) or items_by_key.get((store_id, line.get("barcode")))
+        snapshot = line_snapshot(item) if item else {}
+        merged = dict(line)
+        if item and not merged.get("item_id"):
+            merged["item_id"] = item.get("id")
+        for field in SNAPSHOT_FIELDS:
+            # Same precedence as the old read-time join: current item code wins
+            if field == "internal_code" and snapshot.get(field):
+                merged[field] = snapshot[field]
+            elif not merged.get(field):
+                merged[field] = snapshot.get(field) or merged.get(field) or ""
+        lines.append(merged)
+    return lines
+
+
+async def backfill_rental_lines(db, store_id=None, batch_size: int = 500, limit: Optional[int] = None) -> dict:
+    """
+    Copy internal_code / item_type / category (and item_id, by barcode) into the
+    lines of unmarked rentals.
+    Each rental is written only if its lines did not change meanwhile (a rental
+    written concurrently keeps its new lines and is picked up on the next run).
+    """
+    updated = skipped = 0
+    last_id = None
+    exhausted = False
+    while limit is None or updated + skipped < limit:
+        query = backfill_query(store_id)
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        rentals = await db.rentals.find(
+            query, {"_id": 1, "store_id": 1, "items": 1}
+        ).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not rentals:
+            exhausted = True
+            break
+        last_id = rentals[-1]["_id"]
+        items_by_key = await _items_by_key(db, rentals)
+        ops = [
+            UpdateOne(
+                {"_id": rental["_id"], "items": rental.get("items") or []},
+                {"$set": {"items": _snapshot_lines(rental, items_by_key), "lines_version": LINES_VERSION}},
+            )
+            for rental in rentals
+        ]
+        result = await db.rentals.bulk_write(ops, ordered=False)
+        updated += result.modified_count
+        skipped += len(ops) - result.matched_count
+    if updated or skipped:
+        logger.info(f"✅ Rental lines backfilled: {updated} rentals updated, {skipped} changed meanwhile")
+    # A run that reached the end left behind only the rentals that changed meanwhile
+    remaining = skipped if exhausted else await db.rentals.count_documents(backfill_query(store_id))
+    if exhausted and not remaining and store_id is None:
+        await db[STATE_COLLECTION].update_one(
+            {"_id": STATE_ID},
+            {"$set": {"version": LINES_VERSION, "finished_at": datetime.now(timezone.utc).isoformat()}},
+            upsert=True
+        )
+    return {"updated": updated, "skipped": skipped, "remaining": remaining}
+
+
+async def backfill_done(db) -> bool:
+    state = await db[STATE_COLLECTION].find_one({"_id": STATE_ID})
+    return bool(state) and state.get("version", 0) >= LINES_VERSION
+
+
+async def _backfill_in_background(db):
+    try:
+        if await backfill_done(db):
+            return
+        await backfill_rental_lines(db)
+    except Exception as e:
+        logger.error(f"❌ Rental lines backfill failed (resumes on next start): {e}")
+
+
+def start_backfill(db):
+    """Run the backfill once in the background (startup); nothing to scan once it has finished"""
+    task = asyncio.create_task(_backfill_in_background(db), context=contextvars.Context())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
@@ -0,0 +1,123 @@
+"""
+Response cache for polled endpoints (dashboard, stats, returns control, cash realtime)
+Every terminal of a shop polls the same endpoints every few seconds. This layer:
+- Single-flight: concurrent identical requests of the same store share one computation
+- Short TTL cache on top of it
+- Per-store write watermark: rental / return / cash writes bump it and every cached
+  entry computed under an older watermark is discarded immediately
+Hit / miss / coalesced counters are exported on /api/metrics.
+
+The watermark lives in-process: with several workers a write on another worker is
+seen here after at most RESPONSE_CACHE_TTL seconds.
+"""
+import asyncio
+import functools
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from observability import registry
+
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "3"))
+MAX_ENTRIES = 5000
+
+cache_requests = registry.counter(
+    "alpineflow_response_cache_requests_total",
+    "Polled endpoint cache lookups by result (hit, miss, coalesced)",
+    ("endpoint", "result"),
+)
+
+
+class StoreWriteWatermark:
+    """Monotonic per-store counter bumped after every write that changes polled data"""
+
+    def __init__(self):
+        self._marks: Dict[Any, int] = {}
+
+    def get(self, store_id) -> int:
+        return self._marks.get(store_id, 0)
+
+    def bump(self, store_id):
+        self._marks[store_id] = self._marks.get(store_id, 0) + 1
+
+
+store_watermark = StoreWriteWatermark()
+
+
+class ResponseCache:
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL):
+        self.ttl = ttl
+        # key -> (watermark, expires_at, value)
+        self._entries: Dict[Hashable, Tuple[int, float, Any]] = {}
+        # (key, watermark) -> future of the computation in flight
+        self._inflight: Dict[Tuple[Hashable, int], asyncio.Future] = {}
+
+    async def get_or_compute(self, endpoint: str, store_id, params: Tuple, compute: Callable[[], Awaitable[Any]]):
+        key = (endpoint, store_id, params)
+        mark = store_watermark.get(store_id)
+        now = time.monotonic()
+
+        entry = self._entries.get(key)
+        if entry and entry[0] == mark and entry[1] > now:
+            cache_requests.inc((endpoint, "hit"))
+            return entry[2]
+
+        flight_key = (key, mark)
+        inflight = self._inflight.get(flight_key)
+        if inflight is not None:
+            cache_requests.inc((endpoint, "coalesced"))
+            return await asyncio.shield(inflight)
+
+        cache_requests.inc((endpoint, "miss"))
+        # Own task: a disconnecting client must not cancel the computation others wait on
+        task = asyncio.ensure_future(compute())
+        self._inflight[flight_key] = task
+        task.add_done_callback(functools.partial(self._store_result, flight_key, mark))
+        return await asyncio.shield(task)
+
+    def _store_result(self, flight_key, mark: int, task: asyncio.Future):
+        self._inflight.pop(flight_key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        key = flight_key[0]
+        store_id = key[1]
+        # Only cache if nothing was written while computing
+        if store_watermark.get(store_id) != mark:
+            return
+        now = time.monotonic()
+        if len(self._entries) >= MAX_ENTRIES:
+            self._evict(now)
+        self._entries[key] = (mark, now + self.ttl, task.result())
+
+    def _evict(self, now: float):
+        expired = [k for k, (_, expires_at, _) in self._entries.items() if expires_at <= now]
+        for k in expired:
+            del self._entries[k]
+        if len(self._entries) >= MAX_ENTRIES:
+            self._entries.clear()
+
+
+response_cache = ResponseCache()
+
+
+def store_id_from_call(args, kwargs) -> Optional[Any]:
+    user = kwargs.get("current_user")
+    if user is None:
+        user = next((a for a in args if hasattr(a, "get_store_filter")), None)
+    return getattr(user, "store_id", None)
+
+
+def bumps_store_watermark(func: Callable) -> Callable:
+    """
+    Mark a write endpoint (rentals, returns, cash): after it runs, cached polled
+    responses of the store are invalidated. Goes below @api_router.<method>(...).
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            store_id = store_id_from_call(args, kwargs)
+            if store_id is not None:
+                store_watermark.bump(store_id)
+    return wrapper
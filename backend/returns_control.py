@@ -0,0 +1,161 @@
+"""
+Returns control tower projection
+One document per (store, due day) in `returns_control` holding the rentals due
+that day that still have items out, each with its pending lines (item type,
+internal code, brand, model). The tower endpoint reads one document.
+
+Kept up to date incrementally: rental write endpoints decorated with
+@updates_returns_control re-project the rental they touched (moving it between
+day documents when the due date changes, dropping it when everything is back).
+A day document that does not exist yet or was dropped is rebuilt from the
+rentals on first read (cold start, item code edits).
+
+Days are the day part of end_date, which is entered in store-local time; the
+tower compares it with today in the store timezone (local_dates.py).
+"""
+import functools
+import logging
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from response_cache import store_id_from_call
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "returns_control"
+OPEN_STATUSES = ["active", "partial"]
+
+
+def rental_entry(rental: dict) -> Optional[dict]:
+    """Projection of one rental (None if it has nothing left to return)"""
+    if rental.get("status") not in OPEN_STATUSES:
+        return None
+    lines = [
+        {
+            "item_type": line.get("item_type") or "unknown",
+            "internal_code": line.get("internal_code") or "-",
+            "brand": line.get("brand") or "-",
+            "model": line.get("model") or "-",
+        }
+        for line in rental.get("items") or []
+        if not line.get("returned")
+    ]
+    if not lines:
+        return None
+    return {"customer_name": rental.get("customer_name"), "lines": lines}
+
+
+def due_day(rental: dict) -> str:
+    return (rental.get("end_date") or "")[:10]
+
+
+class ReturnsControlProjection:
+    def __init__(self):
+        self.db = None
+
+    def attach(self, db):
+        self.db = db
+
+    @property
+    def collection(self):
+        return self.db[COLLECTION]
+
+    async def refresh_rental(self, store_id, rental_id: str):
+        """Re-project one rental after a write"""
+        rental = await self.db.rentals.find_one(
+            {"store_id": store_id, "id": rental_id},
+            {"_id": 0, "status": 1, "end_date": 1, "customer_name": 1, "items": 1}
+        )
+        entry = rental_entry(rental) if rental else None
+        day = due_day(rental) if rental else None
+        key = f"rentals.{rental_id}"
+        # Drop it from any other day (due date changed) and bump their sequence
+        await self.collection.update_many(
+            {"store_id": store_id, key: {"$exists": True}, "day": {"$ne": day if entry else None}},
+            {"$unset": {key: ""}, "$inc": {"seq": 1}}
+        )
+        if entry:
+            await self.collection.update_one(
+                {"store_id": store_id, "day": day},
+                {"$set": {key: entry, "updated_at": datetime.now(timezone.utc).isoformat()}, "$inc": {"seq": 1}},
+                upsert=True
+            )
+
+    async def rebuild_day(self, store_id, day: str) -> dict:
+        before = await self.collection.find_one({"store_id": store_id, "day": day}, {"seq": 1}) or {}
+        rentals = {}
+        cursor = self.db.rentals.find(
+            {
+                "store_id": store_id,
+                "status": {"$in": OPEN_STATUSES},
+                # end_date may be a plain date or a full ISO timestamp
+                "end_date": {"$gte": day, "$lt": f"{day}~"},
+            },
+            {"_id": 0, "id": 1, "status": 1, "end_date": 1, "customer_name": 1, "items": 1}
+        )
+        async for rental in cursor:
+            entry = rental_entry(rental)
+            if entry:
+                rentals[rental["id"]] = entry
+        doc = {
+            "store_id": store_id,
+            "day": day,
+            "rentals": rentals,
+            "built": True,
+            "seq": before.get("seq", 0),
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }
+        # A rental write landed meanwhile: keep its incremental update, rebuild on next read
+        try:
+            result = await self.collection.replace_one(
+                {"store_id": store_id, "day": day, "seq": before.get("seq")} if before
+                else {"store_id": store_id, "day": day, "seq": {"$exists": False}},
+                doc,
+                upsert=not before
+            )
+            raced = before and not result.matched_count
+        except DuplicateKeyError:
+            raced = True
+        if raced:
+            logger.info(f"🔁 Returns control {store_id}/{day} changed during rebuild, kept incremental state")
+        return doc
+
+    async def day(self, store_id, day: str) -> dict:
+        doc = await self.collection.find_one({"store_id": store_id, "day": day}, {"_id": 0})
+        if not doc or not doc.get("built"):
+            doc = await self.rebuild_day(store_id, day)
+        return doc
+
+    async def invalidate_store(self, store_id):
+        """Item codes changed: rebuild day documents on next read"""
+        await self.collection.update_many({"store_id": store_id}, {"$unset": {"built": ""}})
+
+
+returns_control = ReturnsControlProjection()
+
+
+def updates_returns_control(func: Callable) -> Callable:
+    """
+    Mark a rental write endpoint that changes due date or pending lines; the
+    rental is re-projected after the call (`rental_id` kwarg or the returned rental).
+    Goes below @api_router.<method>(...).
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        result = None
+        try:
+            result = await func(*args, **kwargs)
+            return result
+        finally:
+            # Also after an error: the endpoint may have written before raising
+            rental_id = kwargs.get("rental_id") or getattr(result, "id", None)
+            if rental_id:
+                store_id = store_id_from_call(args, kwargs)
+                try:
+                    await returns_control.refresh_rental(store_id, rental_id)
+                except Exception as e:
+                    logger.error(f"❌ Returns control refresh failed for rental {rental_id}: {e}")
+                    await returns_control.invalidate_store(store_id)
+    return wrapper
@@ -1,15 +1,19 @@
+import asyncio
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional, Dict
+import re
 import uuid
+import time
 from datetime import datetime, timezone, timedelta
 import bcrypt
 import jwt
@@ -29,6 +33,30 @@ from emergentintegrations.payments.stripe.checkout import StripeCheckout, Checko
 
 # Multi-tenant imports
 from multitenant import get_current_user, CurrentUser, require_super_admin, require_admin, create_token as mt_create_token
+from query_budget import query_budget
+from observability import mongo_listener, registry as metrics_registry, RequestMetricsMiddleware
+from slow_query_profiler import slow_query_profiler, profiler_enabled
+from response_cache import response_cache, bumps_store_watermark, store_watermark
+from config_cache import store_config
+from pricing_engine import MAX_LINE_QUANTITY, pricing_engine, price_cart, optimize_cart, compile_pricing
+from tariff_simulator import season_cache, simulate
+from amortization import amortization_recompute
+from rental_cache import rental_cache, invalidates_rental
+from pending_returns import INDEX_KEYS as PENDING_RETURNS_INDEX_KEYS, INDEX_NAME as PENDING_RETURNS_INDEX_NAME, MAX_PAGE_DAYS, PENDING_STATUSES, pending_returns_page, pending_returns_summary
+from returns_control import returns_control, updates_returns_control
+from cash_audit import LOOKUP_INDEX_KEYS as CASH_AUDIT_INDEX_KEYS, missing_movements, sync_detail, sync_movement
+from reconciliation import CSV_FIELDS as RECONCILIATION_CSV_FIELDS, MAX_PAGE_SIZE as RECONCILIATION_MAX_PAGE_SIZE, iter_orphans, orphan_totals, orphans_page, period_totals
+from commissions import CUSTOMER_INDEXES as COMMISSION_CUSTOMER_INDEXES, RENTAL_INDEXES as COMMISSION_RENTAL_INDEXES, commissions_by_source, source_rentals
+from analytics_cube import CubeQueryError, DIMENSIONS as CUBE_DIMENSIONS, analytics_cube, parse_group_by as parse_cube_group_by, updates_analytics_cube
+from columnar_export import FORMATS as COLUMNAR_FORMATS, export_stream as columnar_export_stream
+from archive_tier import ARCHIVED_COLLECTIONS, archive_name, archive_tier, default_cutoff as default_archive_cutoff
+from jobs import background_job, job_queue, report_progress
+from migrations import MIGRATIONS, migration_status, run_migrations
+from store_backup import FORMATS as BACKUP_FORMATS, RESTORE_MODES, BackupError, backs_up_store, backup_before, store_backup
+from tenant_isolation import tenant_isolation
+from local_dates import local_dates, local_today, zone, day_range_filter, valid_timezone
+from rental_lines import LINES_VERSION, line_snapshot, backfill_rental_lines, start_backfill as start_rental_lines_backfill
+from item_type_registry import item_type_registry, normalize_type_name, format_type_label
 from store_models import StoreCreate, StoreResponse, StoreUpdate
 
 ROOT_DIR = Path(__file__).parent
@@ -36,8 +64,19 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[mongo_listener])
 db = client[os.environ['DB_NAME']]
+store_config.attach(db)
+rental_cache.attach(store_config)
+local_dates.attach(db, store_config)
+archive_tier.attach(db, store_config)
+item_type_registry.attach(db)
+amortization_recompute.attach(db)
+returns_control.attach(db)
+analytics_cube.attach(db)
+job_queue.attach(db)
+store_backup.attach(db)
+tenant_isolation.attach(db)
 
 # JWT Settings
 JWT_SECRET = os.environ.get('JWT_SECRET', 'alpineflow-secret-key-2024')
@@ -410,6 +449,7 @@ class ItemTypeResponse(BaseModel):
     is_default: bool
     store_id: Optional[int] = None
     created_at: str
+    item_count: Optional[int] = None
 
 # ==================== AUTH HELPERS ====================
 
@@ -1231,7 +1271,12 @@ async def get_customer_history(customer_id: str, current_user: CurrentUser = Dep
     # Get customer info first
     customer = await db.customers.find_one({**current_user.get_store_filter(), **{"customer_id": customer_id}}, {"_id": 0})
     
-    rentals = await db.rentals.find({**current_user.get_store_filter(), "customer_id": customer_id}, {"_id": 0}).sort("created_at", -1).to_list(50)
+    # Both tiers: old seasons live in the store's archive collections (archive_tier.py)
+    rentals = await archive_tier.find(
+        "rentals", current_user.get_store_filter(),
+        {**current_user.get_store_filter(), "customer_id": customer_id}, {"_id": 0},
+        sort=("created_at", -1), limit=50
+    )
     
     # Check for active/pending rentals (for alerts)
     active_rentals = [r for r in rentals if r.get("status") in ["active", "partial"]]
@@ -1259,10 +1304,11 @@ async def get_customer_history(customer_id: str, current_user: CurrentUser = Dep
     # Get cash transactions related to this customer's rentals
     transactions = []
     if rental_ids:
-        cash_movements = await db.cash_movements.find(
-            {"reference_id": {"$in": rental_ids}},
-            {"_id": 0}
-        ).sort("created_at", -1).to_list(5000)
+        cash_movements = await archive_tier.find(
+            "cash_movements", current_user.get_store_filter(),
+            {**current_user.get_store_filter(), "reference_id": {"$in": rental_ids}}, {"_id": 0},
+            sort=("created_at", -1), limit=5000
+        )
         
         for m in cash_movements:
             transactions.append({
@@ -1391,65 +1437,56 @@ async def delete_customer(customer_id: str, current_user: CurrentUser = Depends(
 class BulkCustomerIdsRequest(BaseModel):
     customer_ids: List[str]
 
+async def customers_with_active_rentals(store_filter: dict, customer_ids: List[str]):
+    """
+    Clientes (de la lista) con alquileres activos, en el orden pedido.
+    Devuelve ({customer_id: nº de alquileres activos}, [clientes con active_rentals])
+    """
+    counts = await db.rentals.aggregate([
+        {"$match": {**store_filter, "customer_id": {"$in": customer_ids}, "status": {"$in": ["active", "partial"]}}},
+        {"$group": {"_id": "$customer_id", "active_rentals": {"$sum": 1}}},
+    ]).to_list(None)
+    active = {c["_id"]: c["active_rentals"] for c in counts}
+    if not active:
+        return active, []
+    found = await db.customers.find(
+        {**store_filter, "id": {"$in": list(active)}}, {"_id": 0, "id": 1, "name": 1, "dni": 1}
+    ).to_list(None)
+    by_id = {c["id"]: {**c, "active_rentals": active[c["id"]]} for c in found}
+    return active, [by_id[customer_id] for customer_id in dict.fromkeys(customer_ids) if customer_id in by_id]
+
 @api_router.post("/customers/check-active-rentals")
+@query_budget(2)
 async def check_customers_active_rentals(request: BulkCustomerIdsRequest, current_user: CurrentUser = Depends(get_current_user)):
     """
     Verifica qué clientes tienen alquileres activos.
     Devuelve lista de clientes que NO pueden ser eliminados.
     """
-    customers_with_rentals = []
-    
-    for customer_id in request.customer_ids:
-        # Multi-tenant: Filter by store
-        active_count = await db.rentals.count_documents({
-            **current_user.get_store_filter(),
-            "customer_id": customer_id,
-            "status": {"$in": ["active", "partial"]}
-        })
-        
-        if active_count > 0:
-            customer = await db.customers.find_one({**current_user.get_store_filter(), **{"id": customer_id}}, {"_id": 0, "id": 1, "name": 1, "dni": 1})
-            if customer:
-                customer["active_rentals"] = active_count
-                customers_with_rentals.append(customer)
-    
+    _, customers_with_rentals = await customers_with_active_rentals(
+        current_user.get_store_filter(), request.customer_ids
+    )
     return {"customers_with_rentals": customers_with_rentals}
 
 @api_router.post("/customers/bulk-delete")
+@query_budget(3)
 async def bulk_delete_customers(request: BulkCustomerIdsRequest, current_user: CurrentUser = Depends(get_current_user)):
     """
     Elimina múltiples clientes a la vez.
     Solo elimina clientes SIN alquileres activos.
     """
-    deleted = 0
-    failed = 0
-    failed_customers = []
+    store_filter = current_user.get_store_filter()
+    active, failed_customers = await customers_with_active_rentals(store_filter, request.customer_ids)
     
-    for customer_id in request.customer_ids:
-        # Check if customer has active rentals - Multi-tenant: Filter by store
-        active_count = await db.rentals.count_documents({
-            **current_user.get_store_filter(),
-            "customer_id": customer_id,
-            "status": {"$in": ["active", "partial"]}
-        })
-        
-        if active_count > 0:
-            failed += 1
-            customer = await db.customers.find_one({**current_user.get_store_filter(), **{"id": customer_id}}, {"_id": 0, "id": 1, "name": 1, "dni": 1})
-            if customer:
-                failed_customers.append(customer)
-            continue
-        
-        # Safe to delete
-        result = await db.customers.delete_one({**current_user.get_store_filter(), "id": customer_id})
-        if result.deleted_count > 0:
-            deleted += 1
-        else:
-            failed += 1
+    # Safe to delete: everyone without active rentals, in one round trip
+    deletable = [customer_id for customer_id in request.customer_ids if customer_id not in active]
+    deleted = 0
+    if deletable:
+        result = await db.customers.delete_many({**store_filter, "id": {"$in": deletable}})
+        deleted = result.deleted_count
     
     return {
         "deleted": deleted,
-        "failed": failed,
+        "failed": len(request.customer_ids) - deleted,
         "failed_customers": failed_customers
     }
 
@@ -1468,56 +1505,69 @@ class CustomerImportRequest(BaseModel):
     customers: List[CustomerImportItem]
 
 @api_router.post("/customers/import")
+@query_budget(3)  # existing DNIs, existing emails, one insert_many
+@background_job("customers.import", max_attempts=1)
 async def import_customers(request: CustomerImportRequest, current_user: CurrentUser = Depends(get_current_user)):
     imported = 0
     duplicates = 0
     errors = 0
     duplicate_dnis = []
+    store_filter = current_user.get_store_filter()
     
+    rows = []
     for customer in request.customers:
-        try:
-            dni_upper = customer.dni.strip().upper()
-            if not dni_upper or not customer.name.strip():
-                errors += 1
-                continue
-            
-            # Check for existing customer by DNI
-            existing = await db.customers.find_one({**current_user.get_store_filter(), **{"dni": dni_upper}})
-            if existing:
-                duplicates += 1
-                duplicate_dnis.append(dni_upper)
-                continue
-            
-            # Check for existing by email if provided
-            if customer.email and customer.email.strip():
-                existing_email = await db.customers.find_one({**current_user.get_store_filter(), **{"email": customer.email.strip().lower()}})
-                if existing_email:
-                    duplicates += 1
-                    duplicate_dnis.append(f"{dni_upper} (email)")
-                    continue
-            
-            customer_id = str(uuid.uuid4())
-            doc = {
-                "id": customer_id,
-                "store_id": current_user.store_id,  # CRITICAL: Add store_id for multi-tenant isolation
-                "dni": dni_upper,
-                "name": customer.name.strip(),
-                "phone": customer.phone.strip() if customer.phone else "",
-                "email": customer.email.strip().lower() if customer.email else "",
-                "address": customer.address.strip() if customer.address else "",
-                "city": customer.city.strip() if customer.city else "",
-                "source": customer.source.strip() if customer.source else "",
-                "notes": customer.notes.strip() if customer.notes else "",
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "total_rentals": 0
-            }
-            
-            await db.customers.insert_one(doc)
-            imported += 1
-            
-        except Exception as e:
+        dni_upper = customer.dni.strip().upper()
+        if not dni_upper or not customer.name.strip():
             errors += 1
-            print(f"Error importing customer {customer.dni}: {str(e)}")
+            continue
+        rows.append((customer, dni_upper, customer.email.strip().lower() if customer.email else ""))
+    
+    # Existing customers by DNI / email, in one query each (no lookup per row)
+    existing_dnis = set(await db.customers.distinct(
+        "dni", {**store_filter, "dni": {"$in": list({dni for _, dni, _ in rows})}}
+    )) if rows else set()
+    emails = list({email for _, _, email in rows if email})
+    existing_emails = set(await db.customers.distinct(
+        "email", {**store_filter, "email": {"$in": emails}}
+    )) if emails else set()
+    
+    docs = []
+    for n, (customer, dni_upper, email) in enumerate(rows, start=1):
+        await report_progress(n, len(rows))
+        if dni_upper in existing_dnis:
+            duplicates += 1
+            duplicate_dnis.append(dni_upper)
+            continue
+        if email and email in existing_emails:
+            duplicates += 1
+            duplicate_dnis.append(f"{dni_upper} (email)")
+            continue
+        # Later rows of the same file count as duplicates, as if already inserted
+        existing_dnis.add(dni_upper)
+        if email:
+            existing_emails.add(email)
+        docs.append({
+            "id": str(uuid.uuid4()),
+            "store_id": current_user.store_id,  # CRITICAL: Add store_id for multi-tenant isolation
+            "dni": dni_upper,
+            "name": customer.name.strip(),
+            "phone": customer.phone.strip() if customer.phone else "",
+            "email": email,
+            "address": customer.address.strip() if customer.address else "",
+            "city": customer.city.strip() if customer.city else "",
+            "source": customer.source.strip() if customer.source else "",
+            "notes": customer.notes.strip() if customer.notes else "",
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "total_rentals": 0
+        })
+    
+    if docs:
+        try:
+            imported = len((await db.customers.insert_many(docs, ordered=False)).inserted_ids)
+        except BulkWriteError as e:
+            imported = e.details.get("nInserted", 0)
+            errors += len(e.details.get("writeErrors", []))
+            print(f"Error importing customers: {len(e.details.get('writeErrors', []))} rows rejected")
     
     return {
         "imported": imported,
@@ -1527,6 +1577,7 @@ async def import_customers(request: CustomerImportRequest, current_user: Current
     }
 
 @api_router.get("/customers/export/all")
+@background_job("customers.export")
 async def export_all_customers(
     format: str = Query("json", regex="^(json|count)$"),
     current_user: CurrentUser = Depends(get_current_user)
@@ -1622,6 +1673,7 @@ async def create_item(item: ItemCreate, current_user: CurrentUser = Depends(get_
             "rental_price": item.rental_price or item.purchase_price or 0
         }
         await db.items.insert_one(doc)
+        await item_type_registry.items_added(doc["store_id"], [doc])
         return ItemResponse(**doc)
     
     # Regular item logic (with traceability)
@@ -1675,9 +1727,11 @@ async def create_item(item: ItemCreate, current_user: CurrentUser = Depends(get_
         "rental_price": None
     }
     await db.items.insert_one(doc)
+    await item_type_registry.items_added(doc["store_id"], [doc])
     return ItemResponse(**doc)
 
 @api_router.get("/items", response_model=List[ItemResponse])
+@query_budget(1)
 async def get_items(
     status: Optional[str] = None,
     item_type: Optional[str] = None,
@@ -2061,10 +2115,13 @@ async def get_items_with_profitability(
             rental_query["end_date"] = date_conditions
     
     # Get all closed rentals to calculate revenue per item (FILTERED by date and store)
-    closed_rentals = await db.rentals.find(
+    # Returned rentals of old seasons are in the archive tier
+    closed_rentals = await archive_tier.find(
+        "rentals", current_user.get_store_filter(),
         rental_query,
-        {"items": 1, "total_amount": 1, "days": 1, "end_date": 1, "_id": 0}
-    ).to_list(10000)
+        {"items": 1, "total_amount": 1, "days": 1, "end_date": 1, "_id": 0},
+        start_date=start_date, limit=10000
+    )
     
     # Calculate revenue per item (by barcode or id)
     item_revenue = {}
@@ -2177,8 +2234,11 @@ async def get_item_profitability(item_id: str, current_user: CurrentUser = Depen
     if not rental_query["$or"]:
         rental_query = {"items.item_id": item_id}
     
-    # Get all rentals containing this item
-    rentals = await db.rentals.find(rental_query).to_list(1000)
+    # Get all rentals containing this item (store-scoped, both tiers)
+    rentals = await archive_tier.find(
+        "rentals", current_user.get_store_filter(),
+        {**current_user.get_store_filter(), **rental_query}, {"_id": 0}, limit=1000
+    )
     
     # Calculate total revenue from this specific item
     total_revenue = 0
@@ -2373,6 +2433,18 @@ async def update_item(item_id: str, item: ItemCreate, current_user: CurrentUser
     if item.is_quick_add is not None:
         update_doc["is_quick_add"] = item.is_quick_add
     await db.items.update_one({**current_user.get_store_filter(), "id": item_id}, {"$set": update_doc})
+    await item_type_registry.item_changed(existing.get("store_id"), existing, update_doc)
+    if item.internal_code != existing.get("internal_code", ""):
+        # Rental lines keep a snapshot of the item's internal_code (rental_lines)
+        await db.rentals.update_many(
+            {**current_user.get_store_filter(), "items.item_id": item_id},
+            {"$set": {"items.$[line].internal_code": item.internal_code}},
+            array_filters=[{"line.item_id": item_id}]
+        )
+        await returns_control.invalidate_store(current_user.store_id)
+    if item.internal_code != existing.get("internal_code", "") or item.barcode != existing["barcode"]:
+        # Cached rental views are looked up by item codes
+        await rental_cache.invalidate_store(current_user.store_id)
     
     updated = await db.items.find_one({**current_user.get_store_filter(), **{"id": item_id}}, {"_id": 0})
     return ItemResponse(**updated)
@@ -2403,13 +2475,12 @@ async def delete_item(item_id: str, force: bool = Query(False), current_user: Cu
     
     if rental_history > 0 and not force:
         # Item has history - mark as deleted (soft delete) instead of physical delete
-        await db.items.update_one(
-            {"id": item_id}, 
-            {"$set": {
-                "status": "deleted",
-                "deleted_at": datetime.now(timezone.utc).isoformat()
-            }}
-        )
+        soft_delete = {
+            "status": "deleted",
+            "deleted_at": datetime.now(timezone.utc).isoformat()
+        }
+        await db.items.update_one({"id": item_id}, {"$set": soft_delete})
+        await item_type_registry.item_changed(item.get("store_id"), item, soft_delete)
         # AUTO-CLEANUP: Check if type should be removed
         await auto_cleanup_empty_type(current_user.store_id, item_type)
         return {"message": "Artículo dado de baja (tiene historial)", "action": "soft_delete", "deleted": True}
@@ -2419,6 +2490,7 @@ async def delete_item(item_id: str, force: bool = Query(False), current_user: Cu
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=500, detail="Error al eliminar el artículo")
+    await item_type_registry.items_removed(item.get("store_id"), [item])
     
     # AUTO-CLEANUP: Check if type should be removed after deletion
     await auto_cleanup_empty_type(current_user.store_id, item_type)
@@ -2428,84 +2500,69 @@ async def delete_item(item_id: str, force: bool = Query(False), current_user: Cu
 
 # ============== HELPER FUNCTIONS FOR DYNAMIC TYPE MANAGEMENT ==============
 
-def normalize_type_name(type_name: str) -> str:
-    """
-    Preserve original type name exactly as provided.
-    Only trim whitespace from start/end and collapse multiple spaces.
-    NO lowercase conversion, NO accent removal, NO underscore conversion.
-    """
-    if not type_name:
-        return ""
-    # Only trim and normalize internal spaces
-    import re
-    normalized = type_name.strip()
-    # Replace multiple consecutive spaces with single space
-    normalized = re.sub(r'\s+', ' ', normalized)
-    return normalized
-
-
-def format_type_label(normalized_value: str) -> str:
-    """Create human-readable label from normalized value"""
-    return normalized_value.replace('_', ' ').title()
-
-
-async def ensure_type_and_tariff_exist(store_id: int, type_name: str) -> dict:
+async def ensure_types_and_tariffs_exist(store_id: int, type_names: List[str]) -> Dict[str, dict]:
     """
-    Ensure a type and its tariff exist for the store.
-    Creates them if they don't exist.
-    Returns dict with: normalized_type, tariff_id, daily_rate
+    Ensure the types and their tariffs exist for the store.
+    Creates the missing ones (one lookup and at most one insert_many per collection,
+    whatever the number of names: imports call it once for all their rows).
+    Returns {normalized_type: {normalized_type, tariff_id, daily_rate, type_created}}
     GARANTIZA que siempre devuelve tariff_id y daily_rate válidos.
     """
-    normalized = normalize_type_name(type_name)
-    if not normalized:
-        normalized = "general"  # Fallback para tipos vacíos
-    
+    normalized_types = list(dict.fromkeys(normalize_type_name(name) or "general" for name in type_names))  # Fallback para tipos vacíos
     store_filter = {"store_id": store_id}
-    
-    # Check if type exists
-    existing_type = await db.item_types.find_one({**store_filter, "value": normalized})
-    
-    if not existing_type:
-        # Create new type
-        type_doc = {
+    invalidated = []
+    
+    # Config cache first; DB re-check only for the types the cache misses
+    cached_types = {t.get("value") for t in await store_config.item_types(store_id)}
+    unknown = [t for t in normalized_types if t not in cached_types]
+    new_types = []
+    if unknown:
+        found = set(await db.item_types.distinct("value", {**store_filter, "value": {"$in": unknown}}))
+        new_types = [t for t in unknown if t not in found]
+    if new_types:
+        await db.item_types.insert_many([{
             "id": str(uuid.uuid4()),
             "store_id": store_id,
             "value": normalized,
             "label": format_type_label(normalized),
             "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.item_types.insert_one(type_doc)
-        logger.info(f"✅ Auto-created type '{normalized}' for store {store_id}")
+        } for normalized in new_types])
+        invalidated.append("item_types")
+        logger.info(f"✅ Auto-created types {new_types} for store {store_id}")
     
-    # Check if tariff exists
-    existing_tariff = await db.tariffs.find_one({**store_filter, "item_type": normalized})
-    
-    if not existing_tariff:
-        # Create default tariff with price 0
-        tariff_id = str(uuid.uuid4())
-        tariff_doc = {
-            "id": tariff_id,
+    # Check which tariffs exist
+    tariffs = await store_config.tariffs_by_type(store_id)
+    missing = [t for t in normalized_types if t not in tariffs]
+    if missing:
+        for tariff in await db.tariffs.find({**store_filter, "item_type": {"$in": missing}}, {"_id": 0}).to_list(None):
+            tariffs.setdefault(tariff["item_type"], tariff)
+        # Create default tariffs with price 0
+        new_tariffs = [{
+            "id": str(uuid.uuid4()),
             "store_id": store_id,
             "item_type": normalized,
             "daily_rate": 0.0,
             "deposit": 0.0,
             "name": format_type_label(normalized),
             "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.tariffs.insert_one(tariff_doc)
-        logger.info(f"✅ Auto-created tariff for type '{normalized}' with price 0€ for store {store_id}")
-        
-        return {
-            "normalized_type": normalized,
-            "tariff_id": tariff_id,
-            "daily_rate": 0.0
-        }
+        } for normalized in missing if normalized not in tariffs]
+        if new_tariffs:
+            await db.tariffs.insert_many(new_tariffs)
+            tariffs.update({t["item_type"]: t for t in new_tariffs})
+            invalidated.append("tariffs")
+            logger.info(f"✅ Auto-created tariffs for types {[t['item_type'] for t in new_tariffs]} with price 0€ for store {store_id}")
+    
+    if invalidated:
+        await store_config.invalidate(store_id, *invalidated)
     
-    # Tariff exists - return its data
     return {
-        "normalized_type": normalized,
-        "tariff_id": existing_tariff.get("id", ""),
-        "daily_rate": existing_tariff.get("daily_rate", 0.0)
+        normalized: {
+            "normalized_type": normalized,
+            "tariff_id": tariffs[normalized].get("id", ""),
+            "daily_rate": tariffs[normalized].get("daily_rate", 0.0),
+            "type_created": normalized in new_types
+        }
+        for normalized in normalized_types
     }
 
 
@@ -2520,12 +2577,9 @@ async def auto_cleanup_empty_type(store_id: int, type_value: str):
     normalized = normalize_type_name(type_value)
     store_filter = {"store_id": store_id}
     
-    # Count remaining items of this type (excluding deleted)
-    remaining_items = await db.items.count_documents({
-        **store_filter,
-        "item_type": normalized,
-        "status": {"$nin": ["deleted"]}
-    })
+    # Count remaining items of this type (excluding deleted) - type registry, no scan
+    counts = await item_type_registry.counts(store_id, normalized)
+    remaining_items = counts["total"] - counts["status_deleted"]
     
     if remaining_items == 0:
         # No items left - remove type and tariff
@@ -2533,6 +2587,7 @@ async def auto_cleanup_empty_type(store_id: int, type_value: str):
         tariff_deleted = await db.tariffs.delete_one({**store_filter, "item_type": normalized})
         
         if type_deleted.deleted_count > 0 or tariff_deleted.deleted_count > 0:
+            await store_config.invalidate(store_id, "item_types", "tariffs")
             logger.info(f"🧹 Auto-cleanup: Removed empty type '{normalized}' from store {store_id}")
 
 
@@ -2553,8 +2608,8 @@ async def sync_item_types_from_inventory(store_id: int) -> dict:
     """
     store_filter = {"store_id": store_id}
     
-    # Obtener todos los tipos DISTINCT del inventario (fuente de verdad)
-    inventory_types = await db.items.distinct("item_type", store_filter)
+    # Tipos presentes en el inventario (registro materializado de tipos)
+    inventory_types = [t["value"] for t in await item_type_registry.types(store_id)]
     inventory_types = [t for t in inventory_types if t and t.strip()]
     
     # Obtener tipos existentes en la tabla
@@ -2564,35 +2619,33 @@ async def sync_item_types_from_inventory(store_id: int) -> dict:
     # Encontrar tipos faltantes
     missing_types = [t for t in inventory_types if t not in existing_type_values]
     
-    # Crear los tipos faltantes
-    created_count = 0
-    for type_value in missing_types:
-        type_doc = {
+    # Crear los tipos faltantes (y sus tarifas si no existen), en bloque
+    created_count = len(missing_types)
+    if missing_types:
+        await db.item_types.insert_many([{
             "id": str(uuid.uuid4()),
             "store_id": store_id,
             "value": type_value,
             "label": format_type_label(type_value),
             "is_default": False,
             "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.item_types.insert_one(type_doc)
+        } for type_value in missing_types])
         
-        # También crear tarifa si no existe
-        tariff_exists = await db.tariffs.find_one({**store_filter, "item_type": type_value})
-        if not tariff_exists:
-            tariff_doc = {
-                "id": str(uuid.uuid4()),
-                "store_id": store_id,
-                "item_type": type_value,
-                "daily_rate": 0.0,
-                "deposit": 0.0,
-                "name": format_type_label(type_value),
-                "created_at": datetime.now(timezone.utc).isoformat()
-            }
-            await db.tariffs.insert_one(tariff_doc)
+        tariff_types = set(await db.tariffs.distinct("item_type", {**store_filter, "item_type": {"$in": missing_types}}))
+        new_tariffs = [{
+            "id": str(uuid.uuid4()),
+            "store_id": store_id,
+            "item_type": type_value,
+            "daily_rate": 0.0,
+            "deposit": 0.0,
+            "name": format_type_label(type_value),
+            "created_at": datetime.now(timezone.utc).isoformat()
+        } for type_value in missing_types if type_value not in tariff_types]
+        if new_tariffs:
+            await db.tariffs.insert_many(new_tariffs)
         
-        created_count += 1
-        logger.info(f"🔄 Self-healing: Created type+tariff '{type_value}' for store {store_id}")
+        await store_config.invalidate(store_id, "item_types", "tariffs")
+        logger.info(f"🔄 Self-healing: Created type+tariff {missing_types} for store {store_id}")
     
     return {
         "inventory_types_count": len(inventory_types),
@@ -2606,7 +2659,10 @@ async def sync_item_types_from_inventory(store_id: int) -> dict:
 @api_router.get("/item-types", response_model=List[ItemTypeResponse])
 async def get_item_types(current_user: CurrentUser = Depends(get_current_user)):
     """
-    Get all item types - CRITICAL FIX: Lee DIRECTAMENTE del inventario (DISTINCT) + DEDUPLICA
+    Get all item types - Lee del registro materializado de tipos del inventario + DEDUPLICA
+    
+    El registro (item_type_registry) se mantiene en cada alta/edición/baja de artículos
+    con el número de artículos por tipo, así que no hace falta escanear items.
     
     Esto garantiza matemáticamente que:
     - Si un tipo existe en un artículo → aparecerá en el filtro
@@ -2616,14 +2672,12 @@ async def get_item_types(current_user: CurrentUser = Depends(get_current_user)):
     
     La fuente de verdad es SIEMPRE el inventario real.
     """
-    # Multi-tenant: Filter by store_id
-    store_filter = current_user.get_store_filter()
-    
-    # DISTINCT: Obtener todos los tipos únicos que REALMENTE EXISTEN en el inventario
-    distinct_types = await db.items.distinct("item_type", store_filter)
+    # Multi-tenant: registro de la tienda del usuario
+    registry_docs = await item_type_registry.types(current_user.store_id)
+    item_counts = {d["value"]: d.get("total", 0) for d in registry_docs}
     
     # Filtrar valores nulos/vacíos
-    distinct_types = [t for t in distinct_types if t and t.strip()]
+    distinct_types = [t for t in item_counts if t and t.strip()]
     
     # 🔥 DEDUPLICACIÓN: Agrupar por valor normalizado
     # Si hay "bota snowboard" y "bota_snowboard", solo se mostrará uno
@@ -2642,8 +2696,8 @@ async def get_item_types(current_user: CurrentUser = Depends(get_current_user)):
     
     logger.info(f"[ITEM TYPES] Original distinct: {len(distinct_types)}, After dedup: {len(deduplicated_types)}")
     
-    # Obtener labels personalizados de la tabla item_types (si existen)
-    type_docs = await db.item_types.find(store_filter, {"_id": 0}).to_list(5000)
+    # Obtener labels personalizados de la tabla item_types (si existen) - config cache
+    type_docs = await store_config.item_types(current_user.store_id)
     type_labels = {t["value"]: t["label"] for t in type_docs if "value" in t and "label" in t}
     
     # Construir respuesta: usar label personalizado si existe, sino usar el valor tal cual
@@ -2657,12 +2711,14 @@ async def get_item_types(current_user: CurrentUser = Depends(get_current_user)):
             value=type_value,
             label=type_labels.get(type_value, type_value.replace('_', ' ').title()),
             is_default=False,
-            created_at=type_created_at.get(type_value, datetime.now(timezone.utc).isoformat())
+            created_at=type_created_at.get(type_value, datetime.now(timezone.utc).isoformat()),
+            item_count=item_counts.get(type_value, 0)
         ))
     
     return result
 
 @api_router.post("/item-types/sync")
+@background_job("item_types.sync")
 async def sync_item_types(current_user: CurrentUser = Depends(get_current_user)):
     """
     🔄 SELF-HEALING: Sincroniza la tabla item_types con el inventario real.
@@ -2673,6 +2729,8 @@ async def sync_item_types(current_user: CurrentUser = Depends(get_current_user))
     Ejecutar después de importaciones o cuando los filtros no muestren todos los tipos.
     """
     try:
+        # Recontar el registro de tipos desde el inventario (corrige cualquier desviación)
+        await item_type_registry.rebuild(current_user.store_id)
         sync_result = await sync_item_types_from_inventory(current_user.store_id)
         
         if sync_result["created_count"] > 0:
@@ -2711,9 +2769,12 @@ async def create_item_type(item_type: ItemTypeCreate, current_user: CurrentUser
     }
     
     await db.item_types.insert_one(doc)
+    await store_config.invalidate(current_user.store_id, "item_types")
     return ItemTypeResponse(**doc)
 
 @api_router.delete("/item-types/{type_id}")
+@backs_up_store("delete_item_type", ("items", "item_types", "tariffs", "item_type_registry"),
+                when=lambda kwargs: kwargs.get("force") or kwargs.get("reassign_to"))
 async def delete_item_type(
     type_id: str, 
     force: bool = Query(False, description="Forzar eliminación incluyendo artículos archivados/retirados"),
@@ -2728,48 +2789,43 @@ async def delete_item_type(
     
     type_value = item_type["value"]
     
-    # Count items by status (within same store)
-    total_items = await db.items.count_documents({**current_user.get_store_filter(), "item_type": type_value})
-    active_items = await db.items.count_documents({
-        **current_user.get_store_filter(),
-        "item_type": type_value,
-        "status": {"$in": ["available", "rented", "maintenance"]}
-    })
-    ghost_items = await db.items.count_documents({
-        **current_user.get_store_filter(),
-        "item_type": type_value,
-        "status": {"$in": ["retired", "deleted", "archived"]},
-    })
-    soft_deleted = await db.items.count_documents({
-        **current_user.get_store_filter(),
-        "item_type": type_value,
-        "deleted_at": {"$exists": True, "$ne": None}
-    })
+    # Count items by status (within same store) - type registry, no scan
+    counts = await item_type_registry.counts(current_user.store_id, type_value)
+    total_items = counts["total"]
+    active_items = counts["active"]
+    ghost_items = counts["ghost"]
+    soft_deleted = counts["soft_deleted"]
     
     # Case 1: No items at all - delete directly
     if total_items == 0:
         await db.item_types.delete_one({**current_user.get_store_filter(), "id": type_id})
         # Also delete associated tariff (within same store)
         await db.tariffs.delete_one({**current_user.get_store_filter(), "item_type": type_value})
+        await store_config.invalidate(current_user.store_id, "item_types", "tariffs")
         return {"message": "Tipo eliminado correctamente", "deleted_tariff": True}
     
     # Case 2: Only ghost/retired items and force=True - clean them up
     if force and active_items == 0 and ghost_items > 0:
         # Delete ghost items permanently (within same store)
-        await db.items.delete_many({
+        ghost_query = {
             **current_user.get_store_filter(),
             "item_type": type_value,
             "status": {"$in": ["retired", "deleted", "archived"]}
-        })
+        }
+        await item_type_registry.remove_matching(current_user.store_id, ghost_query)
+        await db.items.delete_many(ghost_query)
         # Delete soft-deleted items (within same store)
-        await db.items.delete_many({
+        soft_query = {
             **current_user.get_store_filter(),
             "item_type": type_value,
             "deleted_at": {"$exists": True, "$ne": None}
-        })
+        }
+        await item_type_registry.remove_matching(current_user.store_id, soft_query)
+        await db.items.delete_many(soft_query)
         # Now delete the type
         await db.item_types.delete_one({**current_user.get_store_filter(), "id": type_id})
         await db.tariffs.delete_one({**current_user.get_store_filter(), "item_type": type_value})
+        await store_config.invalidate(current_user.store_id, "item_types", "tariffs")
         return {
             "message": f"Tipo eliminado. Se eliminaron {ghost_items + soft_deleted} artículos fantasma.",
             "deleted_ghost_items": ghost_items + soft_deleted
@@ -2783,22 +2839,24 @@ async def delete_item_type(
             raise HTTPException(status_code=400, detail=f"El tipo de destino '{reassign_to}' no existe")
         
         # Reassign active items (within same store)
-        await db.items.update_many(
-            {**current_user.get_store_filter(), "item_type": type_value, "status": {"$in": ["available", "rented", "maintenance"]}},
-            {"$set": {"item_type": reassign_to}}
-        )
+        active_query = {**current_user.get_store_filter(), "item_type": type_value, "status": {"$in": ["available", "rented", "maintenance"]}}
+        await item_type_registry.retype_matching(current_user.store_id, active_query, reassign_to)
+        await db.items.update_many(active_query, {"$set": {"item_type": reassign_to}})
         
         # Delete ghost items if force=True (within same store)
         if force:
-            await db.items.delete_many({
+            ghost_query = {
                 **current_user.get_store_filter(),
                 "item_type": type_value,
                 "status": {"$in": ["retired", "deleted", "archived"]}
-            })
+            }
+            await item_type_registry.remove_matching(current_user.store_id, ghost_query)
+            await db.items.delete_many(ghost_query)
         
         # Delete the type
         await db.item_types.delete_one({**current_user.get_store_filter(), "id": type_id})
         await db.tariffs.delete_one({**current_user.get_store_filter(), "item_type": type_value})
+        await store_config.invalidate(current_user.store_id, "item_types", "tariffs")
         return {
             "message": f"Tipo eliminado. {active_items} artículos reasignados a '{reassign_to}'.",
             "reassigned": active_items
@@ -2830,6 +2888,7 @@ async def delete_item_type(
     )
 
 @api_router.post("/item-types/{type_id}/cleanup")
+@backs_up_store("cleanup_item_type", ("items", "item_type_registry"))
 async def cleanup_item_type(type_id: str, current_user: CurrentUser = Depends(get_current_user)):
     """Clean up ghost items for a type (retired, deleted, archived, soft-deleted)
     Multi-tenant: Filters by store_id
@@ -2842,18 +2901,22 @@ async def cleanup_item_type(type_id: str, current_user: CurrentUser = Depends(ge
     type_value = item_type["value"]
     
     # Delete ghost items - Multi-tenant: Filter by store
-    result1 = await db.items.delete_many({
+    ghost_query = {
         **store_filter,
         "item_type": type_value,
         "status": {"$in": ["retired", "deleted", "archived"]}
-    })
+    }
+    await item_type_registry.remove_matching(current_user.store_id, ghost_query)
+    result1 = await db.items.delete_many(ghost_query)
     
     # Delete soft-deleted items - Multi-tenant: Filter by store
-    result2 = await db.items.delete_many({
+    soft_query = {
         **store_filter,
         "item_type": type_value,
         "deleted_at": {"$exists": True, "$ne": None}
-    })
+    }
+    await item_type_registry.remove_matching(current_user.store_id, soft_query)
+    result2 = await db.items.delete_many(soft_query)
     
     total_deleted = result1.deleted_count + result2.deleted_count
     
@@ -2892,6 +2955,7 @@ async def cleanup_orphan_items(current_user: CurrentUser = Depends(get_current_u
     }
 
 @api_router.post("/item-types/migrate-legacy")
+@background_job("item_types.migrate_legacy")
 async def migrate_legacy_types(current_user: CurrentUser = Depends(get_current_user)):
     """Migrate items with legacy hardcoded types to 'sin_categoria' or create new custom types
     Multi-tenant: Filters by store_id
@@ -2927,6 +2991,9 @@ async def migrate_legacy_types(current_user: CurrentUser = Depends(get_current_u
             else:
                 migrated.append({"type": legacy_type, "items_count": count, "action": "already_exists"})
     
+    if any(m["action"] == "created_custom_type" for m in migrated):
+        await store_config.invalidate(current_user.store_id, "item_types")
+    
     return {"migrated": migrated, "message": "Migración completada"}
 
 @api_router.post("/item-types/reassign")
@@ -2945,6 +3012,7 @@ async def reassign_item_types(
         raise HTTPException(status_code=404, detail="El tipo de destino no existe")
     
     # Update all items for this store
+    await item_type_registry.retype_matching(current_user.store_id, {**store_filter, "item_type": old_type}, new_type)
     result = await db.items.update_many(
         {**store_filter, "item_type": old_type},
         {"$set": {"item_type": new_type}}
@@ -2954,9 +3022,13 @@ async def reassign_item_types(
 
 @api_router.put("/items/{item_id}/status")
 async def update_item_status(item_id: str, status: str = Query(...), current_user: CurrentUser = Depends(get_current_user)):
-    result = await db.items.update_one({**current_user.get_store_filter(), "id": item_id}, {"$set": {"status": status}})
-    if result.modified_count == 0:
+    before = await db.items.find_one_and_update(
+        {**current_user.get_store_filter(), "id": item_id, "status": {"$ne": status}},
+        {"$set": {"status": status}}
+    )
+    if not before:
         raise HTTPException(status_code=404, detail="Item not found")
+    await item_type_registry.item_changed(before.get("store_id"), before, {"status": status})
     return {"message": "Status updated"}
 
 @api_router.post("/items/{item_id}/complete-maintenance")
@@ -2992,6 +3064,7 @@ async def complete_item_maintenance(item_id: str, current_user: CurrentUser = De
     
     if result.modified_count == 0:
         raise HTTPException(status_code=500, detail="Error al actualizar el artículo")
+    await item_type_registry.item_changed(item.get("store_id"), item, update_doc)
     
     # Get the updated item
     updated_item = await db.items.find_one({**current_user.get_store_filter(), **{"id": item_id}}, {"_id": 0})
@@ -3009,15 +3082,20 @@ async def complete_item_maintenance(item_id: str, current_user: CurrentUser = De
     }
 
 @api_router.post("/items/bulk")
+@query_budget(5)  # plan limit (2), existing barcodes, insert_many, type registry
 async def create_items_bulk(data: BulkItemCreate, current_user: CurrentUser = Depends(get_current_user)):
     """Create multiple items at once"""
     await check_plan_limit(current_user, 'items')
     created = []
     errors = []
     
+    # Existing barcodes in one query (no lookup per item)
+    existing_barcodes = set(await db.items.distinct(
+        "barcode", {**current_user.get_store_filter(), "barcode": {"$in": [item.barcode for item in data.items]}}
+    )) if data.items else set()
+    
     for item in data.items:
-        existing = await db.items.find_one({**current_user.get_store_filter(), **{"barcode": item.barcode}})
-        if existing:
+        if item.barcode in existing_barcodes:
             errors.append({"barcode": item.barcode, "error": "Already exists"})
             continue
         
@@ -3031,6 +3109,7 @@ async def create_items_bulk(data: BulkItemCreate, current_user: CurrentUser = De
         
         doc = {
             "id": item_id,
+            "store_id": current_user.store_id,  # ✅ Multi-tenant: assign to user's store
             "barcode": item.barcode,
             "item_type": normalized_item_type,  # ✅ NORMALIZED
             "brand": item.brand,
@@ -3045,12 +3124,17 @@ async def create_items_bulk(data: BulkItemCreate, current_user: CurrentUser = De
             "amortization": 0,
             "created_at": datetime.now(timezone.utc).isoformat()
         }
-        await db.items.insert_one(doc)
+        existing_barcodes.add(item.barcode)  # later rows with the same barcode are duplicates
         created.append(doc)
     
+    if created:
+        await db.items.insert_many(created)
+    await item_type_registry.items_added(current_user.store_id, created)
     return {"created": len(created), "errors": errors}
 
 @api_router.post("/items/import-csv")
+@query_budget(20)  # plan limit, existing barcodes, types+tariffs in bulk, insert_many, registry, type sync
+@background_job("items.import_csv", max_attempts=1)
 async def import_items_csv(file: UploadFile = File(...), current_user: CurrentUser = Depends(get_current_user)):
     """Import items from CSV file with automatic type AND tariff creation"""
     await check_plan_limit(current_user, 'items')
@@ -3059,50 +3143,40 @@ async def import_items_csv(file: UploadFile = File(...), current_user: CurrentUs
     
     content = await file.read()
     decoded = content.decode('utf-8')
-    reader = csv.DictReader(io.StringIO(decoded))
+    rows = list(csv.DictReader(io.StringIO(decoded)))
     
     created = []
     errors = []
-    types_created = []
+    inserted_docs = []
+    
+    # Existing barcodes in one query (no lookup per row)
+    barcodes = [b for b in (row.get('barcode', row.get('codigo', '')).strip() for row in rows) if b]
+    existing_barcodes = set(await db.items.distinct(
+        "barcode", {**current_user.get_store_filter(), "barcode": {"$in": barcodes}}
+    )) if barcodes else set()
     
-    for row in reader:
+    for n, row in enumerate(rows, start=1):
+        await report_progress(n, len(rows))
         try:
             barcode = row.get('barcode', row.get('codigo', '')).strip()
             if not barcode:
                 errors.append({"row": row, "error": "Missing barcode"})
                 continue
             
-            existing = await db.items.find_one({**current_user.get_store_filter(), **{"barcode": barcode}})
-            if existing:
+            if barcode in existing_barcodes:
                 errors.append({"barcode": barcode, "error": "Already exists"})
                 continue
             
-            # ============ AUTO-CREATE TYPE AND TARIFF (OBLIGATORIO) ============
             raw_item_type = row.get('item_type', row.get('tipo', row.get('type', 'general'))).strip()
             if not raw_item_type:
                 raw_item_type = 'general'
             
-            # Esta función GARANTIZA que tipo Y tarifa existen, y retorna tariff_id y precio
-            type_tariff_data = await ensure_type_and_tariff_exist(current_user.store_id, raw_item_type)
-            normalized_type = type_tariff_data["normalized_type"]
-            tariff_id = type_tariff_data["tariff_id"]
-            daily_rate = type_tariff_data["daily_rate"]
-            
-            if normalized_type not in types_created:
-                type_check = await db.item_types.find_one({
-                    "store_id": current_user.store_id, 
-                    "value": normalized_type
-                })
-                if type_check and type_check.get("created_at", "").startswith(datetime.now(timezone.utc).strftime("%Y-%m-%d")):
-                    types_created.append(normalized_type)
-            # ===================================================================
-            
             item_id = str(uuid.uuid4())
             doc = {
                 "id": item_id,
                 "store_id": current_user.store_id,
                 "barcode": barcode,
-                "item_type": normalized_type,
+                "item_type": raw_item_type,  # normalized below, with its tariff
                 "brand": row.get('brand', row.get('marca', '')).strip(),
                 "model": row.get('model', row.get('modelo', '')).strip(),
                 "size": row.get('size', row.get('talla', '')).strip(),
@@ -3113,18 +3187,38 @@ async def import_items_csv(file: UploadFile = File(...), current_user: CurrentUs
                 "maintenance_interval": int(row.get('maintenance_interval', row.get('mantenimiento_cada', 30)) or 30),
                 "days_used": 0,
                 "amortization": 0,
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                # ============ ASIGNACIÓN OBLIGATORIA DE TARIFA ============
-                "tariff_id": tariff_id,  # SIEMPRE asignado
-                "rental_price": daily_rate  # SIEMPRE asignado (puede ser 0 si tarifa nueva)
-                # ==========================================================
+                "created_at": datetime.now(timezone.utc).isoformat()
             }
             
-            await db.items.insert_one(doc)
-            created.append({"barcode": barcode, "type": normalized_type})
+            existing_barcodes.add(barcode)  # later rows with the same barcode are duplicates
+            inserted_docs.append(doc)
         except Exception as e:
             errors.append({"barcode": row.get('barcode', 'unknown'), "error": str(e)})
     
+    # ============ AUTO-CREATE TYPES AND TARIFFS (OBLIGATORIO) ============
+    # Esta función GARANTIZA que tipos Y tarifas existen, y retorna tariff_id y precio
+    type_tariffs = await ensure_types_and_tariffs_exist(
+        current_user.store_id, [doc["item_type"] for doc in inserted_docs]
+    ) if inserted_docs else {}
+    for doc in inserted_docs:
+        type_tariff_data = type_tariffs[normalize_type_name(doc["item_type"]) or "general"]
+        doc["item_type"] = type_tariff_data["normalized_type"]
+        # ============ ASIGNACIÓN OBLIGATORIA DE TARIFA ============
+        doc["tariff_id"] = type_tariff_data["tariff_id"]  # SIEMPRE asignado
+        doc["rental_price"] = type_tariff_data["daily_rate"]  # SIEMPRE asignado (puede ser 0 si tarifa nueva)
+        created.append({"barcode": doc["barcode"], "type": doc["item_type"]})
+    types_created = [t for t, data in type_tariffs.items() if data["type_created"]]
+    
+    if inserted_docs:
+        try:
+            await db.items.insert_many(inserted_docs, ordered=False)
+        except BulkWriteError as e:
+            failed = {err["index"]: err.get("errmsg", "") for err in e.details.get("writeErrors", [])}
+            errors.extend({"barcode": inserted_docs[i]["barcode"], "error": msg} for i, msg in failed.items())
+            created = [c for i, c in enumerate(created) if i not in failed]
+            inserted_docs = [doc for i, doc in enumerate(inserted_docs) if i not in failed]
+    await item_type_registry.items_added(current_user.store_id, inserted_docs)
+    
     # 🔄 SELF-HEALING: Sincronizar tipos después de la importación
     try:
         await sync_item_types_from_inventory(current_user.store_id)
@@ -3136,8 +3230,8 @@ async def import_items_csv(file: UploadFile = File(...), current_user: CurrentUs
         "created": len(created), 
         "errors": errors, 
         "total_rows": len(created) + len(errors),
-        "types_created": len(set(types_created)),
-        "new_types": list(set(types_created))
+        "types_created": len(types_created),
+        "new_types": types_created
     }
 
 # Universal import endpoint for inventory (with field mapping)
@@ -3159,6 +3253,8 @@ class ItemImportRequest(BaseModel):
     items: List[ItemImportItem]
 
 @api_router.post("/items/import")
+@query_budget(21)  # plan limit, existing codes + barcodes, types+tariffs in bulk, insert_many, registry, type sync
+@background_job("items.import", max_attempts=1)
 async def import_items(request: ItemImportRequest, current_user: CurrentUser = Depends(get_current_user)):
     """Import items with field mapping support, automatic type creation and tariff assignment"""
     await check_plan_limit(current_user, 'items')
@@ -3166,9 +3262,21 @@ async def import_items(request: ItemImportRequest, current_user: CurrentUser = D
     duplicates = 0
     errors = 0
     duplicate_codes = []
-    types_created = []
+    inserted_docs = []
+    store_filter = current_user.get_store_filter()
     
-    for item in request.items:
+    # Existing internal codes / barcodes in one query each (no lookup per row)
+    codes = list({item.internal_code.strip().upper() for item in request.items if item.internal_code.strip()})
+    existing_codes = set(await db.items.distinct(
+        "internal_code", {**store_filter, "internal_code": {"$in": codes}}
+    )) if codes else set()
+    barcodes = list({item.barcode.strip() for item in request.items if item.barcode and item.barcode.strip()})
+    existing_barcodes = set(await db.items.distinct(
+        "barcode", {**store_filter, "barcode": {"$in": barcodes}}
+    )) if barcodes else set()
+    
+    for n, item in enumerate(request.items, start=1):
+        await report_progress(n, len(request.items))
         try:
             internal_code = item.internal_code.strip().upper()
             if not internal_code or not item.item_type or not item.brand or not item.size:
@@ -3176,37 +3284,16 @@ async def import_items(request: ItemImportRequest, current_user: CurrentUser = D
                 continue
             
             # Check for duplicate by internal_code
-            existing = await db.items.find_one({**current_user.get_store_filter(), **{"internal_code": internal_code}})
-            if existing:
+            if internal_code in existing_codes:
                 duplicates += 1
                 duplicate_codes.append(internal_code)
                 continue
             
             # Check for duplicate barcode if provided
-            if item.barcode and item.barcode.strip():
-                existing_barcode = await db.items.find_one({**current_user.get_store_filter(), **{"barcode": item.barcode.strip()}})
-                if existing_barcode:
-                    duplicates += 1
-                    duplicate_codes.append(f"{internal_code} (barcode)")
-                    continue
-            
-            # ============ AUTO-CREATE TYPE AND TARIFF (OBLIGATORIO) ============
-            raw_item_type = item.item_type.strip() if item.item_type else "general"
-            
-            # Esta función GARANTIZA que tipo Y tarifa existen
-            type_tariff_data = await ensure_type_and_tariff_exist(current_user.store_id, raw_item_type)
-            normalized_type = type_tariff_data["normalized_type"]
-            tariff_id = type_tariff_data["tariff_id"]
-            daily_rate = type_tariff_data["daily_rate"]
-            
-            if normalized_type not in types_created:
-                type_check = await db.item_types.find_one({
-                    "store_id": current_user.store_id, 
-                    "value": normalized_type
-                })
-                if type_check and type_check.get("created_at", "").startswith(datetime.now(timezone.utc).strftime("%Y-%m-%d")):
-                    types_created.append(normalized_type)
-            # ===================================================================
+            if item.barcode and item.barcode.strip() in existing_barcodes:
+                duplicates += 1
+                duplicate_codes.append(f"{internal_code} (barcode)")
+                continue
             
             # Generate barcode if not provided
             barcode = item.barcode.strip() if item.barcode else internal_code
@@ -3218,7 +3305,7 @@ async def import_items(request: ItemImportRequest, current_user: CurrentUser = D
                 "internal_code": internal_code,
                 "barcode": barcode,
                 "serial_number": item.serial_number.strip() if item.serial_number else "",
-                "item_type": normalized_type,
+                "item_type": item.item_type.strip() if item.item_type else "general",  # normalized below, with its tariff
                 "brand": item.brand.strip(),
                 "model": item.model.strip() if item.model else "",
                 "size": str(item.size).strip(),
@@ -3231,20 +3318,42 @@ async def import_items(request: ItemImportRequest, current_user: CurrentUser = D
                 "maintenance_interval": 30,
                 "days_used": 0,
                 "amortization": 0,
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                # ============ ASIGNACIÓN OBLIGATORIA DE TARIFA ============
-                "tariff_id": tariff_id,  # SIEMPRE asignado
-                "rental_price": daily_rate  # SIEMPRE asignado
-                # ==========================================================
+                "created_at": datetime.now(timezone.utc).isoformat()
             }
             
-            await db.items.insert_one(doc)
-            imported += 1
+            # Later rows of the same request count as duplicates, as if already inserted
+            existing_codes.add(internal_code)
+            existing_barcodes.add(barcode)
+            inserted_docs.append(doc)
             
         except Exception as e:
             errors += 1
             print(f"Error importing item {item.internal_code}: {str(e)}")
     
+    # ============ AUTO-CREATE TYPES AND TARIFFS (OBLIGATORIO) ============
+    # Esta función GARANTIZA que tipos Y tarifas existen
+    type_tariffs = await ensure_types_and_tariffs_exist(
+        current_user.store_id, [doc["item_type"] for doc in inserted_docs]
+    ) if inserted_docs else {}
+    for doc in inserted_docs:
+        type_tariff_data = type_tariffs[normalize_type_name(doc["item_type"]) or "general"]
+        doc["item_type"] = type_tariff_data["normalized_type"]
+        # ============ ASIGNACIÓN OBLIGATORIA DE TARIFA ============
+        doc["tariff_id"] = type_tariff_data["tariff_id"]  # SIEMPRE asignado
+        doc["rental_price"] = type_tariff_data["daily_rate"]  # SIEMPRE asignado
+    types_created = [t for t, data in type_tariffs.items() if data["type_created"]]
+    
+    if inserted_docs:
+        try:
+            imported = len((await db.items.insert_many(inserted_docs, ordered=False)).inserted_ids)
+        except BulkWriteError as e:
+            failed = {err["index"] for err in e.details.get("writeErrors", [])}
+            imported = e.details.get("nInserted", 0)
+            errors += len(failed)
+            inserted_docs = [doc for i, doc in enumerate(inserted_docs) if i not in failed]
+            print(f"Error importing items: {len(failed)} rows rejected")
+    await item_type_registry.items_added(current_user.store_id, inserted_docs)
+    
     # 🔄 SELF-HEALING: Sincronizar tipos después de la importación
     try:
         await sync_item_types_from_inventory(current_user.store_id)
@@ -3257,8 +3366,8 @@ async def import_items(request: ItemImportRequest, current_user: CurrentUser = D
         "duplicates": duplicates,
         "errors": errors,
         "duplicate_codes": duplicate_codes[:50],
-        "types_created": len(set(types_created)),
-        "new_types": list(set(types_created))
+        "types_created": len(types_created),
+        "new_types": types_created
     }
 
 @api_router.post("/items/generate-barcodes")
@@ -3289,6 +3398,7 @@ async def generate_barcodes(data: GenerateBarcodeRequest, current_user: CurrentU
     return {"barcodes": barcodes}
 
 @api_router.get("/items/export-csv")
+@background_job("items.export_csv")
 async def export_items_csv(current_user: CurrentUser = Depends(get_current_user)):
     """Export all items as CSV"""
     items = await db.items.find({**current_user.get_store_filter(), }, {"_id": 0}).to_list(10000)
@@ -3374,24 +3484,27 @@ async def create_tariff(tariff: TariffCreate, current_user: CurrentUser = Depend
             {"$set": tariff.model_dump()}
         )
         updated = await db.tariffs.find_one({**current_user.get_store_filter(), "item_type": tariff.item_type}, {"_id": 0})
+        await store_config.invalidate(current_user.store_id, "tariffs")
         return TariffResponse(**updated)
     
     # Create new tariff with store_id
     tariff_id = str(uuid.uuid4())
     doc = {"id": tariff_id, "store_id": current_user.store_id, **tariff.model_dump()}
     await db.tariffs.insert_one(doc)
+    await store_config.invalidate(current_user.store_id, "tariffs")
     return TariffResponse(**doc)
 
 @api_router.get("/tariffs", response_model=List[TariffResponse])
+@query_budget(2)
 async def get_tariffs(current_user: CurrentUser = Depends(get_current_user)):
-    # Multi-tenant: Filter by store_id
-    tariffs = await db.tariffs.find(current_user.get_store_filter(), {"_id": 0}).to_list(20)
-    return [TariffResponse(**t) for t in tariffs]
+    # Multi-tenant: Filter by store_id (config cache)
+    tariffs = await store_config.tariffs(current_user.store_id)
+    return [TariffResponse(**t) for t in tariffs[:20]]
 
 @api_router.get("/tariffs/{item_type}", response_model=TariffResponse)
 async def get_tariff(item_type: str, current_user: CurrentUser = Depends(get_current_user)):
-    # Multi-tenant: Filter by store_id
-    tariff = await db.tariffs.find_one({**current_user.get_store_filter(), "item_type": item_type}, {"_id": 0})
+    # Multi-tenant: Filter by store_id (config cache)
+    tariff = (await store_config.tariffs_by_type(current_user.store_id)).get(item_type)
     if not tariff:
         raise HTTPException(status_code=404, detail="Tariff not found")
     return TariffResponse(**tariff)
@@ -3403,6 +3516,7 @@ async def delete_tariff(item_type: str, current_user: CurrentUser = Depends(get_
     result = await db.tariffs.delete_one({**current_user.get_store_filter(), "item_type": item_type})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Tariff not found")
+    await store_config.invalidate(current_user.store_id, "tariffs")
     return {"status": "success", "deleted": item_type}
 
 
@@ -3423,6 +3537,7 @@ async def update_tariff(tariff_id: str, tariff: TariffCreate, current_user: Curr
         {"id": tariff_id},
         {"$set": update_data}
     )
+    await store_config.invalidate(current_user.store_id, "tariffs")
     
     # PROPAGATE: Update rental_price in ALL items with this tariff
     # El precio base es day_1 (precio por 1 día)
@@ -3436,13 +3551,44 @@ async def update_tariff(tariff_id: str, tariff: TariffCreate, current_user: Curr
     
     logger.info(f"✅ Tariff '{item_type}' updated. Price €{new_price} propagated to {propagate_result.modified_count} items.")
     
+    # AMORTIZATION: recompute stored amortization of the affected types in background
+    affected_types = list(dict.fromkeys(t for t in (item_type, tariff.item_type) if t))
+    amortization_run_id = await amortization_recompute.schedule(
+        current_user.store_id, affected_types, triggered_by=f"update_tariff:{current_user.username}"
+    )
+    
     # Return updated tariff
     updated = await db.tariffs.find_one({"id": tariff_id}, {"_id": 0})
     return {
         **TariffResponse(**updated).model_dump(),
-        "items_updated": propagate_result.modified_count
+        "items_updated": propagate_result.modified_count,
+        "amortization_run_id": amortization_run_id
     }
 
+@api_router.post("/items/amortization/recompute")
+async def recompute_amortization(
+    item_type: Optional[str] = Query(None, description="Solo este tipo (por defecto: todo el inventario)"),
+    current_user: CurrentUser = Depends(require_admin)
+):
+    """Recalcular en segundo plano la amortización (días de uso x tarifa día 1) del inventario"""
+    run_id = await amortization_recompute.schedule(
+        current_user.store_id, [item_type] if item_type else None, triggered_by=f"manual:{current_user.username}"
+    )
+    return {"run_id": run_id, "status": "queued"}
+
+@api_router.get("/items/amortization/runs")
+async def list_amortization_runs(limit: int = Query(10, ge=1, le=50), current_user: CurrentUser = Depends(require_admin)):
+    """Últimos recálculos de amortización de la tienda"""
+    return await amortization_recompute.recent_runs(current_user.store_id, limit)
+
+@api_router.get("/items/amortization/runs/{run_id}")
+async def get_amortization_run(run_id: str, current_user: CurrentUser = Depends(require_admin)):
+    """Estado y progreso de un recálculo de amortización"""
+    run = await amortization_recompute.get_run(current_user.store_id, run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Recálculo no encontrado")
+    return run
+
 
 # ==================== PACK ROUTES ====================
 
@@ -3527,13 +3673,15 @@ async def create_pack(pack: PackCreate, current_user: CurrentUser = Depends(get_
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.packs.insert_one(doc)
+    await store_config.invalidate(current_user.store_id, "packs")
     return PackResponse(**doc)
 
 @api_router.get("/packs", response_model=List[PackResponse])
+@query_budget(2)
 async def get_packs(current_user: CurrentUser = Depends(get_current_user)):
-    # Multi-tenant: Filter by store_id
-    packs = await db.packs.find(current_user.get_store_filter(), {"_id": 0}).to_list(50)
-    return [PackResponse(**p) for p in packs]
+    # Multi-tenant: Filter by store_id (config cache)
+    packs = await store_config.packs(current_user.store_id)
+    return [PackResponse(**p) for p in packs[:50]]
 
 @api_router.put("/packs/{pack_id}", response_model=PackResponse)
 async def update_pack(pack_id: str, pack: PackCreate, current_user: CurrentUser = Depends(get_current_user)):
@@ -3574,6 +3722,7 @@ async def update_pack(pack_id: str, pack: PackCreate, current_user: CurrentUser
     }
     # Multi-tenant: Update only in own store
     await db.packs.update_one({**store_filter, "id": pack_id}, {"$set": update_doc})
+    await store_config.invalidate(current_user.store_id, "packs")
     
     updated = await db.packs.find_one({**store_filter, "id": pack_id}, {"_id": 0})
     return PackResponse(**updated)
@@ -3584,8 +3733,156 @@ async def delete_pack(pack_id: str, current_user: CurrentUser = Depends(get_curr
     result = await db.packs.delete_one({**current_user.get_store_filter(), "id": pack_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Pack not found")
+    await store_config.invalidate(current_user.store_id, "packs")
     return {"message": "Pack deleted"}
 
+# ==================== PRICING ROUTES ====================
+
+class QuoteLine(BaseModel):
+    item_id: Optional[str] = None
+    barcode: Optional[str] = None
+    item_type: Optional[str] = None  # For lines not yet bound to a physical item
+    quantity: int = 1
+    unit_price: Optional[float] = None  # Manual price override
+    days: Optional[int] = None  # Pack optimizer: rental length of this line
+    person: Optional[str] = None  # Pack optimizer: packs never mix people
+
+class QuoteRequest(BaseModel):
+    items: List[QuoteLine]
+    durations: List[int] = Field(default_factory=lambda: [1])
+    apply_packs: bool = True
+
+async def _resolve_quote_lines(items: List[QuoteLine], current_user: CurrentUser) -> List[dict]:
+    """Pricing input lines: item_type and price data of referenced items, in one query"""
+    if len(items) > 500:
+        raise HTTPException(status_code=400, detail="Máximo 500 líneas por presupuesto")
+    if any(l.quantity < 1 or l.quantity > MAX_LINE_QUANTITY for l in items):
+        raise HTTPException(status_code=400, detail=f"La cantidad de cada línea debe estar entre 1 y {MAX_LINE_QUANTITY}")
+    
+    # Resolve referenced items in one query
+    ids = [l.item_id for l in items if l.item_id]
+    barcodes = [l.barcode for l in items if l.barcode and not l.item_id]
+    items_by_ref = {}
+    if ids or barcodes:
+        docs = await db.items.find(
+            {**current_user.get_store_filter(), "$or": [{"id": {"$in": ids}}, {"barcode": {"$in": barcodes}}]},
+            {"_id": 0, "id": 1, "barcode": 1, "item_type": 1, "is_generic": 1, "rental_price": 1}
+        ).to_list(len(ids) + len(barcodes))
+        for doc in docs:
+            items_by_ref[doc.get("id")] = doc
+            if doc.get("barcode"):
+                items_by_ref[doc["barcode"]] = doc
+    
+    lines = []
+    for line in items:
+        ref = line.item_id or line.barcode
+        doc = items_by_ref.get(ref) if ref else None
+        if ref and not doc:
+            raise HTTPException(status_code=404, detail=f"Artículo no encontrado: {ref}")
+        item_type = (doc or {}).get("item_type") or line.item_type
+        if not item_type:
+            raise HTTPException(status_code=400, detail="Cada línea necesita item_id, barcode o item_type")
+        lines.append({
+            "item_type": item_type,
+            "quantity": line.quantity,
+            "unit_price": line.unit_price,
+            "is_generic": bool((doc or {}).get("is_generic")),
+            "rental_price": (doc or {}).get("rental_price"),
+            "days": line.days,
+            "person": line.person,
+        })
+    
+    return lines
+
+@api_router.post("/pricing/quote")
+@query_budget(4)
+async def quote_cart(request: QuoteRequest, current_user: CurrentUser = Depends(get_current_user)):
+    """
+    Price a whole cart for several rental lengths in one call (live totals at the counter).
+    Uses the store's compiled tariff/pack tables; lines can reference an item (id/barcode)
+    or just an item_type.
+    """
+    if not request.durations or len(request.durations) > 60:
+        raise HTTPException(status_code=400, detail="Indica entre 1 y 60 duraciones")
+    if any(d < 1 or d > 365 for d in request.durations):
+        raise HTTPException(status_code=400, detail="Las duraciones deben estar entre 1 y 365 días")
+    lines = await _resolve_quote_lines(request.items, current_user)
+    compiled = await pricing_engine.compiled(current_user.store_id)
+    return price_cart(compiled, lines, request.durations, apply_packs=request.apply_packs)
+
+OPTIMIZE_TIMEOUT_SECONDS = 10
+
+class PackOptimizeRequest(BaseModel):
+    items: List[QuoteLine]
+    days: int = 1  # Default rental length for lines without days
+
+@api_router.post("/pricing/optimize-packs")
+@query_budget(4)
+async def optimize_cart_packs(request: PackOptimizeRequest, current_user: CurrentUser = Depends(get_current_user)):
+    """
+    Cheapest assignment of a cart (group bookings included) to packs and single tariffs.
+    Packs only combine items of the same person and rental length.
+    """
+    if request.days < 1 or any(l.days is not None and (l.days < 1 or l.days > 365) for l in request.items):
+        raise HTTPException(status_code=400, detail="Las duraciones deben estar entre 1 y 365 días")
+    lines = await _resolve_quote_lines(request.items, current_user)
+    for line in lines:
+        line["days"] = line["days"] or request.days
+    
+    compiled = await pricing_engine.compiled(current_user.store_id)
+    # CPU-bound: off the event loop, with a hard limit
+    try:
+        return await asyncio.wait_for(asyncio.to_thread(optimize_cart, compiled, lines), OPTIMIZE_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="El cálculo de packs ha tardado demasiado; divide el carrito")
+
+class TariffSimulationRequest(BaseModel):
+    start_date: str  # YYYY-MM-DD (rental start)
+    end_date: str
+    tariffs: List[TariffCreate] = []  # Proposed prices; types not listed keep the current tariff
+    packs: Optional[List[PackCreate]] = None  # Proposed pack set (None = current packs)
+    apply_packs: bool = True
+
+@api_router.post("/pricing/simulate")
+@query_budget(4)
+async def simulate_tariffs(request: TariffSimulationRequest, current_user: CurrentUser = Depends(require_admin)):
+    """
+    WHAT-IF: reprice the rentals of a period under proposed tariffs/packs.
+    Read-only: nothing is written to tariffs, packs or items.
+    Returns revenue deltas by item type, rental length and week.
+    """
+    try:
+        datetime.strptime(request.start_date, "%Y-%m-%d")
+        datetime.strptime(request.end_date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Formato de fecha inválido (YYYY-MM-DD)")
+    
+    started = time.perf_counter()
+    lines = await season_cache.get(db, current_user.store_id, current_user.get_store_filter(),
+                                   request.start_date, request.end_date)
+    loaded = time.perf_counter()
+    
+    current = await pricing_engine.compiled(current_user.store_id)
+    current_tariffs = await store_config.tariffs(current_user.store_id)
+    proposed_by_type = {t.get("item_type"): t for t in current_tariffs}
+    for tariff in request.tariffs:
+        proposed_by_type[tariff.item_type] = {
+            **proposed_by_type.get(tariff.item_type, {}),
+            **tariff.model_dump(exclude_none=True)
+        }
+    if request.packs is None:
+        proposed_packs = await store_config.packs(current_user.store_id)
+    else:
+        proposed_packs = [{"id": f"proposed-{i}", **p.model_dump()} for i, p in enumerate(request.packs)]
+    proposed = compile_pricing(list(proposed_by_type.values()), proposed_packs)
+    
+    result = await asyncio.to_thread(simulate, lines, current, proposed, apply_packs=request.apply_packs)
+    result["timing_ms"] = {
+        "load": round((loaded - started) * 1000, 1),
+        "simulate": round((time.perf_counter() - loaded) * 1000, 1),
+    }
+    return result
+
 # ==================== RENTAL ROUTES ====================
 
 def calculate_days(start_date: str, end_date: str) -> int:
@@ -3594,6 +3891,10 @@ def calculate_days(start_date: str, end_date: str) -> int:
     return max(1, (end - start).days + 1)
 
 @api_router.post("/rentals", response_model=RentalResponse)
+@bumps_store_watermark
+@invalidates_rental
+@updates_analytics_cube
+@updates_returns_control
 async def create_rental(rental: RentalCreate, current_user: CurrentUser = Depends(get_current_user)):
     # CRITICAL: Validate active cash session FIRST (if ANY payment is being made)
     total_cash_in = rental.paid_amount + rental.deposit
@@ -3645,7 +3946,7 @@ async def create_rental(rental: RentalCreate, current_user: CurrentUser = Depend
             items_data.append({
                 "item_id": item["id"],
                 "barcode": item.get("barcode", item["id"]),
-                "internal_code": item.get("internal_code", ""),  # Include internal code
+                **line_snapshot(item),  # internal_code, item_type, category
                 "item_type": item.get("item_type", "generic"),
                 "brand": item.get("brand", ""),
                 "model": item.get("model", ""),
@@ -3665,8 +3966,7 @@ async def create_rental(rental: RentalCreate, current_user: CurrentUser = Depend
             items_data.append({
                 "item_id": item["id"],
                 "barcode": item["barcode"],
-                "internal_code": item.get("internal_code", ""),  # Include internal code
-                "item_type": item["item_type"],
+                **line_snapshot(item),  # internal_code, item_type, category
                 "brand": item.get("brand", ""),
                 "model": item.get("model", ""),
                 "size": item.get("size", ""),
@@ -3693,6 +3993,7 @@ async def create_rental(rental: RentalCreate, current_user: CurrentUser = Depend
         "end_date": rental.end_date,
         "days": days,
         "items": items_data,
+        "lines_version": LINES_VERSION,
         "payment_method": rental.payment_method,
         "total_amount": rental.total_amount,
         "paid_amount": rental.paid_amount,
@@ -3703,6 +4004,7 @@ async def create_rental(rental: RentalCreate, current_user: CurrentUser = Depend
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
+    await local_dates.stamp(doc, rental=True)
     await db.rentals.insert_one({**current_user.get_store_filter(), **doc})
     await db.customers.update_one({**current_user.get_store_filter(), "id": rental.customer_id}, {"$inc": {"total_rentals": 1}})
     
@@ -3762,7 +4064,7 @@ async def create_rental(rental: RentalCreate, current_user: CurrentUser = Depend
                 "rental_start_date": rental.start_date,
                 "rental_end_date": rental.end_date
             }
-            await db.cash_movements.insert_one(cash_doc)
+            await insert_cash_movement(cash_doc, current_user.store_id)
         
         # Register deposit separately if > 0
         if rental.deposit > 0:
@@ -3783,7 +4085,7 @@ async def create_rental(rental: RentalCreate, current_user: CurrentUser = Depend
                 "created_at": datetime.now(timezone.utc).isoformat(),
                 "created_by": current_user.username
             }
-            await db.cash_movements.insert_one(deposit_doc)
+            await insert_cash_movement(deposit_doc, current_user.store_id)
         
         # Store operation_number in rental for ticket reference
         await db.rentals.update_one({**current_user.get_store_filter(), "id": rental_id}, {"$set": {"operation_number": operation_number}})
@@ -3794,6 +4096,7 @@ async def create_rental(rental: RentalCreate, current_user: CurrentUser = Depend
     return RentalResponse(**doc)
 
 @api_router.get("/rentals", response_model=List[RentalResponse])
+@query_budget(1)
 async def get_rentals(
     status: Optional[str] = None,
     customer_id: Optional[str] = None,
@@ -3805,51 +4108,38 @@ async def get_rentals(
     if customer_id:
         query["customer_id"] = customer_id
     
+    # Lines carry internal_code / item_type / category (rental_lines snapshot): no items join
     rentals = await db.rentals.find(query, {"_id": 0}).sort("created_at", -1).to_list(200)
     
-    # Enrich items with internal_code from items collection
-    all_barcodes = []
-    for rental in rentals:
-        for item in rental.get("items", []):
-            if item.get("barcode"):
-                all_barcodes.append(item.get("barcode"))
-    
-    items_map = {}
-    if all_barcodes:
-        items_cursor = await db.items.find(
-            {**current_user.get_store_filter(), "barcode": {"$in": all_barcodes}},
-            {"_id": 0, "barcode": 1, "internal_code": 1}
-        ).to_list(10000)
-        for item in items_cursor:
-            items_map[item["barcode"]] = item.get("internal_code", "")
-    
-    # Update items with internal_code
-    for rental in rentals:
-        for item in rental.get("items", []):
-            if item.get("barcode") and item.get("barcode") in items_map:
-                item["internal_code"] = items_map[item["barcode"]]
-    
     return [RentalResponse(**r) for r in rentals]
 
+async def load_rental_view(current_user: CurrentUser, query: dict) -> Optional[dict]:
+    """Rental matching `query` in the user's store (lines carry their item snapshot)"""
+    return await db.rentals.find_one({**current_user.get_store_filter(), **query}, {"_id": 0})
+
+def active_rental_by_code_query(code: str, include_item_id: bool = True) -> dict:
+    """Active/partial rental containing an item code (case-insensitive barcode / internal_code)"""
+    pattern = f"^{re.escape(code)}$"
+    matches = [
+        {"items.barcode": {"$regex": pattern, "$options": "i"}},
+        {"items.internal_code": {"$regex": pattern, "$options": "i"}}
+    ]
+    if include_item_id:
+        matches.append({"items.item_id": code})
+    return {"status": {"$in": ["active", "partial"]}, "$or": matches}
+
 @api_router.get("/rentals/{rental_id}", response_model=RentalResponse)
+@query_budget(3)  # rental, archive tier if only there, cache version (once a second)
 async def get_rental(rental_id: str, current_user: CurrentUser = Depends(get_current_user)):
-    rental = await db.rentals.find_one({**current_user.get_store_filter(), **{"id": rental_id}}, {"_id": 0})
+    # Counter view: rental view cache (invalidated by every rental write endpoint)
+    async def load():
+        return await load_rental_view(current_user, {"id": rental_id}) or await archive_tier.find_one(
+            "rentals", current_user.get_store_filter(), {"id": rental_id}, {"_id": 0}
+        )
+    rental = await rental_cache.get(current_user.store_id, rental_id, load)
     if not rental:
         raise HTTPException(status_code=404, detail="Rental not found")
     
-    # Enrich items with internal_code from items collection
-    barcodes = [item.get("barcode") for item in rental.get("items", []) if item.get("barcode")]
-    if barcodes:
-        items_cursor = await db.items.find(
-            {**current_user.get_store_filter(), "barcode": {"$in": barcodes}},
-            {"_id": 0, "barcode": 1, "internal_code": 1}
-        ).to_list(1000)
-        items_map = {item["barcode"]: item.get("internal_code", "") for item in items_cursor}
-        
-        for item in rental.get("items", []):
-            if item.get("barcode") and item["barcode"] in items_map:
-                item["internal_code"] = items_map[item["barcode"]]
-    
     return RentalResponse(**rental)
 
 @api_router.get("/rentals/barcode/{barcode}")
@@ -3859,144 +4149,65 @@ async def get_rental_by_barcode(barcode: str, current_user: CurrentUser = Depend
     This enables scanner-friendly workflow with any type of code.
     """
     code = barcode.strip()
-    code_upper = code.upper()
     
     # Search by barcode OR internal_code OR item_id (case-insensitive for codes)
-    rental = await db.rentals.find_one(
-        {
-            "status": {"$in": ["active", "partial"]},
-            "$or": [
-                {"items.barcode": {"$regex": f"^{code}$", "$options": "i"}},
-                {"items.internal_code": {"$regex": f"^{code}$", "$options": "i"}},
-                {"items.item_id": code}
-            ]
-        },
-        {"_id": 0}
+    # Scanner lookups hit the code map of the rental view cache first
+    rental = await rental_cache.get_active_by_code(
+        current_user.store_id, code, lambda: load_rental_view(current_user, active_rental_by_code_query(code))
     )
     if not rental:
         raise HTTPException(status_code=404, detail="No active rental found for this item")
     
-    # Enrich items with internal_code from items collection
-    barcodes = [item.get("barcode") for item in rental.get("items", []) if item.get("barcode")]
-    if barcodes:
-        items_cursor = await db.items.find(
-            {**current_user.get_store_filter(), "barcode": {"$in": barcodes}},
-            {"_id": 0, "barcode": 1, "internal_code": 1}
-        ).to_list(1000)
-        items_map = {item["barcode"]: item.get("internal_code", "") for item in items_cursor}
-        
-        for item in rental.get("items", []):
-            if item.get("barcode") and item["barcode"] in items_map:
-                item["internal_code"] = items_map[item["barcode"]]
-    
     return RentalResponse(**rental)
 
 @api_router.get("/rentals/pending/returns")
+@query_budget(3)
 async def get_pending_returns(current_user: CurrentUser = Depends(get_current_user)):
     """Get all rentals with pending returns, grouped by date
-    Multi-tenant: Filters by store_id
+    Multi-tenant: Filters by store_id. "Today" is the store's local day (local_dates.py).
     """
-    today = datetime.now(timezone.utc).date().isoformat()
-    
-    # Get all active and partial rentals - Multi-tenant: Filter by store
-    rentals = await db.rentals.find(
-        {**current_user.get_store_filter(), "status": {"$in": ["active", "partial"]}},
-        {"_id": 0}
-    ).sort("end_date", 1).to_list(200)
-    
-    # Get item details for item_type AND internal_code
-    all_item_ids = []
-    all_barcodes = []
-    for rental in rentals:
-        for item in rental.get("items", []):
-            all_item_ids.append(item.get("item_id"))
-            all_barcodes.append(item.get("barcode"))
+    today = await local_dates.today(current_user.store_id)
     
-    items_map = {}
-    if all_item_ids or all_barcodes:
-        # Multi-tenant: Filter items by store - get internal_code too
-        items_cursor = await db.items.find(
-            {
-                **current_user.get_store_filter(), 
-                "$or": [
-                    {"id": {"$in": all_item_ids}},
-                    {"barcode": {"$in": all_barcodes}}
-                ]
-            },
-            {"_id": 0, "id": 1, "barcode": 1, "item_type": 1, "internal_code": 1}
-        ).to_list(10000)
-        for item in items_cursor:
-            items_map[item["id"]] = {
-                "item_type": item.get("item_type", "unknown"),
-                "internal_code": item.get("internal_code", "")
-            }
-            # Also map by barcode
-            if item.get("barcode"):
-                items_map[item["barcode"]] = {
-                    "item_type": item.get("item_type", "unknown"),
-                    "internal_code": item.get("internal_code", "")
-                }
+    # All due dates in one aggregation (no row cap); paginated variant: /rentals/pending/returns/by-day
+    page = await pending_returns_page(db, current_user.get_store_filter(), today, page_days=None)
     
     today_returns = []
     other_returns = []
-    
-    for rental in rentals:
-        end_date = rental["end_date"].split("T")[0]  # Get just the date part
-        pending_items = []
-        for i in rental["items"]:
-            if not i.get("returned", False):
-                # Get item info from map by item_id or barcode
-                item_info = items_map.get(i.get("item_id")) or items_map.get(i.get("barcode")) or {"item_type": "unknown", "internal_code": ""}
-                item_with_type = {
-                    **i, 
-                    "item_type": item_info.get("item_type", i.get("item_type", "unknown")),
-                    "internal_code": item_info.get("internal_code", i.get("internal_code", ""))
-                }
-                pending_items.append(item_with_type)
-        
-        if not pending_items:
-            continue
-        
-        # Get all item types in this rental
-        rental_item_types = list(set(p.get("item_type") for p in pending_items))
-            
-        rental_info = {
-            "id": rental["id"],
-            "customer_name": rental["customer_name"],
-            "customer_dni": rental["customer_dni"],
-            "customer_phone": rental.get("customer_phone", ""),
-            "customer_email": rental.get("customer_email", ""),
-            "customer_hotel": rental.get("customer_hotel", "") or rental.get("hotel", ""),
-            "customer_id": rental.get("customer_id", ""),
-            "end_date": end_date,
-            "start_date": rental.get("start_date", ""),
-            "days": rental.get("days", 1),
-            "total_amount": rental.get("total_amount", 0),
-            "pending_items": pending_items,
-            "pending_amount": rental["pending_amount"],
-            "days_overdue": 0,
-            "items": [{"item_type": t} for t in rental_item_types]  # For filtering
-        }
-        
-        # Calculate overdue days
-        end_dt = datetime.fromisoformat(end_date)
-        today_dt = datetime.fromisoformat(today)
-        days_diff = (today_dt - end_dt).days
-        
-        if days_diff > 0:
-            rental_info["days_overdue"] = days_diff
-        
-        if end_date == today:
-            today_returns.append(rental_info)
+    for day in page["days"]:
+        if day["is_today"]:
+            today_returns.extend(day["rentals"])
         else:
-            other_returns.append(rental_info)
+            other_returns.extend(day["rentals"])
     
     return {
         "today": today_returns,
         "other_days": other_returns
     }
 
+@api_router.get("/rentals/pending/returns/by-day")
+@query_budget(4)
+async def get_pending_returns_by_day(
+    after: Optional[str] = Query(None, description="Primera fecha de vencimiento (YYYY-MM-DD); next_cursor de la página anterior"),
+    days: int = Query(7, ge=1, le=MAX_PAGE_DAYS),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    """
+    Pending returns grouped by due date, paginated by due date ("today" in the store's timezone).
+    Each day carries its rentals (pending lines only), rental/item counts and counts per item type.
+    """
+    if after:
+        try:
+            datetime.strptime(after, "%Y-%m-%d")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Formato de fecha inválido. Use YYYY-MM-DD")
+    today = await local_dates.today(current_user.store_id)
+    return await pending_returns_page(db, current_user.get_store_filter(), today, after=after, page_days=days)
+
 @api_router.post("/rentals/{rental_id}/return")
+@bumps_store_watermark
+@invalidates_rental
+@updates_analytics_cube
+@updates_returns_control
 async def process_return(rental_id: str, return_input: ReturnInput, current_user: CurrentUser = Depends(get_current_user)):
     rental = await db.rentals.find_one({**current_user.get_store_filter(), **{"id": rental_id}}, {"_id": 0})
     if not rental:
@@ -4006,6 +4217,7 @@ async def process_return(rental_id: str, return_input: ReturnInput, current_user
     pending_items = []
     days = rental["days"]
     quantities_map = return_input.quantities or {}
+    pricing = None  # compiled tariff tables, loaded lazily
     
     for item in rental["items"]:
         if item["barcode"] in return_input.barcodes:
@@ -4059,10 +4271,11 @@ async def process_return(rental_id: str, return_input: ReturnInput, current_user
                 )
                 # Update amortization for regular items
                 if item_doc:
-                    # Get tariff (within same store)
-                    tariff = await db.tariffs.find_one({**current_user.get_store_filter(), "item_type": item_doc.get("item_type")})
-                    if tariff:
-                        daily_rate = tariff.get("day_1") or tariff.get("days_1") or 0
+                    # Daily rate from the compiled pricing tables, loaded once per return
+                    if pricing is None:
+                        pricing = await pricing_engine.compiled(current_user.store_id)
+                    if pricing.has_tariff(item_doc.get("item_type")):
+                        daily_rate = pricing.daily_rate(item_doc.get("item_type"))
                         if daily_rate:
                             days_used = item_doc.get("days_used", 0) or 0
                             amortization = days_used * daily_rate
@@ -4123,7 +4336,7 @@ async def process_return(rental_id: str, return_input: ReturnInput, current_user
                 "created_at": datetime.now(timezone.utc).isoformat(),
                 "created_by": current_user.username
             }
-            await db.cash_movements.insert_one(cash_doc)
+            await insert_cash_movement(cash_doc, current_user.store_id)
             deposit_returned = True
             update_fields["deposit_status"] = "returned"
             update_fields["deposit_returned_at"] = datetime.now(timezone.utc).isoformat()
@@ -4148,7 +4361,7 @@ async def process_return(rental_id: str, return_input: ReturnInput, current_user
                 "created_at": datetime.now(timezone.utc).isoformat(),
                 "created_by": current_user.username
             }
-            await db.cash_movements.insert_one(cash_doc)
+            await insert_cash_movement(cash_doc, current_user.store_id)
             deposit_forfeited = True
             update_fields["deposit_status"] = "forfeited"
             update_fields["deposit_forfeited_at"] = datetime.now(timezone.utc).isoformat()
@@ -4174,6 +4387,10 @@ async def process_return(rental_id: str, return_input: ReturnInput, current_user
 
 # =================== ADD ITEMS TO EXISTING RENTAL ====================
 @api_router.post("/rentals/{rental_id}/add-items")
+@bumps_store_watermark
+@invalidates_rental
+@updates_analytics_cube
+@updates_returns_control
 async def add_items_to_rental(
     rental_id: str, 
     add_items_input: AddItemsToRentalInput, 
@@ -4241,9 +4458,10 @@ async def add_items_to_rental(
         
         # Agregar al array de items del rental
         new_item_entry = {
+            "item_id": item.get("id"),
             "barcode": item_input.barcode,
+            **line_snapshot(item),  # internal_code, item_type, category
             "name": item.get("name", "Artículo"),
-            "item_type": item.get("item_type", ""),
             "size": item.get("size", ""),
             "person_name": item_input.person_name or "",
             "unit_price": item_price,
@@ -4311,7 +4529,7 @@ async def add_items_to_rental(
             "created_at": datetime.now(timezone.utc).isoformat(),
             "created_by": current_user.username
         }
-        await db.cash_movements.insert_one(cash_doc)
+        await insert_cash_movement(cash_doc, current_user.store_id)
         
         # Actualizar paid_amount del rental
         await db.rentals.update_one(
@@ -4342,6 +4560,9 @@ class PaymentRequest(BaseModel):
     payment_method: str = "cash"
 
 @api_router.post("/rentals/{rental_id}/payment")
+@bumps_store_watermark
+@invalidates_rental
+@updates_analytics_cube
 async def process_payment(rental_id: str, payment: PaymentRequest, current_user: CurrentUser = Depends(get_current_user)):
     """
     Procesar un pago adicional para un alquiler existente.
@@ -4398,7 +4619,7 @@ async def process_payment(rental_id: str, payment: PaymentRequest, current_user:
         "created_at": datetime.now(timezone.utc).isoformat(),
         "created_by": current_user.username
     }
-    await db.cash_movements.insert_one(cash_doc)
+    await insert_cash_movement(cash_doc, current_user.store_id)
     
     return {
         "message": "Payment processed",
@@ -4417,6 +4638,10 @@ class CentralSwapRequest(BaseModel):
     delta_amount: float = 0
 
 @api_router.post("/rentals/{rental_id}/central-swap")
+@bumps_store_watermark
+@invalidates_rental
+@updates_analytics_cube
+@updates_returns_control
 async def central_swap_item(rental_id: str, data: CentralSwapRequest, current_user: CurrentUser = Depends(get_current_user)):
     """
     CENTRALIZED SWAP: Intelligent item replacement with automatic detection.
@@ -4514,8 +4739,7 @@ async def central_swap_item(rental_id: str, data: CentralSwapRequest, current_us
     new_item_entry = {
         "item_id": new_item["id"],
         "barcode": new_item.get("barcode", ""),
-        "internal_code": new_item.get("internal_code", ""),
-        "item_type": new_item.get("item_type", ""),
+        **line_snapshot(new_item),  # internal_code, item_type, category
         "brand": new_item.get("brand", ""),
         "model": new_item.get("model", ""),
         "size": new_item.get("size", ""),
@@ -4608,7 +4832,7 @@ async def central_swap_item(rental_id: str, data: CentralSwapRequest, current_us
                 "created_by": current_user.username,
                 "operation_number": operation_number
             }
-            await db.cash_movements.insert_one(cash_doc)
+            await insert_cash_movement(cash_doc, current_user.store_id)
             
             # If upgrade was paid, update pending
             if data.delta_amount > 0:
@@ -4653,6 +4877,10 @@ class ModifyDurationRequest(BaseModel):
     defer_refund: Optional[bool] = True  # Por defecto, el reembolso se difiere a la devolución
 
 @api_router.patch("/rentals/{rental_id}/modify-duration")
+@bumps_store_watermark
+@invalidates_rental
+@updates_analytics_cube
+@updates_returns_control
 async def modify_rental_duration(rental_id: str, data: ModifyDurationRequest, current_user: CurrentUser = Depends(get_current_user)):
     """
     Modify rental duration with support for deferred refunds (days to discount).
@@ -4711,6 +4939,7 @@ async def modify_rental_duration(rental_id: str, data: ModifyDurationRequest, cu
     update_fields = {
         "days": data.new_days,
         "end_date": new_end_date.isoformat(),
+        "end_local_date": new_end_date.strftime("%Y-%m-%d"),
         "total_amount": data.new_total,
         "pending_amount": max(0, new_pending)
     }
@@ -4798,7 +5027,7 @@ async def modify_rental_duration(rental_id: str, data: ModifyDurationRequest, cu
             "created_by": current_user.username,
             "created_at": datetime.now(timezone.utc).isoformat()
         }
-        await db.cash_movements.insert_one(cash_doc)
+        await insert_cash_movement(cash_doc, current_user.store_id)
     
     updated = await db.rentals.find_one({**current_user.get_store_filter(), **{"id": rental_id}}, {"_id": 0})
     
@@ -4818,6 +5047,10 @@ async def modify_rental_duration(rental_id: str, data: ModifyDurationRequest, cu
     }
 
 @api_router.patch("/rentals/{rental_id}/days")
+@bumps_store_watermark
+@invalidates_rental
+@updates_analytics_cube
+@updates_returns_control
 async def update_rental_days(rental_id: str, update_data: UpdateRentalDaysRequest, current_user: CurrentUser = Depends(get_current_user)):
     rental = await db.rentals.find_one({**current_user.get_store_filter(), **{"id": rental_id}})
     if not rental:
@@ -4842,6 +5075,7 @@ async def update_rental_days(rental_id: str, update_data: UpdateRentalDaysReques
             "$set": {
                 "days": update_data.days,
                 "end_date": new_end_date.isoformat(),
+                "end_local_date": new_end_date.strftime("%Y-%m-%d"),
                 "total_amount": update_data.new_total,
                 "pending_amount": new_pending
             }
@@ -4881,7 +5115,7 @@ async def update_rental_days(rental_id: str, update_data: UpdateRentalDaysReques
             "created_by": current_user.username,
             "created_at": datetime.now(timezone.utc).isoformat()
         }
-        await db.cash_movements.insert_one(cash_doc)
+        await insert_cash_movement(cash_doc, current_user.store_id)
     
     updated = await db.rentals.find_one({**current_user.get_store_filter(), **{"id": rental_id}}, {"_id": 0})
     return RentalResponse(**updated)
@@ -4909,6 +5143,9 @@ def is_unpaid_method(method: str) -> bool:
     return method in UNPAID_METHODS
 
 @api_router.patch("/rentals/{rental_id}/payment-method")
+@bumps_store_watermark
+@invalidates_rental
+@updates_analytics_cube
 async def update_rental_payment_method(
     rental_id: str, 
     data: UpdatePaymentMethodRequest, 
@@ -4970,7 +5207,7 @@ async def update_rental_payment_method(
         reconciliation_action = "moved_between_registers"
         
         # Remove from old cash register
-        await db.cash_movements.insert_one({"store_id": current_user.store_id, 
+        await insert_cash_movement({"store_id": current_user.store_id, 
             "id": str(uuid.uuid4()),
             "session_id": session_id,  # CRITICAL: Link to cash session
             "date": datetime.now(timezone.utc).isoformat(),
@@ -4985,10 +5222,10 @@ async def update_rental_payment_method(
             "created_by": current_user.username,  # Required field
             "user": current_user.username,
             "created_at": datetime.now(timezone.utc).isoformat()
-        })
+        }, current_user.store_id)
         
         # Add to new cash register
-        await db.cash_movements.insert_one({"store_id": current_user.store_id, 
+        await insert_cash_movement({"store_id": current_user.store_id, 
             "id": str(uuid.uuid4()),
             "session_id": session_id,  # CRITICAL: Link to cash session
             "date": datetime.now(timezone.utc).isoformat(),
@@ -5003,14 +5240,14 @@ async def update_rental_payment_method(
             "created_by": current_user.username,  # Required field
             "user": current_user.username,
             "created_at": datetime.now(timezone.utc).isoformat()
-        })
+        }, current_user.store_id)
     
     # ========== CASE 2: Income -> Debt (Remove from cash - it was an error) ==========
     elif old_is_paid and new_is_unpaid:
         reconciliation_action = "removed_from_cash"
         
         # Remove from cash register (negative adjustment)
-        await db.cash_movements.insert_one({"store_id": current_user.store_id, 
+        await insert_cash_movement({"store_id": current_user.store_id, 
             "id": str(uuid.uuid4()),
             "session_id": session_id,  # CRITICAL: Link to cash session
             "date": datetime.now(timezone.utc).isoformat(),
@@ -5025,7 +5262,7 @@ async def update_rental_payment_method(
             "created_by": current_user.username,  # Required field
             "user": current_user.username,
             "created_at": datetime.now(timezone.utc).isoformat()
-        })
+        }, current_user.store_id)
         
         # Update rental to unpaid status
         await db.rentals.update_one(
@@ -5038,7 +5275,7 @@ async def update_rental_payment_method(
         reconciliation_action = "added_to_cash"
         
         # Add to cash register
-        await db.cash_movements.insert_one({"store_id": current_user.store_id, 
+        await insert_cash_movement({"store_id": current_user.store_id, 
             "id": str(uuid.uuid4()),
             "session_id": session_id,  # CRITICAL: Link to cash session
             "date": datetime.now(timezone.utc).isoformat(),
@@ -5053,7 +5290,7 @@ async def update_rental_payment_method(
             "created_by": current_user.username,  # Required field
             "user": current_user.username,
             "created_at": datetime.now(timezone.utc).isoformat()
-        })
+        }, current_user.store_id)
         
         # Update rental to paid status
         await db.rentals.update_one(
@@ -5089,6 +5326,9 @@ class RefundRequest(BaseModel):
     reason: str = ""
 
 @api_router.post("/rentals/{rental_id}/refund")
+@bumps_store_watermark
+@invalidates_rental
+@updates_analytics_cube
 async def process_refund(rental_id: str, refund: RefundRequest, current_user: CurrentUser = Depends(get_current_user)):
     """
     Process a partial refund for unused days.
@@ -5132,6 +5372,7 @@ async def process_refund(rental_id: str, refund: RefundRequest, current_user: Cu
             "$set": {
                 "days": new_days,
                 "end_date": new_end_date.isoformat(),
+                "end_local_date": new_end_date.strftime("%Y-%m-%d"),
                 "total_amount": new_total,
                 "paid_amount": new_paid,
                 "pending_amount": max(0, new_pending)
@@ -5167,7 +5408,7 @@ async def process_refund(rental_id: str, refund: RefundRequest, current_user: Cu
         "created_at": datetime.now(timezone.utc).isoformat(),
         "created_by": current_user.username
     }
-    await db.cash_movements.insert_one(refund_doc)
+    await insert_cash_movement(refund_doc, current_user.store_id)
     
     updated_rental = await db.rentals.find_one({**current_user.get_store_filter(), **{"id": rental_id}}, {"_id": 0})
     
@@ -5182,6 +5423,10 @@ async def process_refund(rental_id: str, refund: RefundRequest, current_user: Cu
     }
 
 @api_router.post("/rentals/{rental_id}/quick-return")
+@bumps_store_watermark
+@invalidates_rental
+@updates_analytics_cube
+@updates_returns_control
 async def quick_return(rental_id: str, current_user: CurrentUser = Depends(get_current_user)):
     """
     Quick return: Mark ALL items as returned with one click
@@ -5237,9 +5482,75 @@ async def quick_return(rental_id: str, current_user: CurrentUser = Depends(get_c
     
     return {"message": "Quick return successful", "items_returned": len(rental["items"])}
 
+# ==================== BACKGROUND JOBS ====================
+
+@api_router.get("/jobs")
+async def list_jobs(
+    status: Optional[str] = Query(None, regex="^(queued|running|done|failed|cancelled)$"),
+    limit: int = Query(50, ge=1, le=200),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    """
+    Trabajos en segundo plano de la tienda, más recientes primero: los propios y los que
+    no requieren un rol superior al del usuario
+    """
+    return await job_queue.list(current_user, status, limit)
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str, current_user: CurrentUser = Depends(get_current_user)):
+    """
+    Estado de un trabajo lanzado con ?async=true: status (queued, running, done, failed, cancelled),
+    progress {done, total}, result o file (descargar en /jobs/{id}/download), error y attempts.
+    """
+    job = await job_queue.get(current_user, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job
+
+@api_router.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str, current_user: CurrentUser = Depends(get_current_user)):
+    """
+    Cancela un trabajo pendiente o en curso (el trabajo en curso se detiene en segundos).
+    Los trabajos de otros usuarios solo los gestiona un administrador.
+    """
+    job = await job_queue.cancel(current_user, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job
+
+@api_router.post("/jobs/{job_id}/retry")
+async def retry_job(job_id: str, current_user: CurrentUser = Depends(get_current_user)):
+    """
+    Vuelve a encolar un trabajo fallido o cancelado (se ejecuta como quien lo lanzó).
+    Los trabajos de otros usuarios solo los gestiona un administrador.
+    """
+    job = await job_queue.retry(current_user, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    if job["status"] != "queued":
+        raise HTTPException(status_code=409, detail=f"Solo se pueden reintentar trabajos fallidos o cancelados (estado: {job['status']})")
+    return job
+
+@api_router.get("/jobs/{job_id}/download")
+async def download_job_file(job_id: str, current_user: CurrentUser = Depends(get_current_user)):
+    """Fichero generado por un trabajo terminado (exportaciones, resultados grandes)"""
+    download = await job_queue.download(current_user, job_id)
+    if not download:
+        raise HTTPException(status_code=404, detail="El trabajo no tiene fichero o no ha terminado")
+    file, chunks = download
+    
+    from fastapi.responses import StreamingResponse
+    return StreamingResponse(
+        chunks,
+        media_type=file["media_type"],
+        headers={"Content-Disposition": f"attachment; filename={file['filename']}"}
+    )
+
 # ==================== ADMIN CLEANUP ROUTES ====================
 
 @api_router.delete("/admin/cleanup-store-data")
+@background_job("admin.cleanup_store_data", max_attempts=1)
+@backs_up_store("cleanup_store_data", ("items", "customers", "packs", "item_type_registry"))
 async def cleanup_store_data(current_user: CurrentUser = Depends(get_current_user)):
     """
     CRITICAL: Delete ALL items, customers, and packs for current store.
@@ -5258,12 +5569,16 @@ async def cleanup_store_data(current_user: CurrentUser = Depends(get_current_use
     
     # Delete all items for this store
     items_result = await db.items.delete_many(store_filter)
+    await item_type_registry.collection.delete_many(store_filter)
     
     # Delete all customers for this store
     customers_result = await db.customers.delete_many(store_filter)
     
     # Delete all packs for this store (cascade: no items → no types → no packs)
     packs_result = await db.packs.delete_many(store_filter)
+    await store_config.invalidate(current_user.store_id, "packs")
+    # Cached rental views carry internal codes of the deleted items
+    await rental_cache.invalidate_store(current_user.store_id)
     
     logger.info(f"✅ CLEANUP COMPLETE: Store {current_user.store_id} - Deleted {items_result.deleted_count} items, {customers_result.deleted_count} customers, {packs_result.deleted_count} packs")
     
@@ -5513,6 +5828,7 @@ class DeliverAndChargeRequest(BaseModel):
     payment_method: str = "cash"
 
 @api_router.post("/external-repairs/{repair_id}/deliver")
+@bumps_store_watermark
 async def deliver_external_repair(
     repair_id: str, 
     delivery: DeliverAndChargeRequest,
@@ -5565,7 +5881,7 @@ async def deliver_external_repair(
             "created_at": now,
             "created_by": current_user.username
         }
-        await db.cash_movements.insert_one(cash_doc)
+        await insert_cash_movement(cash_doc, current_user.store_id)
     
     return {"message": "Repair delivered and charged", "amount": repair["price"], "operation_number": operation_number if repair["price"] > 0 else None}
 
@@ -5624,12 +5940,9 @@ class FinancialCalculatorService:
         Returns:
             dict con totales por método de pago y tipo de movimiento
         """
-        start_dt = f"{start_date}T00:00:00"
-        end_dt = f"{end_date}T23:59:59"
-        
         # Construir filtro base - Multi-tenant: Include store_filter if provided
         match_filter = {
-            "created_at": {"$gte": start_dt, "$lte": end_dt}
+            **day_range_filter(start_date, end_date)
         }
         
         # Multi-tenant: Add store filter if provided
@@ -5664,6 +5977,7 @@ class FinancialCalculatorService:
             }}
         ]
         
+        pipeline = await archive_tier.pipeline("cash_movements", store_filter, start_date, pipeline)
         results = await db.cash_movements.aggregate(pipeline).to_list(200)
         
         # Inicializar estructura de resultados
@@ -5746,7 +6060,8 @@ class FinancialCalculatorService:
         return summary
     
     @staticmethod
-    async def get_reconciliation_data(start_date: str, end_date: str, store_filter: dict = None) -> dict:
+    async def get_reconciliation_data(start_date: str, end_date: str, store_filter: dict = None,
+                                      after: Optional[str] = None, limit: int = 50) -> dict:
         """
         Genera datos de reconciliación para depurar discrepancias.
         Multi-tenant: Acepta store_filter para aislar datos por tienda.
@@ -5754,79 +6069,40 @@ class FinancialCalculatorService:
         Compara:
         1. Lo que dice cash_movements
         2. Lo que dice rentals.paid_amount
-        3. Identifica transacciones huérfanas
+        3. Identifica transacciones huérfanas (merge-join en streaming, reconciliation.py)
+        
+        Los huérfanos se paginan por id de alquiler (after = next_cursor de la página anterior);
+        la primera página incluye los totales de huérfanos de todo el período.
         """
-        start_dt = f"{start_date}T00:00:00"
-        end_dt = f"{end_date}T23:59:59"
+        # 1-2. Totales de cada fuente (una agregación por colección)
+        movements_total, rentals_total = await period_totals(db, store_filter, start_date, end_date)
+        
+        # 3. Huérfanos: alquileres pagados sin movimiento y movimientos sin alquiler
+        page = await orphans_page(db, store_filter, start_date, end_date, after=after, limit=limit)
         
-        # Construir filtro base
-        base_filter = {
-            "created_at": {"$gte": start_dt, "$lte": end_dt}
+        # 4. Calcular diferencias
+        discrepancy = {
+            "cash": movements_total["cash"] - rentals_total["cash"],
+            "card": movements_total["card"] - rentals_total["card"]
         }
         
-        # Multi-tenant: Add store filter if provided
-        if store_filter:
-            base_filter.update(store_filter)
-        
-        # 1. Obtener todos los cash_movements del período
-        movements = await db.cash_movements.find(base_filter, {"_id": 0}).to_list(5000)
-        
-        # 2. Obtener todos los rentals del período
-        rentals = await db.rentals.find(
-            base_filter,
-            {"_id": 0, "id": 1, "paid_amount": 1, "payment_method": 1, "customer_name": 1}
-        ).to_list(5000)
-        
-        # 3. Calcular totales de cada fuente
-        movements_total = {
-            "cash": sum(m["amount"] for m in movements if m.get("payment_method") == "cash" and m.get("movement_type") == "income"),
-            "card": sum(m["amount"] for m in movements if m.get("payment_method") == "card" and m.get("movement_type") == "income")
-        }
-        
-        rentals_total = {
-            "cash": sum(r.get("paid_amount", 0) for r in rentals if r.get("payment_method") == "cash"),
-            "card": sum(r.get("paid_amount", 0) for r in rentals if r.get("payment_method") == "card")
-        }
-        
-        # 4. Identificar discrepancias
-        # Rentals sin movimiento de caja correspondiente
-        rental_ids_with_movement = set(
-            m.get("rental_id") for m in movements 
-            if m.get("rental_id") and m.get("category") == "rental"
-        )
-        orphan_rentals = [
-            {"id": r["id"], "amount": r.get("paid_amount", 0), "customer": r.get("customer_name")}
-            for r in rentals 
-            if r["id"] not in rental_ids_with_movement and r.get("paid_amount", 0) > 0
-        ]
-        
-        # Movimientos sin rental correspondiente
-        rental_ids = set(r["id"] for r in rentals)
-        orphan_movements = [
-            {"id": m.get("id"), "rental_id": m.get("rental_id"), "amount": m.get("amount")}
-            for m in movements 
-            if m.get("rental_id") and m.get("rental_id") not in rental_ids and m.get("category") == "rental"
-        ]
-        
-        # 5. Calcular diferencias
-        discrepancy = {
-            "cash": movements_total["cash"] - rentals_total["cash"],
-            "card": movements_total["card"] - rentals_total["card"]
-        }
-        
-        return {
+        result = {
             "period": {"start": start_date, "end": end_date},
             "cash_movements_totals": movements_total,
             "rentals_totals": rentals_total,
             "discrepancy": discrepancy,
-            "orphan_rentals": orphan_rentals[:50],  # Limitar a 50
-            "orphan_movements": orphan_movements[:50],
+            "orphan_rentals": page["orphan_rentals"],
+            "orphan_movements": page["orphan_movements"],
+            "next_cursor": page["next_cursor"],
             "explanation": {
                 "positive_discrepancy": "cash_movements tiene más → puede incluir ajustes, reparaciones, etc.",
                 "negative_discrepancy": "rentals tiene más → hay alquileres sin registro en caja",
                 "expected": "Normalmente cash_movements >= rentals porque incluye más tipos de transacciones"
             }
         }
+        if not after:
+            result["orphan_totals"] = await orphan_totals(db, store_filter, start_date, end_date)
+        return result
 
 
 # Instancia global del servicio
@@ -5842,7 +6118,7 @@ async def get_daily_report(date: Optional[str] = None, current_user: CurrentUser
     Solo accesible para ADMIN y SUPER_ADMIN.
     """
     if not date:
-        date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        date = await local_dates.today(current_user.store_id)
     
     start = f"{date}T00:00:00"
     end = f"{date}T23:59:59"
@@ -5858,10 +6134,10 @@ async def get_daily_report(date: Optional[str] = None, current_user: CurrentUser
     
     # Para online y other, buscar en cash_movements con payment_method específico
     # Multi-tenant: Filter by store
-    other_methods = await db.cash_movements.aggregate([
+    other_methods = await db.cash_movements.aggregate(await archive_tier.pipeline("cash_movements", current_user.get_store_filter(), date, [
         {"$match": {
             **current_user.get_store_filter(),
-            "created_at": {"$gte": start, "$lte": end},
+            **day_range_filter(date, date),
             "movement_type": "income",
             "payment_method": {"$nin": ["cash", "card"]}
         }},
@@ -5869,7 +6145,7 @@ async def get_daily_report(date: Optional[str] = None, current_user: CurrentUser
             "_id": "$payment_method",
             "total": {"$sum": "$amount"}
         }}
-    ]).to_list(10)
+    ])).to_list(10)
     
     online_revenue = 0
     other_revenue = 0
@@ -5880,39 +6156,23 @@ async def get_daily_report(date: Optional[str] = None, current_user: CurrentUser
             other_revenue += m["total"]
     
     # Get rentals count for the day (operational data, not financial) - Multi-tenant: Filter by store
-    rentals_count = await db.rentals.count_documents({
+    rentals_count = await archive_tier.count("rentals", current_user.get_store_filter(), {
         **current_user.get_store_filter(),
-        "created_at": {"$gte": start, "$lte": end}
-    })
+        **day_range_filter(date, date)
+    }, start_date=date)
     
     # Get returns for the day - Multi-tenant: Filter by store
-    returns_count = await db.rentals.count_documents({
+    returns_count = await archive_tier.count("rentals", current_user.get_store_filter(), {
         **current_user.get_store_filter(),
         "status": "returned",
         "actual_return_date": {"$gte": start, "$lte": end}
-    })
+    }, start_date=date)
     
     # Get active rentals - Multi-tenant: Filter by store
     active_rentals = await db.rentals.count_documents({**current_user.get_store_filter(), "status": {"$in": ["active", "partial"]}})
     
     # Get pending returns - Multi-tenant: Filter by store
-    pending_returns = await db.rentals.find(
-        {**current_user.get_store_filter(), "status": {"$in": ["active", "partial"]}},
-        {"_id": 0}
-    ).to_list(5000)
-    
-    pending_list = []
-    for r in pending_returns:
-        pending_items = [i for i in r.get("items", []) if not i.get("returned", False)]
-        if pending_items:
-            pending_list.append({
-                "rental_id": r["id"],
-                "customer_name": r.get("customer_name", ""),
-                "customer_dni": r.get("customer_dni", ""),
-                "end_date": r.get("end_date", ""),
-                "pending_items": len(pending_items),
-                "pending_amount": r.get("pending_amount", 0)
-            })
+    pending_list = await pending_returns_summary(db, current_user.get_store_filter())
     
     # Calculate inventory usage (percentage of items rented) - Multi-tenant: Filter by store
     total_items = await db.items.count_documents({**current_user.get_store_filter(), "status": {"$nin": ["deleted", "retired"]}})
@@ -5936,6 +6196,7 @@ async def get_daily_report(date: Optional[str] = None, current_user: CurrentUser
     )
 
 @api_router.get("/reports/range", response_model=RangeReportResponse)
+@query_budget(8)  # constant in the number of providers (commissions.py)
 async def get_range_report(
     start_date: str,
     end_date: str,
@@ -5966,10 +6227,10 @@ async def get_range_report(
     card_revenue = financial_summary["by_payment_method"]["card"]["income"]
     
     # Para online y other, buscar en cash_movements - Multi-tenant: Filter by store
-    other_methods = await db.cash_movements.aggregate([
+    other_methods = await db.cash_movements.aggregate(await archive_tier.pipeline("cash_movements", current_user.get_store_filter(), start_date, [
         {"$match": {
             **current_user.get_store_filter(),
-            "created_at": {"$gte": start_dt, "$lte": end_dt},
+            **day_range_filter(start_date, end_date),
             "movement_type": "income",
             "payment_method": {"$nin": ["cash", "card"]}
         }},
@@ -5977,7 +6238,7 @@ async def get_range_report(
             "_id": "$payment_method",
             "total": {"$sum": "$amount"}
         }}
-    ]).to_list(10)
+    ])).to_list(10)
     
     online_revenue = 0
     other_revenue = 0
@@ -5988,75 +6249,47 @@ async def get_range_report(
             other_revenue += m["total"]
     
     # Get rentals count in the range (operational data, not financial) - Multi-tenant: Filter by store
-    rentals = await db.rentals.find({
+    new_rentals = await archive_tier.count("rentals", current_user.get_store_filter(), {
         **current_user.get_store_filter(),
-        "created_at": {"$gte": start_dt, "$lte": end_dt}
-    }, {"_id": 0, "id": 1, "customer_id": 1, "paid_amount": 1}).to_list(5000)
+        **day_range_filter(start_date, end_date)
+    }, start_date=start_date)
     
     # Get returns in the range - Multi-tenant: Filter by store
-    returns_count = await db.rentals.count_documents({
+    returns_count = await archive_tier.count("rentals", current_user.get_store_filter(), {
         **current_user.get_store_filter(),
         "status": "returned",
         "actual_return_date": {"$gte": start_dt, "$lte": end_dt}
-    })
+    }, start_date=start_date)
     
     # Get external repairs revenue (ya está en cash_movements pero también lo mostramos)
     repairs_revenue = financial_summary["by_category"].get("external_repair", {}).get("total", 0)
     
-    # Calculate commissions by provider - Multi-tenant: Filter by store
-    sources = await db.sources.find(current_user.get_store_filter(), {"_id": 0}).to_list(5000)
+    # Calculate commissions by provider - Multi-tenant: Filter by store (config cache)
+    # One aggregation for all providers (commissions.py); customers reference their provider by name
+    sources = [s for s in await store_config.sources(current_user.store_id) if s.get("commission_percent", 0) > 0]
+    by_source = await commissions_by_source(
+        db, current_user.get_store_filter(), [s["name"] for s in sources], start_date, end_date
+    )
     commissions_list = []
     
     for source in sources:
-        if source.get("commission_percent", 0) > 0:
-            # Get customers from this source - Multi-tenant: Filter by store
-            source_customers = await db.customers.find(
-                {**current_user.get_store_filter(), "source_id": source["id"]},
-                {"_id": 0, "id": 1}
-            ).to_list(1000)
-            
-            customer_ids = [c["id"] for c in source_customers]
+        totals = by_source.get(source["name"])
+        revenue_generated = totals["revenue"] if totals else 0
+        
+        if revenue_generated > 0:
+            commission_amount = revenue_generated * (source.get("commission_percent", 0) / 100)
             
-            if customer_ids:
-                # Get rentals from these customers in the date range - Multi-tenant: Filter by store
-                source_rentals = await db.rentals.find({
-                    **current_user.get_store_filter(),
-                    "customer_id": {"$in": customer_ids},
-                    "created_at": {"$gte": start_dt, "$lte": end_dt}
-                }, {"_id": 0, "paid_amount": 1}).to_list(1000)
-                
-                revenue_generated = sum(r.get("paid_amount", 0) for r in source_rentals)
-                
-                if revenue_generated > 0:
-                    commission_amount = revenue_generated * (source.get("commission_percent", 0) / 100)
-                    
-                    commissions_list.append(CommissionSummary(
-                        provider_name=source["name"],
-                        provider_id=source["id"],
-                        commission_percent=source.get("commission_percent", 0),
-                        customer_count=len(customer_ids),
-                        revenue_generated=revenue_generated,
-                        commission_amount=commission_amount
-                    ))
+            commissions_list.append(CommissionSummary(
+                provider_name=source["name"],
+                provider_id=source["id"],
+                commission_percent=source.get("commission_percent", 0),
+                customer_count=totals["customers"],
+                revenue_generated=revenue_generated,
+                commission_amount=commission_amount
+            ))
     
     # Get pending returns (all active/partial rentals) - Multi-tenant: Filter by store
-    pending_returns = await db.rentals.find(
-        {**current_user.get_store_filter(), "status": {"$in": ["active", "partial"]}},
-        {"_id": 0}
-    ).to_list(200)
-    
-    pending_list = []
-    for r in pending_returns:
-        pending_items = [i for i in r.get("items", []) if not i.get("returned", False)]
-        if pending_items:
-            pending_list.append({
-                "rental_id": r["id"],
-                "customer_name": r.get("customer_name", ""),
-                "customer_dni": r.get("customer_dni", ""),
-                "end_date": r.get("end_date", ""),
-                "pending_items": len(pending_items),
-                "pending_amount": r.get("pending_amount", 0)
-            })
+    pending_list = await pending_returns_summary(db, current_user.get_store_filter())
     
     total_revenue = cash_revenue + card_revenue + online_revenue + other_revenue + repairs_revenue
     
@@ -6069,7 +6302,7 @@ async def get_range_report(
         online_revenue=online_revenue,
         other_revenue=other_revenue,
         repairs_revenue=repairs_revenue,
-        new_rentals=len(rentals),
+        new_rentals=new_rentals,
         returns=returns_count,
         pending_returns=pending_list,
         commissions=commissions_list
@@ -6079,6 +6312,8 @@ async def get_range_report(
 async def get_reconciliation_report(
     start_date: str,
     end_date: str,
+    after: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=RECONCILIATION_MAX_PAGE_SIZE),
     current_user: CurrentUser = Depends(require_admin)
 ):
     """
@@ -6088,12 +6323,71 @@ async def get_reconciliation_report(
     Compara:
     1. Totales de cash_movements (fuente de verdad)
     2. Totales de rentals.paid_amount (referencia)
-    3. Identifica transacciones huérfanas en ambas direcciones
+    3. Identifica transacciones huérfanas en ambas direcciones (paginadas: after=next_cursor)
     
     Uso: Cuando los totales de Caja no coinciden con los de Reportes
     """
     return await financial_service.get_reconciliation_data(
-        start_date, end_date, store_filter=current_user.get_store_filter()
+        start_date, end_date, store_filter=current_user.get_store_filter(), after=after, limit=limit
+    )
+
+@api_router.get("/reports/reconciliation/orphans.csv")
+@background_job("reconciliation.orphans_csv")
+async def export_reconciliation_orphans_csv(
+    start_date: str,
+    end_date: str,
+    current_user: CurrentUser = Depends(require_admin)
+):
+    """Todos los huérfanos del período en CSV (generado en streaming, sin límite de filas)"""
+    store_filter = current_user.get_store_filter()
+    
+    async def rows():
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=RECONCILIATION_CSV_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        async for row in iter_orphans(db, store_filter, start_date, end_date):
+            writer.writerow(row)
+            if output.tell() > 64 * 1024:
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+        yield output.getvalue()
+    
+    from fastapi.responses import StreamingResponse
+    return StreamingResponse(
+        rows(),
+        media_type="text/csv",
+        headers={"Content-Disposition": f"attachment; filename=reconciliacion_{start_date}_{end_date}.csv"}
+    )
+
+@api_router.get("/exports/columnar")
+@background_job("exports.columnar")
+async def export_columnar(
+    dataset: str = Query(..., regex="^(rental_lines|cash_movements|cash_closings)$"),
+    format: str = Query("parquet", regex="^(parquet|arrow)$"),
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    current_user: CurrentUser = Depends(require_admin)
+):
+    """
+    Exportación columnar para BI (Parquet o Arrow IPC stream), generada en streaming.
+    dataset: rental_lines (una fila por línea de alquiler), cash_movements o cash_closings.
+    Columnas tipadas y categóricas con diccionario (columnar_export.py).
+    """
+    for value in (date_from, date_to):
+        if value:
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Formato de fecha inválido (YYYY-MM-DD)")
+    media_type, extension = COLUMNAR_FORMATS[format]
+    period = f"_{date_from or 'inicio'}_{date_to or 'hoy'}"
+    
+    from fastapi.responses import StreamingResponse
+    return StreamingResponse(
+        columnar_export_stream(db, current_user.get_store_filter(), dataset, format, date_from, date_to),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={dataset}_{current_user.store_id}{period}.{extension}"}
     )
 
 @api_router.get("/reports/financial-summary")
@@ -6138,32 +6432,45 @@ async def get_stats(current_user: CurrentUser = Depends(get_current_user)):
     - occupancy_percent: Calculated over rentable inventory (excludes retired/lost/deleted)
     
     TIMEZONE: Uses Europe/Madrid for consistent date comparison
+    CACHE: Polled by every terminal - single-flight + short TTL per store (response_cache.py)
     """
-    import pytz
-    
-    # Use Europe/Madrid timezone for consistent date handling
-    madrid_tz = pytz.timezone('Europe/Madrid')
-    today = datetime.now(madrid_tz).strftime("%Y-%m-%d")
-    start = f"{today}T00:00:00"
-    end = f"{today}T23:59:59"
-    
-    # Today's rentals count (new contracts) - Multi-tenant: Filter by store
-    today_rentals = await db.rentals.count_documents({
-        **current_user.get_store_filter(),
-        "created_at": {"$gte": start, "$lte": end}
-    })
+    return await response_cache.get_or_compute(
+        "reports.stats", current_user.store_id, (), lambda: _compute_stats(current_user)
+    )
+
+
+async def _compute_stats(current_user: CurrentUser):
+    # Store timezone for consistent date handling (local_date keys)
+    today = await local_dates.today(current_user.store_id)
+    store_filter = current_user.get_store_filter()
     
-    # ========== UNIFIED REVENUE CALCULATION (Single Source of Truth) ==========
-    # Revenue today = Sum of all cash movements from today's active session
-    # This includes: new rentals + adjustments (extensions/reductions) - refunds
+    # EXCLUDE unpaid methods: pending
+    UNPAID_METHODS = ["pending"]
     
-    active_session = await db.cash_sessions.find_one({**current_user.get_store_filter(), **{"date": today, "status": "open"}})
+    async def count_today_rentals():
+        # Today's rentals count (new contracts) - Multi-tenant: Filter by store
+        return await db.rentals.count_documents({
+            **store_filter,
+            **day_range_filter(today, today)
+        })
     
-    if active_session:
-        # Use MongoDB aggregation to calculate total revenue from cash movements
-        # EXCLUDE unpaid methods: pending
-        UNPAID_METHODS = ["pending"]
+    async def revenue_today():
+        # ========== UNIFIED REVENUE CALCULATION (Single Source of Truth) ==========
+        # Revenue today = Sum of all cash movements from today's active session
+        # This includes: new rentals + adjustments (extensions/reductions) - refunds
+        active_session = await db.cash_sessions.find_one({**store_filter, **{"date": today, "status": "open"}})
+        
+        if not active_session:
+            # No active session - fallback to rentals created today
+            # Also exclude unpaid methods here - Multi-tenant: Filter by store
+            rentals = await db.rentals.find({
+                **store_filter,
+                **day_range_filter(today, today),
+                "payment_method": {"$nin": UNPAID_METHODS}
+            }, {"_id": 0, "paid_amount": 1}).to_list(10000)
+            return sum(r.get("paid_amount", 0) for r in rentals), 0
         
+        # Use MongoDB aggregation to calculate total revenue from cash movements
         revenue_pipeline = [
             {"$match": {
                 "session_id": active_session["id"],
@@ -6174,7 +6481,15 @@ async def get_stats(current_user: CurrentUser = Depends(get_current_user)):
                 "total": {"$sum": "$amount"}
             }}
         ]
-        revenue_results = await db.cash_movements.aggregate(revenue_pipeline).to_list(10)
+        # Calculate UNPAID amount separately for display - Multi-tenant: Filter by store
+        revenue_results, unpaid_rentals = await asyncio.gather(
+            db.cash_movements.aggregate(revenue_pipeline).to_list(10),
+            db.rentals.find({
+                **store_filter,
+                **day_range_filter(today, today),
+                "payment_method": {"$in": UNPAID_METHODS}
+            }, {"_id": 0, "total_amount": 1}).to_list(1000)
+        )
         
         total_income = 0
         total_refunds = 0
@@ -6186,26 +6501,8 @@ async def get_stats(current_user: CurrentUser = Depends(get_current_user)):
                 total_refunds = r["total"]
         
         # Net revenue = income - refunds (same formula as cash register balance)
-        today_revenue = total_income - total_refunds
-        
-        # Calculate UNPAID amount separately for display - Multi-tenant: Filter by store
-        unpaid_rentals = await db.rentals.find({
-            **current_user.get_store_filter(),
-            "created_at": {"$gte": start, "$lte": end},
-            "payment_method": {"$in": UNPAID_METHODS}
-        }, {"_id": 0, "total_amount": 1}).to_list(1000)
         unpaid_amount = sum(r.get("total_amount", 0) for r in unpaid_rentals)
-    else:
-        # No active session - fallback to rentals created today
-        # Also exclude unpaid methods here - Multi-tenant: Filter by store
-        UNPAID_METHODS = ["pending"]
-        rentals = await db.rentals.find({
-            **current_user.get_store_filter(),
-            "created_at": {"$gte": start, "$lte": end},
-            "payment_method": {"$nin": UNPAID_METHODS}
-        }, {"_id": 0, "paid_amount": 1}).to_list(10000)
-        today_revenue = sum(r.get("paid_amount", 0) for r in rentals)
-        unpaid_amount = 0
+        return total_income - total_refunds, unpaid_amount
     
     # ========== PENDING RETURNS (HOY + ATRASADAS) ==========
     # NEW LOGIC: Count ALL pending returns (today + overdue)
@@ -6217,27 +6514,15 @@ async def get_stats(current_user: CurrentUser = Depends(get_current_user)):
     # Multi-tenant: Filter by store
     
     # Find all active/partial rentals with end_date <= today
-    rentals_pending_return = await db.rentals.find(
+    pending_query = db.rentals.find(
         {
-            **current_user.get_store_filter(),
+            **store_filter,
             "status": {"$in": ["active", "partial"]},
             "end_date": {"$lte": today}  # Today OR overdue
         },
-        {"_id": 0, "id": 1, "items": 1}
+        {"_id": 0, "id": 1, "items": 1, "end_date": 1}
     ).to_list(1000)
     
-    # Count rentals that have at least 1 unreturned item
-    pending_returns_count = 0
-    for rental in rentals_pending_return:
-        has_pending_item = False
-        for item in rental.get("items", []):
-            if not item.get("returned", False):
-                has_pending_item = True
-                break
-        
-        if has_pending_item:
-            pending_returns_count += 1
-    
     # ========== CUSTOMERS TODAY (COUNT DISTINCT customer_id) ==========
     # Count unique customers who had a rental created today
     # This prevents counting the same customer multiple times if they rented multiple times
@@ -6245,8 +6530,8 @@ async def get_stats(current_user: CurrentUser = Depends(get_current_user)):
     customers_pipeline = [
         {
             "$match": {
-                **current_user.get_store_filter(),
-                "created_at": {"$gte": start, "$lte": end},
+                **store_filter,
+                **day_range_filter(today, today),
                 "status": {"$nin": ["cancelled", "deleted"]}  # Exclude cancelled/deleted
             }
         },
@@ -6259,35 +6544,41 @@ async def get_stats(current_user: CurrentUser = Depends(get_current_user)):
             "$count": "unique_customers"
         }
     ]
-    customers_result = await db.rentals.aggregate(customers_pipeline).to_list(1)
-    customers_today = customers_result[0]["unique_customers"] if customers_result else 0
     
-    # Active rentals - Multi-tenant: Filter by store
-    active_rentals = await db.rentals.count_documents({**current_user.get_store_filter(), "status": {"$in": ["active", "partial"]}})
+    # Independent queries run concurrently
+    (
+        today_rentals,
+        (today_revenue, unpaid_amount),
+        rentals_pending_return,
+        customers_result,
+        active_rentals,
+        inventory
+    ) = await asyncio.gather(
+        count_today_rentals(),
+        revenue_today(),
+        pending_query,
+        db.rentals.aggregate(customers_pipeline).to_list(1),
+        # Active rentals - Multi-tenant: Filter by store
+        db.rentals.count_documents({**store_filter, "status": {"$in": ["active", "partial"]}}),
+        # Inventory stats (now with proper occupancy calculation)
+        get_inventory_stats(current_user)
+    )
+    customers_today = customers_result[0]["unique_customers"] if customers_result else 0
     
+    # Count rentals that have at least 1 unreturned item
     # Separate count for overdue returns (for dashboard alerts)
-    # Multi-tenant: Filter by store
+    pending_returns_count = 0
     overdue_returns = 0
-    rentals_due_today = []
     
     for rental in rentals_pending_return:
-        end_date = rental.get("end_date", "").split("T")[0]  # Remove timestamp if present
-        has_pending_item = False
-        for item in rental.get("items", []):
-            if not item.get("returned", False):
-                has_pending_item = True
-                break
+        has_pending_item = any(not item.get("returned", False) for item in rental.get("items", []))
+        if not has_pending_item:
+            continue
         
-        if has_pending_item:
-            # DEBUG: Log the comparison
-            # print(f"DEBUG: end_date={end_date}, today={today}, comparison={end_date < today}")
-            if end_date < today:  # Only overdue (not today)
-                overdue_returns += 1
-            elif end_date == today:
-                rentals_due_today.append(rental)
-    
-    # Inventory stats (now with proper occupancy calculation)
-    inventory = await get_inventory_stats(current_user)
+        pending_returns_count += 1
+        end_date = rental.get("end_date", "").split("T")[0]  # Remove timestamp if present
+        if end_date < today:  # Only overdue (not today)
+            overdue_returns += 1
     
     return {
         "today_rentals": today_rentals,
@@ -6303,6 +6594,7 @@ async def get_stats(current_user: CurrentUser = Depends(get_current_user)):
 # ==================== GLOBAL LOOKUP / REVERSE SEARCH ====================
 
 @api_router.get("/lookup/{code}")
+@query_budget(4)  # item, rental view (+ cache version), customer / customers + their active rentals
 async def global_lookup(code: str, current_user: CurrentUser = Depends(get_current_user)):
     """
     GLOBAL REVERSE LOOKUP - Scan-to-Action
@@ -6314,7 +6606,7 @@ async def global_lookup(code: str, current_user: CurrentUser = Depends(get_curre
     This enables the "scan the ski and get the customer" workflow.
     """
     code_upper = code.strip().upper()
-    code_lower = code.strip().lower()
+    store_filter = current_user.get_store_filter()
     
     results = {
         "found": False,
@@ -6329,6 +6621,7 @@ async def global_lookup(code: str, current_user: CurrentUser = Depends(get_curre
     # STEP 1: Check if it's an item barcode/internal_code
     # Search in items collection
     item = await db.items.find_one({
+        **current_user.get_store_filter(),
         "$or": [
             {"barcode": {"$regex": f"^{code}$", "$options": "i"}},
             {"internal_code": {"$regex": f"^{code}$", "$options": "i"}}
@@ -6338,14 +6631,11 @@ async def global_lookup(code: str, current_user: CurrentUser = Depends(get_curre
     if item:
         # Found an item - check if it's currently rented
         if item.get("status") == "rented":
-            # Find the active rental that contains this item
-            rental = await db.rentals.find_one({
-                "status": {"$in": ["active", "partial"]},
-                "$or": [
-                    {"items.barcode": {"$regex": f"^{code}$", "$options": "i"}},
-                    {"items.internal_code": {"$regex": f"^{code}$", "$options": "i"}}
-                ]
-            }, {"_id": 0})
+            # Find the active rental that contains this item (rental view cache)
+            rental = await rental_cache.get_active_by_code(
+                current_user.store_id, code,
+                lambda: load_rental_view(current_user, active_rental_by_code_query(code, include_item_id=False))
+            )
             
             if rental:
                 # Find the specific item in the rental
@@ -6362,7 +6652,7 @@ async def global_lookup(code: str, current_user: CurrentUser = Depends(get_curre
                 customer = None
                 if rental.get("customer_id"):
                     customer = await db.customers.find_one(
-                        {"id": rental["customer_id"]}, 
+                        {**store_filter, "id": rental["customer_id"]}, 
                         {"_id": 0}
                     )
                 
@@ -6424,6 +6714,7 @@ async def global_lookup(code: str, current_user: CurrentUser = Depends(get_curre
     
     # STEP 2: Check if it's a customer name/DNI search
     customers = await db.customers.find({
+        **store_filter,
         "$or": [
             {"name": {"$regex": code, "$options": "i"}},
             {"dni": {"$regex": f"^{code}$", "$options": "i"}}
@@ -6431,18 +6722,24 @@ async def global_lookup(code: str, current_user: CurrentUser = Depends(get_curre
     }, {"_id": 0}).to_list(10)
     
     if customers:
-        # Find active rentals for these customers
+        # Active rentals of all these customers in one query (by id or DNI)
+        dnis = [c["dni"] for c in customers if c.get("dni")]
+        active_rentals = await db.rentals.find({
+            **store_filter,
+            "status": {"$in": ["active", "partial"]},
+            "$or": [
+                {"customer_id": {"$in": [c.get("id") for c in customers]}},
+                {"customer_dni": {"$in": [re.compile(f"^{re.escape(dni)}$", re.IGNORECASE) for dni in dnis]}}
+            ]
+        }, {"_id": 0}).to_list(None)
         customers_with_rentals = []
         
         for customer in customers:
-            # Check for active rentals
-            active_rental = await db.rentals.find_one({
-                "status": {"$in": ["active", "partial"]},
-                "$or": [
-                    {"customer_id": customer.get("id")},
-                    {"customer_dni": {"$regex": f"^{customer.get('dni')}$", "$options": "i"}}
-                ]
-            }, {"_id": 0})
+            dni = (customer.get("dni") or "").upper()
+            active_rental = next((
+                r for r in active_rentals
+                if r.get("customer_id") == customer.get("id") or (dni and (r.get("customer_dni") or "").upper() == dni)
+            ), None)
             
             if active_rental:
                 # Calculate days remaining
@@ -6501,15 +6798,19 @@ async def global_lookup(code: str, current_user: CurrentUser = Depends(get_curre
 
 @api_router.get("/dashboard")
 async def get_dashboard(current_user: CurrentUser = Depends(get_current_user)):
-    stats = await get_stats(current_user)
-    
-    # Recent activity
-    recent_rentals = await db.rentals.find({**current_user.get_store_filter(), }, {"_id": 0}).sort("created_at", -1).to_list(10)
+    """Dashboard - polled by every terminal: single-flight + short TTL per store (response_cache.py)"""
+    return await response_cache.get_or_compute(
+        "dashboard", current_user.store_id, (), lambda: _compute_dashboard(current_user)
+    )
+
+
+async def _compute_dashboard(current_user: CurrentUser):
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
     
     # Occupancy by Category (Gama) - EXCLUDING retired/deleted/lost items
     # Only count rentable items: available, rented, maintenance
     # Multi-tenant: Filter by store
-    category_stats = await db.items.aggregate([
+    category_stats_query = db.items.aggregate([
         {
             "$match": {
                 **current_user.get_store_filter(),
@@ -6527,37 +6828,9 @@ async def get_dashboard(current_user: CurrentUser = Depends(get_current_user)):
         }
     ]).to_list(50)
     
-    # Process category stats for occupancy calculation
-    occupancy_by_category = {
-        "SUPERIOR": {"total": 0, "rented": 0, "maintenance": 0, "available": 0, "percentage": 0},
-        "ALTA": {"total": 0, "rented": 0, "maintenance": 0, "available": 0, "percentage": 0},
-        "MEDIA": {"total": 0, "rented": 0, "maintenance": 0, "available": 0, "percentage": 0}
-    }
-    
-    for stat in category_stats:
-        category = stat["_id"].get("category", "MEDIA")
-        status = stat["_id"].get("status", "available")
-        count = stat["count"]
-        
-        if category in occupancy_by_category:
-            occupancy_by_category[category]["total"] += count
-            if status == "rented":
-                occupancy_by_category[category]["rented"] += count
-            elif status == "maintenance":
-                occupancy_by_category[category]["maintenance"] += count
-            elif status == "available":
-                occupancy_by_category[category]["available"] += count
-    
-    # Calculate percentages (rented / rentable_total * 100)
-    for category in occupancy_by_category:
-        total = occupancy_by_category[category]["total"]
-        rented = occupancy_by_category[category]["rented"]
-        if total > 0:
-            occupancy_by_category[category]["percentage"] = round((rented / total) * 100, 1)
-    
     # Maintenance Alerts (grouped by category and item type)
     # Multi-tenant: Filter by store
-    maintenance_items = await db.items.aggregate([
+    maintenance_query = db.items.aggregate([
         {
             "$match": {
                 **current_user.get_store_filter(),
@@ -6593,6 +6866,47 @@ async def get_dashboard(current_user: CurrentUser = Depends(get_current_user)):
         }
     ]).to_list(50)
     
+    # Independent queries run concurrently (stats goes through the shared stats cache)
+    stats, recent_rentals, category_stats, maintenance_items, overdue_rentals = await asyncio.gather(
+        get_stats(current_user),
+        # Recent activity
+        db.rentals.find({**current_user.get_store_filter(), }, {"_id": 0}).sort("created_at", -1).to_list(10),
+        category_stats_query,
+        maintenance_query,
+        db.rentals.find(
+            {**current_user.get_store_filter(), "status": {"$in": ["active", "partial"]}, "end_date": {"$lt": today}},
+            {"_id": 0}
+        ).to_list(10)
+    )
+    
+    # Process category stats for occupancy calculation
+    occupancy_by_category = {
+        "SUPERIOR": {"total": 0, "rented": 0, "maintenance": 0, "available": 0, "percentage": 0},
+        "ALTA": {"total": 0, "rented": 0, "maintenance": 0, "available": 0, "percentage": 0},
+        "MEDIA": {"total": 0, "rented": 0, "maintenance": 0, "available": 0, "percentage": 0}
+    }
+    
+    for stat in category_stats:
+        category = stat["_id"].get("category", "MEDIA")
+        status = stat["_id"].get("status", "available")
+        count = stat["count"]
+        
+        if category in occupancy_by_category:
+            occupancy_by_category[category]["total"] += count
+            if status == "rented":
+                occupancy_by_category[category]["rented"] += count
+            elif status == "maintenance":
+                occupancy_by_category[category]["maintenance"] += count
+            elif status == "available":
+                occupancy_by_category[category]["available"] += count
+    
+    # Calculate percentages (rented / rentable_total * 100)
+    for category in occupancy_by_category:
+        total = occupancy_by_category[category]["total"]
+        rented = occupancy_by_category[category]["rented"]
+        if total > 0:
+            occupancy_by_category[category]["percentage"] = round((rented / total) * 100, 1)
+    
     # Build maintenance alerts
     maintenance_alerts = []
     for group in maintenance_items:
@@ -6622,11 +6936,6 @@ async def get_dashboard(current_user: CurrentUser = Depends(get_current_user)):
     alerts = maintenance_alerts
     
     # Overdue rentals - Multi-tenant: Filter by store
-    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    overdue_rentals = await db.rentals.find(
-        {**current_user.get_store_filter(), "status": {"$in": ["active", "partial"]}, "end_date": {"$lt": today}},
-        {"_id": 0}
-    ).to_list(10)
     for rental in overdue_rentals:
         alerts.append({
             "type": "overdue",
@@ -6642,62 +6951,36 @@ async def get_dashboard(current_user: CurrentUser = Depends(get_current_user)):
     }
 
 @api_router.get("/dashboard/returns-control")
+@query_budget(6)  # steady state 1-2; first read of a day rebuilds its projection
 async def get_returns_control(current_user: CurrentUser = Depends(get_current_user)):
     """
     Get pending returns by item type for today - the 'control tower' for end of day
     Multi-tenant: Filters by store_id
+    PROJECTION: one returns_control document per store and local day, maintained by
+    the rental write endpoints (returns_control.py) - cheap enough to poll
     """
-    today = datetime.now(timezone.utc)
-    today_str = today.strftime("%Y-%m-%d")
+    tz_name = await local_dates.timezone(current_user.store_id)
+    today_str = local_today(tz_name)
+    projection = await returns_control.day(current_user.store_id, today_str)
     
-    # Get all rentals that should return today and are not yet returned - Multi-tenant: Filter by store
-    pending_returns = await db.rentals.find({
-        **current_user.get_store_filter(),
-        "end_date": today_str,
-        "status": {"$in": ["active", "pending"]}
-    }, {"_id": 0}).to_list(10000)
-    
-    # Get item details for all items in pending returns
-    item_ids = []
-    for rental in pending_returns:
-        for item in rental.get("items", []):
-            item_ids.append(item.get("item_id"))
-    
-    items_data = {}
-    if item_ids:
-        # Multi-tenant: Filter items by store
-        items_cursor = await db.items.find(
-            {**current_user.get_store_filter(), "id": {"$in": item_ids}},
-            {"_id": 0, "id": 1, "item_type": 1, "brand": 1, "model": 1, "internal_code": 1}
-        ).to_list(10000)
-        for item in items_cursor:
-            items_data[item["id"]] = item
-    
-    # Get all item types (dynamic categories) - Multi-tenant: Filter by store
-    item_types = await db.item_types.find(current_user.get_store_filter(), {"_id": 0}).to_list(5000)
+    # Item type labels (config cache)
+    item_types = await store_config.item_types(current_user.store_id)
     type_labels = {t["value"]: t["label"] for t in item_types}
     
     # Count by item type
     counts_by_type = {}
     details_by_type = {}
     
-    for rental in pending_returns:
-        for item in rental.get("items", []):
-            item_id = item.get("item_id")
-            item_info = items_data.get(item_id, {})
-            item_type = item_info.get("item_type", "unknown")
-            
-            if item_type not in counts_by_type:
-                counts_by_type[item_type] = 0
-                details_by_type[item_type] = []
-            
-            counts_by_type[item_type] += 1
-            details_by_type[item_type].append({
-                "rental_id": rental.get("id"),
+    for rental_id, rental in projection.get("rentals", {}).items():
+        for line in rental.get("lines", []):
+            item_type = line["item_type"]
+            counts_by_type[item_type] = counts_by_type.get(item_type, 0) + 1
+            details_by_type.setdefault(item_type, []).append({
+                "rental_id": rental_id,
                 "customer_name": rental.get("customer_name"),
-                "internal_code": item_info.get("internal_code", "-"),
-                "brand": item_info.get("brand", "-"),
-                "model": item_info.get("model", "-")
+                "internal_code": line["internal_code"],
+                "brand": line["brand"],
+                "model": line["model"]
             })
     
     # Build response with label names
@@ -6714,9 +6997,9 @@ async def get_returns_control(current_user: CurrentUser = Depends(get_current_us
     # Calculate total
     total_pending = sum(counts_by_type.values())
     
-    # Get store closing hour (default 20:00)
+    # Get store closing hour (default 20:00), in store-local time
     closing_hour = 20
-    current_hour = today.hour
+    current_hour = datetime.now(zone(tz_name)).hour
     is_past_closing = current_hour >= closing_hour
     
     return {
@@ -6934,6 +7217,89 @@ async def get_dashboard_analytics(
 
 # ==================== HEALTH CHECK ====================
 
+@api_router.get("/analytics/cube")
+@query_budget(12)  # claim of dirty days (3), their rebuild under the lease (7), cube aggregation + fleet
+async def query_analytics_cube(
+    group_by: Optional[str] = Query(None, description="Dimensiones separadas por comas: " + ", ".join(CUBE_DIMENSIONS)),
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    season: Optional[str] = None,
+    week: Optional[str] = None,
+    month: Optional[str] = None,
+    item_type: Optional[str] = None,
+    category: Optional[str] = None,
+    source: Optional[str] = None,
+    payment_method: Optional[str] = None,
+    current_user: CurrentUser = Depends(require_admin)
+):
+    """
+    CUBO DE ANALÍTICA DE TEMPORADA (slice & dice)
+    Agrupa por cualquier combinación de dimensiones (group_by=item_type,week) y filtra
+    por cualquiera de ellas (valores separados por comas). Medidas: rentals, lines,
+    rental_days, revenue, returns; utilization (%) al agrupar por item_type.
+    Se sirve del cubo precalculado (analytics_cube.py), no de los alquileres.
+    """
+    for value in (date_from, date_to):
+        if value:
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Formato de fecha inválido (YYYY-MM-DD)")
+    raw_filters = {
+        "season": season, "week": week, "month": month, "item_type": item_type,
+        "category": category, "source": source, "payment_method": payment_method,
+    }
+    filters = {
+        dimension: [v.strip() for v in value.split(",") if v.strip()]
+        for dimension, value in raw_filters.items() if value
+    }
+    try:
+        return await analytics_cube.query(
+            current_user.store_id, parse_cube_group_by(group_by), filters, date_from, date_to
+        )
+    except CubeQueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api_router.post("/analytics/cube/rebuild")
+async def rebuild_analytics_cube(current_user: CurrentUser = Depends(require_admin)):
+    """Reconstruye todo el cubo de la tienda (normalmente lo hace el proceso nocturno)"""
+    cells = await analytics_cube.rebuild(current_user.store_id)
+    return {"message": "Cubo de analítica reconstruido", "cells": cells}
+
+@api_router.get("/metrics")
+async def get_metrics(request: Request):
+    """
+    Prometheus text exposition of per-route latency, DB time, round trips and response size.
+    If METRICS_TOKEN is set, the scraper must send it as a Bearer token.
+    """
+    expected = os.environ.get("METRICS_TOKEN")
+    if expected and request.headers.get("authorization") != f"Bearer {expected}":
+        raise HTTPException(status_code=401, detail="Token de métricas inválido")
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+@api_router.get("/admin/slow-queries")
+async def get_slow_queries(
+    limit: int = Query(20, ge=1, le=200),
+    collection: Optional[str] = None,
+    current_user: CurrentUser = Depends(require_super_admin)
+):
+    """
+    Top slow Mongo query shapes (literals stripped), with explain summary.
+    Requires SLOW_QUERY_PROFILER=1 - SUPER_ADMIN only (shapes span all stores).
+    """
+    if not profiler_enabled():
+        return {"enabled": False, "threshold_ms": None, "offenders": []}
+    return {
+        "enabled": True,
+        "threshold_ms": slow_query_profiler.threshold * 1000,
+        "offenders": await slow_query_profiler.top_offenders(limit, collection)
+    }
+
+@api_router.get("/admin/cache-stats")
+async def get_cache_stats(current_user: CurrentUser = Depends(require_admin)):
+    """Hit rates of the in-process store configuration cache (tariffs, packs, types, sources, settings)"""
+    return {"config_cache_hit_rates": store_config.hit_rates()}
+
 @api_router.get("/health")
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.now(timezone.utc).isoformat()}
@@ -6994,17 +7360,24 @@ async def create_source(source: SourceCreate, current_user: CurrentUser = Depend
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.sources.insert_one(doc)
+    await store_config.invalidate(current_user.store_id, "sources")
     return SourceResponse(**doc)
 
 @api_router.get("/sources", response_model=List[SourceResponse])
+@query_budget(3)  # cache version, sources (on a miss), one customer count per source aggregation
 async def get_sources(current_user: CurrentUser = Depends(get_current_user)):
-    # Multi-tenant: Filter by store_id
-    sources = await db.sources.find(current_user.get_store_filter(), {"_id": 0}).sort([("is_favorite", -1), ("name", 1)]).to_list(5000)
-    
-    # Count customers per source (within same store)
+    # Multi-tenant: Filter by store_id (config cache)
+    sources = await store_config.sources(current_user.store_id)
+    
+    # Count customers per source (within same store), all sources in one aggregation
+    counts = {}
+    if sources:
+        counts = {c["_id"]: c["count"] for c in await db.customers.aggregate([
+            {"$match": {**current_user.get_store_filter(), "source": {"$in": [source["name"] for source in sources]}}},
+            {"$group": {"_id": "$source", "count": {"$sum": 1}}},
+        ]).to_list(None)}
     for source in sources:
-        count = await db.customers.count_documents({**current_user.get_store_filter(), "source": source["name"]})
-        source["customer_count"] = count
+        source["customer_count"] = counts.get(source["name"], 0)
     
     return [SourceResponse(**s) for s in sources]
 
@@ -7040,6 +7413,7 @@ async def delete_source(source_id: str, current_user: CurrentUser = Depends(get_
     
     # Multi-tenant: Delete only from own store
     await db.sources.delete_one({**current_user.get_store_filter(), "id": source_id})
+    await store_config.invalidate(current_user.store_id, "sources")
     return {"message": "Proveedor eliminado correctamente"}
 
 @api_router.put("/sources/{source_id}", response_model=SourceResponse)
@@ -7068,6 +7442,7 @@ async def update_source(source_id: str, source: SourceCreate, current_user: Curr
     }
     # Multi-tenant: Update only in own store
     await db.sources.update_one({**current_user.get_store_filter(), "id": source_id}, {"$set": update_doc})
+    await store_config.invalidate(current_user.store_id, "sources")
     
     updated = await db.sources.find_one({**current_user.get_store_filter(), "id": source_id}, {"_id": 0})
     # Count customers from same store
@@ -7083,40 +7458,15 @@ async def get_source_stats(
     current_user: CurrentUser = Depends(get_current_user)
 ):
     """Get statistics for a specific provider/source with optional date filtering"""
-    # Multi-tenant: Check source exists in same store
-    source = await db.sources.find_one({**current_user.get_store_filter(), "id": source_id}, {"_id": 0})
+    # Multi-tenant: Check source exists in same store (config cache)
+    source = next((s for s in await store_config.sources(current_user.store_id) if s.get("id") == source_id), None)
     if not source:
         raise HTTPException(status_code=404, detail="Source not found")
     
-    # Get customers from this source (within same store)
-    customers = await db.customers.find({**current_user.get_store_filter(), "source": source["name"]}, {"_id": 0}).to_list(10000)
-    customer_ids = [c["id"] for c in customers]
-    customer_dnis = [c["dni"].upper() for c in customers if c.get("dni")]
-    
-    # Build rental query with optional date filters
-    rental_query = {
-        **current_user.get_store_filter(),
-        "$or": [
-            {"customer_id": {"$in": customer_ids}},
-            {"customer_dni": {"$in": customer_dnis}}
-        ]
-    }
-    
-    # Add date filters if provided
-    if date_from or date_to:
-        date_filter = {}
-        if date_from:
-            date_filter["$gte"] = date_from
-        if date_to:
-            date_filter["$lte"] = date_to + "T23:59:59"
-        if date_filter:
-            rental_query["created_at"] = date_filter
-    
-    # Get rentals from these customers (within same store)
-    rentals = await db.rentals.find(
-        rental_query,
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(10000)
+    # Customers of this source and their rentals, by customer id or DNI (one aggregation, commissions.py)
+    customer_count, rentals = await source_rentals(
+        db, current_user.get_store_filter(), source["name"], date_from, date_to
+    )
     
     # Calculate statistics
     total_revenue = sum(r.get("total_amount", 0) for r in rentals)
@@ -7147,7 +7497,7 @@ async def get_source_stats(
     return {
         "source": source,
         "stats": {
-            "total_customers": len(unique_customers) if date_from or date_to else len(customers),
+            "total_customers": len(unique_customers) if date_from or date_to else customer_count,
             "total_revenue": total_revenue,
             "average_ticket": average_ticket,
             "total_commission": total_commission,
@@ -7247,6 +7597,7 @@ class CashClosingResponse(BaseModel):
 # ==================== CASH SESSIONS ROUTES ====================
 
 @api_router.post("/cash/sessions")
+@bumps_store_watermark
 async def create_cash_session(session: CashSessionCreate, current_user: CurrentUser = Depends(get_current_user)):
     """Open a new cash session/shift (simple state change in DB)"""
     date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
@@ -7307,19 +7658,44 @@ async def get_next_operation_number():
     Generate sequential operation number in format AXXXXXX (A + 6 digits).
     This is a GLOBAL counter for all cash movements (sales, refunds, expenses).
     """
+    return (await reserve_operation_numbers(1))[0]
+
+async def reserve_operation_numbers(count: int) -> List[str]:
+    """Reserve `count` consecutive operation numbers with a single counter update"""
+    if count <= 0:
+        return []
     # Get or create the counter document
     counter = await db.counters.find_one_and_update(
         {"_id": "operation_number"},
-        {"$inc": {"sequence": 1}},
+        {"$inc": {"sequence": count}},
         upsert=True,
         return_document=True
     )
     
-    sequence = counter.get("sequence", 1)
+    last = counter.get("sequence", count)
     # Format as A + 6 digits (e.g., A000001, A000042, A123456)
-    return f"A{sequence:06d}"
+    return [f"A{sequence:06d}" for sequence in range(last - count + 1, last + 1)]
+
+async def insert_cash_movement(doc: dict, store_id):
+    """
+    Insert a cash movement: owned by the store (some callers did not set store_id)
+    and stamped with its store-local date keys (local_dates.py).
+    """
+    doc.setdefault("store_id", store_id)
+    await local_dates.stamp(doc)
+    return await db.cash_movements.insert_one(doc)
+
+async def insert_cash_movements(docs: List[dict], store_id):
+    """Bulk variant of insert_cash_movement (one insert_many)"""
+    if not docs:
+        return None
+    for doc in docs:
+        doc.setdefault("store_id", store_id)
+        await local_dates.stamp(doc)
+    return await db.cash_movements.insert_many(docs)
 
 @api_router.post("/cash/movements")
+@bumps_store_watermark
 async def create_cash_movement(movement: CashMovementCreate, current_user: CurrentUser = Depends(get_current_user)):
     # Check if there's an active session
     date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
@@ -7345,7 +7721,7 @@ async def create_cash_movement(movement: CashMovementCreate, current_user: Curre
         "created_at": datetime.now(timezone.utc).isoformat(),
         "created_by": current_user.username
     }
-    await db.cash_movements.insert_one(doc)
+    await insert_cash_movement(doc, current_user.store_id)
     return CashMovementResponse(**doc)
 
 @api_router.get("/cash/movements")
@@ -7373,6 +7749,7 @@ async def get_cash_movements(
     return [CashMovementResponse(**m) for m in movements]
 
 @api_router.patch("/cash/movements/{movement_id}")
+@bumps_store_watermark
 async def update_cash_movement(
     movement_id: str, 
     update_data: dict, 
@@ -7469,11 +7846,20 @@ async def get_cash_summary(date: Optional[str] = None, current_user: CurrentUser
     }
 
 @api_router.post("/cash/audit-sync")
-async def audit_and_sync_cash_movements(current_user: CurrentUser = Depends(get_current_user)):
+@query_budget(8)  # session, anti-join, counter, insert_many, summary (+ store timezone on a cold cache)
+@background_job("cash.audit_sync")
+@bumps_store_watermark
+async def audit_and_sync_cash_movements(
+    dry_run: bool = Query(False, description="Solo informar de los movimientos que faltan, sin crearlos"),
+    current_user: CurrentUser = Depends(get_current_user)
+):
     """
     AUDITORÍA Y SINCRONIZACIÓN FORZADA DE CAJA
     Detecta alquileres/servicios pagados sin movimiento de caja y los crea automáticamente.
     Este endpoint asegura la integridad contable total.
+    
+    Una sola agregación por tienda (anti-join contra cash_movements.reference_id, cash_audit.py),
+    números de operación reservados en bloque e insert_many. dry_run=true solo devuelve la diferencia.
     """
     date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
     
@@ -7485,86 +7871,26 @@ async def audit_and_sync_cash_movements(current_user: CurrentUser = Depends(get_
     session_id = active_session["id"]
     session_opened_at = active_session.get("opened_at", date)
     
-    # Get all existing movement reference_ids for this session
-    existing_movements = await db.cash_movements.find(
-        {"session_id": session_id},
-        {"reference_id": 1}
-    ).to_list(1000)
-    existing_refs = set(m.get("reference_id") for m in existing_movements if m.get("reference_id"))
-    
-    created_movements = []
-    
-    # 1. AUDIT RENTALS - Find paid rentals created after session opened without corresponding movement
-    rentals_query = {
-        "paid_amount": {"$gt": 0},
-        "created_at": {"$gte": session_opened_at}
-    }
-    rentals = await db.rentals.find(rentals_query, {"_id": 0}).to_list(10000)
+    # Paid rentals / delivered repairs since the session opened without a movement in it
+    missing = await missing_movements(db, current_user.get_store_filter(), session_id, session_opened_at)
     
-    for rental in rentals:
-        if rental["id"] not in existing_refs:
-            # Missing movement! Create it
-            cash_movement_id = str(uuid.uuid4())
-            operation_number = await get_next_operation_number()
-            cash_doc = {
-                "id": cash_movement_id,
-                "operation_number": operation_number,
-                "session_id": session_id,
-                "movement_type": "income",
-                "amount": rental["paid_amount"],
-                "payment_method": rental.get("payment_method", "cash"),
-                "category": "rental",
-                "concept": f"[SYNC] Alquiler #{rental['id'][:8]} - {rental.get('customer_name', 'Cliente')}",
-                "reference_id": rental["id"],
-                "customer_name": rental.get("customer_name", ""),
-                "notes": f"Movimiento sincronizado automáticamente. Alquiler del {rental.get('start_date', date)}",
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "created_by": current_user.username
-            }
-            await db.cash_movements.insert_one(cash_doc)
-            created_movements.append({
-                "type": "rental",
-                "operation_number": operation_number,
-                "rental_id": rental["id"][:8],
-                "amount": rental["paid_amount"],
-                "payment_method": rental.get("payment_method", "cash")
-            })
-    
-    # 2. AUDIT WORKSHOP REPAIRS - Find paid repairs without movement
-    repairs_query = {
-        "status": "delivered",
-        "price": {"$gt": 0},
-        "delivery_date": {"$gte": session_opened_at}
-    }
-    repairs = await db.external_repairs.find(repairs_query, {"_id": 0}).to_list(10000)
+    if dry_run:
+        return {
+            "message": "Auditoría (simulación): no se ha creado ningún movimiento",
+            "dry_run": True,
+            "movements_missing": len(missing),
+            "amount_missing": round(sum(row["amount"] for row in missing), 2),
+            "details": [sync_detail(row) for row in missing]
+        }
     
-    for repair in repairs:
-        if repair["id"] not in existing_refs:
-            cash_movement_id = str(uuid.uuid4())
-            operation_number = await get_next_operation_number()
-            cash_doc = {
-                "id": cash_movement_id,
-                "operation_number": operation_number,
-                "session_id": session_id,
-                "movement_type": "income",
-                "amount": repair.get("price", 0),
-                "payment_method": repair.get("payment_method", "cash"),
-                "category": "workshop",
-                "concept": f"[SYNC] Taller: {repair.get('customer_name', 'Cliente')}",
-                "reference_id": repair["id"],
-                "customer_name": repair.get("customer_name", ""),
-                "notes": f"Movimiento sincronizado automáticamente. Reparación: {repair.get('description', '')[:50]}",
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "created_by": current_user.username
-            }
-            await db.cash_movements.insert_one(cash_doc)
-            created_movements.append({
-                "type": "workshop",
-                "operation_number": operation_number,
-                "repair_id": repair["id"][:8],
-                "amount": repair.get("price", 0),
-                "payment_method": repair.get("payment_method", "cash")
-            })
+    operation_numbers = await reserve_operation_numbers(len(missing))
+    now = datetime.now(timezone.utc).isoformat()
+    docs = [
+        sync_movement(row, session_id, number, current_user.username, now, date)
+        for row, number in zip(missing, operation_numbers)
+    ]
+    await insert_cash_movements(docs, current_user.store_id)
+    created_movements = [sync_detail(row, number) for row, number in zip(missing, operation_numbers)]
     
     # Get updated summary
     summary = await get_cash_summary(date, current_user)
@@ -7598,10 +7924,19 @@ async def get_cash_summary_realtime(date: Optional[str] = None, current_user: Cu
     - BALANCE_NETO_DIA = Ingresos Brutos - Total Salidas (SIN fondo inicial)
     - EFECTIVO_ESPERADO = Fondo + (Ingresos Efectivo - Salidas Efectivo)
     - TARJETA_ESPERADA = Ingresos Tarjeta - Salidas Tarjeta
+    
+    CACHE: polled by every terminal - single-flight + short TTL per store (response_cache.py).
+    Closing the register uses _compute_cash_summary_realtime directly (never cached).
     """
     if not date:
         date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    
+    return await response_cache.get_or_compute(
+        "cash.summary_realtime", current_user.store_id, (date,),
+        lambda: _compute_cash_summary_realtime(date, current_user)
+    )
+
+
+async def _compute_cash_summary_realtime(date: str, current_user: CurrentUser):
     # Find active session
     active_session = await db.cash_sessions.find_one({**current_user.get_store_filter(), **{"date": date, "status": "open"}})
     
@@ -7746,6 +8081,7 @@ async def get_next_closure_number(date: str) -> int:
     return 1
 
 @api_router.post("/cash/close")
+@bumps_store_watermark
 async def close_cash_register(closing: CashClosingCreate, current_user: CurrentUser = Depends(get_current_user)):
     """Close the active cash session and create closing record with corrected financial logic"""
     
@@ -7756,7 +8092,7 @@ async def close_cash_register(closing: CashClosingCreate, current_user: CurrentU
         raise HTTPException(status_code=400, detail="No active cash session found for this date")
     
     # Get realtime summary (corrected logic)
-    summary = await get_cash_summary_realtime(closing.date, current_user)
+    summary = await _compute_cash_summary_realtime(closing.date, current_user)
     
     if not summary.get("session_active"):
         raise HTTPException(status_code=400, detail="No active session to close")
@@ -7830,6 +8166,7 @@ async def get_cash_closings(current_user: CurrentUser = Depends(get_current_user
     return [CashClosingResponse(**c) for c in closings]
 
 @api_router.get("/cash/movements/search")
+@query_budget(3)  # count, page, rentals of the page
 async def search_cash_movements(
     date_from: str = Query(..., description="Fecha inicio YYYY-MM-DD"),
     date_to: str = Query(..., description="Fecha fin YYYY-MM-DD"),
@@ -7843,11 +8180,10 @@ async def search_cash_movements(
     Advanced search for cash movements with pagination.
     Searches across all historical data without session restrictions.
     """
+    # Multi-tenant: Filter by store; local_date keys for the day range
     query = {
-        "created_at": {
-            "$gte": date_from + "T00:00:00",
-            "$lte": date_to + "T23:59:59"
-        }
+        **current_user.get_store_filter(),
+        "$and": [day_range_filter(date_from, date_to)]
     }
     
     # Payment method filter
@@ -7875,10 +8211,18 @@ async def search_cash_movements(
         {"_id": 0}
     ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
     
-    # Enrich with rental/customer data if available
+    # Enrich with rental/customer data if available (all rentals of the page in one query)
+    rental_ids = list({mov["reference_id"] for mov in movements
+                       if mov.get("reference_id") and mov.get("reference_type") == "rental"})
+    rentals = {}
+    if rental_ids:
+        rentals = {r["id"]: r for r in await db.rentals.find(
+            {**current_user.get_store_filter(), "id": {"$in": rental_ids}},
+            {"_id": 0, "id": 1, "customer_name": 1, "customer_dni": 1, "items": 1}
+        ).to_list(None)}
     for mov in movements:
         if mov.get("reference_id") and mov.get("reference_type") == "rental":
-            rental = await db.rentals.find_one({**current_user.get_store_filter(), **{"id": mov["reference_id"]}}, {"_id": 0, "customer_name": 1, "customer_dni": 1, "items": 1})
+            rental = rentals.get(mov["reference_id"])
             if rental:
                 mov["customer_name"] = rental.get("customer_name", mov.get("customer_name"))
                 mov["customer_dni"] = rental.get("customer_dni", "")
@@ -7904,15 +8248,9 @@ async def get_cash_movements_history(
     """Get all cash movements with optional filters for historic view"""
     query = {**current_user.get_store_filter()}
     
-    # Date range filter
+    # Date range filter (store-local days)
     if date_from or date_to:
-        date_query = {}
-        if date_from:
-            date_query["$gte"] = date_from + "T00:00:00"
-        if date_to:
-            date_query["$lte"] = date_to + "T23:59:59"
-        if date_query:
-            query["created_at"] = date_query
+        query["$and"] = [day_range_filter(date_from, date_to)]
     
     # Movement type filter
     if movement_type and movement_type != "all":
@@ -7926,10 +8264,14 @@ async def get_cash_movements_history(
             {"notes": {"$regex": search, "$options": "i"}}
         ]
     
-    movements = await db.cash_movements.find(query, {"_id": 0}).sort("created_at", -1).to_list(10000)
+    movements = await archive_tier.find(
+        "cash_movements", current_user.get_store_filter(), query, {"_id": 0},
+        start_date=date_from, sort=("created_at", -1), limit=10000
+    )
     return movements
 
 @api_router.post("/cash/validate-orphans")
+@bumps_store_watermark
 async def validate_and_fix_orphan_movements(current_user: CurrentUser = Depends(get_current_user)):
     """
     Validate and fix orphan movements (movements without session_id).
@@ -7986,6 +8328,7 @@ async def validate_and_fix_orphan_movements(current_user: CurrentUser = Depends(
     }
 
 @api_router.delete("/cash/closings/{closing_id}")
+@bumps_store_watermark
 async def revert_cash_closing(closing_id: str, current_user: CurrentUser = Depends(get_current_user)):
     """Revert/delete a specific cash closing to allow a new closure"""
     existing = await db.cash_closings.find_one({**current_user.get_store_filter(), **{"id": closing_id}})
@@ -8040,6 +8383,7 @@ async def get_integration_config(integration_type: str, current_user: CurrentUse
 
 
 @api_router.post("/admin/fix-return-dates")
+@bumps_store_watermark
 async def fix_return_dates(current_user: CurrentUser = Depends(get_current_user)):
     """
     MIGRATION UTILITY: Fix rentals that are 'returned' but missing actual_return_date.
@@ -8052,7 +8396,7 @@ async def fix_return_dates(current_user: CurrentUser = Depends(get_current_user)
             {"actual_return_date": {"$exists": False}},
             {"actual_return_date": None}
         ]
-    }, {"_id": 0, "id": 1, "end_date": 1, "created_at": 1}).to_list(1000)
+    }, {"_id": 0, "id": 1, "store_id": 1, "end_date": 1, "created_at": 1}).to_list(1000)
     
     fixed_count = 0
     for rental in rentals_to_fix:
@@ -8065,11 +8409,195 @@ async def fix_return_dates(current_user: CurrentUser = Depends(get_current_user)
         )
         fixed_count += 1
     
+    if fixed_count:
+        await rental_cache.clear({r.get("store_id") for r in rentals_to_fix})
+    
     return {
         "message": f"Fixed {fixed_count} rentals with missing actual_return_date",
         "fixed_count": fixed_count
     }
 
+@api_router.post("/admin/backfill-rental-lines")
+async def backfill_rental_lines_endpoint(
+    limit: Optional[int] = Query(None, ge=1),
+    current_user: CurrentUser = Depends(require_admin)
+):
+    """
+    MIGRATION UTILITY: Copy internal_code / item_type / category (and item_id, by barcode)
+    into the lines of the store's rentals written before line snapshots. Resumable; also
+    runs on startup until a full run finishes.
+    """
+    result = await backfill_rental_lines(db, store_id=current_user.store_id, limit=limit)
+    if result["updated"]:
+        await rental_cache.invalidate_store(current_user.store_id)
+    return result
+
+
+@api_router.post("/admin/archive")
+async def archive_store_data(
+    before: Optional[str] = Query(None, description="Archivar datos cerrados anteriores a este día (YYYY-MM-DD)"),
+    current_user: CurrentUser = Depends(require_admin)
+):
+    """
+    ARCHIVO DE TEMPORADAS CERRADAS: mueve alquileres devueltos, movimientos de sesiones
+    cerradas y cierres de caja anteriores a `before` (por defecto, hace ARCHIVE_AFTER_DAYS días)
+    a las colecciones de archivo de la tienda. Se ejecuta como trabajo en segundo plano
+    (estado en /jobs/{job_id}) y se reanuda si se interrumpe.
+    Historial de clientes, rentabilidad y reportes siguen leyendo ambos niveles (archive_tier.py).
+    """
+    today = await local_dates.today(current_user.store_id)
+    if before:
+        try:
+            datetime.strptime(before, "%Y-%m-%d")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Formato de fecha inválido (YYYY-MM-DD)")
+        if before >= today:
+            raise HTTPException(status_code=400, detail="La fecha de corte debe ser anterior a hoy")
+    cutoff = before or default_archive_cutoff(today)
+    if await job_queue.active(current_user.store_id, "admin.archive"):
+        raise HTTPException(status_code=409, detail="Ya hay un archivado en curso para esta tienda")
+    job = await job_queue.submit("admin.archive", current_user, {"before": cutoff}, required_role="admin")
+    return {"message": "Archivado iniciado", "before": cutoff, "job_id": job["id"]}
+
+async def run_archive_job(job):
+    return await archive_tier.archive_store(job.store_id, job.params["before"])
+
+job_queue.register("admin.archive", run_archive_job)
+
+@api_router.post("/admin/migrations")
+async def run_data_migrations(
+    dry_run: bool = Query(False, description="Solo contar los cambios, sin escribir"),
+    only: Optional[str] = Query(None, description="Ejecutar solo esta versión"),
+    store_id: Optional[int] = Query(None, description="Solo esta tienda (por defecto, todas)"),
+    current_user: CurrentUser = Depends(require_super_admin)
+):
+    """
+    MIGRACIONES DE DATOS (migrations.py): sustituyen a los scripts de reparación sueltos.
+    Por lotes con cursores y bulk_write, reanudables desde el último lote, en paralelo por tienda.
+    Se ejecutan como trabajo en segundo plano (estado en /jobs/{job_id}, resultado por tienda).
+    """
+    if only and only not in {m.version for m in MIGRATIONS}:
+        raise HTTPException(status_code=400, detail=f"Migración desconocida: {only}")
+    job = await job_queue.submit("admin.migrations", current_user, {"dry_run": dry_run, "only": only, "store_id": store_id},
+                                 required_role="super_admin")
+    return {"message": "Migraciones iniciadas", "job_id": job["id"], "dry_run": dry_run}
+
+@api_router.get("/admin/migrations")
+async def get_data_migrations(current_user: CurrentUser = Depends(require_super_admin)):
+    """Migraciones registradas y su estado por tienda (done, failed, running)"""
+    return await migration_status(db)
+
+async def run_migrations_job(job):
+    store_id = job.params.get("store_id")
+    return await run_migrations(db, [store_id] if store_id is not None else None, job.params.get("only"),
+                                job.params.get("dry_run", False))
+
+job_queue.register("admin.migrations", run_migrations_job)
+
+@api_router.post("/admin/backups")
+async def create_store_backup(
+    format: str = Query("bson", description="bson | ndjson"),
+    current_user: CurrentUser = Depends(require_admin)
+):
+    """
+    COPIA DE SEGURIDAD DE LA TIENDA (store_backup.py): cada colección filtrada por store_id
+    (archivos incluidos) en fragmentos comprimidos con manifiesto y checksums.
+    Se ejecuta como trabajo en segundo plano (estado en /jobs/{job_id}, resultado = manifiesto).
+    Las operaciones destructivas crean su propia copia antes de borrar.
+    """
+    if format not in BACKUP_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato no válido. Opciones: {', '.join(BACKUP_FORMATS)}")
+    job = await job_queue.submit("admin.backup", current_user, {"format": format}, required_role="admin")
+    return {"message": "Copia de seguridad iniciada", "job_id": job["id"]}
+
+@api_router.get("/admin/backups")
+async def list_store_backups(current_user: CurrentUser = Depends(require_admin)):
+    """Copias de seguridad de la tienda, la más reciente primero"""
+    return await store_backup.list(current_user.store_id)
+
+@api_router.post("/admin/backups/{backup_id}/restore")
+async def restore_store_backup(
+    backup_id: str,
+    mode: str = Query("merge", description="merge: añade lo que falta | replace: borra y recarga"),
+    current_user: CurrentUser = Depends(require_admin)
+):
+    """
+    RESTAURAR UNA COPIA de la tienda: verifica los checksums, recarga las colecciones en paralelo
+    por lotes y crea los índices al final. Trabajo en segundo plano (estado en /jobs/{job_id}).
+    """
+    if mode not in RESTORE_MODES:
+        raise HTTPException(status_code=400, detail=f"Modo no válido. Opciones: {', '.join(RESTORE_MODES)}")
+    try:
+        await store_backup.manifest(current_user.store_id, backup_id)
+    except BackupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if await job_queue.active(current_user.store_id, "admin.restore"):
+        raise HTTPException(status_code=409, detail="Ya hay una restauración en curso para esta tienda")
+    job = await job_queue.submit("admin.restore", current_user, {"backup_id": backup_id, "mode": mode},
+                                 required_role="admin")
+    return {"message": "Restauración iniciada", "job_id": job["id"], "mode": mode}
+
+async def run_backup_job(job):
+    return await store_backup.backup(job.store_id, "manual", fmt=job.params.get("format", "bson"))
+
+async def run_restore_job(job):
+    try:
+        result = await store_backup.restore(job.store_id, job.params["backup_id"], job.params.get("mode", "merge"))
+    except BackupError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Caches and derived data of the restored collections
+    await store_config.invalidate(job.store_id)
+    await rental_cache.invalidate_store(job.store_id)
+    store_watermark.bump(job.store_id)  # polled responses (dashboard, returns, cash)
+    await returns_control.invalidate_store(job.store_id)
+    if "items" in result["collections"]:
+        await item_type_registry.rebuild(job.store_id)
+    if "rentals" in result["collections"]:
+        await analytics_cube.rebuild(job.store_id)
+    return result
+
+job_queue.register("admin.backup", run_backup_job)
+job_queue.register("admin.restore", run_restore_job)
+
+@api_router.get("/admin/tenant-isolation")
+async def get_tenant_isolation(current_user: CurrentUser = Depends(require_super_admin)):
+    """
+    AISLAMIENTO MULTI-TENANT (tenant_isolation.py): resultado de la última comprobación en segundo plano,
+    marca de agua por colección y documentos sin store_id válido (muestra de cada colección).
+    """
+    return await tenant_isolation.report()
+
+@api_router.post("/admin/tenant-isolation/run")
+async def run_tenant_isolation(
+    full: bool = Query(False, description="Volver a comprobar todos los documentos, no solo los nuevos"),
+    current_user: CurrentUser = Depends(require_super_admin)
+):
+    """Lanza ahora la comprobación de aislamiento como trabajo en segundo plano (estado en /jobs/{job_id})"""
+    if await job_queue.active(current_user.store_id, "admin.tenant_isolation"):
+        raise HTTPException(status_code=409, detail="Ya hay una comprobación de aislamiento en curso")
+    job = await job_queue.submit("admin.tenant_isolation", current_user, {"full": full}, required_role="super_admin")
+    return {"message": "Comprobación de aislamiento iniciada", "job_id": job["id"], "full": full}
+
+async def run_tenant_isolation_job(job):
+    result = await tenant_isolation.run_once(job.params.get("full", False))
+    if result.get("skipped"):
+        raise HTTPException(status_code=409, detail="Ya hay una comprobación de aislamiento en curso")
+    return result
+
+job_queue.register("admin.tenant_isolation", run_tenant_isolation_job)
+
+@api_router.get("/admin/archive")
+async def get_archive_status(current_user: CurrentUser = Depends(require_admin)):
+    """Estado del archivo de la tienda: límite archivado, último resultado y tamaño de cada nivel"""
+    state = await archive_tier.state(current_user.store_id)
+    tiers = {}
+    for name in ARCHIVED_COLLECTIONS:
+        tiers[name] = {
+            "hot": await db[name].count_documents(current_user.get_store_filter()),
+            "archive": await db[archive_name(name, current_user.store_id)].estimated_document_count(),
+        }
+    return {**state, "collections": tiers}
+
 
 # ==================== BUSINESS SETTINGS/CONFIGURATION ====================
 
@@ -8127,8 +8655,13 @@ class FAQCreate(BaseModel):
     auto_print: bool = False
 
 @api_router.get("/settings")
+@query_budget(3)
 async def get_settings(current_user: CurrentUser = Depends(get_current_user)):
-    """Get business settings from database, including store-level hardware settings"""
+    """Get business settings from database, including store-level hardware settings (config cache)"""
+    return await store_config.get(current_user.store_id, "settings", lambda: _load_settings(current_user))
+
+
+async def _load_settings(current_user: CurrentUser) -> dict:
     settings = await db.settings.find_one({"type": "business", "store_id": current_user.store_id}, {"_id": 0})
     
     # Base defaults
@@ -8193,6 +8726,7 @@ async def save_settings(settings: BusinessSettings, current_user: CurrentUser =
             {"$set": {"company_logo": settings.company_logo or ""}}
         )
     
+    await store_config.invalidate(current_user.store_id, "settings")
     return {"success": True, "message": "Configuración guardada"}
 
 
@@ -9520,11 +10054,30 @@ async def update_store(store_id: int, updates: StoreUpdate, current_user: Curren
         
         update_dict["settings"] = settings
     
+    # Timezone: local_date keys of rentals and cash movements are re-stamped
+    timezone_changed = False
+    if updates.timezone is not None:
+        if not valid_timezone(updates.timezone):
+            raise HTTPException(status_code=400, detail=f"Zona horaria no válida: {updates.timezone}")
+        timezone_changed = updates.timezone != await local_dates.timezone(store_id)
+        if "settings" in update_dict:
+            update_dict["settings"]["timezone"] = updates.timezone
+        else:
+            update_dict["settings.timezone"] = updates.timezone
+    
     if update_dict:
         await db.stores.update_one(
             {"store_id": store_id},
             {"$set": update_dict}
         )
+        await store_config.invalidate(store_id, "settings", "timezone")
+    
+    if timezone_changed:
+        # Day keys of the cube and the returns tower follow the new local days
+        async def rebuild_local_views():
+            await analytics_cube.rebuild(store_id)
+            await returns_control.invalidate_store(store_id)
+        local_dates.start_backfill(store_id, restamp=True, after=rebuild_local_views)
     
     return {"message": "Store updated successfully"}
 
@@ -9548,6 +10101,9 @@ async def delete_store(store_id: int, current_user: CurrentUser = Depends(requir
     if not store:
         raise HTTPException(status_code=404, detail="Store not found")
     
+    # Backup after the checks: a rejected call doesn't dump the store
+    await backup_before(store_id, "delete_store")
+    
     # Delete all users associated with this store
     users_result = await db.users.delete_many({"store_id": store_id})
     
@@ -10189,8 +10745,12 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# Outermost: per-request Mongo round trips / DB time, Server-Timing header, /api/metrics histograms
+app.add_middleware(RequestMetricsMiddleware)
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -10216,6 +10776,64 @@ async def startup_db_indexes():
         await db.rentals.create_index("start_date")
         await db.rentals.create_index("end_date")
         
+        # Config cache cross-process version counters (one doc per store)
+        await db.config_versions.create_index("store_id", unique=True)
+        
+        # Item type registry: one doc per (store, type) with live item counts
+        await db.item_type_registry.create_index([("store_id", 1), ("value", 1)], unique=True)
+        
+        # Amortization recompute runs (status endpoint)
+        await db.amortization_runs.create_index([("store_id", 1), ("created_at", -1)])
+        await db.amortization_runs.create_index("id", unique=True)
+        
+        # Store-local day keys (local_dates.py)
+        await db.rentals.create_index([("store_id", 1), ("local_date", 1)])
+        await db.cash_movements.create_index([("store_id", 1), ("local_date", 1)])
+        
+        # Cash audit-sync anti-join (movements of a session by reference)
+        await db.cash_movements.create_index(CASH_AUDIT_INDEX_KEYS)
+        
+        # Reconciliation: confirm orphan candidates by rental id (reconciliation.py)
+        await db.cash_movements.create_index([("store_id", 1), ("reference_id", 1)])
+        await db.rentals.create_index([("store_id", 1), ("id", 1)])
+        
+        # Season analytics cube cells, dirty days and build state (analytics_cube.py)
+        await analytics_cube.create_indexes()
+        
+        # Provider commissions: rentals -> customers joins (commissions.py)
+        for keys in COMMISSION_CUSTOMER_INDEXES:
+            await db.customers.create_index(keys)
+        for keys in COMMISSION_RENTAL_INDEXES:
+            await db.rentals.create_index(keys)
+        
+        # Background jobs queue (jobs.py)
+        await job_queue.create_indexes()
+        await store_backup.create_indexes()
+        
+        # Tenant isolation check: orphans found, one doc per (collection, _id) (tenant_isolation.py)
+        await tenant_isolation.create_indexes()
+        
+        # Data migrations state, one doc per (version, store) (migrations.py)
+        await db.migrations.create_index([("version", 1), ("store_id", 1)], unique=True)
+        
+        # Returns control tower: one projection doc per (store, due day)
+        await db.returns_control.create_index([("store_id", 1), ("day", 1)], unique=True)
+        
+        # Pending returns by due date: only open rentals are indexed
+        try:
+            await db.rentals.create_index(
+                PENDING_RETURNS_INDEX_KEYS,
+                name=PENDING_RETURNS_INDEX_NAME,
+                partialFilterExpression={"status": {"$in": PENDING_STATUSES}}
+            )
+        except Exception as e:
+            # $in in partial indexes needs MongoDB 6.0+
+            logger.warning(f"⚠️ Partial pending-returns index not available ({e}), using full index")
+            await db.rentals.create_index(PENDING_RETURNS_INDEX_KEYS)
+        
+        # Rental lines by item (internal_code snapshot kept in sync by update_item)
+        await db.rentals.create_index([("store_id", 1), ("items.item_id", 1)])
+        
         # ITEM INDEXES: Multi-field search optimization for barcode scanner
         # Compound indexes with store_id for multi-tenant performance
         await db.items.create_index([("store_id", 1), ("internal_code", 1)])
@@ -10236,65 +10854,31 @@ async def startup_db_indexes():
     except Exception as e:
         logger.warning(f"⚠️ Index creation error (may already exist): {e}")
     
-    # MULTI-TENANT SECURITY: Validate data isolation on startup
-    await validate_multitenant_isolation()
+    # One-time backfill of rental line snapshots (resumable, runs in background)
+    start_rental_lines_backfill(db)
+    
+    # Store-local date keys on rentals / cash movements written before them
+    local_dates.start_backfill()
+    
+    # Analytics cube: dirty days every few minutes, full rebuild nightly
+    analytics_cube.start()
+    
+    # Background jobs (imports, exports, audits...): resumes jobs left by a previous process
+    job_queue.start()
+    
+    # Multi-tenant isolation check: documents written since the last run, in one worker
+    tenant_isolation.start()
 
+    # Opt-in slow query profiler (SLOW_QUERY_PROFILER=1)
+    if profiler_enabled():
+        await slow_query_profiler.start(db, mongo_listener)
 
-async def validate_multitenant_isolation():
-    """
-    CRITICAL SECURITY CHECK: Validate multi-tenant data isolation.
-    Runs on every server startup to detect anomalies.
-    """
-    try:
-        # Get all valid store IDs
-        stores = await db.stores.distinct("store_id")
-        valid_store_ids = set(stores)
-        
-        # Check for items without store_id
-        orphan_items = await db.items.count_documents({
-            "$or": [
-                {"store_id": {"$exists": False}},
-                {"store_id": None},
-                {"store_id": {"$nin": list(valid_store_ids)}}
-            ]
-        })
-        
-        if orphan_items > 0:
-            logger.error(f"🚨 SECURITY ALERT: {orphan_items} items without valid store_id!")
-        
-        # Check for customers without store_id
-        orphan_customers = await db.customers.count_documents({
-            "$or": [
-                {"store_id": {"$exists": False}},
-                {"store_id": None}
-            ]
-        })
-        
-        if orphan_customers > 0:
-            logger.error(f"🚨 SECURITY ALERT: {orphan_customers} customers without store_id!")
-        
-        # Check for rentals without store_id
-        orphan_rentals = await db.rentals.count_documents({
-            "$or": [
-                {"store_id": {"$exists": False}},
-                {"store_id": None}
-            ]
-        })
-        
-        if orphan_rentals > 0:
-            logger.error(f"🚨 SECURITY ALERT: {orphan_rentals} rentals without store_id!")
-        
-        # Summary
-        total_orphans = orphan_items + orphan_customers + orphan_rentals
-        if total_orphans == 0:
-            logger.info("✅ Multi-tenant isolation: ALL DATA PROPERLY ISOLATED")
-        else:
-            logger.error(f"🚨 MULTI-TENANT VIOLATION: {total_orphans} records without proper store_id!")
-            
-    except Exception as e:
-        logger.error(f"Error validating multi-tenant isolation: {e}")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    analytics_cube.stop()
+    job_queue.stop()
+    tenant_isolation.stop()
+    await slow_query_profiler.stop(mongo_listener)
     client.close()
 
@@ -0,0 +1,188 @@
+"""
+Slow-query profiler (opt-in)
+Every Mongo command above SLOW_QUERY_MS is recorded with its literal-free
+filter shape, collection, route and an explain("executionStats") summary
+(docs/keys examined vs returned, index used or COLLSCAN) into the capped
+collection `slow_queries`. /api/admin/slow-queries lists the top offenders
+grouped by shape.
+
+Enable with SLOW_QUERY_PROFILER=1 (threshold: SLOW_QUERY_MS, default 100).
+The command listener runs on Motor's executor threads, so it only enqueues;
+explain + insert happen in a background task on the event loop.
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import logging
+
+from query_budget import command_shape
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERIES_COLLECTION = "slow_queries"
+CAPPED_SIZE_BYTES = 16 * 1024 * 1024
+CAPPED_MAX_DOCS = 20000
+
+# Commands we can re-run under explain without side effects
+_EXPLAINABLE = {"find", "aggregate", "count", "distinct"}
+# Driver/session fields that must not go into the explain command
+_STRIP_FIELDS = {"lsid", "txnNumber", "$clusterTime", "$db", "$readPreference", "readConcern",
+                 "autocommit", "startTransaction", "writeConcern"}
+# Re-explaining the same shape on every occurrence would make the profiler a load source
+EXPLAIN_COOLDOWN_SECONDS = 300
+
+
+def profiler_enabled() -> bool:
+    return os.environ.get("SLOW_QUERY_PROFILER", "").lower() in ("1", "true", "yes")
+
+
+def _walk(node: Any):
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from _walk(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _walk(value)
+
+
+def summarize_explain(explain: dict) -> Dict[str, Any]:
+    """Reduce an explain("executionStats") document to what matters for triage"""
+    summary = {"docs_examined": 0, "keys_examined": 0, "returned": None,
+               "execution_ms": None, "indexes": [], "collscan": False}
+    for node in _walk(explain):
+        stats = node.get("executionStats")
+        if isinstance(stats, dict):
+            summary["docs_examined"] += stats.get("totalDocsExamined", 0) or 0
+            summary["keys_examined"] += stats.get("totalKeysExamined", 0) or 0
+            if summary["returned"] is None:
+                summary["returned"] = stats.get("nReturned")
+            if summary["execution_ms"] is None:
+                summary["execution_ms"] = stats.get("executionTimeMillis")
+        stage = node.get("stage")
+        if stage == "COLLSCAN":
+            summary["collscan"] = True
+        index_name = node.get("indexName")
+        if isinstance(index_name, str) and index_name not in summary["indexes"]:
+            summary["indexes"].append(index_name)
+    return summary
+
+
+class SlowQueryProfiler:
+    def __init__(self):
+        self.db = None
+        self.threshold = float(os.environ.get("SLOW_QUERY_MS", "100")) / 1000
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._last_explained: Dict[str, float] = {}
+
+    async def start(self, db, listener):
+        """Create the capped collection and attach to the command listener (startup)"""
+        self.db = db
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=1000)
+        try:
+            existing = await db.list_collection_names(filter={"name": SLOW_QUERIES_COLLECTION})
+            if not existing:
+                await db.create_collection(SLOW_QUERIES_COLLECTION, capped=True,
+                                           size=CAPPED_SIZE_BYTES, max=CAPPED_MAX_DOCS)
+            await db[SLOW_QUERIES_COLLECTION].create_index("shape")
+        except Exception as e:
+            logger.warning(f"⚠️ Slow query collection setup: {e}")
+        self._worker = asyncio.create_task(self._run())
+        listener.observer = self.observe
+        logger.info(f"✅ Slow query profiler enabled (threshold {self.threshold * 1000:.0f} ms)")
+
+    async def stop(self, listener):
+        listener.observer = None
+        if self._worker:
+            self._worker.cancel()
+
+    def observe(self, command_name: str, collection: str, command: dict, duration: float, documents: int, route: str):
+        """Called from the listener (executor thread): cheap filter + hand-off to the loop"""
+        if duration < self.threshold or self._loop is None:
+            return
+        if command_name == "explain" or collection == SLOW_QUERIES_COLLECTION:
+            return
+        record = {
+            "command": command_name,
+            "collection": collection,
+            "route": route,
+            "duration_ms": round(duration * 1000, 2),
+            "documents_returned": documents,
+            "raw": command,
+        }
+        self._loop.call_soon_threadsafe(self._enqueue, record)
+
+    def _enqueue(self, record: dict):
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            pass  # profiler must never back-pressure the app
+
+    async def _run(self):
+        while True:
+            record = await self._queue.get()
+            try:
+                await self._store(record)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f"Slow query record failed: {e}")
+
+    async def _store(self, record: dict):
+        raw = record.pop("raw")
+        shape = command_shape(record["command"], record["collection"], raw)
+        record["shape"] = shape
+        record["created_at"] = datetime.now(timezone.utc).isoformat()
+
+        now = time.monotonic()
+        if record["command"] in _EXPLAINABLE and now - self._last_explained.get(shape, 0) > EXPLAIN_COOLDOWN_SECONDS:
+            self._last_explained[shape] = now
+            explain_cmd = {k: v for k, v in raw.items() if k not in _STRIP_FIELDS}
+            try:
+                explain = await self.db.command({"explain": explain_cmd, "verbosity": "executionStats"})
+                record["explain"] = summarize_explain(explain)
+            except Exception as e:
+                record["explain_error"] = str(e)[:300]
+
+        await self.db[SLOW_QUERIES_COLLECTION].insert_one(record)
+
+    async def top_offenders(self, limit: int = 20, collection: Optional[str] = None) -> List[dict]:
+        match = {"collection": collection} if collection else {}
+        pipeline = [
+            {"$match": match},
+            {"$sort": {"_id": -1}},
+            {"$group": {
+                "_id": "$shape",
+                "collection": {"$first": "$collection"},
+                "command": {"$first": "$command"},
+                "count": {"$sum": 1},
+                "total_ms": {"$sum": "$duration_ms"},
+                "avg_ms": {"$avg": "$duration_ms"},
+                "max_ms": {"$max": "$duration_ms"},
+                "routes": {"$addToSet": "$route"},
+                "last_seen": {"$first": "$created_at"},
+                # documents sort above missing/null, so this picks a recorded explain if any
+                "explain": {"$max": "$explain"},
+            }},
+            {"$sort": {"total_ms": -1}},
+            {"$limit": limit},
+        ]
+        results = await self.db[SLOW_QUERIES_COLLECTION].aggregate(pipeline).to_list(limit)
+        offenders = []
+        for r in results:
+            offenders.append({
+                "shape": r.pop("_id"),
+                **r,
+                "avg_ms": round(r["avg_ms"] or 0, 2),
+                "total_ms": round(r["total_ms"] or 0, 2),
+            })
+        return offenders
+
+
+slow_query_profiler = SlowQueryProfiler()
@@ -0,0 +1,406 @@
+"""
+Per-store backup and restore
+A backup is a directory BACKUP_DIR/store_<id>/<backup_id>/ holding, for every
+collection with documents of the store (store_id, the store's archive
+collections included):
+- <collection>.<n>.bson.gz (or .ndjson.gz): the documents streamed from a
+  cursor filtered by store_id, a new chunk every CHUNK_DOCUMENTS
+- manifest.json: documents and files (size, sha256) per collection, with the
+  collection's index specs
+The manifest is also kept in `store_backups` for listing.
+
+Collections are dumped and restored concurrently (BACKUP_CONCURRENCY), with one
+batch per collection in memory. BSON chunks carry the raw documents (no
+decode/encode); NDJSON uses canonical Extended JSON so types survive the trip.
+Restore checks every checksum before writing, then insert_many in batches
+("merge" keeps what exists, duplicates ignored; "replace" deletes the store's
+documents of each collection first) and builds the manifest's indexes at the
+end. Indexes of collections shared with other stores already exist, so only
+collections created by the restore (archives, an empty database) build them.
+
+Destructive endpoints are decorated with @backs_up_store(...): a backup of the
+collections they touch is taken first and the endpoint fails if it can't be.
+BACKUP_KEEP backups are kept per store.
+CLI: python store_backup.py backup|restore|list --store N [--backup ID]
+"""
+import argparse
+import asyncio
+import functools
+import gzip
+import hashlib
+import itertools
+import json
+import logging
+import os
+import shutil
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional
+
+import bson
+from bson import json_util
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from fastapi import HTTPException
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from archive_tier import ARCHIVED_COLLECTIONS, archive_name
+from jobs import report_progress
+from response_cache import store_id_from_call
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "store_backups"
+BACKUP_DIR = Path(os.environ.get("BACKUP_DIR", Path(__file__).parent / "backups"))
+BACKUP_KEEP = int(os.environ.get("BACKUP_KEEP", "10"))
+CONCURRENCY = int(os.environ.get("BACKUP_CONCURRENCY", "4"))
+CHUNK_DOCUMENTS = 100_000
+BATCH_SIZE = 1000
+FORMATS = {"bson": "bson.gz", "ndjson": "ndjson.gz"}
+RESTORE_MODES = ("merge", "replace")
+# Operational collections: not tenant data, or rebuilt on their own
+SKIP_COLLECTIONS = {COLLECTION, "jobs", "migrations", "config_versions"}
+SKIP_PREFIXES = ("system.", "job_files.")
+RAW = CodecOptions(document_class=RawBSONDocument, tz_aware=True)
+DUPLICATE_KEY = 11000
+
+
+class BackupError(ValueError):
+    """Backup not found or not usable (bad checksum, missing file)"""
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class _ChunkWriter:
+    """gzip chunk files of one collection; write/close run in a worker thread"""
+
+    def __init__(self, directory: Path, collection: str, fmt: str):
+        self.directory = directory
+        self.collection = collection
+        self.fmt = fmt
+        self.files: List[dict] = []
+        self._file = None
+        self._count = 0
+
+    def write(self, docs: List[RawBSONDocument]):
+        for doc in docs:
+            if self._file is None or self._count >= CHUNK_DOCUMENTS:
+                self._rotate()
+            if self.fmt == "bson":
+                self._file.write(doc.raw)
+            else:
+                data = json_util.dumps(bson.decode(doc.raw), json_options=json_util.CANONICAL_JSON_OPTIONS)
+                self._file.write(data.encode() + b"\n")
+            self._count += 1
+
+    def _rotate(self):
+        self._finish()
+        name = f"{self.collection}.{len(self.files):04d}.{FORMATS[self.fmt]}"
+        self._file = gzip.open(self.directory / name, "wb")
+        self._count = 0
+        self.files.append({"name": name})
+
+    def _finish(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        entry = self.files[-1]
+        path = self.directory / entry["name"]
+        entry.update(documents=self._count, bytes=path.stat().st_size, sha256=_sha256(path))
+
+    def close(self) -> List[dict]:
+        self._finish()
+        return self.files
+
+
+def _read_chunk(path: Path, fmt: str) -> Iterator:
+    with gzip.open(path, "rb") as f:
+        if fmt == "bson":
+            yield from bson.decode_file_iter(f, codec_options=RAW)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json_util.loads(line, json_options=json_util.CANONICAL_JSON_OPTIONS)
+
+
+def _take(docs: Iterator, n: int) -> list:
+    return list(itertools.islice(docs, n))
+
+
+def _index_spec(index: dict) -> dict:
+    return {
+        "key": list(index["key"].items()),
+        "options": {k: v for k, v in index.items() if k not in ("v", "key", "ns")},
+    }
+
+
+class StoreBackup:
+    def __init__(self):
+        self.db = None
+
+    def attach(self, db):
+        self.db = db
+
+    async def create_indexes(self):
+        await self.db[COLLECTION].create_index([("store_id", 1), ("created_at", -1)])
+        await self.db[COLLECTION].create_index("backup_id", unique=True)
+
+    async def store_collections(self, store_id) -> List[str]:
+        """Collections holding documents of the store (its own archives included)"""
+        archives = tuple(archive_name(c, "") for c in ARCHIVED_COLLECTIONS)
+        own = {archive_name(c, store_id) for c in ARCHIVED_COLLECTIONS}
+        names = []
+        for name in sorted(await self.db.list_collection_names()):
+            if name in SKIP_COLLECTIONS or name.startswith(SKIP_PREFIXES):
+                continue
+            if name.startswith(archives) and name not in own:
+                continue  # another store's archive
+            if await self.db[name].find_one({"store_id": store_id}, {"_id": 1}):
+                names.append(name)
+        return names
+
+    async def _with_archives(self, store_id, collections: Iterable[str]) -> List[str]:
+        existing = set(await self.db.list_collection_names())
+        names = list(collections)
+        names += [archive_name(c, store_id) for c in names
+                  if c in ARCHIVED_COLLECTIONS and archive_name(c, store_id) in existing]
+        return names
+
+    # ---------- backup ----------
+
+    async def _dump(self, directory: Path, name: str, store_id, fmt: str) -> dict:
+        writer = _ChunkWriter(directory, name, fmt)
+        collection = self.db[name]
+        cursor = collection.with_options(codec_options=RAW).find({"store_id": store_id}).batch_size(BATCH_SIZE)
+        documents, batch = 0, []
+        try:
+            async for doc in cursor:
+                batch.append(doc)
+                if len(batch) >= BATCH_SIZE:
+                    await asyncio.to_thread(writer.write, batch)
+                    documents, batch = documents + len(batch), []
+        finally:
+            await cursor.close()
+        if batch:
+            await asyncio.to_thread(writer.write, batch)
+            documents += len(batch)
+        files = await asyncio.to_thread(writer.close)
+        indexes = [_index_spec(index) async for index in collection.list_indexes() if index["name"] != "_id_"]
+        return {"documents": documents, "files": files, "indexes": indexes}
+
+    async def backup(self, store_id, reason: str = "manual", collections: Optional[Iterable[str]] = None,
+                     fmt: str = "bson", concurrency: int = CONCURRENCY) -> dict:
+        """Dump the store's documents (all its collections, or `collections` and their archives)"""
+        if fmt not in FORMATS:
+            raise BackupError(f"Formato no válido: {fmt}")
+        now = datetime.now(timezone.utc)
+        backup_id = f"{store_id}-{now:%Y%m%dT%H%M%SZ}-{uuid.uuid4().hex[:6]}"
+        directory = BACKUP_DIR / f"store_{store_id}" / backup_id
+        names = await (self._with_archives(store_id, collections) if collections is not None
+                       else self.store_collections(store_id))
+        await asyncio.to_thread(directory.mkdir, parents=True, exist_ok=True)
+
+        limit = asyncio.Semaphore(max(1, concurrency))
+        done = 0
+
+        async def dump(name):
+            nonlocal done
+            async with limit:
+                result = await self._dump(directory, name, store_id, fmt)
+            done += 1
+            await report_progress(done, len(names), name)
+            return result
+
+        try:
+            results = await asyncio.gather(*(dump(name) for name in names))
+        except BaseException:
+            await asyncio.to_thread(shutil.rmtree, directory, True)
+            raise
+        manifest = {
+            "backup_id": backup_id,
+            "store_id": store_id,
+            "reason": reason,
+            "format": fmt,
+            "created_at": now.isoformat(),
+            "path": str(directory),
+            "documents": sum(r["documents"] for r in results),
+            "bytes": sum(f["bytes"] for r in results for f in r["files"]),
+            "collections": dict(zip(names, results)),
+        }
+        data = json.dumps(manifest, indent=2, default=str)
+        await asyncio.to_thread((directory / "manifest.json").write_text, data)
+        await self.db[COLLECTION].insert_one(dict(manifest))
+        await self._prune(store_id)
+        logger.info(f"💾 Backup {backup_id}: {manifest['documents']} documents in {len(names)} collections ({reason})")
+        return manifest
+
+    async def _prune(self, store_id):
+        old = await self.db[COLLECTION].find(
+            {"store_id": store_id}, {"_id": 0, "backup_id": 1, "path": 1}
+        ).sort("created_at", -1).skip(BACKUP_KEEP).to_list(None)
+        for backup in old:
+            await asyncio.to_thread(shutil.rmtree, backup["path"], True)
+            await self.db[COLLECTION].delete_one({"backup_id": backup["backup_id"]})
+
+    # ---------- restore ----------
+
+    async def manifest(self, store_id, backup_id: str) -> dict:
+        manifest = await self.db[COLLECTION].find_one({"store_id": store_id, "backup_id": backup_id}, {"_id": 0})
+        if not manifest:
+            raise BackupError("Copia de seguridad no encontrada")
+        return manifest
+
+    async def verify(self, manifest: dict):
+        """Every chunk present with the manifest's checksum"""
+        directory = Path(manifest["path"])
+        for info in manifest["collections"].values():
+            for entry in info["files"]:
+                path = directory / entry["name"]
+                if not await asyncio.to_thread(path.exists):
+                    raise BackupError(f"Falta el fichero {entry['name']}")
+                if await asyncio.to_thread(_sha256, path) != entry["sha256"]:
+                    raise BackupError(f"Checksum no válido: {entry['name']}")
+
+    async def _load(self, directory: Path, name: str, info: dict, store_id, fmt: str, mode: str) -> dict:
+        collection = self.db[name]
+        deleted = 0
+        if mode == "replace":
+            deleted = (await collection.delete_many({"store_id": store_id})).deleted_count
+        inserted = 0
+        for entry in info["files"]:
+            docs = _read_chunk(directory / entry["name"], fmt)
+            while batch := await asyncio.to_thread(_take, docs, BATCH_SIZE):
+                try:
+                    inserted += len((await collection.insert_many(batch, ordered=False)).inserted_ids)
+                except BulkWriteError as e:
+                    # merge: documents still present are kept as they are
+                    if any(err.get("code") != DUPLICATE_KEY for err in e.details.get("writeErrors", [])):
+                        raise
+                    inserted += e.details.get("nInserted", 0)
+        return {"documents": info["documents"], "inserted": inserted, "deleted": deleted}
+
+    async def _build_indexes(self, name: str, indexes: List[dict]):
+        for index in indexes:
+            try:
+                await self.db[name].create_index(index["key"], **index["options"])
+            except OperationFailure as e:
+                logger.warning(f"⚠️ Restore: index {index['options'].get('name')} on {name} not built: {e}")
+
+    async def restore(self, store_id, backup_id: str, mode: str = "merge",
+                      concurrency: int = CONCURRENCY) -> dict:
+        """Load a backup of the store back (checksums verified first, indexes built at the end)"""
+        if mode not in RESTORE_MODES:
+            raise BackupError(f"Modo no válido: {mode}")
+        manifest = await self.manifest(store_id, backup_id)
+        await self.verify(manifest)
+        directory = Path(manifest["path"])
+        collections = manifest["collections"]
+        limit = asyncio.Semaphore(max(1, concurrency))
+        done = 0
+
+        async def load(name, info):
+            nonlocal done
+            async with limit:
+                result = await self._load(directory, name, info, store_id, manifest["format"], mode)
+            done += 1
+            await report_progress(done, len(collections), name)
+            return result
+
+        results = await asyncio.gather(*(load(name, info) for name, info in collections.items()))
+        for name, info in collections.items():
+            await self._build_indexes(name, info["indexes"])
+        logger.info(f"♻️ Restored backup {backup_id} ({mode}) into store {store_id}")
+        return {"backup_id": backup_id, "store_id": store_id, "mode": mode,
+                "collections": dict(zip(collections, results))}
+
+    async def list(self, store_id) -> List[dict]:
+        return await self.db[COLLECTION].find(
+            {"store_id": store_id}, {"_id": 0, "path": 0}
+        ).sort("created_at", -1).to_list(None)
+
+
+store_backup = StoreBackup()
+
+
+async def backup_before(store_id, reason: str, collections: Optional[Iterable[str]] = None):
+    """Backup before a destructive operation; raises HTTP 500 (operation cancelled) if it fails"""
+    try:
+        await store_backup.backup(store_id, reason, collections)
+    except Exception as e:
+        logger.error(f"❌ Backup before {reason} failed for store {store_id}: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail="No se pudo crear la copia de seguridad previa; la operación se ha cancelado"
+        )
+
+
+def backs_up_store(reason: str, collections: Optional[Iterable[str]] = None,
+                   when: Optional[Callable[[dict], bool]] = None, store_param: Optional[str] = None) -> Callable:
+    """
+    Mark a destructive endpoint: a backup of the store (only `collections` if
+    given) is taken before it runs, and the endpoint fails if it can't be.
+    `when(kwargs)` limits it to some calls; `store_param` names the path param
+    holding the store (default: the current user's store). Goes below
+    @api_router.<method>(...) and @background_job(...). Endpoints that must
+    validate first (existence checks...) call backup_before themselves.
+    """
+    collections = tuple(collections) if collections is not None else None
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if when is None or when(kwargs):
+                store_id = kwargs.get(store_param) if store_param else store_id_from_call(args, kwargs)
+                await backup_before(store_id, reason, collections)
+            return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+async def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(os.path.join(os.path.dirname(__file__), ".env"))
+    parser = argparse.ArgumentParser(description="Back up / restore AlpineFlow stores")
+    parser.add_argument("command", choices=("backup", "restore", "list"))
+    parser.add_argument("--store", type=int, action="append", help="store id (repeatable; backup: default all)")
+    parser.add_argument("--backup", help="backup id to restore")
+    parser.add_argument("--format", choices=tuple(FORMATS), default="bson")
+    parser.add_argument("--mode", choices=RESTORE_MODES, default="merge")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = client[os.environ["DB_NAME"]]
+    store_backup.attach(db)
+    try:
+        await store_backup.create_indexes()
+        stores = args.store or await db.stores.distinct("store_id")
+        if args.command == "backup":
+            for store_id in stores:
+                manifest = await store_backup.backup(store_id, "cli", fmt=args.format, concurrency=args.concurrency)
+                print(manifest["backup_id"], manifest["documents"], manifest["path"])
+        elif args.command == "restore":
+            if len(stores) != 1 or not args.backup:
+                parser.error("restore needs one --store and --backup")
+            print(await store_backup.restore(stores[0], args.backup, args.mode, args.concurrency))
+        else:
+            for store_id in stores:
+                for backup in await store_backup.list(store_id):
+                    print(backup["backup_id"], backup["reason"], backup["documents"], backup["created_at"])
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -37,3 +37,4 @@ class StoreUpdate(BaseModel):
     max_users: Optional[int] = None
     max_items: Optional[int] = None
     max_customers: Optional[int] = None
+    timezone: Optional[str] = None  # IANA name, e.g. "Europe/Madrid"
@@ -0,0 +1,239 @@
+"""
+Tariff what-if simulator
+Reprices a season of historical rental lines under a proposed tariff/pack set
+and reports revenue deltas by item type, rental length and week. Read-only:
+proposed prices live in memory only, nothing is written to tariffs/packs/items.
+
+Rental lines are loaded once into columnar NumPy arrays (cached for
+SEASON_CACHE_SECONDS per store and range, so successive what-ifs skip Mongo)
+and repriced in one vectorized pass:
+- tariff lines: one gather on the compiled price tables
+- packs: re-detected per rental and person; the optimizer runs once per distinct
+  (rental length, component counts) composition (greedy for groups too large
+  for the exact one) and the saving is spread over the group's lines
+CPU-bound: the endpoint runs simulate() in a worker thread.
+- generic items and types without tariff keep what was actually charged
+"""
+import os
+import time
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, List
+
+import numpy as np
+
+from pricing_engine import CompiledPricing, PRICE_COLUMNS, duration_columns, pack_cover
+
+SEASON_CACHE_SECONDS = float(os.environ.get("SIMULATION_CACHE_SECONDS", "300"))
+DURATION_LABELS = [""] + [str(d) for d in range(1, PRICE_COLUMNS - 1)] + [f"{PRICE_COLUMNS - 1}+"]
+
+
+@dataclass
+class SeasonLines:
+    types: List[str]
+    type_codes: np.ndarray   # index into types
+    days: np.ndarray
+    actual: np.ndarray       # what was charged for the line
+    quantity: np.ndarray
+    generic: np.ndarray      # bool
+    group: np.ndarray        # rental x person group id
+    weeks: List[str]
+    week_codes: np.ndarray
+    rentals: int
+
+    def __len__(self):
+        return len(self.type_codes)
+
+
+def _iso_week(start_date: str) -> str:
+    try:
+        year, week, _ = date.fromisoformat(start_date[:10]).isocalendar()
+        return f"{year}-W{week:02d}"
+    except (TypeError, ValueError):
+        return "sin-fecha"
+
+
+async def load_season_lines(db, store_filter: dict, start_date: str, end_date: str) -> SeasonLines:
+    """Unwind the rentals started in [start_date, end_date] into columnar arrays"""
+    pipeline = [
+        {"$match": {
+            **store_filter,
+            "start_date": {"$gte": start_date, "$lte": f"{end_date}T23:59:59"},
+            "status": {"$nin": ["cancelled", "deleted"]},
+        }},
+        {"$project": {
+            "_id": 0, "start_date": 1, "days": 1,
+            "items.item_type": 1, "items.unit_price": 1, "items.quantity": 1,
+            "items.is_generic": 1, "items.person_name": 1,
+        }},
+    ]
+    type_index: Dict[str, int] = {}
+    week_index: Dict[str, int] = {}
+    week_of_date: Dict[str, int] = {}
+    type_codes, days, actual, quantity, generic, group, week_codes = [], [], [], [], [], [], []
+    groups: Dict[tuple, int] = {}
+    rentals = 0
+
+    async for rental in db.rentals.aggregate(pipeline, batchSize=5000):
+        rentals += 1
+        start = (rental.get("start_date") or "")[:10]
+        week = week_of_date.get(start)
+        if week is None:
+            week = week_index.setdefault(_iso_week(start), len(week_index))
+            week_of_date[start] = week
+        rental_days = int(rental.get("days") or 1)
+        for line in rental.get("items") or []:
+            item_type = line.get("item_type") or ""
+            qty = max(int(line.get("quantity") or 1), 1)
+            is_generic = bool(line.get("is_generic"))
+            type_codes.append(type_index.setdefault(item_type, len(type_index)))
+            days.append(rental_days)
+            unit_price = float(line.get("unit_price") or 0)
+            actual.append(unit_price * qty if is_generic else unit_price)
+            quantity.append(qty)
+            generic.append(is_generic)
+            group.append(groups.setdefault((rentals, line.get("person_name") or ""), len(groups)))
+            week_codes.append(week)
+
+    return SeasonLines(
+        types=list(type_index),
+        type_codes=np.asarray(type_codes, dtype=np.int64),
+        days=np.asarray(days, dtype=np.int64),
+        actual=np.asarray(actual, dtype=np.float64),
+        quantity=np.asarray(quantity, dtype=np.float64),
+        generic=np.asarray(generic, dtype=bool),
+        group=np.asarray(group, dtype=np.int64),
+        weeks=list(week_index),
+        week_codes=np.asarray(week_codes, dtype=np.int64),
+        rentals=rentals,
+    )
+
+
+class SeasonCache:
+    def __init__(self, ttl: float = SEASON_CACHE_SECONDS):
+        self.ttl = ttl
+        self._entries: Dict[tuple, tuple] = {}
+
+    async def get(self, db, store_id, store_filter: dict, start_date: str, end_date: str) -> SeasonLines:
+        key = (store_id, start_date, end_date)
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+        lines = await load_season_lines(db, store_filter, start_date, end_date)
+        self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+        self._entries[key] = (now + self.ttl, lines)
+        return lines
+
+
+season_cache = SeasonCache()
+
+
+def reprice(lines: SeasonLines, compiled: CompiledPricing, apply_packs: bool = True) -> np.ndarray:
+    """Price of every historical line under `compiled` (vectorized)"""
+    if not len(lines):
+        return np.zeros(0)
+    type_rows = np.array([compiled.type_row(t) for t in lines.types], dtype=np.int64)
+    type_has_tariff = np.array([compiled.has_tariff(t) for t in lines.types], dtype=bool)
+
+    rows = type_rows[lines.type_codes]
+    has_tariff = type_has_tariff[lines.type_codes]
+    cols = duration_columns(lines.days)
+
+    price = compiled.tariff_table[rows, cols]
+    price = np.where(lines.generic | ~has_tariff, lines.actual, price)
+
+    if not (apply_packs and compiled.packs):
+        return price
+
+    pack_type_index = {t: i for i, t in enumerate(compiled.pack_types)}
+    type_pack_slot = np.array([pack_type_index.get(t, -1) for t in lines.types], dtype=np.int64)
+    slots = type_pack_slot[lines.type_codes]
+    eligible = (slots >= 0) & ~lines.generic & has_tariff
+    if not eligible.any():
+        return price
+
+    _, group_idx = np.unique(lines.group[eligible], return_inverse=True)
+    group_idx = group_idx.reshape(-1)
+    n_groups = int(group_idx.max()) + 1
+    counts = np.zeros((n_groups, len(compiled.pack_types)), dtype=np.int64)
+    np.add.at(counts, (group_idx, slots[eligible]), 1)
+    group_cols = np.zeros(n_groups, dtype=np.int64)
+    group_cols[group_idx] = cols[eligible]
+    singles = np.bincount(group_idx, weights=price[eligible], minlength=n_groups)
+
+    # One optimizer run per distinct composition (bounded: large groups fall back to greedy)
+    compositions, comp_idx = np.unique(np.column_stack([group_cols, counts]), axis=0, return_inverse=True)
+    comp_idx = comp_idx.reshape(-1)
+    best = np.array([
+        pack_cover(compiled, int(row[0]), row[1:])[0]
+        for row in compositions
+    ])[comp_idx]
+
+    ratio = np.divide(best, singles, out=np.ones(n_groups), where=singles > 0)
+    price = price.copy()
+    price[eligible] *= ratio[group_idx]
+    return price
+
+
+def _breakdown(codes: np.ndarray, labels: List[str], actual, current, proposed) -> List[dict]:
+    size = len(labels)
+    sums = {
+        name: np.bincount(codes, weights=values, minlength=size)
+        for name, values in (("actual", actual), ("current", current), ("proposed", proposed))
+    }
+    count = np.bincount(codes, minlength=size)
+    rows = []
+    for i, label in enumerate(labels):
+        if not count[i]:
+            continue
+        rows.append({
+            "key": label,
+            "lines": int(count[i]),
+            "actual": round(float(sums["actual"][i]), 2),
+            "current": round(float(sums["current"][i]), 2),
+            "proposed": round(float(sums["proposed"][i]), 2),
+            "delta": round(float(sums["proposed"][i] - sums["current"][i]), 2),
+        })
+    return rows
+
+
+def simulate(lines: SeasonLines, current: CompiledPricing, proposed: CompiledPricing, apply_packs: bool = True) -> dict:
+    """
+    Revenue impact of `proposed` vs the current tariffs (same detection rules on both
+    sides, so the delta isolates the price change) and vs what was actually charged.
+    """
+    actual = lines.actual
+    current_prices = reprice(lines, current, apply_packs)
+    proposed_prices = reprice(lines, proposed, apply_packs)
+
+    by_type = _breakdown(lines.type_codes, lines.types, actual, current_prices, proposed_prices)
+    for row in by_type:
+        row["item_type"] = row.pop("key")
+    by_type.sort(key=lambda r: abs(r["delta"]), reverse=True)
+
+    by_duration = _breakdown(duration_columns(lines.days), DURATION_LABELS, actual, current_prices, proposed_prices)
+    for row in by_duration:
+        row["days"] = row.pop("key")
+
+    by_week = _breakdown(lines.week_codes, lines.weeks, actual, current_prices, proposed_prices)
+    for row in by_week:
+        row["week"] = row.pop("key")
+    by_week.sort(key=lambda r: r["week"])
+
+    totals = {
+        "actual": round(float(actual.sum()), 2),
+        "current": round(float(current_prices.sum()), 2),
+        "proposed": round(float(proposed_prices.sum()), 2),
+    }
+    totals["delta_vs_current"] = round(totals["proposed"] - totals["current"], 2)
+    totals["delta_vs_actual"] = round(totals["proposed"] - totals["actual"], 2)
+
+    return {
+        "rentals": lines.rentals,
+        "lines": len(lines),
+        "totals": totals,
+        "by_type": by_type,
+        "by_duration": by_duration,
+        "by_week": by_week,
+    }
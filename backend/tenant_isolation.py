@@ -0,0 +1,242 @@
+"""
+Tenant isolation check
+Documents of the checked collections must carry the store_id of an existing
+store. The check runs in the background (never at startup), in one worker at
+a time (lease, renewed after every batch), every ISOLATION_CHECK_SECONDS:
+- new documents: read in _id order from the collection's watermark (last
+  checked _id, minus OVERLAP_SECONDS for ObjectIds generated out of order by
+  other processes), {_id, store_id} only, over the _id index
+- deleted stores (stores of the previous run that no longer exist): their
+  documents are read through the store_id-prefixed indexes
+- recorded orphans are rechecked, and dropped once fixed or deleted
+Orphans are kept in tenant_isolation_orphans (one doc per collection and _id)
+and reported by /api/admin/tenant-isolation. MongoDB partial indexes cannot
+select a missing or null store_id, so the watermark is what keeps each run
+to the documents written since the previous one.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+STATE_COLLECTION = "tenant_isolation"
+ORPHANS_COLLECTION = "tenant_isolation_orphans"
+CHECKED_COLLECTIONS = ("items", "customers", "rentals", "cash_movements")
+CHECK_SECONDS = int(os.environ.get("ISOLATION_CHECK_SECONDS", "900"))
+STARTUP_DELAY_SECONDS = 60
+OVERLAP_SECONDS = 60
+LEASE_SECONDS = 600
+BATCH_SIZE = 5000
+SAMPLE_SIZE = 20
+RUN_ID = "_run"
+
+
+class TenantIsolation:
+    def __init__(self):
+        self.db = None
+        self.worker_id = uuid.uuid4().hex
+        self._worker = None
+
+    def attach(self, db):
+        self.db = db
+
+    @property
+    def state(self):
+        return self.db[STATE_COLLECTION]
+
+    @property
+    def orphans(self):
+        return self.db[ORPHANS_COLLECTION]
+
+    async def create_indexes(self):
+        await self.orphans.create_index([("collection", 1), ("doc_id", 1)], unique=True)
+
+    # ----- Lease -----
+
+    async def _acquire(self) -> bool:
+        now = datetime.now(timezone.utc)
+        try:
+            await self.state.find_one_and_update(
+                {"_id": RUN_ID, "$or": [{"lease_until": None}, {"lease_until": {"$lte": now.isoformat()}}]},
+                {"$set": {"lease_until": (now + timedelta(seconds=LEASE_SECONDS)).isoformat(), "worker": self.worker_id}},
+                upsert=True,
+            )
+            return True
+        except DuplicateKeyError:
+            return False  # held by another worker
+
+    async def _renew(self):
+        """Extend the lease after a batch; a run whose lease was taken over stops"""
+        until = (datetime.now(timezone.utc) + timedelta(seconds=LEASE_SECONDS)).isoformat()
+        result = await self.state.update_one({"_id": RUN_ID, "worker": self.worker_id}, {"$set": {"lease_until": until}})
+        if not result.matched_count:
+            raise RuntimeError("Tenant isolation lease lost to another worker")
+
+    async def _release(self):
+        await self.state.update_one({"_id": RUN_ID, "worker": self.worker_id}, {"$set": {"lease_until": None}})
+
+    # ----- Checks -----
+
+    async def _record(self, collection: str, docs: List[dict]):
+        now = datetime.now(timezone.utc).isoformat()
+        await self.orphans.bulk_write([
+            UpdateOne(
+                {"collection": collection, "doc_id": d["_id"]},
+                {"$set": {"store_id": d.get("store_id"), "seen_at": now}, "$setOnInsert": {"found_at": now}},
+                upsert=True,
+            )
+            for d in docs
+        ], ordered=False)
+
+    async def _scan_new(self, collection: str, valid: set) -> int:
+        """Documents after the watermark; returns how many were read"""
+        state = await self.state.find_one({"_id": collection}) or {}
+        last_id = state.get("last_id")
+        query = {}
+        if isinstance(last_id, ObjectId):
+            since = last_id.generation_time - timedelta(seconds=OVERLAP_SECONDS)
+            query = {"_id": {"$gt": ObjectId.from_datetime(since)}}
+        elif last_id is not None:
+            query = {"_id": {"$gt": last_id}}
+        checked = 0
+        while True:
+            cursor = self.db[collection].find(query, {"_id": 1, "store_id": 1}).sort("_id", 1).limit(BATCH_SIZE)
+            docs = await cursor.to_list(None)
+            if not docs:
+                break
+            orphans = [d for d in docs if d.get("store_id") not in valid]
+            if orphans:
+                await self._record(collection, orphans)
+            last_id = docs[-1]["_id"]
+            checked += len(docs)
+            update = {"last_id": last_id, "checked_at": datetime.now(timezone.utc).isoformat()}
+            if isinstance(last_id, ObjectId):
+                update["last_created_at"] = last_id.generation_time.isoformat()
+            await self.state.update_one({"_id": collection}, {"$set": update, "$inc": {"checked": len(docs)}},
+                                        upsert=True)
+            await self._renew()
+            query = {"_id": {"$gt": last_id}}
+        return checked
+
+    async def _scan_stores(self, collection: str, store_ids: List) -> int:
+        """Documents left behind by deleted stores (store_id-prefixed indexes)"""
+        found, batch = 0, []
+        async for doc in self.db[collection].find({"store_id": {"$in": store_ids}}, {"_id": 1, "store_id": 1}):
+            batch.append(doc)
+            if len(batch) >= BATCH_SIZE:
+                await self._record(collection, batch)
+                await self._renew()
+                found, batch = found + len(batch), []
+        if batch:
+            await self._record(collection, batch)
+        return found + len(batch)
+
+    async def _recheck(self, valid: set) -> int:
+        """Drop recorded orphans that were fixed or deleted"""
+        resolved = 0
+        for collection in CHECKED_COLLECTIONS:
+            ids = await self.orphans.distinct("doc_id", {"collection": collection})
+            for start in range(0, len(ids), BATCH_SIZE):
+                chunk = ids[start:start + BATCH_SIZE]
+                current = await self.db[collection].find({"_id": {"$in": chunk}}, {"_id": 1, "store_id": 1}).to_list(None)
+                still = {d["_id"] for d in current if d.get("store_id") not in valid}
+                fixed = [i for i in chunk if i not in still]
+                if fixed:
+                    result = await self.orphans.delete_many({"collection": collection, "doc_id": {"$in": fixed}})
+                    resolved += result.deleted_count
+                await self._renew()
+        return resolved
+
+    async def run_once(self, full: bool = False) -> dict:
+        """One check if no other worker is running one; full=True rechecks every document"""
+        if not await self._acquire():
+            return {"skipped": True, "reason": "already running"}
+        try:
+            started = datetime.now(timezone.utc)
+            stores = sorted(await self.db.stores.distinct("store_id"))
+            valid = set(stores)
+            run = await self.state.find_one({"_id": RUN_ID}) or {}
+            removed = sorted(set(run.get("stores") or []) - valid)
+            if full:
+                await self.state.delete_many({"_id": {"$in": list(CHECKED_COLLECTIONS)}})
+            before = await self.orphans.count_documents({})
+            checked: Dict[str, int] = {}
+            for collection in CHECKED_COLLECTIONS:
+                checked[collection] = await self._scan_new(collection, valid)
+                if removed:
+                    await self._scan_stores(collection, removed)
+            resolved = await self._recheck(valid)
+            total = await self.orphans.count_documents({})
+            result = {
+                "started_at": started.isoformat(),
+                "finished_at": datetime.now(timezone.utc).isoformat(),
+                "full": full,
+                "checked": checked,
+                "deleted_stores": removed,
+                "resolved": resolved,
+                "orphans": total,
+            }
+            await self.state.update_one({"_id": RUN_ID}, {"$set": {"stores": stores, "last_run": result}})
+            if total > before:
+                logger.error(f"🚨 MULTI-TENANT VIOLATION: {total} records without a valid store_id (see /api/admin/tenant-isolation)")
+            return result
+        finally:
+            await self._release()
+
+    async def report(self, collections: Iterable[str] = CHECKED_COLLECTIONS) -> dict:
+        """Last run, watermark per collection and the orphans found (a sample of each)"""
+        run = await self.state.find_one({"_id": RUN_ID}, {"_id": 0, "worker": 0}) or {}
+        states = {s["_id"]: s async for s in self.state.find({"_id": {"$in": list(collections)}})}
+        report = {}
+        for collection in collections:
+            state = states.get(collection, {})
+            sample = await self.orphans.find(
+                {"collection": collection}, {"_id": 0, "collection": 0}
+            ).sort("found_at", -1).to_list(SAMPLE_SIZE)
+            report[collection] = {
+                "last_id": str(state["last_id"]) if state.get("last_id") is not None else None,
+                "last_created_at": state.get("last_created_at"),
+                "checked": state.get("checked", 0),
+                "checked_at": state.get("checked_at"),
+                "orphans": await self.orphans.count_documents({"collection": collection}),
+                "sample": [{**o, "doc_id": str(o["doc_id"])} for o in sample],
+            }
+        return {
+            "isolated": not any(c["orphans"] for c in report.values()),
+            "last_run": run.get("last_run"),
+            "running": (run.get("lease_until") or "") > datetime.now(timezone.utc).isoformat(),
+            "stores": run.get("stores"),
+            "collections": report,
+        }
+
+    # ----- Background loop -----
+
+    async def _run(self):
+        await asyncio.sleep(STARTUP_DELAY_SECONDS)
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"❌ Tenant isolation check failed (retried next cycle): {e}")
+            await asyncio.sleep(CHECK_SECONDS)
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run(), context=contextvars.Context())
+
+    def stop(self):
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+
+
+tenant_isolation = TenantIsolation()
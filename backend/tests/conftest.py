@@ -0,0 +1,38 @@
+"""
+Shared fixtures of the HTTP test suite
+Store-scoped tests run as admin_master impersonating TEST_STORE_ID (default 3):
+take `store_headers` (and `store_id` where the store is asserted). A module or
+class that needs another store overrides the `store_id` fixture.
+"""
+import os
+
+import pytest
+import requests
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+TEST_STORE_ID = int(os.environ.get('TEST_STORE_ID', '3'))
+
+
+@pytest.fixture
+def store_id():
+    """Store the store-scoped tests run against"""
+    return TEST_STORE_ID
+
+
+@pytest.fixture
+def super_headers():
+    """Login as admin_master (super_admin)"""
+    response = requests.post(
+        f"{BASE_URL}/api/auth/login",
+        json={"username": "admin_master", "password": "admin123"}
+    )
+    assert response.status_code == 200, f"Login failed: {response.text}"
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture
+def store_headers(super_headers, store_id):
+    """admin_master impersonating `store_id`"""
+    response = requests.post(f"{BASE_URL}/api/stores/{store_id}/impersonate", headers=super_headers)
+    assert response.status_code == 200, f"Failed to impersonate store {store_id}: {response.text}"
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
@@ -0,0 +1,119 @@
+"""
+Pytest plugin: N+1 query detector
+The backend (started with QUERY_BUDGET_CHECK=1) records the Mongo queries of
+every request with its command listener and checks them against the budget
+declared with @query_budget next to each route in server.py. This plugin hooks
+every `requests` call made by the tests and fails the test as soon as a
+response reports a budget violation or repeated same-shape queries.
+
+Options:
+    --query-budget=enforce  (default) fail the test on a violation
+    --query-budget=report   only list violations in the terminal summary
+    --query-budget=off      disable
+"""
+import json
+
+import pytest
+import requests
+
+HEADER_COUNT = "X-Query-Count"
+HEADER_VIOLATIONS = "X-Query-Budget-Violations"
+
+
+class QueryBudgetViolation(AssertionError):
+    pass
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--query-budget",
+        action="store",
+        default="enforce",
+        choices=("enforce", "report", "off"),
+        help="N+1 query detector mode (server must run with QUERY_BUDGET_CHECK=1)",
+    )
+
+
+class QueryBudgetRecorder:
+    def __init__(self, mode):
+        self.mode = mode
+        self.violations = []        # (test nodeid, method, url, payload)
+        self.checked_responses = 0
+        self.unchecked_responses = 0
+        self.current_test = None
+        self._original_send = None
+
+    def install(self):
+        self._original_send = requests.Session.send
+        recorder = self
+
+        def send(session, request, **kwargs):
+            response = recorder._original_send(session, request, **kwargs)
+            recorder.inspect(request, response)
+            return response
+
+        requests.Session.send = send
+
+    def uninstall(self):
+        if self._original_send is not None:
+            requests.Session.send = self._original_send
+
+    def inspect(self, request, response):
+        if HEADER_COUNT not in response.headers:
+            self.unchecked_responses += 1
+            return
+        self.checked_responses += 1
+        raw = response.headers.get(HEADER_VIOLATIONS)
+        if not raw:
+            return
+        try:
+            payload = json.loads(raw)
+        except ValueError:
+            payload = {"route": request.path_url, "violations": [raw]}
+        self.violations.append((self.current_test, request.method, request.path_url, payload))
+        if self.mode == "enforce":
+            raise QueryBudgetViolation(
+                f"Query budget exceeded on {request.method} {payload.get('route')} "
+                f"({response.headers[HEADER_COUNT]} queries): " + "; ".join(payload.get("violations", []))
+            )
+
+
+def pytest_configure(config):
+    mode = config.getoption("--query-budget")
+    if mode == "off":
+        return
+    recorder = QueryBudgetRecorder(mode)
+    recorder.install()
+    config._query_budget_recorder = recorder
+
+
+def pytest_unconfigure(config):
+    recorder = getattr(config, "_query_budget_recorder", None)
+    if recorder:
+        recorder.uninstall()
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_call(item):
+    recorder = getattr(item.config, "_query_budget_recorder", None)
+    if recorder:
+        recorder.current_test = item.nodeid
+    yield
+    if recorder:
+        recorder.current_test = None
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    recorder = getattr(config, "_query_budget_recorder", None)
+    if not recorder:
+        return
+    if recorder.violations:
+        terminalreporter.section("query budget violations (N+1)")
+        for nodeid, method, url, payload in recorder.violations:
+            terminalreporter.write_line(f"{nodeid}: {method} {payload.get('route', url)}")
+            for violation in payload.get("violations", []):
+                terminalreporter.write_line(f"    {violation}")
+    if recorder.unchecked_responses and not recorder.checked_responses:
+        terminalreporter.write_line(
+            "query budget: backend did not report query counts - start it with QUERY_BUDGET_CHECK=1"
+        )
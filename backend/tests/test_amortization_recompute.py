@@ -0,0 +1,72 @@
+"""
+Test bulk amortization recompute
+- update_tariff schedules a background run and returns its id
+- The run reaches 'done' and item amortization = days_used x day_1
+"""
+import pytest
+import requests
+import os
+import time
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+class TestAmortizationRecompute:
+    """Amortization follows tariff edits without touching items one by one"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, store_headers):
+        self.headers = store_headers
+
+    def _wait_run(self, run_id, timeout=15):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            response = requests.get(f"{BASE_URL}/api/items/amortization/runs/{run_id}", headers=self.headers)
+            assert response.status_code == 200, response.text
+            run = response.json()
+            if run["status"] in ("done", "failed"):
+                return run
+            time.sleep(0.3)
+        pytest.fail(f"Amortization run {run_id} did not finish")
+
+    def test_tariff_update_recomputes_amortization(self):
+        item_type = f"TEST_amort_{uuid.uuid4().hex[:6]}"
+        code = f"TEST-AM-{uuid.uuid4().hex[:8].upper()}"
+        requests.post(f"{BASE_URL}/api/tariffs", headers=self.headers, json={"item_type": item_type, "day_1": 10})
+        item = requests.post(
+            f"{BASE_URL}/api/items",
+            headers=self.headers,
+            json={"internal_code": code, "barcode": code, "item_type": item_type, "brand": "Test", "size": "M"}
+        )
+        assert item.status_code == 200, item.text
+        item_id = item.json()["id"]
+
+        tariff_id = requests.get(f"{BASE_URL}/api/tariffs/{item_type}", headers=self.headers).json()["id"]
+        response = requests.put(
+            f"{BASE_URL}/api/tariffs/{tariff_id}",
+            headers=self.headers,
+            json={"item_type": item_type, "day_1": 25}
+        )
+        assert response.status_code == 200, response.text
+        run_id = response.json()["amortization_run_id"]
+
+        run = self._wait_run(run_id)
+        assert run["status"] == "done", run
+        assert run["types_done"] == run["types_total"] == 1
+
+        items = requests.get(f"{BASE_URL}/api/items?search={code}", headers=self.headers).json()
+        stored = next(i for i in items if i["id"] == item_id)
+        assert stored["amortization"] == stored.get("days_used", 0) * 25
+
+        requests.delete(f"{BASE_URL}/api/items/{item_id}?force=true", headers=self.headers)
+        requests.delete(f"{BASE_URL}/api/tariffs/{item_type}", headers=self.headers)
+
+    def test_manual_recompute_and_listing(self):
+        response = requests.post(f"{BASE_URL}/api/items/amortization/recompute", headers=self.headers)
+        assert response.status_code == 200, response.text
+        run = self._wait_run(response.json()["run_id"], timeout=60)
+        assert run["status"] == "done", run
+
+        runs = requests.get(f"{BASE_URL}/api/items/amortization/runs?limit=5", headers=self.headers)
+        assert runs.status_code == 200
+        assert any(r["id"] == run["id"] for r in runs.json())
@@ -0,0 +1,50 @@
+"""
+Test season analytics cube (/api/analytics/cube)
+- Rental-level totals match across group-bys (day vs week vs season)
+- Line-level group-by returns utilization per item type
+- Unknown dimensions are rejected
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+PERIOD = {"date_from": "2020-01-01", "date_to": "2030-12-31"}
+
+class TestAnalyticsCube:
+    """Slice and dice over the precomputed cube"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, store_headers):
+        self.headers = store_headers
+
+    def _query(self, **params):
+        response = requests.get(f"{BASE_URL}/api/analytics/cube", headers=self.headers, params={**PERIOD, **params})
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    def test_totals_consistent_across_group_bys(self):
+        rebuild = requests.post(f"{BASE_URL}/api/analytics/cube/rebuild", headers=self.headers)
+        assert rebuild.status_code == 200, rebuild.text
+        totals = [
+            sum(row["rentals"] for row in self._query(group_by=dims)["rows"])
+            for dims in ("local_date", "week", "season,payment_method", "source")
+        ]
+        assert len(set(totals)) == 1
+        revenue = [
+            round(sum(row["revenue"] for row in self._query(group_by=dims)["rows"]), 0)
+            for dims in ("month", "item_type,category")
+        ]
+        assert revenue[0] == pytest.approx(revenue[1], abs=len(self._query(group_by="item_type,category")["rows"]))
+
+    def test_item_type_utilization(self):
+        result = self._query(group_by="item_type,week")
+        assert result["level"] == "line"
+        for row in result["rows"]:
+            assert "utilization" in row
+            assert row["week"][4:6] == "-W"
+
+    def test_unknown_dimension_rejected(self):
+        response = requests.get(f"{BASE_URL}/api/analytics/cube", headers=self.headers, params={"group_by": "colour"})
+        assert response.status_code == 400
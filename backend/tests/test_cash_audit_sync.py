@@ -0,0 +1,41 @@
+"""
+Test set-based cash audit-sync (/api/cash/audit-sync)
+- dry_run reports the missing movements without writing them
+- After a sync nothing is left missing and operation numbers are consecutive
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+class TestCashAuditSync:
+    """Anti-join audit + bulk insert"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, store_headers):
+        self.headers = store_headers
+
+    def test_dry_run_then_sync(self):
+        dry = requests.post(f"{BASE_URL}/api/cash/audit-sync", headers=self.headers, params={"dry_run": "true"})
+        if dry.status_code == 400:
+            pytest.skip("No open cash session")
+        assert dry.status_code == 200, dry.text
+        report = dry.json()
+        assert report["dry_run"] is True
+        assert report["movements_missing"] == len(report["details"])
+        assert all(d["operation_number"] is None for d in report["details"])
+
+        # dry run wrote nothing: still reported as missing
+        again = requests.post(f"{BASE_URL}/api/cash/audit-sync", headers=self.headers, params={"dry_run": "true"}).json()
+        assert again["movements_missing"] == report["movements_missing"]
+
+        sync = requests.post(f"{BASE_URL}/api/cash/audit-sync", headers=self.headers)
+        assert sync.status_code == 200, sync.text
+        created = sync.json()
+        assert created["movements_created"] >= report["movements_missing"]
+        numbers = [int(d["operation_number"][1:]) for d in created["details"]]
+        assert numbers == list(range(numbers[0], numbers[0] + len(numbers))) if numbers else True
+
+        after = requests.post(f"{BASE_URL}/api/cash/audit-sync", headers=self.headers, params={"dry_run": "true"}).json()
+        assert after["movements_missing"] == 0
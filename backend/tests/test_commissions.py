@@ -0,0 +1,45 @@
+"""
+Test provider commissions
+- Range report commission rows are consistent (percent applied to revenue)
+- Source stats totals match their rental list
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+class TestCommissions:
+    """Commissions computed in one aggregation per report"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, store_headers):
+        self.headers = store_headers
+
+    def test_range_report_commissions(self):
+        response = requests.get(
+            f"{BASE_URL}/api/reports/range",
+            headers=self.headers,
+            params={"start_date": "2020-01-01", "end_date": "2030-12-31"}
+        )
+        assert response.status_code == 200, response.text
+        commissions = response.json()["commissions"]
+        for row in commissions:
+            assert row["revenue_generated"] > 0
+            assert row["customer_count"] > 0
+            assert row["commission_amount"] == pytest.approx(row["revenue_generated"] * row["commission_percent"] / 100)
+        assert len({row["provider_id"] for row in commissions}) == len(commissions)
+
+    def test_source_stats_match_rentals(self):
+        sources = requests.get(f"{BASE_URL}/api/sources", headers=self.headers).json()
+        if not sources:
+            pytest.skip("No sources")
+        response = requests.get(f"{BASE_URL}/api/sources/{sources[0]['id']}/stats", headers=self.headers)
+        assert response.status_code == 200, response.text
+        data = response.json()
+        rentals = data["rentals"]
+        assert data["stats"]["total_rentals"] == len(rentals)
+        assert len({r["rental_id"] for r in rentals}) == len(rentals)
+        assert data["stats"]["total_revenue"] == pytest.approx(sum(r["amount"] for r in rentals))
+        dates = [r["date"] for r in rentals]
+        assert dates == sorted(dates, reverse=True)
@@ -0,0 +1,58 @@
+"""
+Test store configuration cache (tariffs, packs, item types, sources, settings)
+- Writes are visible immediately on the next read (versioned invalidation)
+- Hit rates exposed on /api/admin/cache-stats
+"""
+import pytest
+import requests
+import os
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+class TestConfigCache:
+    """Config reads served from cache must never be stale after a write"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, store_headers):
+        self.headers = store_headers
+
+    def test_tariff_write_invalidates_cache(self):
+        item_type = f"TEST_cache_{uuid.uuid4().hex[:6]}"
+        requests.get(f"{BASE_URL}/api/tariffs", headers=self.headers)  # warm cache
+
+        response = requests.post(
+            f"{BASE_URL}/api/tariffs",
+            headers=self.headers,
+            json={"item_type": item_type, "day_1": 12.5}
+        )
+        assert response.status_code == 200, response.text
+
+        tariff = requests.get(f"{BASE_URL}/api/tariffs/{item_type}", headers=self.headers)
+        assert tariff.status_code == 200
+        assert tariff.json()["day_1"] == 12.5
+
+        requests.delete(f"{BASE_URL}/api/tariffs/{item_type}", headers=self.headers)
+        gone = requests.get(f"{BASE_URL}/api/tariffs/{item_type}", headers=self.headers)
+        assert gone.status_code == 404
+
+    def test_settings_write_invalidates_cache(self):
+        current = requests.get(f"{BASE_URL}/api/settings", headers=self.headers).json()
+        footer = f"TEST footer {uuid.uuid4().hex[:6]}"
+        payload = {**current, "ticket_footer": footer}
+        response = requests.post(f"{BASE_URL}/api/settings", headers=self.headers, json=payload)
+        assert response.status_code == 200, response.text
+
+        after = requests.get(f"{BASE_URL}/api/settings", headers=self.headers).json()
+        assert after["ticket_footer"] == footer
+
+        requests.post(f"{BASE_URL}/api/settings", headers=self.headers, json=current)
+
+    def test_cache_stats(self):
+        requests.get(f"{BASE_URL}/api/packs", headers=self.headers)
+        requests.get(f"{BASE_URL}/api/packs", headers=self.headers)
+        response = requests.get(f"{BASE_URL}/api/admin/cache-stats", headers=self.headers)
+        assert response.status_code == 200
+        rates = response.json()["config_cache_hit_rates"]
+        assert set(rates) == {"tariffs", "packs", "item_types", "sources", "settings"}
+        assert rates["packs"] is not None
@@ -0,0 +1,68 @@
+"""
+Test item type registry (live item counts per type)
+- /item-types lists a type as soon as an item uses it, with item_count
+- Counts follow create / soft delete / hard delete without scanning items
+- delete_item_type reports counts from the registry
+"""
+import pytest
+import requests
+import os
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+class TestItemTypeRegistry:
+    """Registry counts must match the inventory after every item write"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, store_headers):
+        self.headers = store_headers
+
+    def _type_entry(self, type_value):
+        response = requests.get(f"{BASE_URL}/api/item-types", headers=self.headers)
+        assert response.status_code == 200
+        return next((t for t in response.json() if t["value"] == type_value), None)
+
+    def _create_item(self, type_value):
+        code = f"TEST-REG-{uuid.uuid4().hex[:8].upper()}"
+        response = requests.post(
+            f"{BASE_URL}/api/items",
+            headers=self.headers,
+            json={"internal_code": code, "barcode": code, "item_type": type_value, "brand": "Test", "size": "42"}
+        )
+        assert response.status_code == 200, response.text
+        return response.json()["id"]
+
+    def test_counts_follow_item_writes(self):
+        type_value = f"TEST_registry_{uuid.uuid4().hex[:6]}"
+        first = self._create_item(type_value)
+        second = self._create_item(type_value)
+
+        entry = self._type_entry(type_value)
+        assert entry is not None, "New type must be listed immediately"
+        assert entry["item_count"] == 2
+
+        requests.delete(f"{BASE_URL}/api/items/{first}", headers=self.headers)
+        assert self._type_entry(type_value)["item_count"] == 1
+
+        requests.delete(f"{BASE_URL}/api/items/{second}", headers=self.headers)
+        assert self._type_entry(type_value) is None, "Type without items must disappear"
+
+    def test_delete_type_blocked_with_registry_counts(self):
+        type_value = f"TEST_registry_{uuid.uuid4().hex[:6]}"
+        created = requests.post(
+            f"{BASE_URL}/api/item-types",
+            headers=self.headers,
+            json={"value": type_value, "label": type_value}
+        )
+        assert created.status_code == 200, created.text
+        type_id = created.json()["id"]
+        item_id = self._create_item(type_value)
+
+        response = requests.delete(f"{BASE_URL}/api/item-types/{type_id}", headers=self.headers)
+        assert response.status_code == 400
+        detail = response.json()["detail"]
+        assert detail["total_items"] == 1
+        assert detail["active_items"] == 1
+
+        requests.delete(f"{BASE_URL}/api/items/{item_id}?force=true", headers=self.headers)
@@ -0,0 +1,68 @@
+"""
+Test background jobs (?async=true variants and /api/jobs)
+- Async export returns 202 with a job that finishes with a downloadable file
+- Async import reports progress and the same result as the synchronous call
+- Cancel / unknown jobs
+"""
+import time
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+class TestJobs:
+    """Background job queue"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, store_headers):
+        self.headers = store_headers
+
+    def _wait(self, job_id, timeout=60):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            response = requests.get(f"{BASE_URL}/api/jobs/{job_id}", headers=self.headers)
+            assert response.status_code == 200, response.text
+            job = response.json()
+            if job["status"] in ("done", "failed", "cancelled"):
+                return job
+            time.sleep(1)
+        pytest.fail(f"Job {job_id} did not finish")
+
+    def test_async_items_export(self):
+        response = requests.get(f"{BASE_URL}/api/items/export-csv", headers=self.headers, params={"async": "true"})
+        assert response.status_code == 202, response.text
+        job = response.json()
+        assert job["kind"] == "items.export_csv" and job["status"] == "queued"
+        assert job["required_role"] == "employee"  # GET /items/export-csv only needs a login
+        job = self._wait(job["id"])
+        assert job["status"] == "done", job.get("error")
+        assert job["file"]["filename"] == "inventario.csv"
+        download = requests.get(f"{BASE_URL}/api/jobs/{job['id']}/download", headers=self.headers)
+        assert download.status_code == 200
+        assert download.text.startswith("barcode,item_type")
+
+    def test_async_customer_import(self):
+        dni = f"TESTJOB{int(time.time())}"
+        body = {"customers": [{"dni": dni, "name": "TEST Job Customer"}]}
+        response = requests.post(f"{BASE_URL}/api/customers/import", headers=self.headers, json=body, params={"async": "true"})
+        assert response.status_code == 202, response.text
+        job = self._wait(response.json()["id"])
+        assert job["status"] == "done", job.get("error")
+        assert job["result"]["imported"] == 1
+        assert job["progress"]["done"] == job["progress"]["total"] == 1
+        # Re-running the same import only finds the duplicate
+        response = requests.post(f"{BASE_URL}/api/customers/import", headers=self.headers, json=body)
+        assert response.json()["duplicates"] == 1
+
+    def test_jobs_list(self):
+        response = requests.get(f"{BASE_URL}/api/jobs", headers=self.headers, params={"limit": 5})
+        assert response.status_code == 200
+        for job in response.json():
+            assert "uploads" not in job and "worker" not in job
+            assert job["required_role"] in ("employee", "admin", "super_admin")
+
+    def test_unknown_job(self):
+        for method, path in (("get", ""), ("post", "/cancel"), ("post", "/retry"), ("get", "/download")):
+            response = getattr(requests, method)(f"{BASE_URL}/api/jobs/does-not-exist{path}", headers=self.headers)
+            assert response.status_code == 404, path
@@ -0,0 +1,49 @@
+"""
+Test store-local date keys
+- Cash movement search is scoped to the store and uses local days
+- Store timezone setting is validated
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+class TestLocalDates:
+    """local_date keys on rentals and cash movements"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, super_headers, store_headers, store_id):
+        self.super_headers = super_headers
+        self.headers = store_headers
+        self.store_id = store_id
+
+    def test_search_is_store_scoped(self):
+        response = requests.get(
+            f"{BASE_URL}/api/cash/movements/search",
+            headers=self.headers,
+            params={"date_from": "2020-01-01", "date_to": "2030-12-31", "limit": 100}
+        )
+        assert response.status_code == 200, response.text
+        for movement in response.json()["results"]:
+            assert movement.get("store_id") == self.store_id
+
+    def test_movements_carry_local_date(self):
+        response = requests.get(
+            f"{BASE_URL}/api/cash/movements/history",
+            headers=self.headers,
+            params={"date_from": "2020-01-01"}
+        )
+        assert response.status_code == 200
+        for movement in response.json()[:50]:
+            if "local_date" in movement and movement["local_date"]:
+                assert len(movement["local_date"]) == 10
+                assert movement["local_date"] >= "2020-01-01"
+
+    def test_invalid_timezone_rejected(self):
+        response = requests.put(
+            f"{BASE_URL}/api/stores/{self.store_id}",
+            headers=self.super_headers,
+            json={"timezone": "Mars/Olympus_Mons"}
+        )
+        assert response.status_code == 400
@@ -0,0 +1,51 @@
+"""
+Test paginated pending returns (/api/rentals/pending/returns/by-day)
+- Days are ordered, carry per-day and per-type counts
+- Walking next_cursor covers the same rentals as the legacy endpoint (no 200-row cap)
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+class TestPendingReturnsByDay:
+    """Aggregation-backed pending returns"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, store_headers):
+        self.headers = store_headers
+
+    def test_pages_cover_legacy_list(self):
+        legacy = requests.get(f"{BASE_URL}/api/rentals/pending/returns", headers=self.headers)
+        assert legacy.status_code == 200
+        legacy_ids = {r["id"] for r in legacy.json()["today"] + legacy.json()["other_days"]}
+
+        seen, dates, after = set(), [], None
+        for _ in range(100):
+            params = {"days": 2, **({"after": after} if after else {})}
+            response = requests.get(f"{BASE_URL}/api/rentals/pending/returns/by-day", headers=self.headers, params=params)
+            assert response.status_code == 200, response.text
+            page = response.json()
+            assert len(page["days"]) <= 2
+            for day in page["days"]:
+                assert day["rentals_count"] == len(day["rentals"])
+                assert day["items_count"] == sum(len(r["pending_items"]) for r in day["rentals"])
+                assert sum(t["count"] for t in day["by_type"]) >= day["items_count"]
+                dates.append(day["date"])
+                seen.update(r["id"] for r in day["rentals"])
+            after = page["next_cursor"]
+            if not after:
+                break
+
+        assert dates == sorted(dates)
+        assert len(dates) == len(set(dates))
+        assert seen == legacy_ids
+
+    def test_invalid_cursor_rejected(self):
+        response = requests.get(
+            f"{BASE_URL}/api/rentals/pending/returns/by-day",
+            headers=self.headers,
+            params={"after": "mañana"}
+        )
+        assert response.status_code == 400
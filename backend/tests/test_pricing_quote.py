@@ -0,0 +1,243 @@
+"""
+Test server-side pricing engine (/api/pricing/quote)
+- One call prices a cart for several durations
+- Tariff changes are reflected immediately (compiled tables invalidated)
+- Packs replace the price of their components
+"""
+import pytest
+import requests
+import os
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+class TestPricingQuote:
+    """Batch quote API"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, store_headers):
+        self.headers = store_headers
+
+    def _quote(self, items, durations):
+        response = requests.post(
+            f"{BASE_URL}/api/pricing/quote",
+            headers=self.headers,
+            json={"items": items, "durations": durations}
+        )
+        assert response.status_code == 200, response.text
+        return {q["days"]: q for q in response.json()["quotes"]}
+
+    def test_quote_multiple_durations_and_tariff_update(self):
+        item_type = f"TEST_price_{uuid.uuid4().hex[:6]}"
+        created = requests.post(
+            f"{BASE_URL}/api/tariffs",
+            headers=self.headers,
+            json={"item_type": item_type, "day_1": 10, "day_2": 18, "day_11_plus": 80}
+        )
+        assert created.status_code == 200, created.text
+
+        quotes = self._quote([{"item_type": item_type}, {"item_type": item_type}], [1, 2, 3, 12])
+        assert quotes[1]["total"] == 20
+        assert quotes[2]["total"] == 36
+        assert quotes[3]["total"] == 20  # day_3 missing -> day_1
+        assert quotes[12]["total"] == 160
+
+        tariff_id = requests.get(f"{BASE_URL}/api/tariffs/{item_type}", headers=self.headers).json()["id"]
+        requests.put(
+            f"{BASE_URL}/api/tariffs/{tariff_id}",
+            headers=self.headers,
+            json={"item_type": item_type, "day_1": 15}
+        )
+        assert self._quote([{"item_type": item_type}], [1])[1]["total"] == 15
+
+        requests.delete(f"{BASE_URL}/api/tariffs/{item_type}", headers=self.headers)
+
+    def test_pack_replaces_component_prices(self):
+        suffix = uuid.uuid4().hex[:6]
+        ski, boot = f"TEST_ski_{suffix}", f"TEST_boot_{suffix}"
+        for item_type, price in ((ski, 10), (boot, 6)):
+            requests.post(f"{BASE_URL}/api/tariffs", headers=self.headers,
+                          json={"item_type": item_type, "day_1": price})
+        pack = requests.post(
+            f"{BASE_URL}/api/packs",
+            headers=self.headers,
+            json={"name": f"TEST pack {suffix}", "items": [ski, boot], "day_1": 12}
+        )
+        assert pack.status_code == 200, pack.text
+
+        quote = self._quote([{"item_type": ski}, {"item_type": boot}, {"item_type": ski}], [1])[1]
+        assert quote["packs_total"] == 12
+        assert quote["individuals_total"] == 10
+        assert quote["total"] == 22
+
+        requests.delete(f"{BASE_URL}/api/packs/{pack.json()['id']}", headers=self.headers)
+        for item_type in (ski, boot):
+            requests.delete(f"{BASE_URL}/api/tariffs/{item_type}", headers=self.headers)
+
+    def test_pack_takes_one_unit_of_a_line(self):
+        """3 skis on one line + boots: the pack takes one ski, the other two are paid alone"""
+        suffix = uuid.uuid4().hex[:6]
+        ski, boot = f"TEST_ski_{suffix}", f"TEST_boot_{suffix}"
+        for item_type, price in ((ski, 10), (boot, 5)):
+            requests.post(f"{BASE_URL}/api/tariffs", headers=self.headers,
+                          json={"item_type": item_type, "day_1": price})
+        pack = requests.post(
+            f"{BASE_URL}/api/packs",
+            headers=self.headers,
+            json={"name": f"TEST pack {suffix}", "items": [ski, boot], "day_1": 12}
+        )
+        assert pack.status_code == 200, pack.text
+
+        quote = self._quote([{"item_type": ski, "quantity": 3}, {"item_type": boot}], [1])[1]
+        assert quote["total"] == 32
+        assert quote["packs_total"] == 12
+        assert quote["individuals_total"] == 20
+        assert quote["lines"][0]["packed_quantity"] == 1 and not quote["lines"][0]["in_pack"]
+
+        requests.delete(f"{BASE_URL}/api/packs/{pack.json()['id']}", headers=self.headers)
+        for item_type in (ski, boot):
+            requests.delete(f"{BASE_URL}/api/tariffs/{item_type}", headers=self.headers)
+
+    def test_optimizer_finds_cheapest_pack_combination(self):
+        """ski+ski+boot: '2 skis' pack + boot beats greedy 'ski+boot' pack + ski"""
+        suffix = uuid.uuid4().hex[:6]
+        ski, boot = f"TEST_ski_{suffix}", f"TEST_boot_{suffix}"
+        for item_type, price in ((ski, 10), (boot, 6)):
+            requests.post(f"{BASE_URL}/api/tariffs", headers=self.headers,
+                          json={"item_type": item_type, "day_1": price})
+        pack_ids = []
+        for name, items, price in ((f"TEST combo {suffix}", [ski, boot], 14), (f"TEST duo {suffix}", [ski, ski], 15)):
+            pack = requests.post(f"{BASE_URL}/api/packs", headers=self.headers,
+                                 json={"name": name, "items": items, "day_1": price})
+            assert pack.status_code == 200, pack.text
+            pack_ids.append(pack.json()["id"])
+
+        response = requests.post(
+            f"{BASE_URL}/api/pricing/optimize-packs",
+            headers=self.headers,
+            json={"items": [
+                {"item_type": ski, "person": "Ana"}, {"item_type": ski, "person": "Ana"},
+                {"item_type": boot, "person": "Ana"}, {"item_type": boot, "person": "Luis"},
+            ]}
+        )
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert data["total"] == 15 + 6 + 6
+        assert data["total_without_packs"] == 10 + 10 + 6 + 6
+        groups = {g["person"]: g for g in data["groups"]}
+        assert [p["name"] for p in groups["Ana"]["packs"]] == [f"TEST duo {suffix}"]
+        assert groups["Luis"]["packs"] == []
+
+        for pack_id in pack_ids:
+            requests.delete(f"{BASE_URL}/api/packs/{pack_id}", headers=self.headers)
+        for item_type in (ski, boot):
+            requests.delete(f"{BASE_URL}/api/tariffs/{item_type}", headers=self.headers)
+
+    def test_optimizer_never_packs_cheaper_rental_price_units(self):
+        """Items with their own rental_price below the pack: savings never negative, quote agrees"""
+        suffix = uuid.uuid4().hex[:6]
+        ski, boot = f"TEST_ski_{suffix}", f"TEST_boot_{suffix}"
+        for item_type, price in ((ski, 20), (boot, 10)):
+            requests.post(f"{BASE_URL}/api/tariffs", headers=self.headers,
+                          json={"item_type": item_type, "day_1": price})
+        pack = requests.post(
+            f"{BASE_URL}/api/packs",
+            headers=self.headers,
+            json={"name": f"TEST pack {suffix}", "items": [ski, boot], "day_1": 25}
+        )
+        assert pack.status_code == 200, pack.text
+        item_ids = []
+        for item_type in (ski, boot):
+            body = {"barcode": f"TEST_RP_{item_type}", "item_type": item_type}
+            item = requests.post(f"{BASE_URL}/api/items", headers=self.headers, json=body)
+            assert item.status_code == 200, item.text
+            # Individual items get their rental_price from the edit form
+            updated = requests.put(f"{BASE_URL}/api/items/{item.json()['id']}", headers=self.headers,
+                                   json={**body, "rental_price": 5})
+            assert updated.status_code == 200, updated.text
+            item_ids.append(item.json()["id"])
+
+        lines = [{"item_id": item_id} for item_id in item_ids]
+        response = requests.post(f"{BASE_URL}/api/pricing/optimize-packs", headers=self.headers, json={"items": lines})
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert data["total"] == data["total_without_packs"] == 10
+        assert data["savings"] == 0
+        assert data["groups"][0]["packs"] == []
+        quote = self._quote(lines, [1])[1]
+        assert quote["total"] == 10 and quote["packs"] == []
+
+        for item_id in item_ids:
+            requests.delete(f"{BASE_URL}/api/items/{item_id}", headers=self.headers, params={"force": "true"})
+        requests.delete(f"{BASE_URL}/api/packs/{pack.json()['id']}", headers=self.headers)
+        for item_type in (ski, boot):
+            requests.delete(f"{BASE_URL}/api/tariffs/{item_type}", headers=self.headers)
+
+    def test_optimizer_large_group_and_quantities(self):
+        """One person with 80 units (lines with quantity > 1 included) answers fast and uses packs"""
+        suffix = uuid.uuid4().hex[:6]
+        ski, boot = f"TEST_ski_{suffix}", f"TEST_boot_{suffix}"
+        for item_type, price in ((ski, 10), (boot, 5)):
+            requests.post(f"{BASE_URL}/api/tariffs", headers=self.headers,
+                          json={"item_type": item_type, "day_1": price})
+        pack = requests.post(
+            f"{BASE_URL}/api/packs",
+            headers=self.headers,
+            json={"name": f"TEST pack {suffix}", "items": [ski, boot], "day_1": 12}
+        )
+        assert pack.status_code == 200, pack.text
+
+        items = [{"item_type": ski, "person": "Ana"} for _ in range(30)]
+        items += [{"item_type": ski, "quantity": 10, "person": "Ana"}, {"item_type": boot, "quantity": 40, "person": "Ana"}]
+        response = requests.post(f"{BASE_URL}/api/pricing/optimize-packs", headers=self.headers,
+                                 json={"items": items}, timeout=15)
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert data["total"] == 40 * 12
+        assert data["groups"][0]["packs"][0]["count"] == 40
+
+        response = requests.post(f"{BASE_URL}/api/pricing/optimize-packs", headers=self.headers,
+                                 json={"items": [{"item_type": ski, "quantity": 100000}]})
+        assert response.status_code == 400
+
+        requests.delete(f"{BASE_URL}/api/packs/{pack.json()['id']}", headers=self.headers)
+        for item_type in (ski, boot):
+            requests.delete(f"{BASE_URL}/api/tariffs/{item_type}", headers=self.headers)
+
+    def test_simulation_is_read_only(self):
+        """What-if with a raised tariff: structured deltas, live tariffs untouched"""
+        tariffs_before = requests.get(f"{BASE_URL}/api/tariffs", headers=self.headers).json()
+
+        same = requests.post(
+            f"{BASE_URL}/api/pricing/simulate",
+            headers=self.headers,
+            json={"start_date": "2020-01-01", "end_date": "2030-12-31"}
+        )
+        assert same.status_code == 200, same.text
+        data = same.json()
+        assert data["totals"]["delta_vs_current"] == 0
+        for key in ("by_type", "by_duration", "by_week", "timing_ms"):
+            assert key in data
+
+        if tariffs_before:
+            raised = dict(tariffs_before[0])
+            raised["day_1"] = (raised.get("day_1") or 0) + 100
+            response = requests.post(
+                f"{BASE_URL}/api/pricing/simulate",
+                headers=self.headers,
+                json={"start_date": "2020-01-01", "end_date": "2030-12-31",
+                      "tariffs": [{k: v for k, v in raised.items() if k == "item_type" or k.startswith("day")}]}
+            )
+            assert response.status_code == 200, response.text
+            assert response.json()["totals"]["delta_vs_current"] >= 0
+
+        tariffs_after = requests.get(f"{BASE_URL}/api/tariffs", headers=self.headers).json()
+        assert tariffs_after == tariffs_before
+
+    def test_invalid_durations_rejected(self):
+        response = requests.post(
+            f"{BASE_URL}/api/pricing/quote",
+            headers=self.headers,
+            json={"items": [{"item_type": "x"}], "durations": [0]}
+        )
+        assert response.status_code == 400
@@ -0,0 +1,138 @@
+"""
+Test the N+1 query detector end to end, without the backend
+- A route over its @query_budget fails the test under the plugin (enforce)
+- report mode only records it; routes within budget pass
+- Header parsing: malformed violations header, responses without X-Query-Count
+- The plugin's requests.Session.send hook is removed on uninstall
+A throwaway FastAPI app behind RequestMetricsMiddleware stands in for the
+backend: its routes feed fake Mongo commands to the request's stats.
+"""
+import socket
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+import requests
+import uvicorn
+from fastapi import FastAPI
+
+from observability import RequestMetricsMiddleware, current_request_stats
+from query_budget import query_budget
+from tests.query_budget_plugin import HEADER_COUNT, HEADER_VIOLATIONS, QueryBudgetRecorder, QueryBudgetViolation
+
+
+def _fake_queries(count: int, same_shape: bool):
+    """Record `count` finds on the current request, as the Mongo command listener would"""
+    stats = current_request_stats()
+    for n in range(count):
+        field = "id" if same_shape else f"field_{n}"
+        stats.record("find", "rentals", {"find": "rentals", "filter": {field: str(n)}}, 0.0, 1)
+
+
+def _budget_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/api/within")
+    @query_budget(2)
+    async def within():
+        _fake_queries(2, same_shape=False)
+        return {"ok": True}
+
+    @app.get("/api/over")
+    @query_budget(1)
+    async def over():
+        _fake_queries(5, same_shape=True)  # one find per rental: N+1
+        return {"ok": True}
+
+    app.add_middleware(RequestMetricsMiddleware)
+    return app
+
+
+@pytest.fixture(scope="module")
+def budget_server():
+    """The app above on a free local port, with the budget check on"""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("QUERY_BUDGET_CHECK", "1")
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        server = uvicorn.Server(uvicorn.Config(_budget_app(), log_level="warning"))
+        thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+        thread.start()
+        deadline = time.monotonic() + 10
+        while not server.started:
+            assert time.monotonic() < deadline, "test server did not start"
+            time.sleep(0.05)
+        yield f"http://127.0.0.1:{sock.getsockname()[1]}"
+        server.should_exit = True
+        thread.join(5)
+
+
+class TestQueryBudgetPlugin:
+    """QueryBudgetRecorder against real X-Query-* headers"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, request, monkeypatch):
+        """Recorders of the test run on the plain requests.Session.send (the session-wide one stays out)"""
+        session_recorder = getattr(request.config, "_query_budget_recorder", None)
+        if session_recorder is not None:
+            monkeypatch.setattr(requests.Session, "send", session_recorder._original_send)
+        self.plain_send = requests.Session.send
+        self.recorders = []
+        yield
+        for recorder in reversed(self.recorders):
+            recorder.uninstall()
+
+    def _recorder(self, mode):
+        recorder = QueryBudgetRecorder(mode)
+        recorder.install()
+        self.recorders.append(recorder)
+        return recorder
+
+    def test_route_over_budget_fails_the_test(self, budget_server):
+        recorder = self._recorder("enforce")
+        with pytest.raises(QueryBudgetViolation) as excinfo:
+            requests.get(f"{budget_server}/api/over")
+        message = str(excinfo.value)
+        assert "/api/over" in message
+        assert "5 queries > budget 1" in message
+        assert "N+1: 5x find rentals" in message
+        assert recorder.violations[0][1:3] == ("GET", "/api/over")
+
+    def test_route_within_budget_passes(self, budget_server):
+        recorder = self._recorder("enforce")
+        response = requests.get(f"{budget_server}/api/within")
+        assert response.status_code == 200
+        assert response.headers[HEADER_COUNT] == "2"
+        assert HEADER_VIOLATIONS not in response.headers
+        assert recorder.checked_responses == 1 and recorder.violations == []
+
+    def test_report_mode_records_without_failing(self, budget_server):
+        recorder = self._recorder("report")
+        response = requests.get(f"{budget_server}/api/over")
+        assert response.status_code == 200
+        assert len(recorder.violations) == 1
+        _, method, url, payload = recorder.violations[0]
+        assert (method, url, payload["route"]) == ("GET", "/api/over", "/api/over")
+        assert "5 queries > budget 1" in payload["violations"]
+
+    def test_malformed_violations_header_still_fails(self):
+        recorder = QueryBudgetRecorder("enforce")
+        request = SimpleNamespace(method="POST", path_url="/api/customers/import")
+        response = SimpleNamespace(headers={HEADER_COUNT: "40", HEADER_VIOLATIONS: "not json"})
+        with pytest.raises(QueryBudgetViolation) as excinfo:
+            recorder.inspect(request, response)
+        assert "/api/customers/import" in str(excinfo.value) and "not json" in str(excinfo.value)
+        assert recorder.violations[0][3] == {"route": "/api/customers/import", "violations": ["not json"]}
+
+    def test_responses_without_count_are_unchecked(self):
+        recorder = QueryBudgetRecorder("enforce")
+        recorder.inspect(SimpleNamespace(method="GET", path_url="/"), SimpleNamespace(headers={}))
+        assert (recorder.checked_responses, recorder.unchecked_responses) == (0, 1)
+        assert recorder.violations == []
+
+    def test_uninstall_restores_session_send(self):
+        recorder = self._recorder("enforce")
+        assert requests.Session.send is not self.plain_send
+        recorder.uninstall()
+        assert requests.Session.send is self.plain_send
@@ -0,0 +1,63 @@
+"""
+Test rental view cache
+- Repeated GET /rentals/{id} and barcode lookups return the same enriched view
+- A rental write is visible on the next read (invalidation)
+- Cache counters are exported on /api/metrics
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+METRICS_HEADERS = {"Authorization": f"Bearer {os.environ['METRICS_TOKEN']}"} if os.environ.get('METRICS_TOKEN') else {}
+
+class TestRentalCache:
+    """Counter reads served from the rental view cache"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, store_headers):
+        self.headers = store_headers
+
+    def _active_rental(self):
+        rentals = requests.get(f"{BASE_URL}/api/rentals?status=active", headers=self.headers).json()
+        rentals = [r for r in rentals if any(i.get("barcode") for i in r.get("items", []))]
+        if not rentals:
+            pytest.skip("No active rentals with barcoded items in store 3")
+        return rentals[0]
+
+    def test_repeated_reads_and_barcode_lookup(self):
+        rental = self._active_rental()
+        first = requests.get(f"{BASE_URL}/api/rentals/{rental['id']}", headers=self.headers)
+        second = requests.get(f"{BASE_URL}/api/rentals/{rental['id']}", headers=self.headers)
+        assert first.status_code == second.status_code == 200
+        assert first.json() == second.json()
+
+        barcode = next(i["barcode"] for i in rental["items"] if i.get("barcode"))
+        for code in (barcode, barcode.lower()):
+            response = requests.get(f"{BASE_URL}/api/rentals/barcode/{code}", headers=self.headers)
+            assert response.status_code == 200, response.text
+            assert response.json()["status"] in ("active", "partial")
+
+        metrics = requests.get(f"{BASE_URL}/api/metrics", headers=METRICS_HEADERS).text
+        assert 'alpineflow_rental_cache_requests_total{lookup="id",result="hit"}' in metrics
+
+    def test_write_is_visible_on_next_read(self):
+        """Duration change with the same total (no cash movement), then restore"""
+        rental = self._active_rental()
+        requests.get(f"{BASE_URL}/api/rentals/{rental['id']}", headers=self.headers)
+        url = f"{BASE_URL}/api/rentals/{rental['id']}/modify-duration"
+
+        response = requests.patch(url, headers=self.headers,
+                                  json={"new_days": rental["days"] + 1, "new_total": rental["total_amount"]})
+        assert response.status_code == 200, response.text
+        fresh = requests.get(f"{BASE_URL}/api/rentals/{rental['id']}", headers=self.headers).json()
+        assert fresh["days"] == rental["days"] + 1
+
+        requests.patch(url, headers=self.headers,
+                       json={"new_days": rental["days"], "new_total": rental["total_amount"]})
+        restored = requests.get(f"{BASE_URL}/api/rentals/{rental['id']}", headers=self.headers).json()
+        assert restored["days"] == rental["days"]
+
+    def test_unknown_code_not_found(self):
+        response = requests.get(f"{BASE_URL}/api/rentals/barcode/TEST-NOPE-000", headers=self.headers)
+        assert response.status_code == 404
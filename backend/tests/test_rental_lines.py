@@ -0,0 +1,43 @@
+"""
+Test rental line snapshots
+- Backfill marks every rental of the store and is idempotent
+- Rental reads return internal_code / item_type / category on each line
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+class TestRentalLines:
+    """Rental lines carry their item snapshot (no read-time join)"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, store_headers):
+        self.headers = store_headers
+
+    def test_backfill_is_idempotent(self):
+        first = requests.post(f"{BASE_URL}/api/admin/backfill-rental-lines", headers=self.headers)
+        assert first.status_code == 200, first.text
+        assert first.json()["remaining"] == 0
+
+        second = requests.post(f"{BASE_URL}/api/admin/backfill-rental-lines", headers=self.headers)
+        assert second.status_code == 200
+        assert second.json()["updated"] == 0
+
+    def test_reads_return_line_snapshot(self):
+        requests.post(f"{BASE_URL}/api/admin/backfill-rental-lines", headers=self.headers)
+        rentals = requests.get(f"{BASE_URL}/api/rentals", headers=self.headers).json()
+        if not rentals:
+            pytest.skip("No rentals in store 3")
+        for rental in rentals:
+            for line in rental["items"]:
+                for field in ("internal_code", "item_type", "category"):
+                    assert field in line, f"{field} missing in line of rental {rental['id']}"
+
+        pending = requests.get(f"{BASE_URL}/api/rentals/pending/returns", headers=self.headers)
+        assert pending.status_code == 200
+        for group in ("today", "other_days"):
+            for rental in pending.json()[group]:
+                for line in rental["pending_items"]:
+                    assert "internal_code" in line
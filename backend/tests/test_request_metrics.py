@@ -0,0 +1,58 @@
+"""
+Test per-request Mongo instrumentation
+- Server-Timing header on API responses (db time, round trips, documents)
+- /api/metrics Prometheus text labelled by route template, not raw path
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+METRICS_HEADERS = {"Authorization": f"Bearer {os.environ['METRICS_TOKEN']}"} if os.environ.get('METRICS_TOKEN') else {}
+
+class TestRequestMetrics:
+    """Server-Timing + /api/metrics"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Login as admin_master"""
+        response = requests.post(
+            f"{BASE_URL}/api/auth/login",
+            json={"username": "admin_master", "password": "admin123"}
+        )
+        assert response.status_code == 200, f"Login failed: {response.text}"
+        self.token = response.json()["access_token"]
+        self.headers = {"Authorization": f"Bearer {self.token}"}
+
+    def test_server_timing_header_present(self):
+        """Every API response carries Server-Timing with the Mongo breakdown"""
+        response = requests.get(f"{BASE_URL}/api/customers", headers=self.headers)
+        assert response.status_code == 200
+        timing = response.headers.get("Server-Timing", "")
+        assert "db;dur=" in timing, f"Missing db timing: {timing}"
+        assert "cmds/" in timing
+        print(f"Server-Timing: {timing}")
+
+    def test_metrics_exposes_route_templates(self):
+        """Histograms are labelled by route template so path params don't explode cardinality"""
+        requests.get(f"{BASE_URL}/api/rentals/does-not-exist-123", headers=self.headers)
+
+        response = requests.get(f"{BASE_URL}/api/metrics", headers=METRICS_HEADERS)
+        assert response.status_code == 200
+        body = response.text
+        assert "alpineflow_http_request_duration_seconds_bucket" in body
+        assert "alpineflow_http_request_db_seconds_bucket" in body
+        assert "alpineflow_http_request_db_round_trips_bucket" in body
+        assert "alpineflow_http_response_size_bytes_bucket" in body
+        assert 'route="/api/rentals/{rental_id}"' in body
+        assert "does-not-exist-123" not in body
+
+    def test_slow_queries_endpoint(self):
+        """Slow query profiler listing (empty when SLOW_QUERY_PROFILER is off)"""
+        response = requests.get(f"{BASE_URL}/api/admin/slow-queries?limit=5", headers=self.headers)
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert "enabled" in data
+        assert isinstance(data["offenders"], list)
+        for offender in data["offenders"]:
+            assert "shape" in offender and "count" in offender and "max_ms" in offender
@@ -0,0 +1,57 @@
+"""
+Test single-flight / short-TTL cache on polled endpoints
+- Concurrent identical requests return the same payload
+- A cash write invalidates the cached realtime summary immediately (store watermark)
+- Cache counters are exported on /api/metrics
+"""
+import pytest
+import requests
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+METRICS_HEADERS = {"Authorization": f"Bearer {os.environ['METRICS_TOKEN']}"} if os.environ.get('METRICS_TOKEN') else {}
+
+class TestResponseCache:
+    """Polled dashboard endpoints"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, store_headers):
+        self.headers = store_headers
+
+    def test_concurrent_stats_are_identical(self):
+        """N terminals polling at once get the same computation"""
+        def fetch(_):
+            return requests.get(f"{BASE_URL}/api/reports/stats", headers=self.headers)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(fetch, range(8)))
+
+        assert all(r.status_code == 200 for r in responses)
+        payloads = [r.json() for r in responses]
+        assert all(p == payloads[0] for p in payloads)
+        assert "pending_returns" in payloads[0] and "inventory" in payloads[0]
+
+    def test_cash_write_invalidates_realtime_summary(self):
+        """A new cash movement is visible right away despite the TTL cache"""
+        before = requests.get(f"{BASE_URL}/api/cash/summary/realtime", headers=self.headers)
+        assert before.status_code == 200
+        if not before.json().get("session_active"):
+            pytest.skip("No open cash session in store 3")
+
+        response = requests.post(
+            f"{BASE_URL}/api/cash/movements",
+            headers=self.headers,
+            json={"movement_type": "income", "amount": 1.0, "payment_method": "cash",
+                  "category": "other", "concept": "TEST cache invalidation"}
+        )
+        assert response.status_code == 200, response.text
+
+        after = requests.get(f"{BASE_URL}/api/cash/summary/realtime", headers=self.headers)
+        assert after.json()["movements_count"] == before.json()["movements_count"] + 1
+
+    def test_cache_metrics_exported(self):
+        requests.get(f"{BASE_URL}/api/dashboard", headers=self.headers)
+        requests.get(f"{BASE_URL}/api/dashboard", headers=self.headers)
+        metrics = requests.get(f"{BASE_URL}/api/metrics", headers=METRICS_HEADERS).text
+        assert 'alpineflow_response_cache_requests_total{endpoint="dashboard"' in metrics
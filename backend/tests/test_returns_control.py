@@ -0,0 +1,39 @@
+"""
+Test returns control tower projection (/api/dashboard/returns-control)
+- Same totals as the pending returns of the day
+- Repeated polls return the same document
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+class TestReturnsControl:
+    """Control tower served from the per-day projection"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, store_headers):
+        self.headers = store_headers
+
+    def test_matches_pending_returns_of_the_day(self):
+        response = requests.get(f"{BASE_URL}/api/dashboard/returns-control", headers=self.headers)
+        assert response.status_code == 200, response.text
+        tower = response.json()
+        assert tower["total_pending"] == sum(c["count"] for c in tower["pending_by_category"])
+        for category in tower["pending_by_category"]:
+            assert len(category["details"]) <= 5
+
+        page = requests.get(
+            f"{BASE_URL}/api/rentals/pending/returns/by-day",
+            headers=self.headers,
+            params={"after": tower["date"], "days": 1}
+        ).json()
+        day = next((d for d in page["days"] if d["date"] == tower["date"]), None)
+        assert tower["total_pending"] == (day["items_count"] if day else 0)
+
+    def test_polling_is_stable(self):
+        first = requests.get(f"{BASE_URL}/api/dashboard/returns-control", headers=self.headers).json()
+        second = requests.get(f"{BASE_URL}/api/dashboard/returns-control", headers=self.headers).json()
+        assert first["date"] == second["date"]
+        assert first["pending_by_category"] == second["pending_by_category"]
@@ -0,0 +1,66 @@
+"""
+Test per-store backups (/api/admin/backups)
+- A backup runs as a background job and returns a manifest with checksums
+- Backups are listed newest first
+- Restoring in merge mode keeps the store's data unchanged
+- Invalid formats / modes and unknown backups are rejected
+"""
+import time
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+class TestStoreBackup:
+    """Streaming per-store backup and restore"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, store_headers, store_id):
+        self.headers = store_headers
+        self.store_id = store_id
+
+    def _wait(self, job_id, timeout=120):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            response = requests.get(f"{BASE_URL}/api/jobs/{job_id}", headers=self.headers)
+            assert response.status_code == 200, response.text
+            job = response.json()
+            if job["status"] in ("done", "failed", "cancelled"):
+                return job
+            time.sleep(1)
+        pytest.fail(f"Job {job_id} did not finish")
+
+    def test_backup_and_merge_restore(self):
+        response = requests.post(f"{BASE_URL}/api/admin/backups", headers=self.headers, params={"format": "ndjson"})
+        assert response.status_code == 200, response.text
+        job = self._wait(response.json()["job_id"])
+        assert job["status"] == "done", job.get("error")
+        manifest = job["result"]
+        assert manifest["store_id"] == self.store_id and manifest["format"] == "ndjson"
+        for info in manifest["collections"].values():
+            assert sum(f["documents"] for f in info["files"]) == info["documents"]
+            assert all(len(f["sha256"]) == 64 for f in info["files"])
+
+        backups = requests.get(f"{BASE_URL}/api/admin/backups", headers=self.headers).json()
+        assert backups[0]["backup_id"] == manifest["backup_id"]
+        assert "path" not in backups[0]
+
+        items_before = requests.get(f"{BASE_URL}/api/items", headers=self.headers).json()
+        response = requests.post(f"{BASE_URL}/api/admin/backups/{manifest['backup_id']}/restore", headers=self.headers)
+        if response.status_code == 409:
+            pytest.skip("Restore already running")
+        assert response.status_code == 200, response.text
+        job = self._wait(response.json()["job_id"])
+        assert job["status"] == "done", job.get("error")
+        assert set(job["result"]["collections"]) == set(manifest["collections"])
+        items_after = requests.get(f"{BASE_URL}/api/items", headers=self.headers).json()
+        assert len(items_after) == len(items_before)
+
+    def test_invalid_parameters_rejected(self):
+        response = requests.post(f"{BASE_URL}/api/admin/backups", headers=self.headers, params={"format": "csv"})
+        assert response.status_code == 400
+        response = requests.post(f"{BASE_URL}/api/admin/backups/nope/restore", headers=self.headers, params={"mode": "wipe"})
+        assert response.status_code == 400
+        response = requests.post(f"{BASE_URL}/api/admin/backups/nope/restore", headers=self.headers)
+        assert response.status_code == 404
@@ -772,7 +772,8 @@ export default function ActiveRentals() {
   
   // Función para obtener el código interno de un item por su barcode
   const enrichItemsWithInternalCode = async (items) => {
-    const barcodes = items.map(i => i.barcode).filter(Boolean);
+    // Las líneas de alquiler ya guardan internal_code; solo se consultan las antiguas sin él
+    const barcodes = items.filter(i => !i.internal_code).map(i => i.barcode).filter(Boolean);
     if (barcodes.length === 0) return items;
     
     try {